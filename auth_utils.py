@@ -8,18 +8,42 @@ Functions:
     hash_password(plain) -> hash string
     verify_password(plain, stored_hash) -> bool
     authenticate(username, password) -> (success, user_dict|None, migrated:bool, message)
+    auth_service.authenticate_async(username, password, callback, widget)
 
 If a legacy (plaintext) password is detected (i.e., the stored value is NOT in the pbkdf2 format)
 and the provided password matches exactly, the password is re-hashed and updated (migration).
+Hashes with fewer iterations than the configured target are upgraded the same way.
+Both re-hashes run in a background thread after the login succeeded.
+
+PBKDF2 with a few hundred thousand iterations takes a noticeable time on
+field laptops, so the login window calls authenticate_async(): verification
+runs in a worker thread and the result is delivered back on the Tk thread.
+The target iteration count is read from auth_config.json (written by
+`python -m benchmarks.auth_calibrate --save`). DEFAULT_ITERATIONS is both the
+default and the floor: calibration can raise the cost, never lower it.
 """
 
+import json
+import time
 import sqlite3
 import hashlib
 import base64
 import secrets
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from db import connect_db
 
+logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
+
 DEFAULT_ITERATIONS = 260000
+AUTH_CONFIG_FILE = "auth_config.json"
+
+# Rate control: after MAX_FAILED_ATTEMPTS failures a username is locked for
+# LOCKOUT_SECONDS, doubling with every further failure (capped).
+MAX_FAILED_ATTEMPTS = 5
+LOCKOUT_SECONDS = 30
+MAX_LOCKOUT_SECONDS = 900
 
 
 def hash_password(password: str, iterations: int = DEFAULT_ITERATIONS) -> str:
@@ -30,18 +54,82 @@ def hash_password(password: str, iterations: int = DEFAULT_ITERATIONS) -> str:
     return f"pbkdf2_sha256${iterations}${base64.b64encode(salt).decode()}${base64.b64encode(dk).decode()}"
 
 
+# stored hash -> (iterations, salt, derived key); avoids re-parsing per login
+_hash_params_cache = {}
+
+
+def hash_params(stored_hash: str):
+    """(iterations, salt, derived_key) of a pbkdf2 hash string, or None if malformed."""
+    params = _hash_params_cache.get(stored_hash)
+    if params is None:
+        try:
+            algo, iterations, salt_b64, hash_b64 = stored_hash.split("$", 3)
+            if algo != "pbkdf2_sha256":
+                return None
+            params = (int(iterations), base64.b64decode(salt_b64), base64.b64decode(hash_b64))
+        except Exception:
+            return None
+        if len(_hash_params_cache) > 256:
+            _hash_params_cache.clear()
+        _hash_params_cache[stored_hash] = params
+    return params
+
+
 def verify_password(password: str, stored_hash: str) -> bool:
+    params = hash_params(stored_hash)
+    if params is None:
+        return False
+    iterations, salt, original_hash = params
     try:
-        algo, iterations, salt_b64, hash_b64 = stored_hash.split("$", 3)
-        if algo != "pbkdf2_sha256":
-            return False
-        iterations = int(iterations)
-        salt = base64.b64decode(salt_b64)
-        original_hash = base64.b64decode(hash_b64)
         test_hash = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
-        return secrets.compare_digest(original_hash, test_hash)
     except Exception:
         return False
+    return secrets.compare_digest(original_hash, test_hash)
+
+
+def load_target_iterations() -> int:
+    """Configured PBKDF2 iterations (auth_config.json), never below DEFAULT_ITERATIONS."""
+    try:
+        with open(AUTH_CONFIG_FILE, "r", encoding="utf-8") as f:
+            value = int(json.load(f).get("pbkdf2_iterations", DEFAULT_ITERATIONS))
+    except (OSError, ValueError, TypeError, AttributeError):
+        value = DEFAULT_ITERATIONS
+    return max(value, DEFAULT_ITERATIONS)
+
+
+def save_target_iterations(iterations: int) -> None:
+    with open(AUTH_CONFIG_FILE, "w", encoding="utf-8") as f:
+        json.dump({"pbkdf2_iterations": max(int(iterations), DEFAULT_ITERATIONS)}, f)
+
+
+def needs_rehash(stored_hash: str, target_iterations: int) -> bool:
+    """True for legacy plaintext or a pbkdf2 hash weaker than the target."""
+    params = hash_params(stored_hash) if is_pdkdf2_hash(stored_hash) else None
+    return params is None or params[0] < target_iterations
+
+
+def upgrade_password_hash(user_id, password: str, expected_stored: str, iterations: int) -> bool:
+    """
+    Re-hash and store the password, only if the row still holds expected_stored
+    (a concurrent password change wins). Returns True if the row was updated.
+    """
+    new_hash = hash_password(password, iterations)
+    conn = connect_db()
+    if conn is None:
+        return False
+    try:
+        cur = conn.execute(
+            "UPDATE users SET password_hash=? WHERE user_id=? AND password_hash IS ?",
+            (new_hash, user_id, expected_stored),
+        )
+        conn.commit()
+        return cur.rowcount == 1
+    except sqlite3.Error as e:
+        conn.rollback()
+        logging.error(f"[auth] Password hash upgrade failed: {e}")
+        return False
+    finally:
+        conn.close()
 
 
 def is_pdkdf2_hash(value: str) -> bool:
@@ -51,14 +139,18 @@ def is_pdkdf2_hash(value: str) -> bool:
     return len(parts) == 4 and parts[0] == "pbkdf2_sha256" and parts[1].isdigit()
 
 
-def authenticate(username: str, password: str):
+def authenticate(username: str, password: str, target_iterations: int = None, upgrade: bool = True):
     """
     Returns (success: bool, user_row: dict|None, migrated: bool, message: str)
 
     Migration logic:
-      - If stored password is plaintext (legacy) and matches exactly, re-hash and update row.
-      - If hashing update fails, still allow login (just no migration message).
+      - If stored password is plaintext (legacy) and matches exactly, or is a
+        pbkdf2 hash below target_iterations, it is re-hashed in a background
+        thread (migrated=True means the upgrade was scheduled).
+      - If hashing update fails, login is still allowed.
     """
+    if target_iterations is None:
+        target_iterations = load_target_iterations()
     conn = connect_db()
     if conn is None:
         return False, None, False, "Database connection failed"
@@ -67,38 +159,107 @@ def authenticate(username: str, password: str):
     try:
         cur.execute('SELECT user_id, username, password_hash, role, preferred_language FROM users WHERE username = ?', (username,))
         row = cur.fetchone()
-        if not row:
+    finally:
+        cur.close()
+        conn.close()
+    if not row:
+        return False, None, False, "Invalid username or password"
+
+    stored = row["password_hash"] or ""
+    if is_pdkdf2_hash(stored):
+        # Normal path
+        if not verify_password(password, stored):
             return False, None, False, "Invalid username or password"
+    elif not secrets.compare_digest(stored.encode("utf-8"), password.encode("utf-8")):
+        # Legacy plaintext
+        return False, None, False, "Invalid username or password"
 
-        stored = row["password_hash"] or ""
-        migrated = False
-
-        if is_pdkdf2_hash(stored):
-            # Normal path
-            if not verify_password(password, stored):
-                return False, None, False, "Invalid username or password"
-        else:
-            # Legacy plaintext
-            if stored != password:
-                return False, None, False, "Invalid username or password"
-            # Migrate
-            new_hash = hash_password(password)
-            try:
-                cur.execute('UPDATE users SET password_hash=? WHERE user_id=?', (new_hash, row["user_id"]))
-                conn.commit()
-                migrated = True
-            except sqlite3.Error:
-                conn.rollback()
-                # Migration failure does not block login
-
-        user_obj = {
-            "user_id": row["user_id"],
-            "username": row["username"],
-            "role": row["role"],
-            "preferred_language": (row["preferred_language"] or "EN").upper()
-        }
-        return True, user_obj, migrated, "Login successful"
+    migrated = False
+    if upgrade and needs_rehash(stored, target_iterations):
+        threading.Thread(
+            target=upgrade_password_hash,
+            args=(row["user_id"], password, row["password_hash"], target_iterations),
+            name="password-rehash",
+            daemon=True,
+        ).start()
+        migrated = True
 
-    finally:
-        cur.close()
-        conn.close()
\ No newline at end of file
+    user_obj = {
+        "user_id": row["user_id"],
+        "username": row["username"],
+        "role": row["role"],
+        "preferred_language": (row["preferred_language"] or "EN").upper()
+    }
+    return True, user_obj, migrated, "Login successful"
+
+
+class AuthService:
+    """
+    Runs authenticate() in a single worker thread and hands the result back
+    on the Tk thread (polled with widget.after), so the login window stays
+    responsive. Also applies the per-username failed-attempt lockout.
+    """
+
+    POLL_MS = 25
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="auth")
+        self._lock = threading.Lock()
+        self._failures = {}  # username -> (count, last_failure_time)
+        self._pending = None
+        self.last_seconds = None
+
+    @property
+    def busy(self) -> bool:
+        return self._pending is not None and not self._pending.done()
+
+    def retry_after(self, username: str) -> int:
+        """Seconds until username may try again (0 if not locked)."""
+        with self._lock:
+            count, last = self._failures.get(username, (0, 0.0))
+        if count < MAX_FAILED_ATTEMPTS:
+            return 0
+        lock = min(LOCKOUT_SECONDS * 2 ** (count - MAX_FAILED_ATTEMPTS), MAX_LOCKOUT_SECONDS)
+        return max(int(last + lock - time.monotonic() + 0.999), 0)
+
+    def _record(self, username: str, ok: bool) -> None:
+        with self._lock:
+            if ok:
+                self._failures.pop(username, None)
+            else:
+                count, _ = self._failures.get(username, (0, 0.0))
+                self._failures[username] = (count + 1, time.monotonic())
+
+    def authenticate(self, username: str, password: str):
+        """Blocking authenticate() with rate control (use from worker threads)."""
+        if self.retry_after(username):
+            return False, None, False, "Too many failed attempts"
+        started = time.perf_counter()
+        result = authenticate(username, password)
+        self.last_seconds = time.perf_counter() - started
+        self._record(username, result[0])
+        return result
+
+    def authenticate_async(self, username: str, password: str, callback, widget) -> bool:
+        """
+        Start authentication in the worker; callback(result, error) is called on
+        the Tk thread of widget. Returns False if a login is already running.
+        """
+        if self.busy:
+            return False
+        future = self._executor.submit(self.authenticate, username, password)
+        self._pending = future
+
+        def _poll():
+            if not future.done():
+                widget.after(self.POLL_MS, _poll)
+                return
+            error = future.exception()
+            callback(None if error else future.result(), error)
+
+        widget.after(self.POLL_MS, _poll)
+        return True
+
+
+# Global singleton used by the login window
+auth_service = AuthService()
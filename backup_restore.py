@@ -1,14 +1,42 @@
 import os
+import json
+import time
+import zlib
+import hashlib
+import tempfile
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import shutil
-from tkinter import filedialog, Tk, messagebox
+from tkinter import filedialog, Tk, Toplevel, Label, messagebox, ttk
 import sqlite3
 from language_manager import lang
+from db import close_persistent_connections
+from event_bus import bus, ALL_TOPICS
+from migrations import LATEST_VERSION, apply_migrations
+from schema_registry import schema
 
 # SQLite database file
 DB_FILE = os.path.join(os.path.dirname(__file__), "iseprep.db")
 
+# Online backup: pages copied per sqlite3 backup step (writers can commit between steps)
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_STEP_SLEEP = 0.005
+
+# Menu entries copy the database in this worker; the Tk thread polls it
+PROGRESS_POLL_MS = 50
+_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="backup")
+
+# Incremental snapshot store (content-addressed objects + JSON manifests)
+SNAPSHOT_DIR = os.path.join(os.path.dirname(__file__), "backups")
+SNAPSHOT_CHUNK_SIZE = 1 << 20  # multiple of every SQLite page size
+SNAPSHOT_KEEP = 20  # manifests kept when the menu entry prunes after a snapshot
+
+# Restore: streaming buffer and what a restored database must provide
+RESTORE_BUFFER_SIZE = 1 << 20
+SUPPORTED_SCHEMA_VERSION = LATEST_VERSION  # highest PRAGMA user_version this build understands
+REQUIRED_TABLES = ("scenarios", "items_list", "stock_data", "stock_transactions")
+
 # Base list of source files to ensure key files are always included
 BASE_SOURCE_FILES = [
     "item_utils.py", "db.py", "manage_items.py", "login.py", "end_users.py",
@@ -43,8 +71,465 @@ def get_project_code():
         print(f"{t('error_fetching_project', fallback='Error fetching project code')}: {e}")
         return "NO_PROJECT"
 
-def create_backup_zip():
-    """Create a zip file containing the SQLite database and source files, prompting for save location."""
+# ---------------------------------------------------------------------
+# Consistent database copies
+# ---------------------------------------------------------------------
+def verify_database(path):
+    """Run PRAGMA integrity_check on a database file. Returns (ok, message)."""
+    try:
+        conn = sqlite3.connect(path)
+        try:
+            rows = [r[0] for r in conn.execute("PRAGMA integrity_check").fetchall()]
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        return False, str(e)
+    return rows == ["ok"], "; ".join(rows[:5])
+
+def snapshot_database(dest_path, method="backup", progress=None):
+    """
+    Write a transactionally consistent copy of the live database to dest_path.
+
+    method="backup" uses the sqlite3 online backup API in paged steps, so the
+    WAL content is included and other connections can keep writing between
+    steps; method="vacuum" uses VACUUM INTO (compacted copy).
+    Returns metrics: seconds, size_bytes, pages, method, integrity.
+    """
+    started = time.perf_counter()
+    if os.path.exists(dest_path):
+        os.remove(dest_path)
+    src = sqlite3.connect(DB_FILE)
+    pages = 0
+    try:
+        if method == "vacuum":
+            src.execute("VACUUM INTO ?", (dest_path,))
+        else:
+            def _on_step(status, remaining, total):
+                nonlocal pages
+                pages = total
+                if progress:
+                    progress(total - remaining, total)
+
+            dst = sqlite3.connect(dest_path)
+            try:
+                src.backup(dst, pages=BACKUP_PAGES_PER_STEP, progress=_on_step, sleep=BACKUP_STEP_SLEEP)
+            finally:
+                dst.close()
+    finally:
+        src.close()
+    ok, message = verify_database(dest_path)
+    if not ok:
+        raise sqlite3.DatabaseError(
+            t("integrity_failed", fallback="Integrity check failed: {error}").format(error=message)
+        )
+    return {
+        "method": method,
+        "seconds": round(time.perf_counter() - started, 3),
+        "size_bytes": os.path.getsize(dest_path),
+        "pages": pages,
+        "integrity": message,
+    }
+
+def run_in_background(parent, title, work, on_done):
+    """
+    Run work(progress) in the backup worker behind a progress window on
+    parent, so the Tk loop keeps running during the copy. progress(done,
+    total) may be called from the worker; on_done(result, error) is called
+    on the Tk thread once work returns (polled with after(), as AuthService
+    does for logins).
+    """
+    state = {"done": 0, "total": 0}
+
+    def progress(done, total):
+        state["done"], state["total"] = done, total
+
+    win = Toplevel(parent)
+    win.title(title)
+    win.resizable(False, False)
+    win.protocol("WM_DELETE_WINDOW", lambda: None)  # the copy runs to completion
+    Label(win, text=t("copy_in_progress", fallback="Copying the database, please wait...")).pack(
+        padx=20, pady=(15, 5))
+    bar = ttk.Progressbar(win, length=320, mode="determinate", maximum=1)
+    bar.pack(padx=20, pady=(5, 15))
+    try:
+        win.transient(parent.winfo_toplevel())
+        win.grab_set()
+    except Exception:
+        pass
+    future = _worker.submit(work, progress)
+
+    def _poll():
+        if state["total"]:
+            bar.configure(maximum=state["total"], value=state["done"])
+        if not future.done():
+            parent.after(PROGRESS_POLL_MS, _poll)
+            return
+        try:
+            win.grab_release()
+            win.destroy()
+        except Exception:
+            pass
+        error = future.exception()
+        on_done(None if error else future.result(), error)
+
+    parent.after(PROGRESS_POLL_MS, _poll)
+    return future
+
+# ---------------------------------------------------------------------
+# Incremental content-addressed snapshots
+# ---------------------------------------------------------------------
+def _object_path(store_dir, digest):
+    return os.path.join(store_dir, "objects", digest[:2], digest)
+
+def _store_object(store_dir, data):
+    """Store data under its sha256 (zlib-compressed). Returns (digest, bytes_written)."""
+    digest = hashlib.sha256(data).hexdigest()
+    path = _object_path(store_dir, digest)
+    if os.path.exists(path):
+        return digest, 0
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    packed = zlib.compress(data, 6)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as fh:
+        fh.write(packed)
+    os.replace(tmp, path)
+    return digest, len(packed)
+
+def _load_file_index(store_dir):
+    try:
+        with open(os.path.join(store_dir, "file_index.json"), "r", encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+def _save_file_index(store_dir, index):
+    path = os.path.join(store_dir, "file_index.json")
+    with open(f"{path}.tmp", "w", encoding="utf-8") as fh:
+        json.dump(index, fh)
+    os.replace(f"{path}.tmp", path)
+
+def _snapshot_files():
+    """Relative paths of the source files and data folder contents to snapshot."""
+    files = [f for f in get_all_source_files() if os.path.exists(f)]
+    data_folder = os.path.join(os.getcwd(), "data")
+    for root_dir, dirs, names in os.walk(data_folder):
+        if "__pycache__" in dirs:
+            dirs.remove("__pycache__")
+        for name in names:
+            files.append(os.path.relpath(os.path.join(root_dir, name), os.getcwd()))
+    return sorted(set(files))
+
+def create_snapshot(store_dir=SNAPSHOT_DIR, progress=None):
+    """
+    Incremental snapshot of the database and project files.
+
+    The database is copied with snapshot_database(), verified, then split in
+    SNAPSHOT_CHUNK_SIZE chunks; files are stored whole. Every chunk / file is
+    written once under its sha256, so unchanged pages and files cost nothing
+    on later snapshots. Files whose size and mtime match the previous run are
+    not even re-read. Returns the manifest (with its "metrics").
+    """
+    started = time.perf_counter()
+    os.makedirs(os.path.join(store_dir, "snapshots"), exist_ok=True)
+    metrics = {"chunks": 0, "chunks_new": 0, "files": 0, "files_new": 0, "bytes_written": 0}
+
+    fd, tmp_db = tempfile.mkstemp(suffix=".db", dir=store_dir)
+    os.close(fd)
+    try:
+        db_metrics = snapshot_database(tmp_db, progress=progress)
+        chunks = []
+        with open(tmp_db, "rb") as fh:
+            while True:
+                block = fh.read(SNAPSHOT_CHUNK_SIZE)
+                if not block:
+                    break
+                digest, written = _store_object(store_dir, block)
+                chunks.append(digest)
+                metrics["chunks"] += 1
+                metrics["chunks_new"] += 1 if written else 0
+                metrics["bytes_written"] += written
+    finally:
+        if os.path.exists(tmp_db):
+            os.remove(tmp_db)
+
+    index = _load_file_index(store_dir)
+    files = {}
+    for rel in _snapshot_files():
+        st = os.stat(rel)
+        cached = index.get(rel)
+        if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size \
+                and os.path.exists(_object_path(store_dir, cached[2])):
+            files[rel] = cached[2]
+        else:
+            with open(rel, "rb") as fh:
+                digest, written = _store_object(store_dir, fh.read())
+            files[rel] = digest
+            index[rel] = [st.st_mtime_ns, st.st_size, digest]
+            metrics["files_new"] += 1 if written else 0
+            metrics["bytes_written"] += written
+        metrics["files"] += 1
+    _save_file_index(store_dir, index)
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    metrics["database"] = db_metrics
+    metrics["seconds"] = round(time.perf_counter() - started, 3)
+    manifest = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "project_code": get_project_code(),
+        "database": {
+            "name": os.path.basename(DB_FILE),
+            "size": db_metrics["size_bytes"],
+            "chunk_size": SNAPSHOT_CHUNK_SIZE,
+            "chunks": chunks,
+        },
+        "files": files,
+        "metrics": metrics,
+    }
+    stem = os.path.join(store_dir, "snapshots", f"iseprep_{manifest['project_code']}_{timestamp}")
+    manifest_path, n = f"{stem}.json", 1
+    while os.path.exists(manifest_path):  # several snapshots in one second
+        n += 1
+        manifest_path = f"{stem}_{n}.json"
+    with open(manifest_path, "w", encoding="utf-8") as fh:
+        json.dump(manifest, fh, indent=1)
+    manifest["path"] = manifest_path
+    return manifest
+
+def _backup_failed(error):
+    print(t("error_creating_backup", fallback="Error creating backup: {error}").format(error=str(error)))
+    messagebox.showerror(
+        t("backup_error_title", fallback="Backup Error"),
+        t("backup_failed", fallback="Failed to create backup: {error}").format(error=str(error))
+    )
+
+def _snapshot_and_prune(progress=None):
+    """Worker side of the menu entry: snapshot, then prune to SNAPSHOT_KEEP."""
+    manifest = create_snapshot(progress=progress)
+    try:
+        pruned = prune_snapshots(keep=SNAPSHOT_KEEP)
+    except (OSError, ValueError, KeyError) as e:
+        print(t("snapshot_prune_failed", fallback="Snapshot pruning failed: {error}").format(error=str(e)))
+        pruned = None
+    return manifest, pruned
+
+def create_snapshot_interactive(parent=None):
+    """
+    Menu entry: create an incremental snapshot and report its metrics.
+    With a parent widget the copy runs in the backup worker behind a
+    progress window and None is returned; without one it blocks.
+    """
+    def _done(result, error):
+        if error:
+            _backup_failed(error)
+            return None
+        return _report_snapshot(*result)
+
+    if parent is not None:
+        run_in_background(parent, t("backup_title", fallback="Backup"), _snapshot_and_prune, _done)
+        return None
+    try:
+        result = _snapshot_and_prune()
+    except Exception as e:
+        return _done(None, e)
+    return _done(result, None)
+
+def _report_snapshot(manifest, pruned):
+    m = manifest["metrics"]
+    summary = t(
+        "snapshot_success",
+        fallback="Snapshot saved: {path}\nDatabase: {size} KB in {db_seconds}s (integrity {integrity})\n"
+                 "New chunks: {chunks_new}/{chunks}, new files: {files_new}/{files}\n"
+                 "Written: {written} KB, total time {seconds}s",
+    ).format(
+        path=manifest["path"], size=m["database"]["size_bytes"] // 1024,
+        db_seconds=m["database"]["seconds"], integrity=m["database"]["integrity"],
+        chunks_new=m["chunks_new"], chunks=m["chunks"], files_new=m["files_new"],
+        files=m["files"], written=m["bytes_written"] // 1024, seconds=m["seconds"],
+    )
+    if pruned and (pruned["manifests_removed"] or pruned["objects_removed"]):
+        summary += "\n" + t(
+            "snapshot_pruned",
+            fallback="Pruned {manifests} old snapshots, {objects} objects ({freed} KB)",
+        ).format(manifests=pruned["manifests_removed"], objects=pruned["objects_removed"],
+                 freed=pruned["bytes_freed"] // 1024)
+    print(summary)
+    messagebox.showinfo(t("backup_title", fallback="Backup"), summary)
+    return manifest
+
+def _read_object(store_dir, digest):
+    """Bytes stored under digest, checked against it. ValueError when missing or damaged."""
+    try:
+        with open(_object_path(store_dir, digest), "rb") as fh:
+            data = zlib.decompress(fh.read())
+    except (OSError, zlib.error) as e:
+        raise ValueError(t(
+            "snapshot_object_damaged", fallback="Snapshot object {digest} is missing or damaged: {error}"
+        ).format(digest=digest[:12], error=e))
+    if hashlib.sha256(data).hexdigest() != digest:
+        raise ValueError(t(
+            "snapshot_object_damaged", fallback="Snapshot object {digest} is missing or damaged: {error}"
+        ).format(digest=digest[:12], error="sha256 mismatch"))
+    return data
+
+def _file_digest(path):
+    """sha256 of a file, None when it does not exist."""
+    try:
+        sha = hashlib.sha256()
+        with open(path, "rb") as fh:
+            for block in iter(lambda: fh.read(RESTORE_BUFFER_SIZE), b""):
+                sha.update(block)
+        return sha.hexdigest()
+    except OSError:
+        return None
+
+def load_manifest(manifest):
+    """Snapshot manifest from a dict (returned as is) or a manifest path."""
+    if isinstance(manifest, dict):
+        return manifest
+    with open(manifest, "r", encoding="utf-8") as fh:
+        data = json.load(fh)
+    data["path"] = manifest
+    return data
+
+def list_snapshots(store_dir=SNAPSHOT_DIR):
+    """Manifest paths of the store, oldest first."""
+    folder = os.path.join(store_dir, "snapshots")
+    if not os.path.isdir(folder):
+        return []
+    paths = [os.path.join(folder, n) for n in os.listdir(folder) if n.endswith(".json")]
+    return sorted(paths, key=lambda p: (os.path.getmtime(p), p))
+
+def restore_snapshot(manifest, store_dir=SNAPSHOT_DIR, restore_files=True):
+    """
+    Restore a snapshot written by create_snapshot() (manifest dict or path).
+
+    Every object the manifest references must be in the store before
+    anything is touched. The database is rebuilt from its chunks into a temp
+    file next to DB_FILE (each chunk checked against its sha256, the size
+    against the manifest), verified with verify_restore_candidate() and
+    swapped in by _swap_database(). Files are written back afterwards,
+    skipping the ones already identical.
+    Returns {"counts", "files", "seconds"}.
+    """
+    started = time.perf_counter()
+    manifest = load_manifest(manifest)
+    database = manifest["database"]
+    files = manifest.get("files", {}) if restore_files else {}
+    for digest in list(database["chunks"]) + list(files.values()):
+        if not os.path.exists(_object_path(store_dir, digest)):
+            raise ValueError(t(
+                "snapshot_object_damaged", fallback="Snapshot object {digest} is missing or damaged: {error}"
+            ).format(digest=digest[:12], error="not in the store"))
+
+    fd, candidate = tempfile.mkstemp(suffix=".part", dir=os.path.dirname(os.path.abspath(DB_FILE)))
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for digest in database["chunks"]:
+                out.write(_read_object(store_dir, digest))
+            out.flush()
+            os.fsync(out.fileno())
+        size = os.path.getsize(candidate)
+        if size != database["size"]:
+            raise ValueError(t(
+                "snapshot_size_mismatch", fallback="Rebuilt database is {size} bytes, the snapshot says {expected}"
+            ).format(size=size, expected=database["size"]))
+        counts = verify_restore_candidate(candidate)
+        _swap_database(candidate)
+        candidate = None
+    finally:
+        if candidate and os.path.exists(candidate):
+            os.remove(candidate)
+
+    restored = []
+    for rel, digest in sorted(files.items()):
+        if os.path.isabs(rel) or ".." in rel.replace("\\", "/").split("/"):
+            continue  # only paths under the application folder
+        dest = os.path.join(os.getcwd(), rel)
+        if _file_digest(dest) == digest:
+            continue
+        os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+        with open(f"{dest}.part", "wb") as fh:
+            fh.write(_read_object(store_dir, digest))
+        os.replace(f"{dest}.part", dest)
+        restored.append(rel)
+    return {"counts": counts, "files": restored, "seconds": round(time.perf_counter() - started, 3)}
+
+def prune_snapshots(store_dir=SNAPSHOT_DIR, keep=None):
+    """
+    Delete the manifests older than the newest `keep` (None keeps them all),
+    then every object no remaining manifest references. An unreadable
+    manifest stops the run before any object is deleted.
+    Returns {"manifests_removed", "objects_removed", "bytes_freed"}.
+    """
+    result = {"manifests_removed": 0, "objects_removed": 0, "bytes_freed": 0}
+    manifests = list_snapshots(store_dir)
+    if keep is not None and len(manifests) > keep:
+        for path in manifests[:len(manifests) - keep]:
+            os.remove(path)
+            result["manifests_removed"] += 1
+        manifests = manifests[len(manifests) - keep:]
+
+    referenced = set()
+    for path in manifests:
+        manifest = load_manifest(path)
+        referenced.update(manifest["database"]["chunks"])
+        referenced.update(manifest.get("files", {}).values())
+
+    # file_index.json may still name a removed object: create_snapshot() stores it again
+    for root_dir, _dirs, names in os.walk(os.path.join(store_dir, "objects")):
+        for name in names:
+            if name in referenced:
+                continue
+            path = os.path.join(root_dir, name)
+            result["bytes_freed"] += os.path.getsize(path)
+            os.remove(path)
+            result["objects_removed"] += 1
+    return result
+
+def select_and_restore_snapshot():
+    """Menu entry: pick a snapshot manifest, confirm and restore it."""
+    root = Tk()
+    root.withdraw()
+    manifest_path = filedialog.askopenfilename(
+        title=t("select_snapshot_title", fallback="Select Snapshot"),
+        filetypes=[(t("snapshot_files", fallback="Snapshot Manifests"), "*.json")],
+        initialdir=os.path.join(SNAPSHOT_DIR, "snapshots"),
+    )
+    root.destroy()
+    if not manifest_path:
+        print(t("restore_canceled", fallback="Restore canceled by user."))
+        return None
+    if not messagebox.askyesno(
+        t("confirm_restore_title", fallback="Confirm Restore"),
+        t("confirm_restore_message", fallback="This will overwrite current data. Continue?")
+    ):
+        print(t("restore_canceled", fallback="Restore canceled by user."))
+        return None
+    try:
+        result = restore_snapshot(manifest_path)
+    except Exception as e:
+        print(t("error_during_restore", fallback="Error during restore: {error}").format(error=str(e)))
+        messagebox.showerror(
+            t("restore_error_title", fallback="Restore Error"),
+            t("restore_failed", fallback="Failed to restore backup: {error}").format(error=str(e))
+        )
+        return None
+    details = [t("restore_success", fallback="Restore completed successfully!")]
+    for table, count in result["counts"].items():
+        details.append(t("table_rows", fallback=" - {table}: {count} rows").format(table=table, count=count))
+    details.append(t("restored_files_count", fallback="Restored files: {count}").format(count=len(result["files"])))
+    details.append(t("snapshot_restore_time", fallback="Total time {seconds}s").format(seconds=result["seconds"]))
+    confirmation = "\n".join(details)
+    print(confirmation)
+    messagebox.showinfo(t("restore_complete_title", fallback="Restore Complete"), confirmation)
+    return result
+
+def create_backup_zip(parent=None):
+    """
+    Create a zip file containing the SQLite database and source files, prompting for save location.
+    With a parent widget the zip is written in the backup worker behind a
+    progress window and None is returned; without one it blocks.
+    """
     # Create a hidden Tk root for the file dialog
     root = Tk()
     root.withdraw()  # Hide the main window
@@ -85,13 +570,45 @@ def create_backup_zip():
                 data_files.append(arc_name)
                 print(t("adding_to_backup", fallback="Adding {file} to backup (from data folder)").format(file=arc_name))
 
-    # Create zip file
-    try: 
+    def _done(filename, error):
+        if error:
+            _backup_failed(error)
+            return None
+        print(t("backup_created", fallback="Backup created: {filename}").format(filename=filename))
+        messagebox.showinfo(
+            t("backup_title", fallback="Backup"),
+            t("backup_success", fallback="Backup created successfully: {filename}").format(filename=filename)
+        )
+        return filename
+
+    def _work(progress=None):
+        return _write_backup_zip(zip_filename, source_files, data_files, progress)
+
+    if parent is not None:
+        run_in_background(parent, t("backup_title", fallback="Backup"), _work, _done)
+        return None
+    try:
+        return _done(_work(), None)
+    except Exception as e:
+        return _done(None, e)
+
+def _write_backup_zip(zip_filename, source_files, data_files, progress=None):
+    """Write the backup zip (worker side of create_backup_zip). Returns zip_filename."""
+    db_copy = None
+    try:
         with zipfile.ZipFile(zip_filename, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            # Add SQLite database
+            # Add SQLite database (consistent online copy, not the live file + WAL)
             if os.path.exists(DB_FILE):
-                zipf.write(DB_FILE, os.path.basename(DB_FILE))
+                fd, db_copy = tempfile.mkstemp(suffix=".db")
+                os.close(fd)
+                db_metrics = snapshot_database(db_copy, progress=progress)
+                zipf.write(db_copy, os.path.basename(DB_FILE))
                 print(t("added_db_to_backup", fallback="Added {db} to backup").format(db=DB_FILE))
+                print(t(
+                    "db_copy_metrics",
+                    fallback="Database copy: {size} KB in {seconds}s (integrity {integrity})",
+                ).format(size=db_metrics["size_bytes"] // 1024, seconds=db_metrics["seconds"],
+                         integrity=db_metrics["integrity"]))
             else:
                 print(t("warning_db_not_found", fallback="Warning: SQLite database {db} not found").format(db=DB_FILE))
 
@@ -106,74 +623,139 @@ def create_backup_zip():
                 full_path = os.path.join(os.getcwd(), file)
                 zipf.write(full_path, file)
                 print(t("added_data_file", fallback="Added {file} to backup (data file)").format(file=file))
-
-        print(t("backup_created", fallback="Backup created: {filename}").format(filename=zip_filename))
-        messagebox.showinfo(
-            t("backup_title", fallback="Backup"),
-            t("backup_success", fallback="Backup created successfully: {filename}").format(filename=zip_filename)
-        )
         return zip_filename
-    except Exception as e:
-        print(t("error_creating_backup", fallback="Error creating backup: {error}").format(error=str(e)))
-        messagebox.showerror(
-            t("backup_error_title", fallback="Backup Error"),
-            t("backup_failed", fallback="Failed to create backup: {error}").format(error=str(e))
-        )
-        return None
+    finally:
+        if db_copy and os.path.exists(db_copy):
+            os.remove(db_copy)
 
-def restore_backup(zip_file):
-    """Restore the backup from a zip file, preserving folder structure and showing restore details."""
+def _stream_member(zip_ref, info, dest_path):
+    """
+    Stream one zip member into a temp file next to dest_path (same
+    filesystem, so os.replace is atomic). Returns (temp_path, bytes).
+    """
+    dest_dir = os.path.dirname(os.path.abspath(dest_path))
+    os.makedirs(dest_dir, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(suffix=".part", dir=dest_dir)
     try:
-        # Create temporary directory for extraction
-        temp_dir = "temp_restore"
-        os.makedirs(temp_dir, exist_ok=True)
+        with os.fdopen(fd, "wb") as out, zip_ref.open(info) as src:
+            shutil.copyfileobj(src, out, RESTORE_BUFFER_SIZE)
+            out.flush()
+            os.fsync(out.fileno())
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return tmp, info.file_size
 
-        # Extract zip contents
-        with zipfile.ZipFile(zip_file, 'r') as zip_ref:
-            zip_ref.extractall(temp_dir)
+def _same_content(path, info):
+    """True if path already holds the member (size + CRC32), so it can be skipped."""
+    try:
+        if os.path.getsize(path) != info.file_size:
+            return False
+        crc = 0
+        with open(path, "rb") as fh:
+            for block in iter(lambda: fh.read(RESTORE_BUFFER_SIZE), b""):
+                crc = zlib.crc32(block, crc)
+        return crc == info.CRC
+    except OSError:
+        return False
 
-        # Restore SQLite database
-        db_file = os.path.join(temp_dir, "iseprep.db")
-        restored_tables = []
-        restored_counts = {}
-        if os. path.exists(db_file):
-            shutil.copy(db_file, DB_FILE)
-            print(t("restored_db", fallback="Restored SQLite database to {db}").format(db=DB_FILE))
-
-            # Verify restored data
-            conn = sqlite3.connect(DB_FILE)
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-
-            # Check key tables
-            tables = ["scenarios", "compositions", "items_list"]
-            for table in tables:
-                try:
-                    cursor.execute(f"SELECT COUNT(*) AS count FROM {table}")
-                    count = cursor.fetchone()["count"]
-                    restored_counts[table] = count
-                    restored_tables.append(table)
-                except sqlite3.Error as e:
-                    print(t("error_counting_rows", fallback="Error counting rows in {table}: {error}").format(table=table, error=str(e)))
-
-            cursor.close()
-            conn.close()
-        else:
-            print(t("warning_db_not_in_backup", fallback="Warning:  SQLite database not found in backup"))
+def verify_restore_candidate(path):
+    """
+    Check a restored database before it replaces the live one: integrity,
+    schema version and required tables. Returns row counts of key tables;
+    raises ValueError when the file must not be used.
+    """
+    ok, message = verify_database(path)
+    if not ok:
+        raise ValueError(t("integrity_failed", fallback="Integrity check failed: {error}").format(error=message))
+    conn = sqlite3.connect(path)
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version > SUPPORTED_SCHEMA_VERSION:
+            raise ValueError(t(
+                "schema_too_new",
+                fallback="Backup schema version {version} is newer than this application supports ({supported})",
+            ).format(version=version, supported=SUPPORTED_SCHEMA_VERSION))
+        tables = {r[0].lower() for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        missing = [tbl for tbl in REQUIRED_TABLES if tbl not in tables]
+        if missing:
+            raise ValueError(t(
+                "missing_tables", fallback="Backup database is missing tables: {tables}"
+            ).format(tables=", ".join(missing)))
+        counts = {}
+        for table in ("scenarios", "compositions", "items_list"):
+            if table in tables:
+                counts[table] = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        return counts
+    finally:
+        conn.close()
 
-        # Restore source files and data folder
-        source_files = get_all_source_files()
-        data_folder = os. path.join(os.getcwd(), "data")
-        os.makedirs(data_folder, exist_ok=True)
+def _swap_database(candidate):
+    """
+    Replace DB_FILE by candidate atomically. Long-lived connections are
+    closed and the WAL checkpointed / removed first, so no stale -wal / -shm
+    can be replayed onto the restored file.
+    """
+    close_persistent_connections()
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.close()
+    except sqlite3.Error:
+        pass
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(DB_FILE + suffix):
+            os.remove(DB_FILE + suffix)
+    os.replace(candidate, DB_FILE)
+    # Older backups come back at their own user_version
+    apply_migrations()
+    schema.refresh()
+    for topic in ALL_TOPICS:
+        bus.publish(topic, source="restore")
+
+def restore_backup(zip_file):
+    """
+    Restore the backup from a zip file, preserving folder structure and showing restore details.
+
+    The database member is streamed to a temp file, verified
+    (integrity_check, schema version, required tables) and only then swapped
+    in with os.replace, so a failed restore never leaves a half-written DB.
+    Files are streamed member by member; identical files are skipped.
+    """
+    if not zip_file:
+        print(t("restore_canceled", fallback="Restore canceled by user."))
+        return
+    candidate = None
+    try:
+        started = time.perf_counter()
+        restored_counts = {}
         restored_files = []
+        db_bytes = 0
+        file_bytes = 0
+        source_files = get_all_source_files()
 
-        for root_dir, dirs, files in os.walk(temp_dir):
-            if "__pycache__" in dirs:
-                dirs.remove("__pycache__")  # Exclude __pycache__
-            for file in files: 
-                full_path = os.path.join(root_dir, file)
-                rel_path = os.path.relpath(full_path, temp_dir)
-                dest_path = os.path. join(os.getcwd(), rel_path)
+        with zipfile.ZipFile(zip_file, 'r') as zip_ref:
+            members = [i for i in zip_ref.infolist() if not i.is_dir()]
+
+            # Restore SQLite database (stream -> verify -> atomic swap)
+            db_member = next((i for i in members if os.path.basename(i.filename) == "iseprep.db"), None)
+            if db_member is not None:
+                candidate, db_bytes = _stream_member(zip_ref, db_member, DB_FILE)
+                restored_counts = verify_restore_candidate(candidate)
+                _swap_database(candidate)
+                candidate = None
+                print(t("restored_db", fallback="Restored SQLite database to {db}").format(db=DB_FILE))
+            else:
+                print(t("warning_db_not_in_backup", fallback="Warning:  SQLite database not found in backup"))
+            db_seconds = time.perf_counter() - started
+
+            # Restore source files and data folder
+            os.makedirs(os.path.join(os.getcwd(), "data"), exist_ok=True)
+            for info in members:
+                rel_path = info.filename
+                if info is db_member or "__pycache__" in rel_path.split("/"):
+                    continue
+                file = os.path.basename(rel_path)
 
                 # Handle source files (in main directory)
                 if rel_path in source_files or (not rel_path.startswith("data/") and file.endswith(".py")):
@@ -184,13 +766,21 @@ def restore_backup(zip_file):
                 else:
                     continue  # Skip unexpected files
 
-                os.makedirs(os.path. dirname(dest_path), exist_ok=True)
-                shutil.copy(full_path, dest_path)
+                if not _same_content(dest_path, info):
+                    tmp, size = _stream_member(zip_ref, info, dest_path)
+                    os.replace(tmp, dest_path)
+                    file_bytes += size
                 restored_files.append(rel_path)
                 print(t("restored_file", fallback="Restored {file} to {dest}").format(file=rel_path, dest=dest_path))
 
-        # Clean up
-        shutil.rmtree(temp_dir)
+        seconds = max(time.perf_counter() - started, 1e-6)
+        throughput = t(
+            "restore_throughput",
+            fallback="Database: {db_mb:.1f} MB in {db_seconds:.2f}s ({rate:.1f} MB/s); files: {files_mb:.1f} MB; total {seconds:.2f}s",
+        ).format(
+            db_mb=db_bytes / 1e6, db_seconds=db_seconds, rate=db_bytes / 1e6 / max(db_seconds, 1e-6),
+            files_mb=file_bytes / 1e6, seconds=seconds,
+        )
 
         # Build confirmation message
         details = [t("restore_success", fallback="Restore completed successfully!")]
@@ -202,6 +792,7 @@ def restore_backup(zip_file):
             details.append(f" - {file}")
         if len(restored_files) > 5:
             details.append(t("more_files", fallback=" - ... and {count} more files").format(count=len(restored_files) - 5))
+        details.append(throughput)
 
         confirmation = "\n".join(details)
         print(confirmation)
@@ -215,7 +806,9 @@ def restore_backup(zip_file):
             t("restore_error_title", fallback="Restore Error"),
             t("restore_failed", fallback="Failed to restore backup: {error}").format(error=str(e))
         )
-        shutil.rmtree(temp_dir, ignore_errors=True)
+    finally:
+        if candidate and os.path.exists(candidate):
+            os.remove(candidate)
 
 def select_and_restore_backup():
     """Prompt user to select a backup file and restore it."""
@@ -0,0 +1,12 @@
+"""
+benchmarks
+Headless performance checks for IsEPREP (no Tk window is opened).
+
+Each module is runnable on its own and exits non-zero on a regression:
+    python -m benchmarks.import_time
+    python -m benchmarks.depot_bench --scale 100k
+    python -m benchmarks.query_plans
+
+benchmarks.synthetic_depot builds the deterministic depot databases
+(10k / 100k / 1M ledger rows) the compute benchmarks run on.
+"""
@@ -0,0 +1,69 @@
+"""
+benchmarks/auth_calibrate.py
+Calibrate PBKDF2 iterations to a target login latency on this CPU.
+
+Times pbkdf2_hmac("sha256") on the host, derives the iteration count that
+costs --target-ms (rounded down to 10,000, never below DEFAULT_ITERATIONS:
+a fast host raises the cost, a slow one keeps the default) and, with --save,
+writes it to auth_config.json. Existing hashes with fewer iterations are
+upgraded in the background at their next successful login.
+
+Usage:
+    python -m benchmarks.auth_calibrate
+    python -m benchmarks.auth_calibrate --target-ms 300 --save
+"""
+
+import sys
+import time
+import hashlib
+import argparse
+
+from auth_utils import (
+    AUTH_CONFIG_FILE,
+    DEFAULT_ITERATIONS,
+    load_target_iterations,
+    save_target_iterations,
+)
+
+SAMPLE_ITERATIONS = 50000
+
+
+def seconds_per_iteration(samples=5, iterations=SAMPLE_ITERATIONS):
+    """Best-of-N cost of one PBKDF2-SHA256 iteration on this host."""
+    salt = b"\x00" * 16
+    best = None
+    for _ in range(max(samples, 1)):
+        started = time.perf_counter()
+        hashlib.pbkdf2_hmac("sha256", b"calibration-password", salt, iterations)
+        elapsed = (time.perf_counter() - started) / iterations
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def calibrate(target_ms, samples=5):
+    """Iterations that take about target_ms here (multiple of 10,000, >= DEFAULT_ITERATIONS)."""
+    per_iteration = seconds_per_iteration(samples)
+    iterations = int(target_ms / 1000.0 / per_iteration) // 10000 * 10000
+    return max(iterations, DEFAULT_ITERATIONS), per_iteration
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Calibrate PBKDF2 iterations to a target latency")
+    parser.add_argument("--target-ms", type=float, default=250.0)
+    parser.add_argument("--samples", type=int, default=5)
+    parser.add_argument("--save", action="store_true", help=f"write the result to {AUTH_CONFIG_FILE}")
+    args = parser.parse_args(argv)
+
+    iterations, per_iteration = calibrate(args.target_ms, args.samples)
+    current = load_target_iterations()
+    print(f"PBKDF2-SHA256: {per_iteration * 1e6:.3f} us / iteration")
+    print(f"current target: {current} iterations ({current * per_iteration * 1000:.0f} ms)")
+    print(f"calibrated:     {iterations} iterations ({iterations * per_iteration * 1000:.0f} ms)")
+    if args.save:
+        save_target_iterations(iterations)
+        print(f"saved to {AUTH_CONFIG_FILE}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,284 @@
+"""
+benchmarks/depot_bench.py
+Headless timings of the report / stock compute paths on a synthetic depot.
+
+Builds (or reuses, with --db) a SyntheticDepot at the requested scale,
+points db.DB_FILE at a scratch copy of it and runs the non-Tk compute paths
+the screens call:
+
+    expiry_data          ExpiryDataCalculator.compute()
+    stock_availability   StockAvailabilityCalculator.compute()
+    consumption          CombinedCalculator.compute()
+    order                OrderData.fetch()
+    stock_summary        aggregate_stock_by_treecode()
+    loans                aggregate_loans()
+    stock_update         StockData.add_or_update() on UPDATE_SAMPLE lots
+
+Every path runs --repeat times with cold caches (each event-bus topic is
+published first, as after a restore); best and median wall time are kept,
+and the peak of a separate tracemalloc run. Results are saved per scale to
+a JSON baseline; compare mode fails when a path is more than --tolerance
+slower (and MIN_DELTA_MS slower in absolute terms) or its peak memory
+grew by more than --memory-tolerance.
+
+Usage:
+    python -m benchmarks.depot_bench --scale 10k --save-baseline
+    python -m benchmarks.depot_bench --scale 10k
+    python -m benchmarks.depot_bench --scale 1m --db /tmp/depot_1m.db --only order loans
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import sqlite3
+import argparse
+import platform
+import statistics
+import tempfile
+import tracemalloc
+from datetime import date
+
+import db
+from event_bus import bus, ALL_TOPICS
+from benchmarks.synthetic_depot import BASE_DATE, DEFAULT_SEED, SCALES, SyntheticDepot
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "depot_baseline.json")
+DEFAULT_REPEAT = 3
+DEFAULT_TOLERANCE = 0.25
+DEFAULT_MEMORY_TOLERANCE = 0.25
+MIN_DELTA_MS = 5.0
+UPDATE_SAMPLE = 100
+
+
+# ---------------- Compute paths ----------------
+def _scenario_map():
+    conn = db.connect_db()
+    try:
+        return {str(sid): name for sid, name in conn.execute("SELECT scenario_id, name FROM scenarios")}
+    finally:
+        conn.close()
+
+
+def bench_expiry_data():
+    from expiry_data import ExpiryDataCalculator
+    scenario_map = _scenario_map()
+    return lambda: ExpiryDataCalculator(scenario_name_map=scenario_map).compute()
+
+
+def bench_stock_availability():
+    from stock_availability import StockAvailabilityCalculator
+    scenario_map = _scenario_map()
+    return lambda: StockAvailabilityCalculator(scenario_name_map=scenario_map).compute()
+
+
+def bench_consumption():
+    from consumption import CombinedCalculator
+    params = dict(
+        dataset_mode="All", management_mode="All", scenario="All", kit="All", module="All",
+        type_filter="All", item_search="", out_type="All", out_movement="ALL", in_type="All",
+        in_movement="ALL", document_number="", date_from=BASE_DATE, date_to=date(BASE_DATE.year + 2, 12, 31),
+    )
+    return lambda: CombinedCalculator(**params).compute()
+
+
+def bench_order():
+    from order import OrderData
+    return lambda: OrderData(kit_filter="All", module_filter="All", type_filter="All",
+                             item_search="", lead=6, cover=6, buffer=3).fetch()
+
+
+def bench_stock_summary():
+    from stock_summary import aggregate_stock_by_treecode, cutoff_date_from_months, load_scenario_maps
+    filters = {"scenario": None, "management_mode": "All", "kit_number": None,
+               "module_number": None, "item_code": None, "type_filter": "All"}
+    cutoff_iso = cutoff_date_from_months(15)
+
+    def run():
+        id_to_name, name_set = load_scenario_maps()
+        return aggregate_stock_by_treecode(filters, cutoff_iso, id_to_name, name_set)
+    return run
+
+
+def bench_loans():
+    from loans import aggregate_loans
+    filters = {"scenario": "All", "kit": "All", "module": "All", "type": "All",
+               "third_party": "All", "item_search": "", "doc_number": "",
+               "date_from": None, "date_to": None}
+    return lambda: aggregate_loans(filters)
+
+
+def bench_stock_update():
+    from stock_data import StockData
+    conn = db.connect_db()
+    try:
+        lots = [r[0] for r in conn.execute("SELECT unique_id FROM stock_data ORDER BY unique_id")]
+    finally:
+        conn.close()
+    sample = random.Random(DEFAULT_SEED).sample(lots, min(UPDATE_SAMPLE, len(lots)))
+
+    def run():
+        for unique_id in sample:
+            StockData.add_or_update(unique_id, qty_in=1)
+        return sample
+    return run
+
+
+BENCHMARKS = (
+    ("expiry_data", bench_expiry_data),
+    ("stock_availability", bench_stock_availability),
+    ("consumption", bench_consumption),
+    ("order", bench_order),
+    ("stock_summary", bench_stock_summary),
+    ("loans", bench_loans),
+    ("stock_update", bench_stock_update),
+)
+
+
+# ---------------- Measurement ----------------
+def _cold():
+    """Drop every cache subscribed to the bus and the query cache, as a restore does."""
+    for topic in ALL_TOPICS:
+        bus.publish(topic, source="benchmark")
+    db.query_cache.clear()
+
+
+def measure(run, repeat=DEFAULT_REPEAT):
+    """{best_ms, median_ms, peak_kb} of `run` with cold caches."""
+    times = []
+    for _ in range(max(repeat, 1)):
+        _cold()
+        started = time.perf_counter()
+        run()
+        times.append((time.perf_counter() - started) * 1000.0)
+    _cold()
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"best_ms": round(min(times), 2), "median_ms": round(statistics.median(times), 2),
+            "peak_kb": round(peak / 1024.0, 1)}
+
+
+def run_suite(db_path, repeat=DEFAULT_REPEAT, only=None):
+    """Run the selected paths against db_path; {name: measurement or {"error": ...}}."""
+    db.DB_FILE = db_path
+    results = {}
+    for name, setup in BENCHMARKS:
+        if only and name not in only:
+            continue
+        try:
+            results[name] = measure(setup(), repeat)
+        except Exception as e:
+            results[name] = {"error": f"{type(e).__name__}: {e}"}
+        status = results[name].get("error") or (
+            f"best {results[name]['best_ms']:9.1f} ms  median {results[name]['median_ms']:9.1f} ms  "
+            f"peak {results[name]['peak_kb']:9.0f} KiB")
+        print(f"  {name:20s} {status}")
+    return results
+
+
+def table_counts(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return {t: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]
+                for t in ("items_list", "kit_items", "stock_data", "stock_transactions")}
+    finally:
+        conn.close()
+
+
+# ---------------- Baseline ----------------
+def load_baseline(path=BASELINE_FILE):
+    try:
+        with open(path, "r", encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_baseline(report, path=BASELINE_FILE):
+    baselines = load_baseline(path)
+    baselines[report["scale"]] = report
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump(baselines, fh, indent=1, sort_keys=True)
+
+
+def compare(report, baseline, tolerance=DEFAULT_TOLERANCE, memory_tolerance=DEFAULT_MEMORY_TOLERANCE):
+    """Regression messages of `report` against the baseline of the same scale."""
+    failures = []
+    if baseline.get("seed") != report["seed"] or baseline.get("rows") != report["rows"]:
+        failures.append("baseline was recorded on a different depot (scale / seed / rows)")
+        return failures
+    for name, base in baseline.get("results", {}).items():
+        now = report["results"].get(name)
+        if now is None or "error" in base:
+            continue
+        if "error" in now:
+            failures.append(f"{name}: {now['error']}")
+            continue
+        limit = base["best_ms"] * (1 + tolerance)
+        if now["best_ms"] > limit and now["best_ms"] - base["best_ms"] > MIN_DELTA_MS:
+            failures.append(f"{name}: {now['best_ms']:.1f} ms vs baseline {base['best_ms']:.1f} ms "
+                            f"(limit {limit:.1f} ms)")
+        mem_limit = base["peak_kb"] * (1 + memory_tolerance)
+        if now["peak_kb"] > mem_limit:
+            failures.append(f"{name}: peak {now['peak_kb']:.0f} KiB vs baseline {base['peak_kb']:.0f} KiB")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compute path benchmark on a synthetic depot")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="10k")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--db", help="depot built by benchmarks.synthetic_depot (not modified)")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--only", nargs="+", choices=[name for name, _ in BENCHMARKS])
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed slowdown vs baseline (0.25 = +25%%)")
+    parser.add_argument("--memory-tolerance", type=float, default=DEFAULT_MEMORY_TOLERANCE)
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="iseprep_bench_")
+    try:
+        work_db = os.path.join(workdir, "depot.db")
+        started = time.perf_counter()
+        db.DB_FILE = work_db    # before build(): nothing may open the real database
+        if args.db:
+            shutil.copyfile(args.db, work_db)
+        else:
+            SyntheticDepot(args.scale, args.seed).build(work_db)
+        rows = table_counts(work_db)
+        print(f"depot {args.scale} (seed {args.seed}) ready in {time.perf_counter() - started:.1f} s: "
+              + ", ".join(f"{t} {n:,}" for t, n in rows.items()))
+        report = {
+            "scale": args.scale, "seed": args.seed, "rows": rows,
+            "python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+            "results": run_suite(work_db, args.repeat, args.only),
+        }
+    finally:
+        db.close_persistent_connections()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    failures = []
+    baseline = load_baseline(args.baseline).get(args.scale)
+    if args.save_baseline:
+        save_baseline(report, args.baseline)
+        print(f"baseline for {args.scale} saved to {args.baseline}")
+    elif baseline:
+        failures = compare(report, baseline, args.tolerance, args.memory_tolerance)
+    else:
+        print(f"no baseline for {args.scale} in {args.baseline} (run with --save-baseline)")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""
+benchmarks/import_time.py
+Cold-start import benchmark for the login window.
+
+Runs `python -X importtime -c "import login_gui"` in a fresh interpreter
+(several times, best run kept) and fails when:
+  * a heavy dependency (pandas, openpyxl, dateutil, numpy) or a screen module
+    from screen_registry is imported before login, or
+  * the cumulative import time of login_gui exceeds --budget-ms, or is more
+    than --tolerance above the saved baseline.
+
+Usage:
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --save-baseline
+    python -m benchmarks.import_time --budget-ms 800 --runs 5
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+from screen_registry import SCREENS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "import_time_baseline.json")
+
+ENTRY_MODULE = "login_gui"
+HEAVY_MODULES = ("pandas", "openpyxl", "dateutil", "numpy")
+DEFAULT_BUDGET_MS = 1500.0
+DEFAULT_TOLERANCE = 0.5
+
+
+def measure_once(entry=ENTRY_MODULE):
+    """
+    One cold import. Returns (cumulative_ms of entry, {module: cumulative_us})
+    parsed from the -X importtime report on stderr.
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {entry}"],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {entry} failed:\n{proc.stderr[-2000:]}")
+    modules = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = [p.strip() for p in line[len("import time:"):].split("|")]
+        if len(parts) != 3 or not parts[1].isdigit():
+            continue
+        modules[parts[2].strip()] = int(parts[1])
+    if entry not in modules:
+        raise RuntimeError(f"no importtime entry for {entry}")
+    return modules[entry] / 1000.0, modules
+
+
+def measure(runs=3, entry=ENTRY_MODULE):
+    """Best of `runs` cold imports: (cumulative_ms, modules of that run)."""
+    results = [measure_once(entry) for _ in range(max(runs, 1))]
+    return min(results, key=lambda r: r[0])
+
+
+def forbidden_imports(modules):
+    """Heavy dependencies and screen modules that were imported eagerly."""
+    screen_modules = {mod for mod, _ in SCREENS.values()}
+    found = []
+    for name in modules:
+        top = name.split(".")[0]
+        if top in HEAVY_MODULES or name in screen_modules:
+            found.append(name)
+    return sorted(set(found))
+
+
+def load_baseline(path=BASELINE_FILE):
+    try:
+        with open(path, "r", encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Login window cold-start import benchmark")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed slowdown vs baseline (0.5 = +50%%)")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true")
+    args = parser.parse_args(argv)
+
+    cumulative_ms, modules = measure(args.runs)
+    slowest = sorted(modules.items(), key=lambda kv: kv[1], reverse=True)[:10]
+    print(f"import {ENTRY_MODULE}: {cumulative_ms:.1f} ms cumulative, {len(modules)} modules")
+    for name, us in slowest:
+        print(f"  {us / 1000.0:8.1f} ms  {name}")
+
+    failures = []
+    eager = forbidden_imports(modules)
+    if eager:
+        failures.append(f"imported before login: {', '.join(eager)}")
+    if cumulative_ms > args.budget_ms:
+        failures.append(f"{cumulative_ms:.1f} ms exceeds budget {args.budget_ms:.0f} ms")
+    baseline = load_baseline(args.baseline)
+    if baseline and not args.save_baseline:
+        limit = baseline["cumulative_ms"] * (1 + args.tolerance)
+        print(f"baseline: {baseline['cumulative_ms']:.1f} ms (limit {limit:.1f} ms)")
+        if cumulative_ms > limit:
+            failures.append(f"{cumulative_ms:.1f} ms is above baseline limit {limit:.1f} ms")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as fh:
+            json.dump({"entry": ENTRY_MODULE, "cumulative_ms": round(cumulative_ms, 1),
+                       "modules": len(modules)}, fh, indent=1)
+        print(f"baseline saved to {args.baseline}")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,360 @@
+"""
+benchmarks/query_plans.py
+EXPLAIN QUERY PLAN regression check of the report queries.
+
+An index that is dropped, renamed or no longer matches a rewritten WHERE
+clause does not break anything: the report just reads the whole ledger
+again. This check builds (or reuses, with --db) a SyntheticDepot, asks
+SQLite for the plan of each report query in PLAN_CASES and fails when a
+plan reads a table in full:
+
+  * a plan line "SCAN <table>" without an index is a full table scan;
+    full scans of an index ("SCAN ... USING [COVERING] INDEX", the ordered
+    transaction list) and of CTEs are not
+  * a case may allow_scan tables it reads in full on purpose (small lookup
+    tables, whole-depot aggregates)
+  * the SQL is the screens' own: each case calls the module-level constant
+    or builder the screen executes, so a rewritten query is checked as shipped
+  * parameters are taken from the generated rows (a real code, treecode,
+    document number ...), so the planner sees the values the screens bind
+
+The plans are printed with --show and can be saved to PLANS_FILE; a saved
+plan that changed is reported, only full scans fail the run.
+
+Usage:
+    python -m benchmarks.query_plans
+    python -m benchmarks.query_plans --scale 100k --show
+    python -m benchmarks.query_plans --db /tmp/depot_100k.db --save
+"""
+
+import os
+import re
+import sys
+import json
+import shutil
+import sqlite3
+import argparse
+import tempfile
+from collections import namedtuple
+from datetime import date
+
+import db
+from benchmarks.synthetic_depot import BASE_DATE, DEFAULT_SEED, SCALES, SyntheticDepot
+
+PLANS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "query_plans.json")
+
+# Lookup tables small enough to be read in full by any query
+SMALL_TABLES = ("scenarios", "project_details")
+
+# name, screen / function the query comes from, query(sample) -> (sql, params),
+# tables allowed a full scan
+PlanCase = namedtuple("PlanCase", "name source query allow_scan")
+
+# The queries are the ones the screens run, taken from their module-level
+# constants and builders (imported on use: the screen modules pull in tkinter).
+_FROM = BASE_DATE
+_TO = date(BASE_DATE.year, 12, 31)
+_DATE_FROM = _FROM.isoformat()
+_DATE_TO = _TO.isoformat()
+
+# stock_summary filters with nothing selected
+_NO_STOCK_FILTERS = {"scenario": "", "kit_number": "", "module_number": "", "item_code": ""}
+
+
+def _order_matrix_sql(s):
+    from order_engine import OrderEngine
+    return OrderEngine._build_sql(None, None)
+
+
+def _hierarchy_sql(name):
+    def query(s):
+        import filter_options
+        return getattr(filter_options, name), ()
+    return query
+
+
+def _amc_sql(s):
+    from order_engine import AMC_OUT_SQL
+    return AMC_OUT_SQL, (_DATE_FROM, _DATE_TO)
+
+
+def _monthly_out_sql(s):
+    from order_engine import MONTHLY_OUT_SQL
+    return MONTHLY_OUT_SQL, (_DATE_FROM, _DATE_TO)
+
+
+def _consumption_sql(s, by_scenario=False):
+    from consumption import build_ledger_query
+    return build_ledger_query(_FROM, _TO, "", s["scenario"] if by_scenario else "All")
+
+
+def _loans_sql(s, by_third_party=False):
+    from loans import build_loans_query
+    filters = {"third_party": s["third_party"], "date_from": _FROM, "date_to": _TO} \
+        if by_third_party else {}
+    return build_loans_query(filters)
+
+
+def _loan_history_sql(s, count=False):
+    from loans import build_loan_history_queries
+    count_sql, rows_sql, params = build_loan_history_queries(s["code"], s["third_party"])
+    return (count_sql if count else rows_sql), params
+
+
+def _donations_sql(s):
+    from donations import build_donations_query
+    return build_donations_query({})
+
+
+def _losses_sql(s):
+    from losses import build_losses_query
+    return build_losses_query({"date_from": _FROM, "date_to": _TO})
+
+
+def _document_lines_sql(s):
+    from stock_card import DOCUMENT_LINES_SQL
+    return DOCUMENT_LINES_SQL, (s["document_number"],)
+
+
+def _last_document_sql(s):
+    from transaction_utils import LAST_DOCUMENT_SQL
+    return LAST_DOCUMENT_SQL, (s["document_prefix"] + "/%",)
+
+
+def _transactions_sql(s):
+    from stock_transactions import TRANSACTIONS_SQL
+    return TRANSACTIONS_SQL, ()
+
+
+def _stock_card_sql(s, management_mode=None):
+    from stock_card import build_card_query
+    return build_card_query(s["code"], _DATE_FROM, _DATE_TO, management_mode=management_mode)
+
+
+def _stock_card_opening_sql(s):
+    from stock_card import build_opening_query
+    return build_opening_query(s["code"], _DATE_FROM, management_mode="on_shelf")
+
+
+def _expiring_sql(s, in_box=False):
+    from stock_summary import (EXPIRING_IN_BOX_SQL, EXPIRING_ON_SHELF_SQL, IN_BOX_MODES,
+                               ON_SHELF_MODES, build_stock_where)
+    where, params = build_stock_where(_NO_STOCK_FILTERS)
+    if in_box:
+        sql = EXPIRING_IN_BOX_SQL.format(where=f"{where} AND {IN_BOX_MODES}")
+    else:
+        sql = EXPIRING_ON_SHELF_SQL.format(where=f"{where} AND {ON_SHELF_MODES}")
+    return sql, params + [_DATE_TO]
+
+
+def _inbox_lots_sql(s):
+    from stock_summary import IN_BOX_LOTS_SQL
+    return IN_BOX_LOTS_SQL, (s["scenario_id"], s["scenario"], s["treecode"])
+
+
+def _module_numbers_sql(s):
+    from dispatch_kit import build_module_numbers_query
+    return build_module_numbers_query(s["scenario_id"], s["scenario"], s["kit_number"])
+
+
+def _fefo_lots_sql(s):
+    from fefo_allocator import build_lots_query
+    return build_lots_query([s["scenario_id"], s["scenario"]], [s["code"]])
+
+
+PLAN_CASES = (
+    PlanCase("amc_out_msf", "expiry_data / stock_availability (AMC)", _amc_sql, ()),
+    PlanCase("monthly_out_msf", "order_engine.OrderEngine._load_monthly_out", _monthly_out_sql, ()),
+    PlanCase("consumption", "consumption.CombinedCalculator.compute", _consumption_sql, ()),
+    PlanCase("consumption_scenario", "consumption.CombinedCalculator.compute",
+             lambda s: _consumption_sql(s, by_scenario=True), ()),
+    PlanCase("loans", "loans.aggregate_loans", _loans_sql, ()),
+    PlanCase("loans_third_party", "loans.aggregate_loans",
+             lambda s: _loans_sql(s, by_third_party=True), ()),
+    PlanCase("loan_returns", "loans (return matching)", _loan_history_sql, ()),
+    PlanCase("loan_returns_count", "loans (return matching)",
+             lambda s: _loan_history_sql(s, count=True), ()),
+    PlanCase("donations", "donations.aggregate_donations", _donations_sql, ()),
+    PlanCase("losses", "losses.aggregate_losses", _losses_sql, ()),
+    PlanCase("document_lines", "stock_card (document popup)", _document_lines_sql, ()),
+    PlanCase("next_document_number", "in_ / out / dispatch_kit (document numbering)",
+             _last_document_sql, ()),
+    PlanCase("transactions_list", "stock_transactions.load_transactions", _transactions_sql, ()),
+    PlanCase("stock_card", "stock_card.fetch_transactions_for_code", _stock_card_sql, ()),
+    PlanCase("stock_card_mode", "stock_card.fetch_transactions_for_code (management mode)",
+             lambda s: _stock_card_sql(s, management_mode="on_shelf"), ()),
+    PlanCase("stock_card_opening", "stock_card.fetch_transactions_for_code (management mode)",
+             _stock_card_opening_sql, ()),
+    PlanCase("ledger_hierarchy", "filter_options (ledger Scenario / Kit / Module)",
+             _hierarchy_sql("_LEDGER_HIERARCHY_SQL"), ()),
+    PlanCase("stock_hierarchy", "filter_options (stock kit / module numbers)",
+             _hierarchy_sql("_STOCK_HIERARCHY_SQL"), ()),
+    PlanCase("expiring_on_shelf", "stock_summary.aggregate_stock_by_treecode", _expiring_sql, ()),
+    PlanCase("expiring_in_box", "stock_summary.aggregate_stock_by_treecode",
+             lambda s: _expiring_sql(s, in_box=True), ()),
+    PlanCase("inbox_lots", "stock_summary (in-box lots popup)", _inbox_lots_sql, ()),
+    PlanCase("kit_module_numbers", "dispatch_kit.fetch_module_numbers", _module_numbers_sql, ()),
+    PlanCase("fefo_lots", "fefo_allocator.fetch_lots", _fefo_lots_sql, ()),
+    # the order matrix aggregates the whole stock and standard list by design
+    PlanCase("order_matrix", "order_engine.OrderEngine.matrix", _order_matrix_sql,
+             ("stock_data", "std_qty_helper")),
+)
+
+
+# ---------------- Sample values ----------------
+def sample_values(conn):
+    """Representative parameter values read from the depot."""
+    def one(sql):
+        row = conn.execute(sql).fetchone()
+        return row[0] if row else ""
+    scenario_id = one("SELECT scenario_id FROM scenarios ORDER BY scenario_id LIMIT 1")
+    document_number = one("SELECT document_number FROM stock_transactions "
+                          "WHERE IFNULL(document_number,'') <> '' ORDER BY rowid LIMIT 1")
+    return {
+        "scenario_id": str(scenario_id),
+        "scenario": one(f"SELECT name FROM scenarios WHERE scenario_id = {int(scenario_id or 0)}"),
+        "code": one("SELECT code FROM stock_transactions ORDER BY rowid LIMIT 1"),
+        "third_party": one("SELECT Third_Party FROM stock_transactions "
+                           "WHERE IFNULL(Third_Party,'') <> '' ORDER BY rowid LIMIT 1"),
+        "document_number": document_number,
+        "document_prefix": document_number.rsplit("/", 1)[0],
+        "treecode": one("SELECT treecode FROM stock_data WHERE IFNULL(treecode,'') <> '' "
+                        "ORDER BY unique_id LIMIT 1"),
+        "kit_number": one("SELECT kit_number FROM stock_data WHERE IFNULL(kit_number,'') <> '' "
+                          "ORDER BY unique_id LIMIT 1"),
+    }
+
+
+# ---------------- Plans ----------------
+_SOURCE_RE = re.compile(r"\b(?:FROM|JOIN)\s+([\w.]+)(?:\s+(?:AS\s+)?(\w+))?", re.I)
+_KEYWORDS = {"where", "left", "join", "inner", "on", "group", "order", "limit", "union", "cross"}
+
+
+def _aliases(sql):
+    """{name as shown in plans: table} of the FROM / JOIN sources of sql."""
+    names = {}
+    for table, alias in _SOURCE_RE.findall(sql):
+        table = table.split(".")[-1]
+        names[table] = table
+        if alias and alias.lower() not in _KEYWORDS:
+            names[alias] = table
+    return names
+
+
+def explain(conn, sql, params):
+    """Plan of sql as [(depth, detail)]."""
+    depth, plan = {0: -1}, []
+    for node_id, parent, _unused, detail in conn.execute("EXPLAIN QUERY PLAN " + sql, params):
+        depth[node_id] = depth.get(parent, -1) + 1
+        plan.append((depth[node_id], detail))
+    return plan
+
+
+def full_scans(plan, sql, tables, allow_scan=()):
+    """Tables the plan reads in full without an index, minus the allowed ones."""
+    aliases = _aliases(sql)
+    scans = []
+    for _depth, detail in plan:
+        if not detail.startswith("SCAN ") or " USING " in detail:
+            continue
+        name = detail.split()[1]
+        table = aliases.get(name, name)
+        if table in tables and table not in allow_scan and table not in SMALL_TABLES:
+            scans.append(table)
+    return scans
+
+
+def check_plans(conn, cases=PLAN_CASES):
+    """[{name, source, plan, scans}] of every case; scans lists the offending tables."""
+    from ledger_archive import attach_ledger
+    attach_ledger(conn)
+    tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    sample = sample_values(conn)
+    results = []
+    for case in cases:
+        try:
+            sql, params = case.query(sample)
+            plan = explain(conn, sql, params)
+        except sqlite3.Error as e:
+            results.append({"name": case.name, "source": case.source, "plan": [],
+                            "scans": [], "error": str(e)})
+            continue
+        results.append({"name": case.name, "source": case.source, "plan": plan,
+                        "scans": full_scans(plan, sql, tables, case.allow_scan)})
+    return results
+
+
+def plan_text(plan):
+    return "\n".join("  " * depth + detail for depth, detail in plan)
+
+
+def load_plans(path=PLANS_FILE):
+    try:
+        with open(path, "r", encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_plans(results, path=PLANS_FILE):
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump({r["name"]: plan_text(r["plan"]) for r in results}, fh, indent=1, sort_keys=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="EXPLAIN QUERY PLAN check of the report queries")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="10k")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--db", help="depot built by benchmarks.synthetic_depot (not modified)")
+    parser.add_argument("--only", nargs="+", choices=[c.name for c in PLAN_CASES])
+    parser.add_argument("--show", action="store_true", help="print every plan")
+    parser.add_argument("--plans", default=PLANS_FILE)
+    parser.add_argument("--save", action="store_true", help="save the plans to --plans")
+    args = parser.parse_args(argv)
+
+    cases = [c for c in PLAN_CASES if not args.only or c.name in args.only]
+    workdir = tempfile.mkdtemp(prefix="iseprep_plans_")
+    try:
+        work_db = os.path.join(workdir, "depot.db")
+        db.DB_FILE = work_db    # before build(): nothing may open the real database
+        if args.db:
+            shutil.copyfile(args.db, work_db)
+        else:
+            SyntheticDepot(args.scale, args.seed).build(work_db)
+        conn = db.connect_db()
+        try:
+            results = check_plans(conn, cases)
+        finally:
+            conn.close()
+    finally:
+        db.close_persistent_connections()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    saved = load_plans(args.plans)
+    failures = []
+    for r in results:
+        text = plan_text(r["plan"])
+        if r.get("error"):
+            status = f"ERROR {r['error']}"
+            failures.append(f"{r['name']}: {r['error']}")
+        elif r["scans"]:
+            status = "FULL SCAN of " + ", ".join(r["scans"])
+            failures.append(f"{r['name']} ({r['source']}): full scan of {', '.join(r['scans'])}")
+        else:
+            status = "ok"
+        if r["name"] in saved and saved[r["name"]] != text and not r.get("error"):
+            status += " (plan changed)"
+        print(f"  {r['name']:22s} {status}")
+        if args.show or r["scans"]:
+            print("\n".join("      " + line for line in text.splitlines()))
+
+    if args.save:
+        save_plans(results, args.plans)
+        print(f"plans saved to {args.plans}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
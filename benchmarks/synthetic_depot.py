@@ -0,0 +1,367 @@
+"""
+benchmarks/synthetic_depot.py
+Deterministic synthetic depot databases for the benchmarks.
+
+The shipped iseprep.db holds a handful of stock_data rows and a few ledger
+lines, far from a depot after years of use. SyntheticDepot builds a
+database with the schema of the real one (tables, indexes, views and
+triggers are copied from a template, the migrations are applied on top)
+and fills it from a seeded random.Random:
+
+  * items_list: kit, module and item codes with EN/FR/ES designations
+  * scenarios, kit_items (kit -> module -> item, with treecodes) and
+    compositions (on-shelf standard lists)
+  * stock_data: on-shelf lots and in-box lots (kit / module numbers)
+  * stock_transactions: receptions, issues, loans and inventory
+    adjustments over three years from BASE_DATE
+
+The same scale and seed always give the same rows; nothing depends on the
+current date. Derived data (kit closure, ledger checkpoints, the standard
+list snapshots) is built after the bulk load, not row by row by triggers.
+
+Usage:
+    python -m benchmarks.synthetic_depot --scale 100k --out /tmp/depot_100k.db
+    from benchmarks.synthetic_depot import SyntheticDepot
+    counts = SyntheticDepot("10k").build("/tmp/depot.db")
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import sqlite3
+import tempfile
+import argparse
+import calendar
+from collections import namedtuple
+from datetime import date, timedelta
+
+import db
+from db import DB_FILE
+from migrations import apply_migrations
+from statement_engine import designation_sql, rebuild_snapshots
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DepotSpec = namedtuple(
+    "DepotSpec", "items scenarios kits modules module_items shelf_items stock_rows ledger_rows"
+)
+
+SCALES = {
+    "10k": DepotSpec(items=1500, scenarios=4, kits=3, modules=4, module_items=12,
+                     shelf_items=150, stock_rows=2000, ledger_rows=10000),
+    "100k": DepotSpec(items=5000, scenarios=8, kits=4, modules=6, module_items=20,
+                      shelf_items=400, stock_rows=20000, ledger_rows=100000),
+    "1m": DepotSpec(items=10000, scenarios=10, kits=6, modules=8, module_items=30,
+                    shelf_items=800, stock_rows=100000, ledger_rows=1000000),
+}
+
+DEFAULT_SEED = 1729
+BASE_DATE = date(2023, 1, 1)
+LEDGER_DAYS = 3 * 365
+TEMPLATE_DB = os.path.join(ROOT, DB_FILE)
+INSERT_CHUNK = 5000
+
+# Created and backfilled by migrations.py, never copied from the template
+DERIVED_TABLES = (
+    "kit_items_closure", "ledger_checkpoints", "ledger_archives",
+    "schema_migrations", "report_snapshot_version",
+)
+
+IN_TYPES = ("In MSF", "In Local Purchase", "In Donation", "In Borrowing", "In Return of Loan")
+OUT_TYPES = ("Out MSF", "Issue to Project", "Expired Items", "Loan", "Return of Borrowing")
+THIRD_PARTIES = ("MOH District 01", "MSF Holland", "MSF OCBA", "Partner NGO")
+LOAN_TYPES = {"In Borrowing", "In Return of Loan", "Loan", "Return of Borrowing"}
+
+
+def _month_end(year, month):
+    return date(year, month, calendar.monthrange(year, month)[1])
+
+
+def _derived(sql):
+    return any(table in sql for table in DERIVED_TABLES)
+
+
+def template_schema(template=TEMPLATE_DB):
+    """
+    {"table": [...], "index": [...], "view": [...], "trigger": [...]} CREATE
+    statements of the template, without SQLite internals and derived tables.
+    Read from a scratch copy: even a read-only open of a WAL database
+    writes its -shm file.
+    """
+    scratch = tempfile.mkdtemp(prefix="iseprep_template_")
+    try:
+        copy = os.path.join(scratch, os.path.basename(template))
+        for suffix in ("", "-wal"):
+            if os.path.exists(template + suffix):
+                shutil.copyfile(template + suffix, copy + suffix)
+        conn = sqlite3.connect(copy)
+        try:
+            rows = conn.execute(
+                "SELECT type, name, sql FROM sqlite_master "
+                "WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' ORDER BY rowid"
+            ).fetchall()
+        finally:
+            conn.close()
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    objects = {"table": [], "index": [], "view": [], "trigger": []}
+    for kind, name, sql in rows:
+        if kind in objects and name not in DERIVED_TABLES and not _derived(sql):
+            objects[kind].append(sql)
+    return objects
+
+
+class SyntheticDepot:
+    """Seeded generator of one depot database at a given scale."""
+
+    def __init__(self, scale="10k", seed=DEFAULT_SEED, **overrides):
+        spec = SCALES[scale] if isinstance(scale, str) else scale
+        self.spec = spec._replace(**overrides)
+        self.scale = scale if isinstance(scale, str) else "custom"
+        self.seed = seed
+        self.rng = random.Random(seed)
+
+    # ---------------- Reference data ----------------
+    def _items(self):
+        spec = self.spec
+        n_kits = spec.kits * 2
+        n_modules = spec.kits * spec.modules * 2
+        n_items = max(spec.items - n_kits - n_modules, spec.module_items, spec.shelf_items)
+        self.kit_codes = [f"KBENKIT{i:04d}" for i in range(1, n_kits + 1)]
+        self.module_codes = [f"KBENMOD{i:04d}" for i in range(1, n_modules + 1)]
+        self.item_codes = [f"DBEN{i:07d}" for i in range(1, n_items + 1)]
+        rows = []
+        for kind, codes in (("Kit", self.kit_codes), ("Module", self.module_codes),
+                            ("Item", self.item_codes)):
+            label = {"Kit": "KIT", "Module": "MODULE", "Item": "TABLET"}[kind]
+            for code in codes:
+                price = round(self.rng.uniform(0.5, 400.0), 2)
+                rows.append((
+                    code, "1", price, price, round(self.rng.uniform(0.01, 25.0), 3),
+                    round(self.rng.uniform(0.05, 80.0), 3), self.rng.choice((24, 36, 60)),
+                    "60200", kind, f"{label}, benchmark {code}", f"{label}, benchmark {code}",
+                    f"{label}, référence {code}", f"{label}, referencia {code}", code,
+                ))
+        return rows
+
+    def _scenarios(self):
+        self.scenarios = {i: f"Scenario {i:02d}" for i in range(1, self.spec.scenarios + 1)}
+        return [(sid, name, "IPD", self.rng.randint(1000, 100000), "Pharma-Co", "Benchmark depot")
+                for sid, name in self.scenarios.items()]
+
+    def _kit_items(self):
+        """kit_items rows; self.kit_lines keeps the item level for the in-box lots."""
+        spec = self.spec
+        rows, self.kit_lines = [], []
+        next_id = 1
+        for sid, name in self.scenarios.items():
+            for k, kit in enumerate(self.rng.sample(self.kit_codes, spec.kits), 1):
+                rows.append((next_id, sid, name, kit, None, None, kit, 1, "primary",
+                             f"{sid:02d}{k:03d}000000"))
+                next_id += 1
+                for m, module in enumerate(self.rng.sample(self.module_codes, spec.modules), 1):
+                    rows.append((next_id, sid, name, kit, module, None, module, 1, "secondary",
+                                 f"{sid:02d}{k:03d}{m:03d}000"))
+                    next_id += 1
+                    for i, item in enumerate(self.rng.sample(self.item_codes, spec.module_items), 1):
+                        treecode = f"{sid:02d}{k:03d}{m:03d}{i:03d}"
+                        std_qty = self.rng.randint(1, 200)
+                        rows.append((next_id, sid, name, kit, module, item, item, std_qty,
+                                     "tertiary", treecode))
+                        self.kit_lines.append((sid, name, k, kit, m, module, item, std_qty, treecode))
+                        next_id += 1
+        return rows
+
+    def _compositions(self):
+        rows, self.shelf_lines = [], []
+        next_id = 1
+        for sid in self.scenarios:
+            for code in self.rng.sample(self.item_codes, min(self.spec.shelf_items, len(self.item_codes))):
+                qty = self.rng.randint(10, 5000)
+                rows.append((code, qty, f"{sid}/None/None/{code}/{qty}", sid, next_id, f"std{next_id}"))
+                self.shelf_lines.append((sid, code, qty))
+                next_id += 1
+        return rows
+
+    # ---------------- Stock ----------------
+    def _expiry(self):
+        months = self.rng.randint(0, 60)
+        year, month = BASE_DATE.year + months // 12, months % 12 + 1
+        return _month_end(year, month).isoformat()
+
+    def _stock(self):
+        """stock_data rows; on-shelf lots from compositions, the rest in kits."""
+        rows, seen = [], set()
+        self.lots = []
+        line_id = 0
+        shelf_target = self.spec.stock_rows * 3 // 5
+        attempts = 0
+        while len(rows) < self.spec.stock_rows and attempts < self.spec.stock_rows * 20:
+            attempts += 1
+            exp = self._expiry()
+            if len(rows) < shelf_target:
+                sid, code, std_qty = self.rng.choice(self.shelf_lines)
+                unique_id = f"{sid}/None/None/{code}/{std_qty}/{exp}"
+                kit = module = "None"
+                kit_code = module_code = None
+                kit_number = module_number = treecode = None
+                mode = "on_shelf"
+            else:
+                sid, name, k, kit_code, m, module_code, code, std_qty, treecode = self.rng.choice(self.kit_lines)
+                copy = self.rng.randint(1, 3)
+                kit_number = f"{name[-2:]}-K{k:02d}-{copy}"
+                module_number = f"{kit_number}-M{m:02d}"
+                unique_id = (f"{sid}/{kit_code}/{module_code}/{code}/{std_qty}/{exp}/"
+                             f"{kit_number}/{module_number}/{treecode}")
+                kit, module = kit_code, module_code
+                mode = "in_box"
+            if unique_id in seen:
+                continue
+            seen.add(unique_id)
+            line_id += 1
+            qty_in = self.rng.randint(1, 1000)
+            qty_out = self.rng.randint(0, qty_in)
+            rows.append((
+                unique_id, line_id, str(sid), kit_number, module_number, kit, module, code,
+                std_qty, qty_in, qty_out, qty_in - qty_out, exp, 0,
+                f"{BASE_DATE.isoformat()} 08:00:00", mode, 0, None, treecode,
+            ))
+            self.lots.append((unique_id, code, str(sid), kit_code, module_code, exp, treecode))
+        self.last_line_id = line_id
+        return rows
+
+    def _ledger(self):
+        rows = []
+        for n in range(self.spec.ledger_rows):
+            unique_id, code, sid, kit, module, exp, treecode = self.rng.choice(self.lots)
+            day = BASE_DATE + timedelta(days=self.rng.randrange(LEDGER_DAYS))
+            stamp = f"{self.rng.randrange(7, 19):02d}:{self.rng.randrange(60):02d}:{self.rng.randrange(60):02d}"
+            qty_in = qty_out = in_type = out_type = discrepancy = third_party = None
+            roll = self.rng.random()
+            if roll < 0.45:
+                movement, in_type = "stock_in", self.rng.choice(IN_TYPES)
+                qty_in, doc_type = self.rng.randint(1, 500), "IN"
+            elif roll < 0.92:
+                movement, out_type = "stock_out", self.rng.choice(OUT_TYPES)
+                qty_out, doc_type = self.rng.randint(1, 300), "OUT"
+            else:
+                movement, doc_type = "stock_inv", "CINV"
+                discrepancy = str(self.rng.randint(-20, 20))
+            if (in_type or out_type) in LOAN_TYPES:
+                third_party = self.rng.choice(THIRD_PARTIES)
+            rows.append((
+                day.isoformat(), stamp, unique_id, code, f"TABLET, benchmark {code}", exp, "",
+                sid, kit, module, qty_in, in_type, qty_out, out_type, third_party, None,
+                discrepancy, "", movement,
+                f"{day.year}/{day.month:02d}/BENCH/{doc_type}/{n + 1:07d}", None, treecode,
+            ))
+        return rows
+
+    # ---------------- Build ----------------
+    @staticmethod
+    def _insert(cur, sql, rows):
+        for start in range(0, len(rows), INSERT_CHUNK):
+            cur.executemany(sql, rows[start:start + INSERT_CHUNK])
+
+    def build(self, path, template=TEMPLATE_DB):
+        """
+        Write the depot to `path` (replaced if it exists). Returns
+        {table: rows} of the generated tables. Callers point db.DB_FILE at
+        `path` first; the template is only read through a copy.
+        """
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        schema_sql = template_schema(template)
+        conn = sqlite3.connect(path)
+        cur = conn.cursor()
+        try:
+            cur.execute("PRAGMA synchronous = OFF")
+            for sql in schema_sql["table"]:
+                cur.execute(sql)
+
+            cur.execute("BEGIN")
+            self._insert(cur, """
+                INSERT INTO items_list (code, pack, price_per_pack_euros, unit_price_euros,
+                    weight_per_pack_kg, volume_per_pack_dm3, shelf_life_months, account_code,
+                    type, designation, designation_en, designation_fr, designation_sp, unique_id_1)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", self._items())
+            self._insert(cur, """
+                INSERT INTO scenarios (scenario_id, name, activity_type, target_population,
+                    responsible_person, stock_location)
+                VALUES (?, ?, ?, ?, ?, ?)""", self._scenarios())
+            self._insert(cur, """
+                INSERT INTO kit_items (id, scenario_id, scenario, kit, module, item, code,
+                    std_qty, level, treecode)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", self._kit_items())
+            self._insert(cur, """
+                INSERT INTO compositions (code, quantity, unique_id_2, scenario_id, id, std_id)
+                VALUES (?, ?, ?, ?, ?, ?)""", self._compositions())
+            self._insert(cur, """
+                INSERT INTO stock_data (unique_id, line_id, scenario, kit_number, module_number,
+                    kit, module, item, std_qty, qty_in, qty_out, final_qty, exp_date, qt_expiring,
+                    updated_at, management_mode, discrepancy, comments, treecode)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", self._stock())
+            self._insert(cur, """
+                INSERT INTO stock_transactions (Date, Time, unique_id, code, Description,
+                    Expiry_date, Batch_Number, Scenario, Kit, Module, Qty_IN, IN_Type, Qty_Out,
+                    Out_Type, Third_Party, End_User, Discrepancy, Remarks, Movement_Type,
+                    document_number, comments, treecode)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                self._ledger())
+            cur.execute("DELETE FROM stock_sequence")
+            cur.execute("INSERT INTO stock_sequence (last_line_id) VALUES (?)", (self.last_line_id,))
+            cur.execute("DELETE FROM third_parties")
+            self._insert(cur, "INSERT INTO third_parties (name, type) VALUES (?, 'MSF-Other Section')",
+                         [(name,) for name in THIRD_PARTIES])
+            cur.execute("DELETE FROM project_details")
+            cur.execute("""
+                INSERT INTO project_details (project_name, project_code, eprep_type,
+                    replenishment_frequency, lead_time_months, cover_period_months, buffer_months)
+                VALUES ('Benchmark depot', 'BENCH', 'Hybrid', 'Twice a year', 6, 6, 3)""")
+            conn.commit()
+
+            for kind in ("index", "view", "trigger"):
+                for sql in schema_sql[kind]:
+                    cur.execute(sql)
+            rebuild_snapshots(cur, designation_sql("en"))
+            conn.commit()
+            cur.execute("PRAGMA journal_mode = WAL")
+        finally:
+            cur.close()
+        try:
+            apply_migrations(conn)
+            counts = {
+                table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ("items_list", "scenarios", "kit_items", "compositions",
+                              "stock_data", "stock_transactions")
+            }
+        finally:
+            conn.close()
+        return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic depot database")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="10k")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--ledger-rows", type=int, help="override the scale's ledger size")
+    parser.add_argument("--template", default=TEMPLATE_DB, help="database whose schema is copied")
+    parser.add_argument("--out", required=True)
+    args = parser.parse_args(argv)
+
+    overrides = {"ledger_rows": args.ledger_rows} if args.ledger_rows else {}
+    started = time.perf_counter()
+    db.DB_FILE = args.out
+    counts = SyntheticDepot(args.scale, args.seed, **overrides).build(args.out, args.template)
+    print(f"{args.out}: scale {args.scale}, seed {args.seed}, "
+          f"built in {time.perf_counter() - started:.1f} s")
+    for table, n in counts.items():
+        print(f"  {table:20s} {n:>10,}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -37,7 +37,10 @@ import openpyxl
 from openpyxl.styles import PatternFill
 from openpyxl.utils import get_column_letter
 
-from db import connect_db
+from db import connect_db, cached_query
+from filter_options import filter_options
+from ledger_archive import LEDGER_VIEW, attach_ledger
+from schema_registry import schema
 from language_manager import lang
 from popup_utils import custom_popup
 from manage_items import get_item_description, detect_type
@@ -171,14 +174,8 @@ def ym_label(y, m):
     return date(y, m, 1).strftime("%b-%Y")
 
 def fetch_project_details():
-    conn = connect_db()
-    if conn is None:
-        return (lang.t("consumption.unknown_project","Unknown Project"),
-                lang.t("consumption.unknown_code","Unknown Code"))
-    cur = conn.cursor()
     try:
-        cur.execute("SELECT project_name, project_code FROM project_details LIMIT 1")
-        row = cur.fetchone()
+        row = next(iter(cached_query("SELECT project_name, project_code FROM project_details LIMIT 1")), None)
         if not row:
             return (lang.t("consumption.unknown_project","Unknown Project"),
                     lang.t("consumption.unknown_code","Unknown Code"))
@@ -187,8 +184,31 @@ def fetch_project_details():
     except sqlite3.Error:
         return (lang.t("consumption.unknown_project","Unknown Project"),
                 lang.t("consumption.unknown_code","Unknown Code"))
-    finally:
-        cur.close(); conn.close()
+
+def build_ledger_query(date_from=None, date_to=None, document_number="", scenario="All"):
+    """(sql, params) of the ledger movements the calculator aggregates."""
+    where = []
+    params = []
+    if date_from:
+        where.append("Date >= ?")
+        params.append(date_from.strftime("%Y-%m-%d"))
+    if date_to:
+        where.append("Date <= ?")
+        params.append(date_to.strftime("%Y-%m-%d"))
+    if document_number:
+        where.append("document_number LIKE ?")
+        params.append(f"%{document_number}%")
+    if scenario.lower() != "all":
+        where.append("Scenario = ?")
+        params.append(scenario)
+    sql = f"""
+        SELECT Date, code, Scenario, Kit, Module,
+               Qty_IN, IN_Type, Qty_Out, Out_Type,
+               Movement_Type, document_number, unique_id
+        FROM {LEDGER_VIEW}
+        WHERE {' AND '.join(where) if where else '1=1'}
+    """
+    return sql, params
 
 class CombinedCalculator:
     def __init__(self, **kwargs):
@@ -205,8 +225,7 @@ class CombinedCalculator:
         if not need: return mapping
         cur = conn.cursor()
         try:
-            cur.execute("PRAGMA table_info(stock_data)")
-            cols = [r[1].lower() for r in cur.fetchall()]
+            cols = schema.columns("stock_data")
             if "unique_id" not in cols: return mapping
             fields = ["unique_id"]
             if "management_mode" in cols: fields.append("management_mode")
@@ -227,28 +246,11 @@ class CombinedCalculator:
         try:
             cur = conn.cursor()
             mgmt_map = self._load_mgmt_map(conn)
-            where = []
-            params = []
-            if self.date_from:
-                where.append("Date >= ?")
-                params.append(self.date_from.strftime("%Y-%m-%d"))
-            if self.date_to:
-                where.append("Date <= ?")
-                params.append(self.date_to.strftime("%Y-%m-%d"))
-            if self.document_number:
-                where.append("document_number LIKE ?")
-                params.append(f"%{self.document_number}%")
-            if self.scenario.lower() != "all":
-                where.append("Scenario = ?")
-                params.append(self.scenario)
-
-            sql = f"""
-                SELECT Date, code, Scenario, Kit, Module,
-                       Qty_IN, IN_Type, Qty_Out, Out_Type,
-                       Movement_Type, document_number, unique_id
-                FROM stock_transactions
-                WHERE {' AND '.join(where) if where else '1=1'}
-            """
+            sql, params = build_ledger_query(self.date_from, self.date_to,
+                                             self.document_number, self.scenario)
+
+            # Hot ledger plus the archived years the range reaches into
+            attach_ledger(conn, self.date_from, self.date_to)
             cur.execute(sql, params)
             rows = cur.fetchall()
 
@@ -673,22 +675,12 @@ class Consumption(tk.Frame):
             try:
                 cur.execute("SELECT name FROM scenarios ORDER BY name")
                 scenarios = [r[0] for r in cur.fetchall()]
-                cur.execute("PRAGMA table_info(stock_data)")
-                sd_cols = [r[1].lower() for r in cur.fetchall()]
-                if "kit_number" in sd_cols:
-                    cur.execute("""SELECT DISTINCT kit_number FROM stock_data
-                                   WHERE kit_number IS NOT NULL AND kit_number!='None'
-                                   ORDER BY kit_number""")
-                    kits = [r[0] for r in cur.fetchall()]
-                if "module_number" in sd_cols:
-                    cur.execute("""SELECT DISTINCT module_number FROM stock_data
-                                   WHERE module_number IS NOT NULL AND module_number!='None'
-                                   ORDER BY module_number""")
-                    modules = [r[0] for r in cur.fetchall()]
             except sqlite3.Error:
                 pass
             finally:
                 cur.close(); conn.close()
+        kits = filter_options.kit_numbers()
+        modules = filter_options.module_numbers()
 
         all_lbl = self.t("all","All")
         self.scenario_cb['values'] = [all_lbl] + scenarios
@@ -28,6 +28,10 @@ from datetime import datetime, date, timedelta
 import sqlite3
 from collections import defaultdict
 from db import connect_db
+from event_bus import (
+    bus, STOCK_CHANGED, COMPOSITION_CHANGED, SCENARIOS_CHANGED, PROJECT_CHANGED,
+)
+from schema_registry import schema
 from language_manager import lang
 from manage_items import get_item_description
 
@@ -36,7 +40,7 @@ SHORT_EXPIRY_DAYS = 20
 EXPIRY_ACTION_WINDOW_DAYS = 180
 STANDARD_LIST_STALE_DAYS = 730
 SCENARIO_STALE_DAYS = 1095
-AUTO_REFRESH_MS = 5 * 60 * 1000
+AUTO_REFRESH_MS = 30 * 60 * 1000   # fallback only (writes from other stations); in-app saves arrive via event_bus
 
 MIN_STOCK_FOR_ACTION = 1
 ALWAYS_INCLUDE_ORPHAN_STOCK = True
@@ -105,6 +109,11 @@ class Dashboard(tk.Frame):
         self._build_layout()
         self.refresh()
         self.after(AUTO_REFRESH_MS, self._auto_refresh)
+        bus.subscribe(
+            (STOCK_CHANGED, COMPOSITION_CHANGED, SCENARIOS_CHANGED, PROJECT_CHANGED),
+            lambda events: self.refresh(),
+            widget=self,
+        )
 
     # ---------- Initial Pane Sizing Helpers (NEW) ----------
     def _set_initial_pane_sizes(self, retry=0):
@@ -328,8 +337,7 @@ class Dashboard(tk.Frame):
         if not conn: return info
         c = conn.cursor()
         try:
-            c.execute("PRAGMA table_info(project_details)")
-            pc = {r[1].lower(): r[1] for r in c.fetchall()}
+            pc = schema.columns("project_details")
             if {"project_name","project_code"}.issubset(pc.keys()):
                 c.execute("SELECT project_name, project_code, updated_at FROM project_details ORDER BY id DESC LIMIT 1")
                 r = c.fetchone()
@@ -338,14 +346,12 @@ class Dashboard(tk.Frame):
                     info["project_code"] = r[1] or ""
                     info["updated_at"] = r[2]
 
-            c.execute("PRAGMA table_info(scenarios)")
-            sc = {r[1].lower(): r[1] for r in c.fetchall()}
+            sc = schema.columns("scenarios")
             if "scenario_id" in sc:
                 c.execute("SELECT COUNT(*) FROM scenarios")
                 info["scenario_count"] = c.fetchone()[0]
 
-            c.execute("PRAGMA table_info(kit_items)")
-            kc = {r[1].lower(): r[1] for r in c.fetchall()}
+            kc = schema.columns("kit_items")
             if {"kit","module","item"}.issubset(kc.keys()):
                 c.execute("SELECT kit,module,item FROM kit_items")
                 for kit, module, item in c.fetchall():
@@ -359,8 +365,7 @@ class Dashboard(tk.Frame):
                     c.execute("SELECT MAX(updated_at) FROM kit_items")
                     info["standard_last_update"] = c.fetchone()[0]
             if not info["standard_last_update"]:
-                c.execute("PRAGMA table_info(std_qty_helper)")
-                sq = {r[1].lower(): r[1] for r in c.fetchall()}
+                sq = schema.columns("std_qty_helper")
                 if "updated_at" in sq:
                     c.execute("SELECT MAX(updated_at) FROM std_qty_helper")
                     info["standard_last_update"] = c.fetchone()[0]
@@ -376,8 +381,7 @@ class Dashboard(tk.Frame):
         if not conn: return res
         c = conn.cursor()
         try:
-            c.execute("PRAGMA table_info(scenarios)")
-            cols = {r[1].lower(): r[1] for r in c.fetchall()}
+            cols = schema.columns("scenarios")
             if "scenario_id" not in cols or "name" not in cols:
                 return res
             opt = [col for col in ["activity_type","target_population","stock_location",
@@ -430,8 +434,7 @@ class Dashboard(tk.Frame):
         c = conn.cursor()
         try:
             # kit_items
-            c.execute("PRAGMA table_info(kit_items)")
-            kit_cols = {r[1].lower(): r[1] for r in c.fetchall()}
+            kit_cols = schema.columns("kit_items")
             if {"scenario_id","kit","module","item"}.issubset(kit_cols.keys()):
                 for cand in ["std_qty","standard_qty","quantity","qty"]:
                     if cand in kit_cols:
@@ -450,8 +453,7 @@ class Dashboard(tk.Frame):
                         items_std[sid][kit][(module,item)] += std_v
 
             # stock_data
-            c.execute("PRAGMA table_info(stock_data)")
-            sd_cols = {r[1].lower(): r[1] for r in c.fetchall()}
+            sd_cols = schema.columns("stock_data")
             sc_col = "scenario" if "scenario" in sd_cols else None
             fields_needed = {"kit","module","item","final_qty"}
             stock_rows = []
@@ -1,18 +1,665 @@
+import os
+import sys
+import time
+import logging
 import sqlite3
+import threading
+import weakref
+from collections import OrderedDict, deque
 from sqlite3 import Error
 
 # SQLite database file (in the same folder as your app)
 DB_FILE = 'iseprep.db'
 
+# Long-lived connections (data_version watchers of the caches) that must be
+# closed before the database file is replaced by a restore.
+_persistent_connections = []
+_persistent_closers = []
+
+# Seconds a connection waits for another writer's lock before raising
+# "database is locked" (sqlite3's own default, made explicit).
+BUSY_TIMEOUT = 5.0
+
 def connect_db():
     """
     Central function to connect to the SQLite database.
     Creates the file if it doesn't exist.
     """
     try:
-        conn = sqlite3.connect(DB_FILE)
+        if sql_tracer.enabled:
+            conn = sqlite3.connect(DB_FILE, timeout=BUSY_TIMEOUT, factory=_TracedConnection)
+        else:
+            conn = sqlite3.connect(DB_FILE, timeout=BUSY_TIMEOUT)
         conn.row_factory = sqlite3.Row  # This makes it return dict-like rows
         return conn
     except Error as e:
         raise
-    return None
\ No newline at end of file
+    return None
+
+def connect_persistent():
+    """
+    Connection kept open by a long-lived service. Tracked so that
+    close_persistent_connections() can release it (e.g. before a restore).
+    """
+    conn = connect_db()
+    _persistent_connections.append(conn)
+    return conn
+
+def on_close_persistent(callback):
+    """Register a callback releasing a long-lived connection of its own (the writer thread)."""
+    _persistent_closers.append(callback)
+
+def close_persistent_connections():
+    """Close every connection handed out by connect_persistent() and release the on_close_persistent() owners."""
+    for callback in _persistent_closers:
+        try:
+            callback()
+        except Exception as e:
+            logging.error(f"[db] Closing a persistent connection failed: {e}")
+    while _persistent_connections:
+        conn = _persistent_connections.pop()
+        try:
+            conn.close()
+        except Error:
+            pass
+
+
+# ---------------- SQL tracing ----------------
+# Per-statement timings of connections opened by connect_db() while tracing
+# is on (ISEPREP_SQL_TRACE=1 at startup, or the Info > SQL diagnostics
+# window). Statements are keyed on their text and the first caller outside
+# db.py ("module.function"), so the screen that issues a query shows up next
+# to it. Statements slower than ISEPREP_SLOW_QUERY_MS (default 100) are
+# logged to the "iseprep.sql" logger with their EXPLAIN QUERY PLAN.
+
+_sql_log = logging.getLogger("iseprep.sql")
+_sql_log.setLevel(logging.WARNING)
+
+_PLAN_VERBS = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE")
+_THIS_FILE = os.path.normcase(os.path.abspath(__file__))
+
+
+def _env_flag(name):
+    return os.environ.get(name, "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def _normalize_sql(sql):
+    return " ".join(str(sql).split())
+
+
+def _caller():
+    """'module.function' of the nearest frame outside db.py."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        if os.path.normcase(os.path.abspath(frame.f_code.co_filename)) != _THIS_FILE:
+            return f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return "?"
+
+
+def _format_plan(rows):
+    """EXPLAIN QUERY PLAN rows (id, parent, notused, detail) as an indented tree."""
+    depth, lines = {0: -1}, []
+    for node_id, parent, _unused, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append("  " * depth[node_id] + detail)
+    return "\n".join(lines)
+
+
+class QueryStats:
+    __slots__ = ("sql", "caller", "count", "total_ms", "max_ms", "rows")
+
+    def __init__(self, sql, caller):
+        self.sql = sql
+        self.caller = caller
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+
+    def as_dict(self):
+        return {"sql": self.sql, "caller": self.caller, "count": self.count,
+                "total_ms": round(self.total_ms, 3), "max_ms": round(self.max_ms, 3),
+                "avg_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+                "rows": self.rows}
+
+
+class SqlTracer:
+    """
+    Collector of the per-statement statistics. Only connections opened after
+    enable() are traced; persistent connections keep the mode they had.
+    """
+
+    def __init__(self, enabled=False, slow_ms=100.0, slow_keep=50):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._slow = deque(maxlen=slow_keep)
+        self.enabled = enabled
+        self.slow_ms = slow_ms
+
+    def enable(self, slow_ms=None):
+        if slow_ms is not None:
+            self.slow_ms = float(slow_ms)
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._slow.clear()
+
+    def _entry(self, sql, caller):
+        key = (sql, caller)
+        entry = self._stats.get(key)
+        if entry is None:
+            entry = self._stats[key] = QueryStats(sql, caller)
+        return entry
+
+    def start(self, sql, caller):
+        """Count one execution; returns the entry its timings are added to."""
+        with self._lock:
+            entry = self._entry(_normalize_sql(sql), caller)
+            entry.count += 1
+            return entry
+
+    def finish(self, entry, elapsed_ms, rows, plan_source=None):
+        """
+        Add one execution's time and rows. plan_source() -> plan text is
+        only called when the statement was slow.
+        """
+        with self._lock:
+            entry.total_ms += elapsed_ms
+            entry.rows += rows
+            if elapsed_ms > entry.max_ms:
+                entry.max_ms = elapsed_ms
+        if elapsed_ms < self.slow_ms:
+            return
+        plan = ""
+        if plan_source is not None:
+            try:
+                plan = plan_source()
+            except Error as e:
+                plan = f"(no plan: {e})"
+        with self._lock:
+            self._slow.append({"at": time.strftime("%Y-%m-%d %H:%M:%S"), "sql": entry.sql,
+                               "caller": entry.caller, "ms": round(elapsed_ms, 3),
+                               "rows": rows, "plan": plan})
+        _sql_log.warning(f"[db] Slow query ({elapsed_ms:.1f} ms, {rows} rows) from {entry.caller}: "
+                         f"{entry.sql}" + (f"\n{plan}" if plan else ""))
+
+    def record(self, sql, caller, elapsed_ms=0.0, rows=0):
+        """Count a statement that ran outside the cursor wrappers."""
+        self.finish(self.start(sql, caller), elapsed_ms, rows)
+
+    def top(self, n=20, key="total_ms"):
+        """The n worst statements by key (total_ms, max_ms, count or rows), as dicts."""
+        with self._lock:
+            entries = sorted(self._stats.values(), key=lambda e: getattr(e, key), reverse=True)
+            return [e.as_dict() for e in entries[:n]]
+
+    def slow_queries(self):
+        """Recent slow statements, newest first."""
+        with self._lock:
+            return list(reversed(self._slow))
+
+
+class _TracedCursor(sqlite3.Cursor):
+    """Cursor timing each statement from execute() until its rows are consumed."""
+
+    _entry = None
+
+    def _begin(self, sql, params):
+        self._finish()
+        conn = self.connection
+        self._entry = sql_tracer.start(sql, _caller())
+        conn._open_cursors.add(self)
+        self._sql, self._params = sql, params
+        self._elapsed, self._rows = 0.0, 0
+        conn._tracing_depth += 1
+        return time.perf_counter()
+
+    def _end_call(self, started):
+        self._elapsed += time.perf_counter() - started
+        self.connection._tracing_depth -= 1
+
+    def _finish(self):
+        entry, self._entry = self._entry, None
+        if entry is None:
+            return
+        sql, params = self._sql, self._params
+        conn = self.connection
+
+        def plan():
+            if not sql.lstrip().upper().startswith(_PLAN_VERBS) or params is None:
+                return ""
+            cur = sqlite3.Cursor(conn)
+            conn._tracing_depth += 1
+            try:
+                return _format_plan(cur.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall())
+            finally:
+                conn._tracing_depth -= 1
+                cur.close()
+
+        sql_tracer.finish(entry, self._elapsed * 1000.0, self._rows, plan)
+
+    def execute(self, sql, parameters=()):
+        started = self._begin(sql, parameters)
+        try:
+            super().execute(sql, parameters)
+        finally:
+            self._end_call(started)
+        if self.description is None:
+            self._finish()
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        if not isinstance(seq_of_parameters, (list, tuple)):
+            seq_of_parameters = list(seq_of_parameters)
+        first = seq_of_parameters[0] if seq_of_parameters else None
+        started = self._begin(sql, first)
+        try:
+            super().executemany(sql, seq_of_parameters)
+        finally:
+            self._end_call(started)
+        self._rows = max(self.rowcount, 0)
+        self._finish()
+        return self
+
+    def _fetch(self, fetch, *args):
+        started = time.perf_counter()
+        self.connection._tracing_depth += 1
+        try:
+            return fetch(*args)
+        finally:
+            self._end_call(started)
+
+    def fetchone(self):
+        row = self._fetch(super().fetchone)
+        if row is None:
+            self._finish()
+        elif self._entry is not None:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._fetch(super().fetchmany, self.arraysize if size is None else size)
+        if self._entry is not None:
+            self._rows += len(rows)
+        if not rows:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._fetch(super().fetchall)
+        if self._entry is not None:
+            self._rows += len(rows)
+        self._finish()
+        return rows
+
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        # statements read with a single fetchone() end when the cursor goes
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+
+class _TracedConnection(sqlite3.Connection):
+    """
+    Connection whose cursors are _TracedCursor. Connection.execute() does not
+    go through Cursor.execute(), so it is rerouted here; statements issued by
+    SQLite itself (implicit COMMIT of `with conn:`, executescript) are
+    counted through the trace callback.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._tracing_depth = 0
+        self._open_cursors = weakref.WeakSet()
+        ref = weakref.ref(self)
+
+        def on_statement(sql):
+            conn = ref()
+            if conn is not None and not conn._tracing_depth:
+                sql_tracer.record(sql, _caller())
+
+        self.set_trace_callback(on_statement)
+
+    def cursor(self, factory=_TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        entry = sql_tracer.start("COMMIT", _caller())
+        started = time.perf_counter()
+        self._tracing_depth += 1
+        try:
+            super().commit()
+        finally:
+            self._tracing_depth -= 1
+            sql_tracer.finish(entry, (time.perf_counter() - started) * 1000.0, 0)
+
+    def close(self):
+        for cur in list(self._open_cursors):
+            cur._finish()
+        super().close()
+
+
+sql_tracer = SqlTracer(enabled=_env_flag("ISEPREP_SQL_TRACE"),
+                       slow_ms=float(os.environ.get("ISEPREP_SLOW_QUERY_MS") or 100))
+
+
+# ---------------- Change detection ----------------
+# The in-memory caches (std quantities, kit structure, stock ratios, filter
+# options, order matrix, statement, query results) must notice commits made
+# by other connections: another screen, the writer thread, another station.
+# They share one watcher connection: PRAGMA data_version moves whenever
+# another connection commits, and table_write_counters (bumped by triggers on
+# the lookup tables) then tells which of those tables the commit wrote. A
+# cache only rebuilds when one of its own tables was written; tables without
+# counters (the stock ledger) count as written by every commit.
+
+# Lookup tables whose writes are counted by triggers (installed by
+# migrations.py). The stock ledger tables are left out: they are written on
+# every save.
+COUNTED_TABLES = (
+    "scenarios", "project_details", "end_users", "third_parties", "transaction_types",
+    "item_families", "items_list", "compositions", "kit_items", "std_qty_helper",
+    "std_list_combined", "users",
+)
+
+_COUNTERS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS table_write_counters (
+        name   TEXT PRIMARY KEY,
+        writes INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+"""
+
+
+def install_write_counters(cur, tables=COUNTED_TABLES):
+    """Create table_write_counters and the counting triggers (migration step, caller commits)."""
+    cur.execute(_COUNTERS_TABLE_SQL)
+    for table in tables:
+        cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,))
+        if cur.fetchone() is None:
+            continue
+        cur.execute("INSERT OR IGNORE INTO table_write_counters (name, writes) VALUES (?, 0)", (table,))
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            cur.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_write_counter_{event.lower()}
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE table_write_counters SET writes = writes + 1 WHERE name = '{table}';
+                END
+            """)
+
+
+def write_counters(conn):
+    """{table: writes} of table_write_counters ({} before the migration)."""
+    try:
+        return dict(conn.execute("SELECT name, writes FROM table_write_counters").fetchall())
+    except sqlite3.OperationalError:
+        return {}
+
+
+class _CommitLog:
+    """
+    The watcher connection shared by every TableWatch. It only reads, so its
+    PRAGMA data_version moves on every commit it did not make.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conn = None
+        self._path = None
+        self._generation = 0        # moves when the watcher (re)opens: nothing known survives it
+        self._data_version = None
+        self._counters = {}
+
+    def _open(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Error:
+                pass
+        self._generation += 1
+        self._path = DB_FILE
+        self._data_version = None
+        self._counters = {}
+        self._conn = sqlite3.connect(DB_FILE, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        _persistent_connections.append(self._conn)
+
+    def state(self):
+        """(generation, data_version, {table: writes}); data_version None when unreadable."""
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._conn is None or self._path != DB_FILE:
+                        self._open()
+                    version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+                    if version != self._data_version:
+                        self._counters = write_counters(self._conn)
+                        self._data_version = version
+                    return self._generation, self._data_version, self._counters
+                except Error as e:
+                    # closed by close_persistent_connections() (restore): reopen once
+                    self._conn = None
+                    if attempt:
+                        logging.error(f"[db] Change watcher failed: {e}")
+            self._generation += 1
+            return self._generation, None, {}
+
+
+_commit_log = _CommitLog()
+
+
+class WrittenTables:
+    """Result of TableWatch.poll(): the counted tables written, and the ones whose counters were compared."""
+
+    __slots__ = ("tables", "known")
+
+    def __init__(self, tables=frozenset(), known=frozenset()):
+        self.tables = tables
+        self.known = known
+
+    def touches(self, tables):
+        """May the commits have changed any of `tables`? (None: any table)"""
+        if not tables:
+            return True
+        return any(t in self.tables or t not in self.known for t in tables)
+
+
+class TableWatch:
+    """
+    Tells a cache whether other connections wrote its tables since it last
+    looked. `tables` are the lower-case names it reads; None means any commit
+    counts.
+
+    Usage:
+        watch = TableWatch(("compositions", "kit_items"))
+        if watch.changed():
+            rebuild()
+    """
+
+    def __init__(self, tables=None):
+        self.tables = frozenset(t.lower() for t in tables) if tables else None
+        self._lock = threading.Lock()
+        self._seen = None
+        self._counters = {}
+
+    def poll(self):
+        """
+        None when no other connection committed since the last poll, else a
+        WrittenTables. The first poll, a reopened or unreadable database and
+        a database without counters report every table as written.
+        """
+        generation, version, counters = _commit_log.state()
+        with self._lock:
+            seen, previous = self._seen, self._counters
+            self._seen, self._counters = (generation, version), counters
+        if version is not None and seen == (generation, version):
+            return None
+        if version is None or seen is None or seen[0] != generation:
+            return WrittenTables()
+        known = frozenset(counters.keys() & previous.keys())
+        return WrittenTables(frozenset(t for t in known if counters[t] != previous[t]), known)
+
+    def changed(self):
+        """True when a commit of another connection may have changed one of self.tables."""
+        written = self.poll()
+        return written is not None and written.touches(self.tables)
+
+
+# ---------------- Query result cache ----------------
+# Read-through cache of (sql, params) -> rows for the lookups the screens
+# repeat on every combobox change or refresh (scenario maps, project details,
+# end users / third parties, std quantities ...). Entries are validated on
+# each lookup with a TableWatch, so only the entries reading a table another
+# connection wrote are dropped. The tables of a statement are the ones
+# SQLite reports reading while preparing it (comma joins, subqueries and
+# views included).
+
+CACHE_MAX_ENTRIES = 4096     # per-code lookups (item descriptions) of a whole report fit
+
+
+class QueryCache:
+    """
+    Size-bounded LRU of query results. Rows are returned as a new list of the
+    cached sqlite3.Row objects (immutable). The cache connection belongs to
+    the main (Tk) thread; lookups from other threads bypass the cache.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # (sql, params) -> (rows, tables)
+        self._sql_tables = {}           # sql -> tables it reads
+        self._watch = TableWatch()
+        self._conn = None
+        self._path = None
+        self.reset_stats()
+
+    # ---------------- Validation ----------------
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sql_tables.clear()
+            self._conn = None
+
+    def _sync(self):
+        """Drop the entries a foreign commit may have changed; False when the connection is unusable."""
+        written = self._watch.poll()
+        if written is not None:
+            stale = [key for key, (_rows, tables) in self._entries.items() if written.touches(tables)]
+            for key in stale:
+                del self._entries[key]
+            self._invalidated += len(stale)
+        try:
+            if self._conn is None or self._path != DB_FILE:
+                if self._conn is not None:
+                    self._conn.close()
+                self._entries.clear()
+                self._path = DB_FILE
+                self._conn = connect_persistent()
+        except Error as e:
+            logging.error(f"[db] Query cache connection failed: {e}")
+            self._entries.clear()
+            self._conn = None
+            return False
+        return True
+
+    def _fetch(self, sql, params):
+        """Rows of sql on the cache connection, and the tables it reads."""
+        tables = self._sql_tables.get(sql)
+        if tables is not None:
+            return self._conn.execute(sql, params).fetchall(), tables
+        read = set()
+
+        def authorizer(action, arg1, _arg2, _db, _source):
+            if action == sqlite3.SQLITE_READ and arg1:
+                read.add(arg1.lower())
+            return sqlite3.SQLITE_OK
+
+        self._conn.set_authorizer(authorizer)
+        try:
+            rows = self._conn.execute(sql, params).fetchall()
+        finally:
+            self._conn.set_authorizer(None)
+        if read:
+            # a view is reported next to the tables it reads; only the tables are written
+            marks = ",".join("?" * len(read))
+            views = {r[0].lower() for r in self._conn.execute(
+                f"SELECT name FROM sqlite_master WHERE type = 'view' AND lower(name) IN ({marks})",
+                tuple(read)).fetchall()}
+            read -= views
+        tables = self._sql_tables[sql] = frozenset(read)
+        return rows, tables
+
+    # ---------------- Lookup ----------------
+    def query(self, sql, params=(), tables=None):
+        """
+        Rows of `sql`, from memory while none of its tables were written.
+        `tables` defaults to the tables SQLite reads for the statement.
+        """
+        params = tuple(params)
+        key = (sql, params)
+        with self._lock:
+            usable = threading.current_thread() is threading.main_thread() and self._sync()
+            if usable:
+                hit = self._entries.get(key)
+                if hit is not None:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return list(hit[0])
+                self._misses += 1
+                rows, read = self._fetch(sql, params)
+                self._entries[key] = (rows, frozenset(t.lower() for t in tables) if tables is not None else read)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self._evicted += 1
+                return list(rows)
+            self._bypassed += 1
+
+        conn = connect_db()
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    # ---------------- Metrics ----------------
+    def reset_stats(self):
+        self._hits = self._misses = self._bypassed = self._invalidated = self._evicted = 0
+
+    def stats(self):
+        lookups = self._hits + self._misses
+        return {"entries": len(self._entries), "hits": self._hits, "misses": self._misses,
+                "hit_ratio": round(self._hits / lookups, 3) if lookups else 0.0,
+                "bypassed": self._bypassed, "invalidated": self._invalidated,
+                "evicted": self._evicted}
+
+
+query_cache = QueryCache()
+on_close_persistent(query_cache.clear)
+
+
+def cached_query(sql, params=(), tables=None):
+    """query_cache.query(): rows of a repeated read-only lookup."""
+    return query_cache.query(sql, params, tables)
+
@@ -8,7 +8,12 @@ from openpyxl.utils import get_column_letter
 from datetime import datetime
 import os
 from popup_utils import custom_popup, custom_askyesno, custom_dialog
-from db import connect_db
+from db import connect_db, cached_query
+from transaction_utils import LAST_DOCUMENT_SQL
+from event_bus import bus, STOCK_CHANGED
+from write_queue import writer
+from fefo_allocator import allocate, apply_issue, fetch_lots
+from kit_structure_index import kit_structure
 from manage_items import get_item_description, detect_type
 from language_manager import lang
 
@@ -19,50 +24,24 @@ logging.basicConfig(
 
 # ------------------------- DB HELPERS -------------------------
 def fetch_end_users():
-    conn = connect_db()
-    if conn is None:
-        logging.error("[DISPATCH] DB connection failed (fetch_end_users)")
-        return []
-    cur = conn.cursor()
     try:
-        cur.execute("SELECT name FROM end_users ORDER BY name")
-        return [r[0] for r in cur.fetchall()]
+        return [r[0] for r in cached_query("SELECT name FROM end_users ORDER BY name")]
     except sqlite3.Error as e:
         logging.error(f"[DISPATCH] fetch_end_users error: {e}")
         return []
-    finally:
-        cur.close()
-        conn.close()
 
 
 def fetch_third_parties():
-    conn = connect_db()
-    if conn is None:
-        logging.error("[DISPATCH] DB connection failed (fetch_third_parties)")
-        return []
-    cur = conn.cursor()
     try:
-        cur.execute("SELECT name FROM third_parties ORDER BY name")
-        return [r[0] for r in cur.fetchall()]
+        return [r[0] for r in cached_query("SELECT name FROM third_parties ORDER BY name")]
     except sqlite3.Error as e:
         logging.error(f"[DISPATCH] fetch_third_parties error: {e}")
         return []
-    finally:
-        cur.close()
-        conn.close()
 
 
 def fetch_project_details():
-    conn = connect_db()
-    if conn is None:
-        logging.error("[DISPATCH] DB connection failed (fetch_project_details)")
-        return lang.t("dispatch_kit.unknown_project", "Unknown Project"), lang.t(
-            "dispatch_kit.unknown_code", "Unknown Code"
-        )
-    cur = conn.cursor()
     try:
-        cur.execute("SELECT project_name, project_code FROM project_details LIMIT 1")
-        row = cur.fetchone()
+        row = next(iter(cached_query("SELECT project_name, project_code FROM project_details LIMIT 1")), None)
         return (
             (
                 row[0]
@@ -80,9 +59,6 @@ def fetch_project_details():
         return lang.t("dispatch_kit.unknown_project", "Unknown Project"), lang.t(
             "dispatch_kit.unknown_code", "Unknown Code"
         )
-    finally:
-        cur.close()
-        conn.close()
 
 
 def log_transaction(
@@ -101,48 +77,46 @@ def log_transaction(
     remarks,
     movement_type,
 ):
-    conn = connect_db()
-    if conn is None:
-        raise ValueError("DB connection failed")
-    cur = conn.cursor()
+    def job(conn):
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                """
+                INSERT INTO stock_transactions
+                (Date, Time, unique_id, code, Description, Expiry_date, Batch_Number,
+                 Scenario, Kit, Module, Qty_IN, IN_Type, Qty_Out, Out_Type,
+                 Third_Party, End_User, Remarks, Movement_Type)
+                VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+            """,
+                (
+                    datetime.today().strftime("%Y-%m-%d"),
+                    datetime.now().strftime("%H:%M:%S"),
+                    unique_id,
+                    code,
+                    description,
+                    expiry_date,
+                    batch_number,
+                    scenario,
+                    Kit,
+                    module,
+                    None,
+                    None,
+                    qty_out,
+                    out_type,
+                    third_party,
+                    end_user,
+                    remarks,
+                    movement_type,
+                ),
+            )
+        finally:
+            cur.close()
+
     try:
-        cur.execute(
-            """
-            INSERT INTO stock_transactions
-            (Date, Time, unique_id, code, Description, Expiry_date, Batch_Number,
-             Scenario, Kit, Module, Qty_IN, IN_Type, Qty_Out, Out_Type,
-             Third_Party, End_User, Remarks, Movement_Type)
-            VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-        """,
-            (
-                datetime.today().strftime("%Y-%m-%d"),
-                datetime.now().strftime("%H:%M:%S"),
-                unique_id,
-                code,
-                description,
-                expiry_date,
-                batch_number,
-                scenario,
-                Kit,
-                module,
-                None,
-                None,
-                qty_out,
-                out_type,
-                third_party,
-                end_user,
-                remarks,
-                movement_type,
-            ),
-        )
-        conn.commit()
+        writer.run(job)
     except sqlite3.Error as e:
-        conn.rollback()
         logging.error(f"[DISPATCH] Transaction log error: {e}")
         raise
-    finally:
-        cur.close()
-        conn.close()
 
 
 def configure_db_pragmas():
@@ -163,6 +137,39 @@ def configure_db_pragmas():
             pass
 
 
+ISSUE_TRANSACTION_SQL = """
+    INSERT INTO stock_transactions
+    (Date, Time, unique_id, code, Description, Expiry_date, Batch_Number,
+     Scenario, Kit, Module, Qty_IN, IN_Type, Qty_Out, Out_Type,
+     Third_Party, End_User, Remarks, Movement_Type, document_number)
+    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+"""
+
+
+def build_module_numbers_query(scenario_id, scenario_name, kit_number=None, module_code=None):
+    """(sql, params) of the module numbers with stock left, optionally in one kit / of one module."""
+    where_clauses = [
+        "(scenario=? OR scenario=?)",
+        "module_number IS NOT NULL",
+        "module_number != 'None'",
+        "final_qty > 0",
+    ]
+    params = [str(scenario_id), scenario_name]
+    if kit_number:
+        where_clauses.append("kit_number=?")
+        params.append(kit_number)
+    if module_code:
+        where_clauses.append("module=?")
+        params.append(module_code)
+    sql = f"""
+        SELECT DISTINCT module_number
+        FROM stock_data
+        WHERE {' AND '.join(where_clauses)}
+        ORDER BY module_number
+    """
+    return sql, params
+
+
 # =============================================================
 #                        MAIN CLASS
 # =============================================================
@@ -396,52 +403,15 @@ class StockDispatchKit(tk.Frame):
             required_qty: Total quantity needed (typically std_qty)
 
         Returns:
-            Dict mapping iid ��� quantity_to_issue
+            Dict mapping iid -> quantity_to_issue
         """
         if not item_rows or required_qty <= 0:
             return {}
 
-        # Sort by expiry date (earliest first), then by iid for stability
-        def parse_exp_date(exp_str):
-            """Convert expiry date string to comparable format."""
-            if not exp_str or exp_str == "":
-                return "9999-12-31"  # Put items without expiry at end
-            try:
-                # Try parsing as YYYY-MM-DD
-                if len(exp_str) == 10 and exp_str[4] == "-":
-                    return exp_str
-                # Try parsing as DD-Mon-YYYY (e.g., "31-Dec-2025")
-                dt = datetime.strptime(exp_str, "%d-%b-%Y")
-                return dt.strftime("%Y-%m-%d")
-            except Exception:
-                return "9999-12-31"
-
-        sorted_rows = sorted(
-            item_rows,
-            key=lambda r: (parse_exp_date(r.get("expiry_date", "")), r.get("iid", "")),
-        )
-
-        result = {}
-        remaining = required_qty
-
-        for row in sorted_rows:
-            iid = row.get("iid")
-            try:
-                available = int(row.get("current_stock", 0))
-            except Exception:
-                available = 0
-
-            if remaining <= 0:
-                # No more quantity needed
-                result[iid] = 0
-            elif available >= remaining:
-                # This row can fulfill remaining requirement
-                result[iid] = remaining
-                remaining = 0
-            else:
-                # Take all from this row and continue
-                result[iid] = available
-                remaining -= available
+        result = {
+            row.get("iid"): qty
+            for row, qty, _ in allocate(item_rows, required_qty, tie_field="iid")
+        }
 
         logging.debug(
             f"[DISPATCH][FEFO] Distributed {required_qty} qty across {len(item_rows)} rows: {result}"
@@ -452,61 +422,13 @@ class StockDispatchKit(tk.Frame):
     # Index / Parsing / Enrichment
     # ---------------------------------------------------------
     def ensure_item_index(self, scenario_id):
-        if (
-            hasattr(self, "_item_index_cache")
-            and self._item_index_cache.get("scenario_id") == scenario_id
-        ):
-            return
-        self._item_index_cache = {
-            "scenario_id": scenario_id,
-            "flat_map": {},
-            "triple_map": {},
-        }
-
-        conn = connect_db()
-        if conn is None:
-            logging.warning("[DISPATCH] Cannot build item index (no DB connection).")
-            return
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-        try:
-            cur.execute(
-                """
-                SELECT code, Kit, module, item, treecode, level
-                  FROM Kit_items
-                 WHERE scenario_id = ?
-            """,
-                (scenario_id,),
-            )
-            for row in cur.fetchall():
-                code = (row["code"] or "").strip()
-                Kit = (row["Kit"] or "").strip()
-                module = (row["module"] or "").strip()
-                item = (row["item"] or "").strip()
-                treecode = row["treecode"]
-                level = (row["level"] or "").strip().lower()
-                entry = {
-                    "code": code,
-                    "Kit": Kit,
-                    "module": module,
-                    "item": item,
-                    "treecode": treecode,
-                    "level": level,
-                }
-                for tok in (code, Kit, module, item):
-                    if tok and tok.upper() != "NONE":
-                        self._item_index_cache["flat_map"].setdefault(tok, entry)
-                self._item_index_cache["triple_map"][
-                    (Kit or None, module or None, item or None)
-                ] = entry
-            logging.debug(
-                f"[DISPATCH] item_index built:{len(self._item_index_cache['flat_map'])} tokens"
-            )
-        except sqlite3.Error as e:
-            logging.error(f"[DISPATCH] ensure_item_index error: {e}")
-        finally:
-            cur.close()
-            conn.close()
+        """
+        Point at the shared kit structure of the scenario (built once, kept
+        current) and return it. Loads resolve it once and pass it to
+        enrich_stock_row() for every row.
+        """
+        self._item_index = kit_structure.structure(scenario_id)
+        return self._item_index
 
     @staticmethod
     def parse_unique_id(unique_id: str):
@@ -571,13 +493,16 @@ class StockDispatchKit(tk.Frame):
             return 1
 
     def enrich_stock_row(
-        self, scenario_id, unique_id, final_qty, exp_date, Kit_number, module_number
+        self, scenario_id, unique_id, final_qty, exp_date, Kit_number, module_number,
+        structure=None,
     ):
         """
         Returns a dict with a normalized 'type' field: one of 'Kit', 'Module', 'Item'.
         Forced hierarchy: if module/item segments exist they override a broader detect_type result.
+        structure: the scenario's KitStructure from ensure_item_index() (looked up when omitted).
         """
-        self.ensure_item_index(scenario_id)
+        if structure is None:
+            structure = self.ensure_item_index(scenario_id)
         parsed = self.parse_unique_id(unique_id)
         Kit_code = parsed["Kit_code"]
         module_code = parsed["module_code"]
@@ -602,12 +527,9 @@ class StockDispatchKit(tk.Frame):
             module_code if module_code else None,
             item_code if item_code else None,
         )
-        idx = getattr(self, "_item_index_cache", {})
-        triple_map = idx.get("triple_map", {})
-        flat_map = idx.get("flat_map", {})
-        entry = triple_map.get(triple_key) or flat_map.get(display_code or "")
+        entry = structure.resolve(*triple_key, display_code=display_code)
         if entry:
-            treecode = entry.get("treecode")
+            treecode = entry.treecode
 
         description = get_item_description(display_code or "")
         detected = detect_type(display_code or "", description) or forced_type
@@ -647,24 +569,14 @@ class StockDispatchKit(tk.Frame):
     # Scenario / Modes
     # ---------------------------------------------------------
     def fetch_scenario_map(self):
-        conn = connect_db()
-        if conn is None:
-            logging.error("[DISPATCH] DB connection failed in fetch_scenario_map")
-            return {}
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
         try:
-            cur.execute("SELECT scenario_id, name FROM scenarios ORDER BY name")
-            rows = cur.fetchall()
+            rows = cached_query("SELECT scenario_id, name FROM scenarios ORDER BY name")
             mapping = {str(r["scenario_id"]): r["name"] for r in rows}
             logging.info(f"[DISPATCH] Loaded {len(mapping)} scenarios")
             return mapping
         except sqlite3.Error as e:
             logging.error(f"[DISPATCH] Error loading scenarios: {e}")
             return {}
-        finally:
-            cur.close()
-            conn.close()
 
     def build_mode_definitions(self):
         scenario = self.selected_scenario_name or ""
@@ -1204,36 +1116,10 @@ class StockDispatchKit(tk.Frame):
         try:
             scenario_name = self.scenario_map.get(str(scenario_id), str(scenario_id))
 
-            where_clauses = [
-                "(scenario=? OR scenario=?)",
-                "module_number IS NOT NULL",
-                "module_number != 'None'",
-                "final_qty > 0",
-            ]
-            params = [str(scenario_id), scenario_name]
-
-            # ✅ Filter by kit_number (the actual kit instance)
-            if kit_number:
-                where_clauses.append("kit_number=?")
-                params.append(kit_number)
-                logging.debug(
-                    f"[FETCH_MODULE_NUMBERS] Filtering by kit_number={kit_number}"
-                )
-
-            # ✅ Filter by module code
-            if module_code:
-                where_clauses.append("module=?")
-                params.append(module_code)
-                logging.debug(
-                    f"[FETCH_MODULE_NUMBERS] Filtering by module_code={module_code}"
-                )
-
-            sql = f"""
-                SELECT DISTINCT module_number
-                FROM stock_data
-                WHERE {' AND '.join(where_clauses)}
-                ORDER BY module_number
-            """
+            # Filtered by kit_number (the actual kit instance) and / or module code
+            sql, params = build_module_numbers_query(
+                scenario_id, scenario_name, kit_number, module_code
+            )
 
             logging.debug(f"[FETCH_MODULE_NUMBERS] SQL: {sql}")
             logging.debug(f"[FETCH_MODULE_NUMBERS] Params: {params}")
@@ -1432,6 +1318,7 @@ class StockDispatchKit(tk.Frame):
             cur.execute(sql, params)
             rows = cur.fetchall()
 
+            structure = self.ensure_item_index(scenario_id)
             items = []
             for row in rows:
                 item = dict(row)
@@ -1443,6 +1330,7 @@ class StockDispatchKit(tk.Frame):
                     item.get("exp_date"),
                     item.get("kit_number"),
                     item.get("module_number"),
+                    structure=structure,
                 )
                 items.append(enriched)
 
@@ -1519,6 +1407,7 @@ class StockDispatchKit(tk.Frame):
             cur.execute(sql, params)
             rows = cur.fetchall()
 
+            structure = self.ensure_item_index(scenario_id)
             items = []
             for row in rows:
                 item = dict(row)
@@ -1530,6 +1419,7 @@ class StockDispatchKit(tk.Frame):
                     item.get("exp_date"),
                     item.get("kit_number"),
                     item.get("module_number"),
+                    structure=structure,
                 )
                 items.append(enriched)
 
@@ -1639,80 +1529,37 @@ class StockDispatchKit(tk.Frame):
             item_code: The code of the item or module to fetch
 
         Returns:
-            List of enriched stock item dicts
+            List of enriched stock item dicts (FEFO order)
         """
-        conn = connect_db()
-        if conn is None:
-            logging.error("[DISPATCH] DB connection failed")
-            return []
-
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-
-        try:
-            # ✅ Query stock_data for rows matching this code
-            # Check kit, module, OR item columns
-            logging.debug(
-                f"[FETCH_STANDALONE_STOCK] Fetching stock for code={item_code}, scenario={scenario_id}"
-            )
-
-            cur.execute(
-                """
-                SELECT unique_id, final_qty, exp_date, kit_number, module_number
-                FROM stock_data
-                WHERE (scenario=? OR scenario=?) 
-                  AND final_qty > 0
-                  AND (kit=? OR module=? OR item=?)
-                ORDER BY exp_date, unique_id
-            """,
-                (
-                    scenario_id,
-                    self.scenario_map.get(scenario_id, ""),
-                    item_code,
-                    item_code,
-                    item_code,
-                ),
-            )
-
-            rows = cur.fetchall()
-
-            if not rows:
-                logging.debug(
-                    f"[FETCH_STANDALONE_STOCK] No stock found for code={item_code}"
-                )
-                return []
-
+        logging.debug(
+            f"[FETCH_STANDALONE_STOCK] Fetching stock for code={item_code}, scenario={scenario_id}"
+        )
+        lots = fetch_lots(
+            [scenario_id, self.scenario_map.get(scenario_id, "")], [item_code]
+        )
+        if not lots:
             logging.debug(
-                f"[FETCH_STANDALONE_STOCK] Found {len(rows)} rows in stock_data for code={item_code}"
+                f"[FETCH_STANDALONE_STOCK] No stock found for code={item_code}"
             )
+            return []
 
-            # Enrich each row
-            items = []
-            for row in rows:
-                enriched = self.enrich_stock_row(
-                    scenario_id,
-                    row["unique_id"],
-                    row["final_qty"],
-                    row["exp_date"],
-                    row["kit_number"],
-                    row["module_number"],
-                )
-                items.append(enriched)
-                logging.debug(
-                    f"[FETCH_STANDALONE_STOCK] Enriched: {enriched['code']} qty={enriched['current_stock']}"
-                )
-
-            logging.debug(
-                f"[FETCH_STANDALONE_STOCK] Returning {len(items)} enriched items"
+        structure = self.ensure_item_index(scenario_id)
+        items = [
+            self.enrich_stock_row(
+                scenario_id,
+                lot["unique_id"],
+                lot["final_qty"],
+                lot["exp_date"],
+                lot["kit_number"],
+                lot["module_number"],
+                structure=structure,
             )
-            return items
-
-        except sqlite3.Error as e:
-            logging.error(f"[DISPATCH] fetch_standalone_stock_items error: {e}")
-            return []
-        finally:
-            cur.close()
-            conn.close()
+            for lot in lots
+        ]
+        logging.debug(
+            f"[FETCH_STANDALONE_STOCK] Returning {len(items)} enriched items"
+        )
+        return items
 
     def on_qty_to_issue_changed(self, iid: str):
         """
@@ -3328,41 +3175,10 @@ class StockDispatchKit(tk.Frame):
                     item["qty_required"] = ""
                 continue
 
-            # Sort group by expiry date (FEFO within this module/code)
-            def expiry_key(it):
-                """Sort by expiry date only - preserve original order when dates equal."""
-                exp_str = it.get("expiry_date", "")
-                if not exp_str:
-                    return "9999-12-31"
-                try:
-                    if len(exp_str) == 10 and exp_str[4] == "-":
-                        return exp_str
-                    dt = datetime.strptime(exp_str, "%d-%b-%Y")
-                    return dt.strftime("%Y-%m-%d")
-                except:
-                    return "9999-12-31"
-
-            group_items.sort(key=expiry_key)  # ✅ Only sorts by expiry date
-
             # Apply FEFO: distribute std_qty across items with earliest expiry first
-            remaining = std_qty
-            for item in group_items:
-                current_stock = item.get("current_stock", 0)
-
-                # Calculate qty_required (how much is still needed)
-                qty_required = max(0, remaining)
+            # (stable on equal expiry dates)
+            for item, qty_to_issue, qty_required in allocate(group_items, std_qty):
                 item["qty_required"] = qty_required
-
-                # Calculate qty_to_issue (how much from this batch)
-                if remaining <= 0:
-                    qty_to_issue = 0
-                elif current_stock >= remaining:
-                    qty_to_issue = remaining
-                    remaining = 0
-                else:
-                    qty_to_issue = current_stock
-                    remaining -= current_stock
-
                 item["qty_to_issue"] = qty_to_issue
 
                 logging.debug(
@@ -4005,220 +3821,146 @@ class StockDispatchKit(tk.Frame):
             ).format(doc=doc_number)
         )
 
-        # Process transactions with retry logic
-        import time
-
-        max_attempts = 4
-
-        for attempt in range(1, max_attempts + 1):
-            conn = connect_db()
-            if conn is None:
-                custom_popup(
-                    self.parent,
-                    lang.t("dialog_titles.error", "Error"),
-                    lang.t("dispatch_kit.db_error", "Database connection failed"),
-                    "error",
+        now_date = datetime.today().strftime("%Y-%m-%d")
+        now_time = datetime.now().strftime("%H:%M:%S")
+
+        # Transaction records, inserted in one batch
+        tx_params = []
+        for row in rows_to_issue:
+            # Get kit_number and module_number from metadata
+            rd = row["metadata"]
+            kit_number = (
+                rd.get("Kit_number")
+                or rd.get("kit_number")
+                or row["kit"]
+                or None
+            )
+            module_number = rd.get("module_number") or row["module"] or None
+
+            tx_params.append(
+                self._transaction_issue_params(
+                    unique_id=row["unique_id"],
+                    code=row["code"],
+                    description=row["description"],
+                    expiry_date=row["expiry_date"],
+                    batch_number=row["batch_no"],
+                    scenario=scenario_name,
+                    kit_number=kit_number,
+                    module_number=module_number,
+                    qty_out=row["qty_to_issue"],
+                    out_type=out_type,
+                    third_party=third_party if third_party else None,
+                    end_user=end_user if end_user else None,
+                    remarks=remarks if remarks else None,
+                    movement_type=movement_type_canonical,
+                    ts_date=now_date,
+                    ts_time=now_time,
+                    document_number=doc_number,
                 )
-                return
+            )
 
+        def book(conn):
+            # Verify and book all lots at once (concurrency check included),
+            # then the transaction records in one batch; the writer thread
+            # commits both together and retries while the database is busy
+            cur = conn.cursor()
             try:
-                conn.execute("PRAGMA busy_timeout=5000;")
-                cur = conn.cursor()
-                now_date = datetime.today().strftime("%Y-%m-%d")
-                now_time = datetime.now().strftime("%H:%M:%S")
-
-                # Process each row
-                for row in rows_to_issue:
-                    # Verify stock availability (concurrency check)
-                    cur.execute(
-                        """
-                        SELECT final_qty FROM stock_data WHERE unique_id = ?
-                    """,
-                        (row["unique_id"],),
-                    )
-
-                    db_row = cur.fetchone()
-                    if (
-                        not db_row
-                        or db_row[0] is None
-                        or db_row[0] < row["qty_to_issue"]
-                    ):
-                        raise ValueError(
-                            f"Insufficient stock or concurrency issue for {row['code']}"
-                        )
-
-                    # Update stock_data
-                    cur.execute(
-                        """
-                        UPDATE stock_data
-                        SET qty_out = qty_out + ?,
-                            updated_at = ?
-                        WHERE unique_id = ?
-                        AND (qty_in - qty_out) >= ?
-                    """,
-                        (
-                            row["qty_to_issue"],
-                            f"{now_date} {now_time}",
-                            row["unique_id"],
-                            row["qty_to_issue"],
-                        ),
-                    )
-
-                    if cur.rowcount == 0:
-                        raise ValueError(
-                            f"Concurrent change or insufficient stock for {row['code']}"
-                        )
-
-                    # Get kit_number and module_number from metadata
-                    rd = row["metadata"]
-                    kit_number = (
-                        rd.get("Kit_number")
-                        or rd.get("kit_number")
-                        or row["kit"]
-                        or None
-                    )
-                    module_number = rd.get("module_number") or row["module"] or None
-
-                    # Insert transaction record
-                    self._insert_transaction_issue(
-                        cur,
-                        unique_id=row["unique_id"],
-                        code=row["code"],
-                        description=row["description"],
-                        expiry_date=row["expiry_date"],
-                        batch_number=row["batch_no"],
-                        scenario=scenario_name,
-                        kit_number=kit_number,
-                        module_number=module_number,
-                        qty_out=row["qty_to_issue"],
-                        out_type=out_type,
-                        third_party=third_party if third_party else None,
-                        end_user=end_user if end_user else None,
-                        remarks=remarks if remarks else None,
-                        movement_type=movement_type_canonical,
-                        ts_date=now_date,
-                        ts_time=now_time,
-                        document_number=doc_number,
-                    )
-
-                # Commit transaction
-                conn.commit()
-
-                # Success message
-                custom_popup(
-                    self.parent,
-                    lang.t("dialog_titles.success", "Success"),
-                    lang.t("dispatch_kit.issue_success", "Stock issued successfully."),
-                    "info",
-                )
-
-                self.status_var.set(
-                    lang.t(
-                        "dispatch_kit.issue_complete",
-                        "Issue complete. Document Number: {doc}",
-                    ).format(doc=doc_number)
+                apply_issue(
+                    cur,
+                    [
+                        (row["unique_id"], row["qty_to_issue"], row["code"])
+                        for row in rows_to_issue
+                    ],
+                    f"{now_date} {now_time}",
                 )
+                cur.executemany(ISSUE_TRANSACTION_SQL, tx_params)
+            finally:
+                cur.close()
 
-                # Ask for Excel export
-                if (
-                    custom_askyesno(
-                        self.parent,
-                        lang.t("dialog_titles.confirm", "Confirm"),
-                        lang.t(
-                            "dispatch_kit.ask_export",
-                            "Do you want to export the issuance to Excel?",
-                        ),
-                    )
-                    == "yes"
-                ):
-                    # Prepare export data
-                    export_tuples = [
-                        (
-                            r["iid"],
-                            r["code"],
-                            r["description"],
-                            r["current_stock"],
-                            r["qty_to_issue"],
-                            r["expiry_date"],
-                            r["batch_no"],
-                        )
-                        for r in rows_to_issue
-                    ]
-                    self.export_data(export_tuples)
-
-                # Clear form
-                self.clear_form()
-                return
-
-            except sqlite3.OperationalError as e:
-                if "locked" in str(e).lower():
-                    logging.warning(
-                        f"[DISPATCH] Database locked attempt {attempt}/{max_attempts}; retrying..."
-                    )
-                    try:
-                        conn.rollback()
-                    except:
-                        pass
-                    time.sleep(0.8 * attempt)
-                else:
-                    try:
-                        conn.rollback()
-                    except:
-                        pass
-                    logging.error(f"[DISPATCH] Issue failed: {e}")
-                    custom_popup(
-                        self.parent,
-                        lang.t("dialog_titles.error", "Error"),
-                        lang.t(
-                            "dispatch_kit.issue_failed", "Issue failed: {err}"
-                        ).format(err=e),
-                        "error",
-                    )
-                    return
-
-            except Exception as e:
-                try:
-                    conn.rollback()
-                except:
-                    pass
-                logging.error(f"[DISPATCH] Issue failed: {e}")
-                custom_popup(
-                    self.parent,
-                    lang.t("dialog_titles.error", "Error"),
-                    lang.t("dispatch_kit.issue_failed", "Issue failed: {err}").format(
-                        err=e
-                    ),
-                    "error",
+        try:
+            writer.run(book)
+        except sqlite3.OperationalError as e:
+            logging.error(f"[DISPATCH] Issue failed: {e}")
+            if "locked" in str(e).lower() or "busy" in str(e).lower():
+                message = lang.t(
+                    "dispatch_kit.issue_failed_locked",
+                    "Issue failed: database remained locked.",
                 )
-                return
+            else:
+                message = lang.t(
+                    "dispatch_kit.issue_failed", "Issue failed: {err}"
+                ).format(err=e)
+            custom_popup(
+                self.parent,
+                lang.t("dialog_titles.error", "Error"),
+                message,
+                "error",
+            )
+            return
+        except Exception as e:
+            logging.error(f"[DISPATCH] Issue failed: {e}")
+            custom_popup(
+                self.parent,
+                lang.t("dialog_titles.error", "Error"),
+                lang.t("dispatch_kit.issue_failed", "Issue failed: {err}").format(
+                    err=e
+                ),
+                "error",
+            )
+            return
 
-            finally:
-                try:
-                    cur.close()
-                except:
-                    pass
-                try:
-                    conn.close()
-                except:
-                    pass
+        bus.publish(STOCK_CHANGED)
 
-        # Max attempts reached
+        # Success message
         custom_popup(
             self.parent,
-            lang.t("dialog_titles.error", "Error"),
+            lang.t("dialog_titles.success", "Success"),
+            lang.t("dispatch_kit.issue_success", "Stock issued successfully."),
+            "info",
+        )
+
+        self.status_var.set(
             lang.t(
-                "dispatch_kit.issue_failed_locked",
-                "Issue failed: database remained locked.",
-            ),
-            "error",
+                "dispatch_kit.issue_complete",
+                "Issue complete. Document Number: {doc}",
+            ).format(doc=doc_number)
         )
 
+        # Ask for Excel export
+        if (
+            custom_askyesno(
+                self.parent,
+                lang.t("dialog_titles.confirm", "Confirm"),
+                lang.t(
+                    "dispatch_kit.ask_export",
+                    "Do you want to export the issuance to Excel?",
+                ),
+            )
+            == "yes"
+        ):
+            # Prepare export data
+            export_tuples = [
+                (
+                    r["iid"],
+                    r["code"],
+                    r["description"],
+                    r["current_stock"],
+                    r["qty_to_issue"],
+                    r["expiry_date"],
+                    r["batch_no"],
+                )
+                for r in rows_to_issue
+            ]
+            self.export_data(export_tuples)
+
+        # Clear form
+        self.clear_form()
+
     # ---------------------------------------------------------
-    # Helper: insert transaction using existing cursor
+    # Helper: stock_transactions row for one issued line
     # ---------------------------------------------------------
-    def _insert_transaction_issue(
-        self,
-        cur,
+    @staticmethod
+    def _transaction_issue_params(
         *,
         unique_id,
         code,
@@ -4238,35 +3980,27 @@ class StockDispatchKit(tk.Frame):
         ts_time,
         document_number,
     ):
-        cur.execute(
-            """
-            INSERT INTO stock_transactions
-            (Date, Time, unique_id, code, Description, Expiry_date, Batch_Number,
-             Scenario, Kit, Module, Qty_IN, IN_Type, Qty_Out, Out_Type,
-             Third_Party, End_User, Remarks, Movement_Type, document_number)
-            VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-        """,
-            (
-                ts_date,
-                ts_time,
-                unique_id,
-                code,
-                description,
-                expiry_date,
-                batch_number,
-                scenario,
-                kit_number,
-                module_number,
-                None,
-                None,
-                qty_out,
-                out_type,
-                third_party,
-                end_user,
-                remarks,
-                movement_type,
-                document_number,
-            ),
+        """Parameters for ISSUE_TRANSACTION_SQL (executemany on save)."""
+        return (
+            ts_date,
+            ts_time,
+            unique_id,
+            code,
+            description,
+            expiry_date,
+            batch_number,
+            scenario,
+            kit_number,
+            module_number,
+            None,
+            None,
+            qty_out,
+            out_type,
+            third_party,
+            end_user,
+            remarks,
+            movement_type,
+            document_number,
         )
 
     # ---------------------------------------------------------
@@ -4326,13 +4060,7 @@ class StockDispatchKit(tk.Frame):
             cur = conn.cursor()
             try:
                 cur.execute(
-                    """
-                    SELECT document_number
-                      FROM stock_transactions
-                     WHERE document_number LIKE ?
-                     ORDER BY document_number DESC
-                     LIMIT 1
-                """,
+                    LAST_DOCUMENT_SQL,
                     (prefix + "/%",),
                 )
                 row = cur.fetchone()
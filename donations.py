@@ -73,7 +73,9 @@ try:
 except Exception:
     TKCAL_AVAILABLE = False
 
-from db import connect_db
+from db import connect_db, cached_query
+from filter_options import filter_options
+from ledger_archive import LEDGER_VIEW, attach_ledger
 from manage_items import get_item_description, detect_type
 from language_manager import lang
 from popup_utils import custom_popup
@@ -145,78 +147,34 @@ def parse_user_date(text: str, bound: str):
 
 # ---------------- FILTER DATA LOADERS ----------------
 def fetch_scenarios():
-    conn = connect_db()
-    if conn is None: return []
-    cur = conn.cursor()
     try:
-        cur.execute("SELECT name FROM scenarios ORDER BY name")
-        return [r[0] for r in cur.fetchall()]
+        return [r[0] for r in cached_query("SELECT name FROM scenarios ORDER BY name")]
     except sqlite3.Error:
         return []
-    finally:
-        cur.close(); conn.close()
 
 def fetch_kit_numbers():
-    conn = connect_db()
-    if conn is None: return []
-    cur = conn.cursor()
-    try:
-        cur.execute("""
-            SELECT DISTINCT Kit FROM stock_transactions
-            WHERE Kit IS NOT NULL AND Kit!='None' AND Kit!=''
-            ORDER BY Kit
-        """)
-        return [r[0] for r in cur.fetchall()]
-    except sqlite3.Error:
-        return []
-    finally:
-        cur.close(); conn.close()
+    return filter_options.ledger_kit_numbers()
 
 def fetch_module_numbers():
-    conn = connect_db()
-    if conn is None: return []
-    cur = conn.cursor()
-    try:
-        cur.execute("""
-            SELECT DISTINCT Module FROM stock_transactions
-            WHERE Module IS NOT NULL AND Module!='None' AND Module!=''
-            ORDER BY Module
-        """)
-        return [r[0] for r in cur.fetchall()]
-    except sqlite3.Error:
-        return []
-    finally:
-        cur.close(); conn.close()
+    return filter_options.ledger_module_numbers()
 
 def fetch_third_parties():
-    conn = connect_db()
-    if conn is None: return []
-    cur = conn.cursor()
     try:
-        cur.execute("SELECT name FROM third_parties ORDER BY name")
-        return [r[0] for r in cur.fetchall()]
+        return [r[0] for r in cached_query("SELECT name FROM third_parties ORDER BY name")]
     except sqlite3.Error:
         return []
-    finally:
-        cur.close(); conn.close()
 
 # ---------------- AGGREGATION ----------------
-def aggregate_donations(filters):
+def build_donations_query(filters):
+    """(sql, params) of the donation movements matching the report filters."""
     scenario = filters.get("scenario")
     kit_number = filters.get("kit")
     module_number = filters.get("module")
-    type_filter = filters.get("type")
-    item_search = filters.get("item_search")
     doc_search = filters.get("doc_number")
     third_party_filter = filters.get("third_party")
     date_from = filters.get("date_from")
     date_to = filters.get("date_to")
 
-    conn = connect_db()
-    if conn is None:
-        return []
-
-    cur = conn.cursor()
     clauses = []
     params = []
 
@@ -241,10 +199,25 @@ def aggregate_donations(filters):
         SELECT Date, code, Scenario, Kit, Module,
                Qty_IN, IN_Type, Qty_Out, Out_Type,
                document_number, Third_Party, Remarks, Expiry_date
-        FROM stock_transactions
+        FROM {LEDGER_VIEW}
         WHERE {base_where} AND {donation_clause}
     """
+    return sql, params
+
+def aggregate_donations(filters):
+    type_filter = filters.get("type")
+    item_search = filters.get("item_search")
+    date_from = filters.get("date_from")
+    date_to = filters.get("date_to")
+
+    conn = connect_db()
+    if conn is None:
+        return []
+
+    cur = conn.cursor()
+    sql, params = build_donations_query(filters)
     try:
+        attach_ledger(conn, date_from, date_to)
         cur.execute(sql, params)
         data = cur.fetchall()
     except sqlite3.Error:
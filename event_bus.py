@@ -0,0 +1,200 @@
+"""
+event_bus.py
+In-process publish/subscribe change bus.
+
+Writers publish a typed change event after they commit; caches and open
+windows subscribe to the topics they depend on and invalidate / refresh only
+what is affected, instead of polling the database on a timer.
+
+Topics:
+    STOCK_CHANGED        stock_data / stock_transactions rows written
+                         payload: code, scenario, unique_id (any may be None)
+    ITEMS_CHANGED        items_list rows written            payload: code
+    COMPOSITION_CHANGED  compositions / kit_items written   payload: scenario_id
+    SCENARIOS_CHANGED    scenarios written                  payload: scenario_id
+    PROJECT_CHANGED      project_details written
+
+Usage:
+    from event_bus import bus, STOCK_CHANGED
+    bus.publish(STOCK_CHANGED, code="ABCD", scenario="Cholera")
+    bus.subscribe(STOCK_CHANGED, self._on_stock_changed, widget=self)
+
+When a Tk widget is passed to subscribe(), delivery is marshalled onto the
+Tk event loop with after_idle and bursts are coalesced into one call carrying
+the list of events. The subscription is dropped once the widget is destroyed.
+Tk may only be called from its own thread: events published by other threads
+(writer-queue jobs, workers) are queued and delivered by a pump the first
+widget subscription starts on the Tk event loop.
+"""
+
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+STOCK_CHANGED = "stock_changed"
+ITEMS_CHANGED = "items_changed"
+COMPOSITION_CHANGED = "composition_changed"
+SCENARIOS_CHANGED = "scenarios_changed"
+PROJECT_CHANGED = "project_changed"
+
+OFF_THREAD_POLL_MS = 100    # delivery delay of events published off the Tk thread
+
+ALL_TOPICS = (
+    STOCK_CHANGED,
+    ITEMS_CHANGED,
+    COMPOSITION_CHANGED,
+    SCENARIOS_CHANGED,
+    PROJECT_CHANGED,
+)
+
+
+class ChangeEvent:
+    """A published change: topic name plus keyword payload."""
+
+    __slots__ = ("topic", "payload")
+
+    def __init__(self, topic: str, payload: Dict[str, Any]):
+        self.topic = topic
+        self.payload = payload
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.payload.get(key, default)
+
+    def __repr__(self) -> str:
+        return f"ChangeEvent({self.topic!r}, {self.payload!r})"
+
+
+class _Subscription:
+    __slots__ = ("topics", "callback", "widget", "pending", "scheduled")
+
+    def __init__(self, topics, callback, widget):
+        self.topics = topics
+        self.callback = callback
+        self.widget = widget
+        self.pending: List[ChangeEvent] = []
+        self.scheduled = False
+
+
+class ChangeBus:
+    """
+    Minimal thread-safe pub/sub.
+      subscribe(topics, callback, widget=None) -> token
+      unsubscribe(token)
+      publish(topic, **payload)
+
+    Plain subscribers are called synchronously with one ChangeEvent.
+    Widget subscribers are called on the Tk thread with a list of ChangeEvents.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subs: Dict[int, _Subscription] = {}
+        self._next_token = 1
+        self._off_thread = deque()      # (token, event) published off the Tk thread
+        self._pump_root = None
+
+    def subscribe(self, topics, callback: Callable, widget: Optional[Any] = None) -> int:
+        if isinstance(topics, str):
+            topics = (topics,)
+        with self._lock:
+            token = self._next_token
+            self._next_token += 1
+            self._subs[token] = _Subscription(frozenset(topics), callback, widget)
+        if widget is not None and threading.current_thread() is threading.main_thread():
+            self._start_pump(widget)
+        return token
+
+    def unsubscribe(self, token: int) -> None:
+        with self._lock:
+            self._subs.pop(token, None)
+
+    def publish(self, topic: str, **payload) -> None:
+        event = ChangeEvent(topic, payload)
+        with self._lock:
+            targets = [(t, s) for t, s in self._subs.items() if topic in s.topics]
+        for token, sub in targets:
+            if sub.widget is None:
+                try:
+                    sub.callback(event)
+                except Exception as e:
+                    logging.error(f"[event_bus] Subscriber failed on {topic}: {e}")
+            else:
+                self._deliver_to_widget(token, sub, event)
+
+    def _deliver_to_widget(self, token: int, sub: _Subscription, event: ChangeEvent) -> None:
+        if threading.current_thread() is not threading.main_thread():
+            # Not on the Tk thread: the pump delivers it from the event loop
+            self._off_thread.append((token, event))
+            return
+        with self._lock:
+            sub.pending.append(event)
+            if sub.scheduled:
+                return
+            sub.scheduled = True
+        try:
+            if not sub.widget.winfo_exists():
+                self.unsubscribe(token)
+                return
+            sub.widget.after_idle(lambda: self._flush(token))
+        except Exception as e:
+            with self._lock:
+                sub.scheduled = False
+            if self._widget_alive(sub.widget):
+                logging.error(f"[event_bus] Scheduling {event.topic} failed: {e}")
+            else:
+                # Widget destroyed or Tk not running any more
+                self.unsubscribe(token)
+
+    @staticmethod
+    def _widget_alive(widget) -> bool:
+        try:
+            return bool(widget.winfo_exists())
+        except Exception:
+            return False
+
+    # ---------------- Off-thread delivery ----------------
+    def _start_pump(self, widget) -> None:
+        with self._lock:
+            if self._pump_root is not None:
+                return
+            try:
+                self._pump_root = widget._root()
+                self._pump_root.after(OFF_THREAD_POLL_MS, self._pump)
+            except Exception as e:
+                self._pump_root = None
+                logging.error(f"[event_bus] Off-thread pump not started: {e}")
+
+    def _pump(self) -> None:
+        """Tk thread: deliver the events queued by other threads, then re-arm."""
+        while self._off_thread:
+            token, event = self._off_thread.popleft()
+            with self._lock:
+                sub = self._subs.get(token)
+            if sub is not None:
+                self._deliver_to_widget(token, sub, event)
+        try:
+            self._pump_root.after(OFF_THREAD_POLL_MS, self._pump)
+        except Exception:
+            # Tk closed; the next widget subscription starts a new pump
+            with self._lock:
+                self._pump_root = None
+
+    def _flush(self, token: int) -> None:
+        with self._lock:
+            sub = self._subs.get(token)
+            if sub is None:
+                return
+            events, sub.pending = sub.pending, []
+            sub.scheduled = False
+        try:
+            if not sub.widget.winfo_exists():
+                self.unsubscribe(token)
+                return
+            sub.callback(events)
+        except Exception as e:
+            logging.error(f"[event_bus] Widget subscriber failed: {e}")
+
+
+# Global singleton used across the app
+bus = ChangeBus()
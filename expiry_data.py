@@ -22,6 +22,10 @@ from openpyxl.styles import PatternFill
 from openpyxl.utils import get_column_letter
 
 from db import connect_db
+from filter_options import filter_options
+from ledger_archive import attach_ledger
+from order_engine import AMC_OUT_SQL
+from schema_registry import schema
 from language_manager import lang
 from popup_utils import custom_popup
 from manage_items import get_item_description, detect_type
@@ -89,11 +93,7 @@ class ExpiryDataCalculator:
         self.today = today
 
     def _table_columns_lower(self, cursor, table):
-        try:
-            cursor.execute(f"PRAGMA table_info({table})")
-            return [r[1].lower() for r in cursor.fetchall()]
-        except sqlite3.Error:
-            return []
+        return list(schema.columns(table))
 
     def _stock_data_rows(self, conn):
         cur = conn.cursor()
@@ -185,15 +185,9 @@ class ExpiryDataCalculator:
             needed = {"date", "qty_out", "out_type", "code"}
             if not needed.issubset(set(tx_cols)):
                 return {}
-            sql = """
-                SELECT code, SUM(COALESCE(Qty_Out,0))
-                FROM stock_transactions
-                WHERE Out_Type IS NOT NULL
-                  AND LOWER(Out_Type) = LOWER('Out MSF')
-                  AND Date >= ? AND Date <= ?
-                GROUP BY code
-            """
-            cur.execute(sql, (start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")))
+            # The AMC window reaches back into closed (possibly archived) years
+            attach_ledger(conn, start_date, end_date)
+            cur.execute(AMC_OUT_SQL, (start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")))
             for code, total_out in cur.fetchall():
                 if not code:
                     continue
@@ -585,27 +579,8 @@ class ExpiryDataView(tk.Frame):
             self.scenario_var.set(all_lbl)
 
     def populate_kit_module_lists(self):
-        conn = connect_db()
-        kits, modules = set(), set()
-        if conn:
-            cur = conn.cursor()
-            try:
-                cur.execute("PRAGMA table_info(stock_data)")
-                cols = [r[1].lower() for r in cur.fetchall()]
-                if "kit_number" in cols:
-                    cur.execute("""SELECT DISTINCT kit_number FROM stock_data
-                                   WHERE kit_number IS NOT NULL AND kit_number!='None'
-                                   ORDER BY kit_number""")
-                    for (k,) in cur.fetchall():
-                        if k: kits.add(str(k))
-                if "module_number" in cols:
-                    cur.execute("""SELECT DISTINCT module_number FROM stock_data
-                                   WHERE module_number IS NOT NULL AND module_number!='None'
-                                   ORDER BY module_number""")
-                    for (m,) in cur.fetchall():
-                        if m: modules.add(str(m))
-            finally:
-                cur.close(); conn.close()
+        kits = {str(k) for k in filter_options.kit_numbers()}
+        modules = {str(m) for m in filter_options.module_numbers()}
 
         all_lbl = self.t("all", "All")
         kit_vals = [all_lbl] + sorted(kits, key=lambda x: (len(x), x))
@@ -0,0 +1,192 @@
+"""
+fefo_allocator.py
+Shared FEFO (First Expiry, First Out) allocation for issuing screens.
+
+Dispatch Kit, Out Kit and the other issue screens each had their own
+"sort rows by expiry, walk them, subtract" loop and verified / updated
+stock_data one row at a time on save. This module centralises both halves:
+
+  * fefo_key() / allocate()  : FEFO order and cumulative allocation of a
+                               required quantity over candidate lots
+  * fetch_lots()             : every candidate lot for a whole issue in ONE
+                               query (idx_stock_fefo on item, scenario,
+                               exp_date, created by migrations.py),
+                               with the running stock before each lot
+                               computed by SUM() OVER (...)
+  * apply_issue()            : one read to verify all lots of a plan and one
+                               executemany() to book qty_out
+
+Usage:
+    from fefo_allocator import allocate, apply_issue
+    for lot, qty, remaining in allocate(rows, 12): ...
+    apply_issue(cur, [(unique_id, qty, code), ...], stamp)
+"""
+
+import sqlite3
+import logging
+from datetime import datetime
+
+from db import connect_db
+
+logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
+
+NO_EXPIRY = "9999-12-31"
+
+
+class IssueConflict(ValueError):
+    """Raised when stock changed under an issue (missing lot or not enough left)."""
+
+    def __init__(self, codes):
+        self.codes = list(codes)
+        super().__init__(f"Concurrent change or insufficient stock for {', '.join(self.codes)}")
+
+
+def fefo_key(exp_date):
+    """Comparable expiry: ISO date, 'DD-Mon-YYYY' converted, blank / invalid last."""
+    if not exp_date or exp_date == "None":
+        return NO_EXPIRY
+    text = str(exp_date)
+    if len(text) == 10 and text[4] == "-":
+        return text
+    try:
+        return datetime.strptime(text, "%d-%b-%Y").strftime("%Y-%m-%d")
+    except ValueError:
+        return NO_EXPIRY
+
+
+def _to_int(value):
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def allocate(lots, required, exp_field="expiry_date", qty_field="current_stock", tie_field=None):
+    """
+    Allocate `required` over `lots` (dicts) in FEFO order.
+
+    Lots are ordered by expiry (stable, so rows with the same expiry keep
+    their order unless tie_field is given). Returns a list of
+    (lot, qty_to_issue, remaining_before) in FEFO order, where
+    remaining_before is what was still required when the lot was reached.
+    """
+    if tie_field:
+        order = sorted(lots, key=lambda r: (fefo_key(r.get(exp_field)), r.get(tie_field) or ""))
+    else:
+        order = sorted(lots, key=lambda r: fefo_key(r.get(exp_field)))
+    plan = []
+    cumulative = 0
+    required = max(_to_int(required), 0)
+    for lot in order:
+        available = max(_to_int(lot.get(qty_field)), 0)
+        remaining = max(required - cumulative, 0)
+        plan.append((lot, min(available, remaining), remaining))
+        cumulative += available
+    return plan
+
+
+def build_lots_query(scenario_values, codes, kit_number=None, module_number=None):
+    """(sql, params) of fetch_lots; scenario_values and codes non-empty and distinct."""
+    code_ph = ",".join("?" * len(codes))
+    scen_ph = ",".join("?" * len(scenario_values))
+    where = [
+        f"scenario IN ({scen_ph})",
+        "final_qty > 0",
+        f"(item IN ({code_ph}) OR module IN ({code_ph}) OR kit IN ({code_ph}))",
+    ]
+    params = list(scenario_values) + list(codes) * 3
+    if kit_number:
+        where.append("kit_number = ?")
+        params.append(kit_number)
+    if module_number:
+        where.append("module_number = ?")
+        params.append(module_number)
+    sql = f"""
+        WITH lots AS (
+            SELECT unique_id, final_qty, exp_date, kit_number, module_number,
+                   COALESCE(NULLIF(NULLIF(item, 'None'), ''),
+                            NULLIF(NULLIF(module, 'None'), ''),
+                            kit) AS code,
+                   COALESCE(NULLIF(exp_date, ''), '{NO_EXPIRY}') AS fefo
+              FROM stock_data
+             WHERE {' AND '.join(where)}
+        )
+        SELECT unique_id, code, final_qty, exp_date, kit_number, module_number,
+               COALESCE(SUM(final_qty) OVER (
+                   PARTITION BY code ORDER BY fefo, unique_id
+                   ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING), 0) AS stock_before
+          FROM lots
+         ORDER BY code, fefo, unique_id
+    """
+    return sql, params
+
+
+def fetch_lots(scenario_values, codes, kit_number=None, module_number=None):
+    """
+    All lots with final_qty > 0 whose item / module / kit is one of `codes`
+    for the given scenario id / name values, in FEFO order per code.
+
+    Each lot dict: unique_id, code, final_qty, exp_date, kit_number,
+    module_number, stock_before (running final_qty of earlier lots of the
+    same code, from SUM() OVER).
+    """
+    codes = [c for c in dict.fromkeys(codes) if c]
+    scenario_values = [s for s in dict.fromkeys(str(v) for v in scenario_values if v)]
+    if not codes or not scenario_values:
+        return []
+    conn = connect_db()
+    if conn is None:
+        return []
+    conn.row_factory = sqlite3.Row
+    cur = conn.cursor()
+    try:
+        cur.execute(*build_lots_query(scenario_values, codes, kit_number, module_number))
+        return [dict(r) for r in cur.fetchall()]
+    except sqlite3.Error as e:
+        logging.error(f"[fefo_allocator] fetch_lots failed: {e}")
+        return []
+    finally:
+        cur.close()
+        conn.close()
+
+
+def apply_issue(cur, lines, stamp):
+    """
+    Book qty_out for every (unique_id, qty, code) line inside the caller's
+    transaction: one SELECT verifies all lots, one executemany() updates them.
+    Raises IssueConflict if any lot is missing or short; the caller rolls back.
+    """
+    lines = [(uid, int(qty), code) for uid, qty, code in lines if int(qty) > 0]
+    if not lines:
+        return
+    needed = {}
+    for uid, qty, _ in lines:
+        needed[uid] = needed.get(uid, 0) + qty
+    uids = list(needed)
+    available = {}
+    for start in range(0, len(uids), 500):
+        chunk = uids[start:start + 500]
+        cur.execute(
+            f"SELECT unique_id, final_qty FROM stock_data WHERE unique_id IN ({','.join('?' * len(chunk))})",
+            chunk,
+        )
+        available.update((r[0], r[1]) for r in cur.fetchall())
+    short = [
+        code for uid, _, code in lines
+        if available.get(uid) is None or available[uid] < needed[uid]
+    ]
+    if short:
+        raise IssueConflict(dict.fromkeys(short))
+
+    cur.executemany(
+        """
+        UPDATE stock_data
+           SET qty_out = qty_out + ?,
+               updated_at = ?
+         WHERE unique_id = ?
+           AND (qty_in - qty_out) >= ?
+        """,
+        [(qty, stamp, uid, qty) for uid, qty in needed.items()],
+    )
+    if cur.rowcount != len(needed):
+        raise IssueConflict(dict.fromkeys(code for _, _, code in lines))
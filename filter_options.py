@@ -0,0 +1,171 @@
+"""
+filter_options.py
+Shared scenario -> kit_number -> module_number hierarchy for filter dropdowns.
+
+Every report / stock screen used to run its own
+    SELECT DISTINCT kit_number / module_number FROM stock_data ...
+(often preceded by PRAGMA table_info) on each filter change. The
+FilterOptionsService keeps the hierarchy in memory instead:
+
+  * built from ONE grouped query over stock_data (and one over the ledger
+    Kit / Module columns for ledger-based screens, archived years included)
+  * scenario values are normalized to scenario names (stock_data may hold
+    either the scenario_id or the name)
+  * marked stale by STOCK_CHANGED / SCENARIOS_CHANGED on the event bus and by
+    a db.TableWatch for writes made through other connections; it is
+    rebuilt lazily on the next lookup.
+
+Usage:
+    from filter_options import filter_options
+    filter_options.kit_numbers("Cholera")
+    filter_options.module_numbers("Cholera", "KIT-001")
+"""
+
+import sqlite3
+import logging
+import threading
+
+from db import connect_db, TableWatch
+from event_bus import bus, STOCK_CHANGED, SCENARIOS_CHANGED
+from ledger_archive import LEDGER_VIEW, attach_ledger
+
+logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
+
+_EXCLUDED = (None, "", "None")
+
+_STOCK_HIERARCHY_SQL = """
+    SELECT scenario, kit_number, module_number
+      FROM stock_data
+     GROUP BY scenario, kit_number, module_number
+"""
+
+_LEDGER_HIERARCHY_SQL = f"""
+    SELECT Scenario, Kit, Module
+      FROM {LEDGER_VIEW}
+     GROUP BY Scenario, Kit, Module
+"""
+
+
+class FilterOptionsService:
+    """
+    In-memory filter hierarchy.
+      stock  : {scenario_name: {kit_number: set(module_numbers)}}   (stock_data)
+      ledger : {scenario: {kit: set(modules)}}                      (ledger view)
+    NULL / '' / 'None' numbers are kept out of the option lists.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stock = None
+        self._ledger = None
+        self._watch = TableWatch(("stock_data", "stock_transactions", "scenarios"))
+
+    # ------------------------------------------------------------------ #
+    # Staleness
+    # ------------------------------------------------------------------ #
+    def invalidate(self, *_):
+        with self._lock:
+            self._stock = None
+            self._ledger = None
+
+    def _check_external_writes(self):
+        """Drop the cache when another connection wrote one of its tables."""
+        if self._watch.changed():
+            self.invalidate()
+
+    # ------------------------------------------------------------------ #
+    # Build
+    # ------------------------------------------------------------------ #
+    @staticmethod
+    def _scenario_names(cur):
+        cur.execute("SELECT scenario_id, name FROM scenarios")
+        return {str(r[0]): r[1] for r in cur.fetchall() if r[1]}
+
+    @staticmethod
+    def _add(tree, scenario, kit, module):
+        kits = tree.setdefault(scenario, {})
+        if kit in _EXCLUDED:
+            kit = ""
+        modules = kits.setdefault(kit, set())
+        if module not in _EXCLUDED:
+            modules.add(module)
+
+    def _build(self, sql, ledger=False):
+        tree = {}
+        conn = connect_db()
+        if conn is None:
+            return tree
+        cur = conn.cursor()
+        try:
+            id_to_name = self._scenario_names(cur)
+            if ledger:
+                attach_ledger(conn)
+            cur.execute(sql)
+            for scenario, kit, module in cur.fetchall():
+                scen = "" if scenario is None else str(scenario)
+                self._add(tree, id_to_name.get(scen, scen), kit, module)
+        except sqlite3.Error as e:
+            logging.error(f"[FilterOptionsService] Build failed: {e}")
+        finally:
+            cur.close()
+            conn.close()
+        return tree
+
+    def _stock_tree(self):
+        self._check_external_writes()
+        with self._lock:
+            if self._stock is None:
+                self._stock = self._build(_STOCK_HIERARCHY_SQL)
+            return self._stock
+
+    def _ledger_tree(self):
+        self._check_external_writes()
+        with self._lock:
+            if self._ledger is None:
+                self._ledger = self._build(_LEDGER_HIERARCHY_SQL, ledger=True)
+            return self._ledger
+
+    # ------------------------------------------------------------------ #
+    # Lookups
+    # ------------------------------------------------------------------ #
+    @staticmethod
+    def _kits(tree, scenario):
+        scopes = [tree.get(scenario, {})] if scenario else tree.values()
+        return sorted({k for kits in scopes for k in kits if k})
+
+    @staticmethod
+    def _modules(tree, scenario, kit_number):
+        scopes = [tree.get(scenario, {})] if scenario else tree.values()
+        result = set()
+        for kits in scopes:
+            if kit_number:
+                result.update(kits.get(kit_number, ()))
+            else:
+                for modules in kits.values():
+                    result.update(modules)
+        return sorted(result)
+
+    def scenarios(self):
+        """Scenario names that currently hold stock."""
+        return sorted(s for s in self._stock_tree() if s)
+
+    def kit_numbers(self, scenario=None):
+        """Distinct stock_data.kit_number, optionally limited to one scenario name."""
+        return self._kits(self._stock_tree(), scenario)
+
+    def module_numbers(self, scenario=None, kit_number=None):
+        """Distinct stock_data.module_number, optionally limited by scenario / kit_number."""
+        return self._modules(self._stock_tree(), scenario, kit_number)
+
+    def ledger_kit_numbers(self, scenario=None):
+        """Distinct ledger Kit values (archived years included)."""
+        return self._kits(self._ledger_tree(), scenario)
+
+    def ledger_module_numbers(self, scenario=None, kit_number=None):
+        """Distinct ledger Module values (archived years included)."""
+        return self._modules(self._ledger_tree(), scenario, kit_number)
+
+
+# Shared instance reused by every screen
+filter_options = FilterOptionsService()
+bus.subscribe((STOCK_CHANGED, SCENARIOS_CHANGED), filter_options.invalidate)
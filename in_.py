@@ -5,9 +5,11 @@ import sqlite3
 import re
 from calendar import monthrange
 from language_manager import lang
-from db import connect_db
-from transaction_utils import log_transaction
+from db import connect_db, cached_query
+from event_bus import bus, STOCK_CHANGED
+from transaction_utils import LAST_DOCUMENT_SQL, insert_transaction
 from stock_data import StockData
+from write_queue import writer
 import openpyxl
 from openpyxl.styles import PatternFill, Alignment, Font
 from popup_utils import custom_popup, custom_askyesno, custom_dialog
@@ -113,18 +115,9 @@ def fetch_project_details():
     """
     Returns (project_name, project_code).
     """
-    conn = connect_db()
-    if conn is None:
-        return lang.t("stock_in.unknown_project", "Unknown Project"), lang.t("stock_in.unknown_code", "Unknown Code")
-    cur = conn.cursor()
-    try:
-        cur.execute("SELECT project_name, project_code FROM project_details LIMIT 1")
-        row = cur.fetchone()
-        return (row[0] if row and row[0] else lang.t("stock_in.unknown_project", "Unknown Project"),
-                row[1] if row and row[1] else lang.t("stock_in.unknown_code", "Unknown Code"))
-    finally:
-        cur.close()
-        conn.close()
+    row = next(iter(cached_query("SELECT project_name, project_code FROM project_details LIMIT 1")), None)
+    return (row[0] if row and row[0] else lang.t("stock_in.unknown_project", "Unknown Project"),
+            row[1] if row and row[1] else lang.t("stock_in.unknown_code", "Unknown Code"))
 
 def fetch_qty_needed(self, code, scenario_name, scenario_id, std_qty):
     """
@@ -366,13 +359,7 @@ class StockIn(tk.Frame):
         if conn:
             cur = conn.cursor()
             try:
-                cur.execute("""
-                    SELECT document_number
-                      FROM stock_transactions
-                     WHERE document_number LIKE ?
-                     ORDER BY document_number DESC
-                     LIMIT 1
-                """, (prefix + "/%",))
+                cur.execute(LAST_DOCUMENT_SQL, (prefix + "/%",))
                 row = cur.fetchone()
                 if row and row[0]:
                     tail = row[0].rsplit("/", 1)[-1]
@@ -389,17 +376,7 @@ class StockIn(tk.Frame):
     
     # -------- Data Fetch Helpers -------- #
     def fetch_scenario_map(self):
-        conn = connect_db()
-        if conn is None:
-            return {}
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-        try:
-            cur.execute("SELECT scenario_id, name FROM scenarios ORDER BY name")
-            return {str(r['scenario_id']): r['name'] for r in cur.fetchall()}
-        finally:
-            cur.close()
-            conn.close()
+        return {str(r['scenario_id']): r['name'] for r in cached_query("SELECT scenario_id, name FROM scenarios ORDER BY name")}
 
     def fetch_search_results(self, query):
         conn = connect_db()
@@ -1340,6 +1317,12 @@ class StockIn(tk.Frame):
 
         
     # -------- Save / Persist -------- #
+    @staticmethod
+    def _save_row(conn, transaction, expiry_fmt):
+        """Writer job of one row: its ledger line and stock_data lot, in one savepoint."""
+        insert_transaction(conn, **transaction)
+        StockData.apply(conn, transaction["unique_id"], qty_in=transaction["Qty_IN"], exp_date=expiry_fmt)
+
     def save_all(self):
         if self.role.lower() not in ["admin", "manager"]:
             self.show_error("stock_in.no_permission", "Only admin or manager roles can save changes.")
@@ -1383,6 +1366,7 @@ class StockIn(tk.Frame):
 
         invalid_items = []
         exported_rows = []
+        pending = []   # (writer future, export row)
     
         for iid in rows:
             vals = self.tree.item(iid, "values")
@@ -1426,36 +1410,31 @@ class StockIn(tk.Frame):
             # ✅ Use scenario_id in unique_id (6-layer format)
             six_layer_unique_id = f"{scenario_id}/{kit_code if kit_code != '-----' else 'None'}/{module_code if module_code != '-----' else 'None'}/{code}/{std_qty}/{exp_part}"
 
-            try:
-                # ✅ Store canonical English + scenario_id in DB
-                log_transaction(
-                    unique_id=six_layer_unique_id,
-                    code=code,
-                    Description=description,
-                    Expiry_date=expiry_fmt,
-                    Batch_Number=batch_no,
-                    Scenario=str(scenario_id),          # ✅ Use scenario_id (as string)
-                    Kit=kit_code if kit_code != "-----" else None,
-                    Module=module_code if module_code != "-----" else None,
-                    Qty_IN=qty_in_int,
-                    IN_Type=ttype_canonical,            # ✅ Canonical English
-                    Third_Party=third_party if third_party else None,
-                    End_User=end_user if end_user else None,
-                    Remarks=remarks,
-                    Movement_Type="stock_in",
-                    document_number=doc_number
-                )
-
-                # ✅ Pass scenario_id to StockData
-                StockData.add_or_update(
-                    unique_id=six_layer_unique_id,
-                    qty_in=qty_in_int,
-                    qty_out=0,
-                    exp_date=expiry_fmt
-                )
-                
-            
-                exported_rows.append({
+            # ✅ Store canonical English + scenario_id in DB; queued for the
+            # writer thread so all rows of the save share one commit
+            pending.append((
+                writer.submit(
+                    self._save_row,
+                    dict(
+                        unique_id=six_layer_unique_id,
+                        code=code,
+                        Description=description,
+                        Expiry_date=expiry_fmt,
+                        Batch_Number=batch_no,
+                        Scenario=str(scenario_id),          # ✅ Use scenario_id (as string)
+                        Kit=kit_code if kit_code != "-----" else None,
+                        Module=module_code if module_code != "-----" else None,
+                        Qty_IN=qty_in_int,
+                        IN_Type=ttype_canonical,            # ✅ Canonical English
+                        Third_Party=third_party if third_party else None,
+                        End_User=end_user if end_user else None,
+                        Remarks=remarks,
+                        Movement_Type="stock_in",
+                        document_number=doc_number
+                    ),
+                    expiry_fmt,
+                ),
+                {
                     'code': code,
                     'description': description,
                     'scenario_name': scenario_name,     # Keep for Excel export
@@ -1466,16 +1445,20 @@ class StockIn(tk.Frame):
                     'qty_in': qty_in_int,
                     'expiry_date': expiry_fmt,
                     'batch_no': batch_no
-                })
+                },
+            ))
 
-            except Exception as e:
+        for future, row in pending:
+            error = future.exception()
+            if error is None:
+                exported_rows.append(row)
+            else:
                 custom_popup(
                     self,
                     lang.t("dialog_titles.error", "Error"),
-                    lang.t("stock_in.save_failed", "Failed to save row: {error}").format(error=str(e)),
+                    lang.t("stock_in.save_failed", "Failed to save row: {error}").format(error=str(error)),
                     "error"
                 )
-                continue
 
         if invalid_items:
             self.show_error(
@@ -1485,6 +1468,7 @@ class StockIn(tk.Frame):
             )
             return
 
+        bus.publish(STOCK_CHANGED)
         self.show_info("stock_in.saved", "Stock IN saved successfully.")
     
         # Offer export
@@ -13,7 +13,12 @@ from tkinter import messagebox as mb
 from popup_utils import custom_popup, custom_askyesno, custom_dialog
 import os
 
-from db import connect_db
+from db import connect_db, cached_query
+from transaction_utils import LAST_DOCUMENT_SQL
+from event_bus import bus, STOCK_CHANGED
+from schema_registry import schema
+from write_queue import writer
+from kit_structure_index import kit_structure
 from manage_items import get_item_description, detect_type
 from language_manager import lang
 
@@ -131,13 +136,8 @@ def check_expiry_required(code: str) -> bool:
 
 
 def fetch_project_details():
-    conn = connect_db()
-    if conn is None:
-        return ("Unknown Project", "PRJ")
-    cur = conn.cursor()
     try:
-        cur.execute("SELECT project_name, project_code FROM project_details LIMIT 1")
-        r = cur.fetchone()
+        r = next(iter(cached_query("SELECT project_name, project_code FROM project_details LIMIT 1")), None)
         return (
             r[0] if r and r[0] else "Unknown Project",
             r[1] if r and r[1] else "PRJ",
@@ -145,41 +145,22 @@ def fetch_project_details():
     except sqlite3.Error as e:
         logging.error(f"[fetch_project_details] {e}")
         return ("Unknown Project", "PRJ")
-    finally:
-        cur.close()
-        conn.close()
 
 
 def fetch_third_parties():
-    conn = connect_db()
-    if conn is None:
-        return []
-    cur = conn.cursor()
     try:
-        cur.execute("SELECT name FROM third_parties ORDER BY name")
-        return [r[0] for r in cur.fetchall()]
+        return [r[0] for r in cached_query("SELECT name FROM third_parties ORDER BY name")]
     except sqlite3.Error as e:
         logging.error(f"[fetch_third_parties] {e}")
         return []
-    finally:
-        cur.close()
-        conn.close()
 
 
 def fetch_end_users():
-    conn = connect_db()
-    if conn is None:
-        return []
-    cur = conn.cursor()
     try:
-        cur.execute("SELECT name FROM end_users ORDER BY name")
-        return [r[0] for r in cur.fetchall()]
+        return [r[0] for r in cached_query("SELECT name FROM end_users ORDER BY name")]
     except sqlite3.Error as e:
         logging.error(f"[fetch_end_users] {e}")
         return []
-    finally:
-        cur.close()
-        conn.close()
 
 
 # ---------------------------------------------------------------
@@ -196,97 +177,93 @@ class StockData:
         kit_number=None,
         module_number=None,
     ):
-        conn = connect_db()
-        if conn is None:
-            raise ValueError("DB connection failed")
-        cur = conn.cursor()
-        try:
-            cur.execute("PRAGMA table_info(stock_data)")
-            cols = {row[1].lower() for row in cur.fetchall()}
-            has_scenario = "scenario" in cols
-            cur.execute(
-                "SELECT qty_in, qty_out FROM stock_data WHERE unique_id=?", (unique_id,)
-            )
-            row = cur.fetchone()
-            now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            if row:
-                new_in = (row[0] or 0) + qty_in
-                new_out = (row[1] or 0) + qty_out
-                if has_scenario:
-                    cur.execute(
-                        """
-                        UPDATE stock_data
-                           SET qty_in=?, qty_out=?, exp_date=?, kit_number=?, module_number=?, scenario=?, updated_at=?
-                         WHERE unique_id=?""",
-                        (
-                            new_in,
-                            new_out,
-                            exp_date,
-                            kit_number,
-                            module_number,
-                            scenario,
-                            now,
-                            unique_id,
-                        ),
-                    )
-                else:
-                    cur.execute(
-                        """
-                        UPDATE stock_data
-                           SET qty_in=?, qty_out=?, exp_date=?, kit_number=?, module_number=?, updated_at=?
-                         WHERE unique_id=?""",
-                        (
-                            new_in,
-                            new_out,
-                            exp_date,
-                            kit_number,
-                            module_number,
-                            now,
-                            unique_id,
-                        ),
-                    )
-            else:
-                if has_scenario:
-                    cur.execute(
-                        """
-                        INSERT INTO stock_data
-                            (unique_id, qty_in, qty_out, exp_date, kit_number, module_number, scenario, updated_at)
-                        VALUES (?,?,?,?,?,?,?,?)""",
-                        (
-                            unique_id,
-                            qty_in,
-                            qty_out,
-                            exp_date,
-                            kit_number,
-                            module_number,
-                            scenario,
-                            now,
-                        ),
-                    )
+        def job(conn):
+            cur = conn.cursor()
+            try:
+                has_scenario = schema.has_stock_scenario
+                cur.execute(
+                    "SELECT qty_in, qty_out FROM stock_data WHERE unique_id=?", (unique_id,)
+                )
+                row = cur.fetchone()
+                now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                if row:
+                    new_in = (row[0] or 0) + qty_in
+                    new_out = (row[1] or 0) + qty_out
+                    if has_scenario:
+                        cur.execute(
+                            """
+                            UPDATE stock_data
+                               SET qty_in=?, qty_out=?, exp_date=?, kit_number=?, module_number=?, scenario=?, updated_at=?
+                             WHERE unique_id=?""",
+                            (
+                                new_in,
+                                new_out,
+                                exp_date,
+                                kit_number,
+                                module_number,
+                                scenario,
+                                now,
+                                unique_id,
+                            ),
+                        )
+                    else:
+                        cur.execute(
+                            """
+                            UPDATE stock_data
+                               SET qty_in=?, qty_out=?, exp_date=?, kit_number=?, module_number=?, updated_at=?
+                             WHERE unique_id=?""",
+                            (
+                                new_in,
+                                new_out,
+                                exp_date,
+                                kit_number,
+                                module_number,
+                                now,
+                                unique_id,
+                            ),
+                        )
                 else:
-                    cur.execute(
-                        """
-                        INSERT INTO stock_data
-                            (unique_id, qty_in, qty_out, exp_date, kit_number, module_number, updated_at)
-                        VALUES (?,?,?,?,?,?,?)""",
-                        (
-                            unique_id,
-                            qty_in,
-                            qty_out,
-                            exp_date,
-                            kit_number,
-                            module_number,
-                            now,
-                        ),
-                    )
-            conn.commit()
+                    if has_scenario:
+                        cur.execute(
+                            """
+                            INSERT INTO stock_data
+                                (unique_id, qty_in, qty_out, exp_date, kit_number, module_number, scenario, updated_at)
+                            VALUES (?,?,?,?,?,?,?,?)""",
+                            (
+                                unique_id,
+                                qty_in,
+                                qty_out,
+                                exp_date,
+                                kit_number,
+                                module_number,
+                                scenario,
+                                now,
+                            ),
+                        )
+                    else:
+                        cur.execute(
+                            """
+                            INSERT INTO stock_data
+                                (unique_id, qty_in, qty_out, exp_date, kit_number, module_number, updated_at)
+                            VALUES (?,?,?,?,?,?,?)""",
+                            (
+                                unique_id,
+                                qty_in,
+                                qty_out,
+                                exp_date,
+                                kit_number,
+                                module_number,
+                                now,
+                            ),
+                        )
+            finally:
+                cur.close()
+
+        try:
+            writer.run(job)
         except sqlite3.Error as e:
-            conn.rollback()
             logging.error(f"[StockData.add_or_update] {e}")
             raise
-        finally:
-            cur.close()
-            conn.close()
 
     @staticmethod
     def consume_by_line_id(line_id: int, qty_out_add: int):
@@ -295,34 +272,33 @@ class StockData:
         """
         if qty_out_add <= 0:
             return
-        conn = connect_db()
-        if conn is None:
-            raise ValueError("DB connection failed")
-        cur = conn.cursor()
+
+        def job(conn):
+            cur = conn.cursor()
+            try:
+                cur.execute(
+                    "SELECT qty_in, qty_out FROM stock_data WHERE line_id=?", (line_id,)
+                )
+                row = cur.fetchone()
+                if not row:
+                    logging.warning(f"[consume_by_line_id] line_id {line_id} not found")
+                    return
+                new_out = (row[1] or 0) + qty_out_add
+                cur.execute(
+                    """
+                    UPDATE stock_data
+                       SET qty_out = ?, updated_at = CURRENT_TIMESTAMP
+                     WHERE line_id = ?
+                """,
+                    (new_out, line_id),
+                )
+            finally:
+                cur.close()
+
         try:
-            cur.execute(
-                "SELECT qty_in, qty_out FROM stock_data WHERE line_id=?", (line_id,)
-            )
-            row = cur.fetchone()
-            if not row:
-                logging.warning(f"[consume_by_line_id] line_id {line_id} not found")
-                return
-            new_out = (row[1] or 0) + qty_out_add
-            cur.execute(
-                """
-                UPDATE stock_data
-                   SET qty_out = ?, updated_at = CURRENT_TIMESTAMP
-                 WHERE line_id = ?
-            """,
-                (new_out, line_id),
-            )
-            conn.commit()
+            writer.run(job)
         except sqlite3.Error as e:
-            conn.rollback()
             logging.error(f"[consume_by_line_id] {e}")
-        finally:
-            cur.close()
-            conn.close()
 
 
 # ---------------------------------------------------------------
@@ -535,20 +511,11 @@ class StockInKit(tk.Frame):
 
     # ------------- Scenario helpers ------------
     def fetch_scenario_map(self):
-        conn = connect_db()
-        if conn is None:
-            return {}
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
         try:
-            cur.execute("SELECT scenario_id, name FROM scenarios ORDER BY name")
-            return {str(r["scenario_id"]): r["name"] for r in cur.fetchall()}
+            return {str(r["scenario_id"]): r["name"] for r in cached_query("SELECT scenario_id, name FROM scenarios ORDER BY name")}
         except sqlite3.Error as e:
             logging.error(f"[fetch_scenario_map] {e}")
             return {}
-        finally:
-            cur.close()
-            conn.close()
 
     def fetch_scenarios(self):
         conn = connect_db()
@@ -2546,46 +2513,22 @@ class StockInKit(tk.Frame):
     def fetch_kit_items(self, scenario_id, code):
         if not scenario_id or not code:
             return []
-        conn = connect_db()
-        if conn is None:
-            return []
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-        try:
-            cur.execute(
-                """
-                SELECT code, level, kit, module, item,
-                       COALESCE(std_qty,0) AS std_qty,
-                       treecode
-                  FROM kit_items
-                 WHERE scenario_id=?
-                   AND (code=? OR kit=? OR module=? OR item=?)
-                 ORDER BY treecode
-            """,
-                (scenario_id, code, code, code, code),
+        comps = []
+        for e in kit_structure.structure(scenario_id).related(code):
+            dsc = get_item_description(e.code)
+            comps.append(
+                {
+                    "code": e.code,
+                    "description": dsc,
+                    "type": detect_type(e.code, dsc),
+                    "kit": e.kit or "-----",
+                    "module": e.module or "-----",
+                    "item": e.item or "-----",
+                    "std_qty": e.std_qty,
+                    "treecode": e.treecode,
+                }
             )
-            comps = []
-            for r in cur.fetchall():
-                dsc = get_item_description(r["code"])
-                comps.append(
-                    {
-                        "code": r["code"],
-                        "description": dsc,
-                        "type": detect_type(r["code"], dsc),
-                        "kit": r["kit"] or "-----",
-                        "module": r["module"] or "-----",
-                        "item": r["item"] or "-----",
-                        "std_qty": r["std_qty"],
-                        "treecode": r["treecode"],
-                    }
-                )
-            return comps
-        except sqlite3.Error as e:
-            logging.error(f"[fetch_kit_items] {e}")
-            return []
-        finally:
-            cur.close()
-            conn.close()
+        return comps
 
     # ------------- On-shelf batch extraction (per line) -------------
     def fetch_on_shelf_batches(self, code: str):
@@ -4061,11 +4004,7 @@ class StockInKit(tk.Frame):
             cur = conn.cursor()
             try:
                 cur.execute(
-                    """
-                    SELECT document_number FROM stock_transactions
-                     WHERE document_number LIKE ?
-                     ORDER BY document_number DESC LIMIT 1
-                """,
+                    LAST_DOCUMENT_SQL,
                     (prefix + "/%",),
                 )
                 r = cur.fetchone()
@@ -4110,48 +4049,46 @@ class StockInKit(tk.Frame):
 
         Parameters may be None; they are written as NULL in SQLite.
         """
-        conn = connect_db()
-        if conn is None:
-            return
-        cur = conn.cursor()
+        def job(conn):
+            cur = conn.cursor()
+            try:
+                cur.execute(
+                    """
+                    INSERT INTO stock_transactions
+                    (Date, Time, unique_id, code, Description, Expiry_date, Batch_Number,
+                     Scenario, Kit, Module, Qty_IN, IN_Type, Qty_Out, Out_Type,
+                     Third_Party, End_User, Remarks, Movement_Type, document_number)
+                    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+                """,
+                    (
+                        datetime.today().strftime("%Y-%m-%d"),
+                        datetime.now().strftime("%H:%M:%S"),
+                        unique_id,
+                        code,
+                        description,
+                        expiry_date,
+                        batch_number,
+                        scenario,
+                        kit,
+                        module,
+                        qty_in,
+                        in_type,
+                        qty_out,
+                        out_type,
+                        third_party,
+                        end_user,
+                        remarks,
+                        movement_type,
+                        document_number,
+                    ),
+                )
+            finally:
+                cur.close()
+
         try:
-            cur.execute(
-                """
-                INSERT INTO stock_transactions
-                (Date, Time, unique_id, code, Description, Expiry_date, Batch_Number,
-                 Scenario, Kit, Module, Qty_IN, IN_Type, Qty_Out, Out_Type,
-                 Third_Party, End_User, Remarks, Movement_Type, document_number)
-                VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-            """,
-                (
-                    datetime.today().strftime("%Y-%m-%d"),
-                    datetime.now().strftime("%H:%M:%S"),
-                    unique_id,
-                    code,
-                    description,
-                    expiry_date,
-                    batch_number,
-                    scenario,
-                    kit,
-                    module,
-                    qty_in,
-                    in_type,
-                    qty_out,
-                    out_type,
-                    third_party,
-                    end_user,
-                    remarks,
-                    movement_type,
-                    document_number,
-                ),
-            )
-            conn.commit()
+            writer.run(job)
         except sqlite3.Error as e:
-            conn.rollback()
             logging.error(f"[log_transaction] {e}")
-        finally:
-            cur.close()
-            conn.close()
 
     # ------------- Uniqueness enforcement -------------
     def _enforce_unique_numbers_before_save(self):
@@ -4740,6 +4677,7 @@ class StockInKit(tk.Frame):
                 saved += 1
 
             conn.commit()
+            bus.publish(STOCK_CHANGED)
 
             # ===== HANDLE ERRORS =====
             if errors:
@@ -1,6 +1,8 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 from language_manager import lang
+from db import sql_tracer, query_cache
+from write_queue import writer
 from popup_utils import custom_popup, custom_askyesno, custom_dialog
 
 def get_info_text():
@@ -199,6 +201,19 @@ class AppInfo(tk.Frame):
         )
         save_btn.pack(side="left", padx=(8, 0))
 
+        sql_btn = tk.Button(
+            toolbar,
+            text=lang.t("info.sql_diagnostics", "SQL Diagnostics"),
+            command=self.open_sql_diagnostics,
+            bg="#374151",
+            fg="white",
+            relief="flat",
+            padx=14,
+            pady=4,
+            font=("Helvetica", 10)
+        )
+        sql_btn.pack(side="right")
+
         container = tk.Frame(self, bg="#FFFFFF")
         container.pack(fill="both", expand=True, padx=20, pady=(0, 20))
 
@@ -251,6 +266,143 @@ class AppInfo(tk.Frame):
                 parent=self
             )
 
+    def open_sql_diagnostics(self):
+        SqlDiagnosticsWindow(self)
+
+
+class SqlDiagnosticsWindow(tk.Toplevel):
+    """
+    Top offenders of db.sql_tracer (per statement and calling function),
+    the recent slow queries with their query plans, the write queue figures
+    (commits, queue depth, latency) and the query cache hit ratio.
+    """
+    COLUMNS = ("total_ms", "count", "avg_ms", "max_ms", "rows", "caller", "sql")
+    TOP_N = 100
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.title(lang.t("info.sql_title", "SQL Diagnostics"))
+        self.geometry("1100x650")
+        self.configure(bg="#FFFFFF")
+        self.trace_var = tk.BooleanVar(value=sql_tracer.enabled)
+        self._slow = []
+        self._build()
+        self.refresh()
+
+    def _build(self):
+        toolbar = tk.Frame(self, bg="#FFFFFF")
+        toolbar.pack(fill="x", padx=10, pady=8)
+        tk.Checkbutton(
+            toolbar,
+            text=lang.t("info.sql_record", "Record queries (new connections)"),
+            variable=self.trace_var,
+            command=self._toggle,
+            bg="#FFFFFF"
+        ).pack(side="left")
+        tk.Button(toolbar, text=lang.t("info.sql_refresh", "Refresh"), command=self.refresh,
+                  relief="flat", bg="#2563EB", fg="white", padx=10).pack(side="left", padx=(12, 0))
+        tk.Button(toolbar, text=lang.t("info.sql_reset", "Reset"), command=self.reset,
+                  relief="flat", bg="#374151", fg="white", padx=10).pack(side="left", padx=(8, 0))
+        self.status = tk.Label(toolbar, bg="#FFFFFF", fg="#374151")
+        self.status.pack(side="right")
+        self.writer_status = tk.Label(self, bg="#FFFFFF", fg="#374151", anchor="w")
+        self.writer_status.pack(fill="x", padx=10)
+        self.cache_status = tk.Label(self, bg="#FFFFFF", fg="#374151", anchor="w")
+        self.cache_status.pack(fill="x", padx=10, pady=(0, 6))
+
+        panes = ttk.PanedWindow(self, orient="vertical")
+        panes.pack(fill="both", expand=True, padx=10, pady=(0, 10))
+
+        top = tk.Frame(panes, bg="#FFFFFF")
+        headings = {
+            "total_ms": lang.t("info.sql_total_ms", "Total ms"),
+            "count": lang.t("info.sql_count", "Calls"),
+            "avg_ms": lang.t("info.sql_avg_ms", "Avg ms"),
+            "max_ms": lang.t("info.sql_max_ms", "Max ms"),
+            "rows": lang.t("info.sql_rows", "Rows"),
+            "caller": lang.t("info.sql_caller", "Caller"),
+            "sql": lang.t("info.sql_statement", "Statement"),
+        }
+        self.tree = ttk.Treeview(top, columns=self.COLUMNS, show="headings", height=12)
+        for col in self.COLUMNS:
+            wide = col in ("caller", "sql")
+            self.tree.heading(col, text=headings[col])
+            self.tree.column(col, width=260 if col == "caller" else 520 if col == "sql" else 70,
+                             anchor="w" if wide else "e", stretch=wide)
+        vsb = ttk.Scrollbar(top, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=vsb.set)
+        self.tree.pack(side="left", fill="both", expand=True)
+        vsb.pack(side="right", fill="y")
+        panes.add(top, weight=3)
+
+        bottom = tk.Frame(panes, bg="#FFFFFF")
+        tk.Label(bottom, text=lang.t("info.sql_slow", "Slow queries (>= {ms} ms)").format(
+            ms=int(sql_tracer.slow_ms)), bg="#FFFFFF", font=("Helvetica", 10, "bold")).pack(anchor="w")
+        self.slow_list = tk.Listbox(bottom, height=6, font=("Courier", 9))
+        self.slow_list.pack(fill="x")
+        self.slow_list.bind("<<ListboxSelect>>", self._show_plan)
+        self.plan_text = tk.Text(bottom, height=8, wrap="word", font=("Courier", 9),
+                                 relief="solid", bd=1, state="disabled")
+        self.plan_text.pack(fill="both", expand=True, pady=(6, 0))
+        panes.add(bottom, weight=2)
+
+    def _toggle(self):
+        if self.trace_var.get():
+            sql_tracer.enable()
+        else:
+            sql_tracer.disable()
+        self.refresh()
+
+    def reset(self):
+        sql_tracer.reset()
+        writer.reset_stats()
+        query_cache.reset_stats()
+        self.refresh()
+
+    def refresh(self):
+        self.tree.delete(*self.tree.get_children())
+        rows = sql_tracer.top(self.TOP_N)
+        for stat in rows:
+            self.tree.insert("", "end", values=(
+                f"{stat['total_ms']:.1f}", stat["count"], f"{stat['avg_ms']:.2f}",
+                f"{stat['max_ms']:.1f}", stat["rows"], stat["caller"], stat["sql"][:300]))
+        self._slow = sql_tracer.slow_queries()
+        self.slow_list.delete(0, "end")
+        for q in self._slow:
+            self.slow_list.insert("end", f"{q['at']}  {q['ms']:9.1f} ms  {q['caller']}  {q['sql'][:120]}")
+        self._set_plan("")
+        self.status.config(text=lang.t("info.sql_status", "{n} statements, {ms:.0f} ms total").format(
+            n=len(rows), ms=sum(s["total_ms"] for s in rows)))
+        w = writer.stats()
+        self.writer_status.config(text=lang.t(
+            "info.sql_writer_status",
+            "Write queue: {jobs} jobs in {batches} commits (max {max_batch} per commit), "
+            "queue {depth} (max {max_depth}), latency avg {avg:.1f} / p95 {p95:.1f} ms, "
+            "{retries} busy retries, {failed} failed").format(
+            jobs=w["jobs"], batches=w["batches"], max_batch=w["max_batch"], depth=w["queue_depth"],
+            max_depth=w["max_queue_depth"], avg=w["latency"]["avg_ms"], p95=w["latency"]["p95_ms"],
+            retries=w["retries"], failed=w["failed"]))
+        q = query_cache.stats()
+        self.cache_status.config(text=lang.t(
+            "info.sql_cache_status",
+            "Query cache: {hits} hits / {misses} misses ({ratio:.0%}), {entries} entries, "
+            "{invalidated} invalidated, {evicted} evicted").format(
+            hits=q["hits"], misses=q["misses"], ratio=q["hit_ratio"], entries=q["entries"],
+            invalidated=q["invalidated"], evicted=q["evicted"]))
+
+    def _show_plan(self, _event=None):
+        sel = self.slow_list.curselection()
+        if sel:
+            q = self._slow[sel[0]]
+            self._set_plan(f"{q['sql']}\n\n{q['plan']}")
+
+    def _set_plan(self, text):
+        self.plan_text.config(state="normal")
+        self.plan_text.delete("1.0", "end")
+        self.plan_text.insert("1.0", text)
+        self.plan_text.config(state="disabled")
+
+
 if __name__ == "__main__":
     root = tk.Tk()
     root.title("IsEPREP - Application Info")
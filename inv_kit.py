@@ -3,6 +3,7 @@ from tkinter import ttk, messagebox, filedialog
 from datetime import datetime
 import sqlite3
 from db import connect_db
+from event_bus import bus, STOCK_CHANGED
 from popup_utils import custom_popup, custom_askyesno, custom_dialog
 from manage_items import get_item_description
 from language_manager import lang
@@ -471,6 +472,7 @@ class InventoryKit(tk.Frame):
                         movement_type="inventory_adjustment"
                     )
                 conn.commit()
+                bus.publish(STOCK_CHANGED)
                 messagebox.showinfo(lang.t("dialog_titles.info", "Success"), lang.t("inv_kit.save_success", "Inventory saved successfully."), parent=self.parent)
                 self.clear_form()
                 logging.info("Save completed successfully")
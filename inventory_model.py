@@ -0,0 +1,300 @@
+"""
+inventory_model.py
+In-memory row model behind the StockInventory grid (stock_inv.py).
+
+The Treeview only displays rows; this model owns their values and the
+kit -> module -> item structure so the physical quantity propagation does
+not have to read every row back from the widget on each edit.
+
+Row layout (same as StockInventory.cols):
+    0 unique_id, 1 code, 2 description, 3 type, 4 management_type,
+    5 scenario, 6 kit_number, 7 module_number, 8 current_stock, 9 exp_date,
+    10 physical_qty, 11 updated_exp_date, 12 discrepancy, 13 remarks, 14 std_qty
+
+recompute() performs the kit -> module -> item factor propagation in one pass
+over the model (or only over the subtree affected by one edited row) and
+returns the rows whose physical_qty / discrepancy changed, so the screen only
+pushes those to the widget.
+"""
+
+import unicodedata
+
+COL_UNIQUE_ID = 0
+COL_CODE = 1
+COL_DESCRIPTION = 2
+COL_TYPE = 3
+COL_KIT_NUMBER = 6
+COL_MODULE_NUMBER = 7
+COL_CURRENT_STOCK = 8
+COL_PHYSICAL_QTY = 10
+COL_UPDATED_EXP = 11
+COL_DISCREPANCY = 12
+COL_REMARKS = 13
+ROW_WIDTH = 15
+
+COLUMN_INDEX = {
+    "physical_qty": COL_PHYSICAL_QTY,
+    "updated_exp_date": COL_UPDATED_EXP,
+    "discrepancy": COL_DISCREPANCY,
+    "remarks": COL_REMARKS,
+}
+
+NO_NUMBER = "-----"
+
+
+def _normalize_type(text):
+    """KIT / MODULE / ITEM (accent and case insensitive, Módulo -> MODULE)."""
+    if not text:
+        return ""
+    stripped = "".join(
+        ch for ch in unicodedata.normalize("NFD", str(text))
+        if unicodedata.category(ch) != "Mn"
+    ).upper()
+    if stripped == "MODULO":
+        return "MODULE"
+    return stripped
+
+
+def _to_int(value):
+    return int(value) if str(value).isdigit() else 0
+
+
+class InventoryRow:
+    """One grid row: its display values plus the derived fields used by recompute."""
+
+    __slots__ = (
+        "iid", "values", "row_type", "is_physical", "kit_number",
+        "module_number", "current_stock", "base_physical", "requires_expiry",
+    )
+
+    def __init__(self, iid, values, base_physical=0):
+        vals = list(values) + [""] * (ROW_WIDTH - len(values))
+        unique_id = str(vals[COL_UNIQUE_ID] or "")
+        self.iid = iid
+        self.values = vals
+        self.row_type = _normalize_type(vals[COL_TYPE])
+        self.is_physical = unique_id.count("/") == 7
+        self.kit_number = vals[COL_KIT_NUMBER]
+        self.module_number = vals[COL_MODULE_NUMBER]
+        self.current_stock = _to_int(vals[COL_CURRENT_STOCK])
+        self.base_physical = base_physical or 0
+        self.requires_expiry = None
+
+    @property
+    def unique_id(self):
+        return self.values[COL_UNIQUE_ID]
+
+    @property
+    def code(self):
+        return self.values[COL_CODE]
+
+    @property
+    def description(self):
+        return self.values[COL_DESCRIPTION]
+
+    @property
+    def physical_qty(self):
+        return str(self.values[COL_PHYSICAL_QTY] or "")
+
+    @property
+    def updated_exp_date(self):
+        return str(self.values[COL_UPDATED_EXP] or "")
+
+
+class InventoryModel:
+    """
+    Row table for the inventory grid with kit/module parent indexes.
+
+    kit_rows / module_rows     : kit_number / module_number -> KIT / MODULE row iids
+    kit_members / module_members: kit_number / module_number -> every row iid under it
+    """
+
+    def __init__(self):
+        self.clear()
+
+    # ------------------------------------------------------------------ #
+    # Row table
+    # ------------------------------------------------------------------ #
+    def clear(self):
+        self._rows = {}
+        self._kit_rows = {}
+        self._module_rows = {}
+        self._kit_members = {}
+        self._module_members = {}
+        self._kit_factors = {}
+        self._module_factors = {}
+        self._factors_stale = False
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, iid):
+        return iid in self._rows
+
+    def rows(self):
+        return list(self._rows.values())
+
+    def get(self, iid):
+        return self._rows.get(iid)
+
+    def add(self, iid, values, base_physical=0):
+        row = InventoryRow(iid, values, base_physical)
+        self._rows[iid] = row
+        if row.is_physical:
+            if row.row_type == "KIT" and self._valid(row.kit_number):
+                self._kit_rows.setdefault(row.kit_number, []).append(iid)
+            elif row.row_type == "MODULE" and self._valid(row.module_number):
+                self._module_rows.setdefault(row.module_number, []).append(iid)
+        if self._valid(row.kit_number):
+            self._kit_members.setdefault(row.kit_number, []).append(iid)
+        if self._valid(row.module_number):
+            self._module_members.setdefault(row.module_number, []).append(iid)
+        return row
+
+    def remove(self, iid):
+        row = self._rows.pop(iid, None)
+        if not row:
+            return None
+        for index, key in (
+            (self._kit_rows, row.kit_number),
+            (self._module_rows, row.module_number),
+            (self._kit_members, row.kit_number),
+            (self._module_members, row.module_number),
+        ):
+            members = index.get(key)
+            if members and iid in members:
+                members.remove(iid)
+        if row.is_physical and row.row_type in ("KIT", "MODULE"):
+            # The factor of its number (and of the modules under a kit) came
+            # from this row: the next recompute() re-derives all of them
+            self._factors_stale = True
+        return row
+
+    def set_base(self, iid, value):
+        row = self._rows.get(iid)
+        if row:
+            row.base_physical = value or 0
+
+    def base(self, iid):
+        row = self._rows.get(iid)
+        return row.base_physical if row else 0
+
+    def set_value(self, iid, col_key, value):
+        row = self._rows.get(iid)
+        if row:
+            row.values[COLUMN_INDEX[col_key]] = value
+
+    @staticmethod
+    def _valid(number):
+        return bool(number) and number != NO_NUMBER
+
+    # ------------------------------------------------------------------ #
+    # Quantity propagation
+    # ------------------------------------------------------------------ #
+    def _set_physical(self, row, qty, changed):
+        text = str(qty)
+        if row.values[COL_PHYSICAL_QTY] != text:
+            row.values[COL_PHYSICAL_QTY] = text
+            changed.add(row.iid)
+
+    def _kit_factor(self, kit_number, changed):
+        factor = None
+        for iid in self._kit_rows.get(kit_number, ()):
+            row = self._rows[iid]
+            factor = 1 if row.base_physical > 0 else 0
+            self._set_physical(row, factor, changed)
+        if factor is None:
+            self._kit_factors.pop(kit_number, None)
+        else:
+            self._kit_factors[kit_number] = factor
+
+    def _module_factor(self, module_number, changed, notices):
+        factor = None
+        for iid in self._module_rows.get(module_number, ()):
+            row = self._rows[iid]
+            parent_kit = self._kit_factors.get(row.kit_number, 1)
+            factor = (1 if row.base_physical > 0 else 0) * parent_kit
+            self._set_physical(row, factor, changed)
+            if row.base_physical > 0 and factor == 0 and parent_kit == 0:
+                notices.append(("kit_zero_module_zero", row, row.kit_number))
+                row.base_physical = 0
+        if factor is None:
+            self._module_factors.pop(module_number, None)
+        else:
+            self._module_factors[module_number] = factor
+
+    def _leaf(self, row, changed, notices):
+        if row.is_physical and row.row_type == "ITEM":
+            kit_factor = self._kit_factors.get(row.kit_number, 1)
+            module_factor = self._module_factors.get(row.module_number, 1)
+            final_qty = row.base_physical * kit_factor * module_factor
+            self._set_physical(row, final_qty, changed)
+            if row.base_physical > 0 and final_qty == 0:
+                if module_factor == 0:
+                    notices.append(("module", row, row.module_number))
+                elif kit_factor == 0:
+                    notices.append(("kit", row, row.kit_number))
+                row.base_physical = 0
+        elif not row.is_physical:
+            self._set_physical(row, row.base_physical, changed)
+
+    def _discrepancy(self, row, changed):
+        diff = _to_int(row.values[COL_PHYSICAL_QTY]) - row.current_stock
+        text = "" if diff == 0 else str(diff)
+        if row.values[COL_DISCREPANCY] != text:
+            row.values[COL_DISCREPANCY] = text
+            changed.add(row.iid)
+
+    def recompute(self, iid=None):
+        """
+        Propagate kit -> module -> item factors.
+
+        iid=None recomputes every row; otherwise only the subtree affected by
+        that row (the row itself, plus every row under it for a KIT/MODULE).
+        After a KIT/MODULE row was removed the pass always covers every row.
+
+        Returns (changed_iids, notices). notices is a list of
+        (reason, row, parent_number) for inputs forced to 0 by a parent
+        whose quantity is 0; reason is "kit_zero_module_zero", "kit" or "module".
+        """
+        changed = set()
+        notices = []
+
+        if iid is None or self._factors_stale:
+            self._factors_stale = False
+            self._kit_factors = {}
+            self._module_factors = {}
+            for kit_number in self._kit_rows:
+                self._kit_factor(kit_number, changed)
+            for module_number in self._module_rows:
+                self._module_factor(module_number, changed, notices)
+            scope = list(self._rows.values())
+        else:
+            root = self._rows.get(iid)
+            if root is None:
+                return changed, notices
+            scope_ids = {iid}
+            if root.is_physical and root.row_type == "KIT" and self._valid(root.kit_number):
+                self._kit_factor(root.kit_number, changed)
+                modules = {
+                    self._rows[m].module_number
+                    for m in self._kit_members.get(root.kit_number, ())
+                    if m in self._rows and self._rows[m].row_type == "MODULE"
+                }
+                for module_number in modules:
+                    self._module_factor(module_number, changed, notices)
+                    scope_ids.update(self._module_members.get(module_number, ()))
+                scope_ids.update(self._kit_members.get(root.kit_number, ()))
+            elif root.is_physical and root.row_type == "MODULE" and self._valid(root.module_number):
+                self._module_factor(root.module_number, changed, notices)
+                scope_ids.update(self._module_members.get(root.module_number, ()))
+            scope = [self._rows[s] for s in scope_ids if s in self._rows]
+
+        for row in scope:
+            if row.row_type in ("KIT", "MODULE") and row.is_physical:
+                continue
+            self._leaf(row, changed, notices)
+        for row in scope:
+            self._discrepancy(row, changed)
+
+        return changed, notices
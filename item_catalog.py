@@ -0,0 +1,126 @@
+"""
+item_catalog.py
+Cached items_list catalog (designations + commercial data).
+
+Screens that build one row per code (Order Needs, ...) used to call
+get_item_description() per code (one query each) and then query items_list
+again for pack / price / weight / volume. ItemCatalog loads items_list once
+into memory and is dropped on ITEMS_CHANGED, so lookups are plain dict reads.
+
+Usage:
+    from item_catalog import item_catalog
+    item_catalog.description("ABCD")
+    item_catalog.commercial("ABCD")   # {pack_size, price, weight, volume, account}
+"""
+
+import sqlite3
+import logging
+import threading
+
+from db import connect_db
+from event_bus import bus, ITEMS_CHANGED
+from language_manager import lang
+from schema_registry import schema
+
+logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
+
+NO_DESCRIPTION = "No Description"
+
+_DESIGNATION_COLS = ("designation", "designation_en", "designation_fr", "designation_sp")
+
+# items_list column -> (commercial key, converter)
+_COMMERCIAL_FIELDS = {
+    "pack": ("pack_size", int),
+    "price_per_pack_euros": ("price", float),
+    "weight_per_pack_kg": ("weight", float),
+    "volume_per_pack_dm3": ("volume", float),
+    "account_code": ("account", str),
+}
+
+_LANG_COLUMN = {"en": "designation_en", "fr": "designation_fr", "es": "designation_sp", "sp": "designation_sp"}
+
+
+def _convert(value, conv):
+    try:
+        if conv is str:
+            return value or ""
+        return conv(value or 0)
+    except (TypeError, ValueError):
+        return "" if conv is str else 0
+
+
+class ItemCatalog:
+    """
+    In-memory items_list keyed by code.
+      _designations : code -> {designation column: text}
+      _commercial   : code -> {pack_size, price, weight, volume, account}
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._designations = None
+        self._commercial = None
+
+    def invalidate(self, *_):
+        with self._lock:
+            self._designations = None
+            self._commercial = None
+
+    def _ensure_loaded(self):
+        with self._lock:
+            if self._designations is not None:
+                return
+            designations, commercial = {}, {}
+            cols = schema.columns("items_list")
+            if "code" in cols:
+                des_cols = [c for c in _DESIGNATION_COLS if c in cols]
+                com_cols = [c for c in _COMMERCIAL_FIELDS if c in cols]
+                conn = connect_db()
+                if conn is None:
+                    return
+                cur = conn.cursor()
+                try:
+                    cur.execute(f"SELECT {', '.join(['code'] + des_cols + com_cols)} FROM items_list")
+                    for row in cur.fetchall():
+                        code = row[0]
+                        if not code:
+                            continue
+                        designations[code] = dict(zip(des_cols, row[1:1 + len(des_cols)]))
+                        commercial[code] = {
+                            _COMMERCIAL_FIELDS[src][0]: _convert(val, _COMMERCIAL_FIELDS[src][1])
+                            for src, val in zip(com_cols, row[1 + len(des_cols):])
+                        }
+                except sqlite3.Error as e:
+                    logging.error(f"[ItemCatalog] Load failed: {e}")
+                finally:
+                    cur.close()
+                    conn.close()
+            self._designations = designations
+            self._commercial = commercial
+
+    # ---------------- Lookups ----------------
+    def __contains__(self, code):
+        self._ensure_loaded()
+        return code in self._designations
+
+    def description(self, code):
+        """Same fallback order as manage_items.get_item_description()."""
+        self._ensure_loaded()
+        row = self._designations.get(code)
+        if not row:
+            return NO_DESCRIPTION
+        active = _LANG_COLUMN.get(lang.lang_code.lower(), "designation_en")
+        for col in (active, "designation_en", "designation_fr", "designation_sp", "designation"):
+            if row.get(col):
+                return row[col]
+        return NO_DESCRIPTION
+
+    def commercial(self, code):
+        """{pack_size, price, weight, volume, account} (empty dict if unknown)."""
+        self._ensure_loaded()
+        return self._commercial.get(code, {})
+
+
+# Global singleton used across the app
+item_catalog = ItemCatalog()
+bus.subscribe(ITEMS_CHANGED, item_catalog.invalidate)
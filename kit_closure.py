@@ -0,0 +1,218 @@
+"""
+kit_closure.py
+Closure table of the kit -> module -> item hierarchy in kit_items.
+
+Receive Kit rebuilt module subtrees from kit_items with treecode LIKE
+prefixes, a module-column scan and a code-prefix scan, and kept whichever
+returned most rows. kit_items_closure stores every (ancestor, descendant)
+pair per scenario instead, with its depth (0 = the row itself), so a subtree
+or an ancestry is one indexed join.
+
+The hierarchy comes from the treecode (SS PPP MMM III): a row's parents are
+the rows of the same scenario whose treecode is its own with the trailing
+group(s) zeroed. Triggers on kit_items keep the table current for every
+insert / delete / treecode change (KitsComposition, imports, restores), in
+either insert order: a new row links to the ancestors already present and
+adopts the descendants inserted before it.
+
+The table, its index and the triggers are installed by migrations.py
+(install_kit_closure); the (scenario_id, treecode / code) kit_items indexes
+come with the hot-query index migration.
+
+Usage:
+    from kit_closure import subtree, ancestors
+    rows = subtree(scenario_id, "KMEDMCHO01-", levels=("primary", "secondary"))
+    chain = ancestors(kit_item_id)          # nearest parent last
+"""
+
+import sqlite3
+import logging
+
+from db import connect_db
+
+logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
+
+_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS kit_items_closure (
+        scenario_id   INTEGER,
+        ancestor_id   INTEGER NOT NULL,
+        descendant_id INTEGER NOT NULL,
+        depth         INTEGER NOT NULL,
+        PRIMARY KEY (ancestor_id, descendant_id)
+    ) WITHOUT ROWID
+"""
+
+_INDEX_SQL = (
+    "CREATE INDEX IF NOT EXISTS idx_kit_closure_descendant ON kit_items_closure(descendant_id, depth)",
+)
+
+
+def _level(tc):
+    """0 = top level (SS PPP 000 000), 1 = module (SS PPP MMM 000), 2 = item."""
+    return (f"(CASE WHEN substr({tc},6)='000000' THEN 0 "
+            f"WHEN substr({tc},9)='000' THEN 1 ELSE 2 END)")
+
+
+# Link one row (alias `r`, NEW inside triggers) to its ancestors and to the
+# descendants already present. Children of r sort right after it: same
+# prefix (5 digits under a top-level row, 8 under a module), larger suffix.
+_LINK_SQL = """
+    INSERT OR IGNORE INTO kit_items_closure (scenario_id, ancestor_id, descendant_id, depth)
+    VALUES ({r}.scenario_id, {r}.id, {r}.id, 0);
+
+    INSERT OR IGNORE INTO kit_items_closure (scenario_id, ancestor_id, descendant_id, depth)
+    SELECT {r}.scenario_id, p.id, {r}.id, {lvl_r} - {lvl_p}
+      FROM kit_items p
+     WHERE length({r}.treecode) = 11
+       AND p.scenario_id = {r}.scenario_id
+       AND p.treecode IN (substr({r}.treecode,1,5) || '000000', substr({r}.treecode,1,8) || '000')
+       AND {lvl_p} < {lvl_r};
+
+    INSERT OR IGNORE INTO kit_items_closure (scenario_id, ancestor_id, descendant_id, depth)
+    SELECT {r}.scenario_id, {r}.id, c.id, {lvl_c} - {lvl_r}
+      FROM kit_items c
+     WHERE length({r}.treecode) = 11
+       AND {lvl_r} < 2
+       AND c.scenario_id = {r}.scenario_id
+       AND c.treecode > {r}.treecode
+       AND c.treecode <= substr(substr({r}.treecode,1,CASE {lvl_r} WHEN 0 THEN 5 ELSE 8 END)
+                                || '999999', 1, 11);
+""".format(r="NEW", lvl_r=_level("NEW.treecode"), lvl_p=_level("p.treecode"), lvl_c=_level("c.treecode"))
+
+_UNLINK_SQL = """
+    DELETE FROM kit_items_closure WHERE ancestor_id = OLD.id;
+    DELETE FROM kit_items_closure WHERE descendant_id = OLD.id;
+"""
+
+_TRIGGER_SQL = (
+    f"""
+    CREATE TRIGGER IF NOT EXISTS kit_items_closure_ins
+    AFTER INSERT ON kit_items
+    FOR EACH ROW
+    BEGIN
+    {_LINK_SQL}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS kit_items_closure_upd
+    AFTER UPDATE OF treecode, scenario_id ON kit_items
+    FOR EACH ROW
+    BEGIN
+    {_UNLINK_SQL}
+    {_LINK_SQL}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS kit_items_closure_del
+    AFTER DELETE ON kit_items
+    FOR EACH ROW
+    BEGIN
+    {_UNLINK_SQL}
+    END
+    """,
+)
+
+# Set-based backfill: self rows, then every (ancestor, descendant) pair.
+_REBUILD_SQL = (
+    """
+    INSERT OR IGNORE INTO kit_items_closure (scenario_id, ancestor_id, descendant_id, depth)
+    SELECT scenario_id, id, id, 0 FROM kit_items {where}
+    """,
+    """
+    INSERT OR IGNORE INTO kit_items_closure (scenario_id, ancestor_id, descendant_id, depth)
+    SELECT d.scenario_id, a.id, d.id, {lvl_d} - {lvl_a}
+      FROM kit_items d
+      JOIN kit_items a
+        ON a.scenario_id = d.scenario_id
+       AND a.treecode IN (substr(d.treecode,1,5) || '000000', substr(d.treecode,1,8) || '000')
+     WHERE length(d.treecode) = 11
+       AND {lvl_a} < {lvl_d}
+       {and_where}
+    """.replace("{lvl_d}", _level("d.treecode")).replace("{lvl_a}", _level("a.treecode")),
+)
+
+_SUBTREE_SQL = """
+    SELECT d.id, d.code, d.level, d.kit, d.module, d.item,
+           COALESCE(d.std_qty, 0) AS std_qty, d.treecode, c.depth
+      FROM kit_items_closure c
+      JOIN kit_items d ON d.id = c.descendant_id
+     WHERE c.ancestor_id = (
+               SELECT id FROM kit_items
+                WHERE scenario_id = ? AND code = ? {level_filter}
+                ORDER BY id
+                LIMIT 1)
+     ORDER BY d.treecode
+"""
+
+_ANCESTORS_SQL = """
+    SELECT a.id, a.code, a.level, a.kit, a.module, a.item,
+           COALESCE(a.std_qty, 0) AS std_qty, a.treecode, c.depth
+      FROM kit_items_closure c
+      JOIN kit_items a ON a.id = c.ancestor_id
+     WHERE c.descendant_id = ? AND c.depth > 0
+     ORDER BY c.depth DESC
+"""
+
+
+def rebuild_kit_closure(cur, scenario_id=None):
+    """Recompute the closure for one scenario (all when None) from kit_items."""
+    if scenario_id is None:
+        cur.execute("DELETE FROM kit_items_closure")
+        where, and_where, params = "", "", ()
+    else:
+        cur.execute("DELETE FROM kit_items_closure WHERE scenario_id = ?", (scenario_id,))
+        where, and_where, params = "WHERE scenario_id = ?", "AND d.scenario_id = ?", (scenario_id,)
+    cur.execute(_REBUILD_SQL[0].format(where=where), params)
+    cur.execute(_REBUILD_SQL[1].replace("{and_where}", and_where), params)
+
+
+def install_kit_closure(cur):
+    """
+    Create the closure table, its index and the kit_items triggers (migration
+    step, caller commits); a freshly created table is backfilled from kit_items.
+    """
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='kit_items_closure'")
+    existed = cur.fetchone() is not None
+    cur.execute(_TABLE_SQL)
+    for sql in _INDEX_SQL + _TRIGGER_SQL:
+        cur.execute(sql)
+    if not existed:
+        rebuild_kit_closure(cur)
+
+
+def _query(sql, params):
+    conn = connect_db()
+    if conn is None:
+        return []
+    conn.row_factory = sqlite3.Row
+    cur = conn.cursor()
+    try:
+        cur.execute(sql, params)
+        return cur.fetchall()
+    except sqlite3.Error as e:
+        logging.error(f"[kit_closure] Query failed: {e}")
+        return []
+    finally:
+        cur.close()
+        conn.close()
+
+
+def subtree(scenario_id, code, levels=None):
+    """
+    The first kit_items row of `code` in the scenario (restricted to `levels`
+    when given) and all its descendants, ordered by treecode. Rows carry
+    id, code, level, kit, module, item, std_qty, treecode and depth.
+    """
+    if not scenario_id or not code:
+        return []
+    params = [scenario_id, code]
+    level_filter = ""
+    if levels:
+        level_filter = f"AND LOWER(level) IN ({','.join('?' * len(levels))})"
+        params.extend(lv.lower() for lv in levels)
+    return _query(_SUBTREE_SQL.format(level_filter=level_filter), params)
+
+
+def ancestors(kit_item_id):
+    """Ancestor rows of one kit_items row, top level first."""
+    return _query(_ANCESTORS_SQL, (kit_item_id,))
@@ -0,0 +1,228 @@
+"""
+kit_structure_index.py
+Shared, in-memory kit structure (kit_items) per scenario.
+
+Receive Kit, Out Kit, Dispatch Kit and In Kit resolved std_qty / treecode
+with one kit_items query per row (receive_kit's lookups ran two per tree row)
+and each window rebuilt its own item index, which never noticed edits made in
+KitsComposition. KitStructureIndex instead:
+
+  * loads a scenario's kit_items with ONE query and keeps it as a
+    KitStructure: (kit, module, item) -> KitItemEntry in a dict, the rows
+    filed by code and by every code they carry, and parent -> children
+    adjacency (kit -> modules / items, module -> items)
+  * is shared by every window and reloaded lazily per scenario
+  * drops a scenario on COMPOSITION_CHANGED (all scenarios when the event
+    has no scenario_id, and on SCENARIOS_CHANGED); commits from other
+    connections are caught by a db.TableWatch on kit_items, so stock writes
+    do not throw the structure away
+
+Usage:
+    from kit_structure_index import kit_structure
+    s = kit_structure.structure(scenario_id)
+    s.get(kit, module, item)            # exact triple -> KitItemEntry / None
+    s.find(kit, module, item)           # receive-style context match
+    s.children(kit, module)             # direct children, ordered by treecode
+    kit_structure.std_qty(scenario_id, kit, module, item)
+    kit_structure.treecode(scenario_id, kit, module, item)
+"""
+
+import sqlite3
+import logging
+import threading
+from collections import namedtuple
+
+from db import connect_db, TableWatch
+from event_bus import bus, COMPOSITION_CHANGED, SCENARIOS_CHANGED
+
+logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
+
+KitItemEntry = namedtuple("KitItemEntry", "id code kit module item treecode level std_qty")
+
+_STRUCTURE_SQL = """
+    SELECT id, code, kit, module, item, treecode, level, std_qty
+      FROM kit_items
+     WHERE scenario_id = ?
+     ORDER BY id
+"""
+
+ROOT = (None, None, None)
+
+
+def _norm(value):
+    """Strip a code; '', 'None' and NULL all become None."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    if not value or value.upper() == "NONE":
+        return None
+    return value
+
+
+def _parent_key(kit, module, item):
+    """Triple of the parent node: drop the last filled level (kits -> ROOT)."""
+    if item:
+        return (kit, module, None) if (kit or module) else ROOT
+    if module:
+        return (kit, None, None) if kit else ROOT
+    return ROOT
+
+
+class KitStructure:
+    """Immutable kit_items snapshot of one scenario."""
+
+    def __init__(self, scenario_id, rows=()):
+        self.scenario_id = scenario_id
+        self.entries = []
+        self._triples = {}      # (kit, module, item) -> entry (last row wins)
+        self._by_code = {}      # code column -> [entry, ...] in id order
+        self._by_token = {}     # code / kit / module / item -> [entry, ...]
+        self._children = {}     # parent triple -> [entry, ...] by treecode
+        for row in rows:
+            entry = KitItemEntry(
+                row[0],
+                (row[1] or "").strip(),
+                _norm(row[2]),
+                _norm(row[3]),
+                _norm(row[4]),
+                row[5],
+                (row[6] or "").strip().lower(),
+                row[7] or 0,
+            )
+            self.entries.append(entry)
+            self._triples[(entry.kit, entry.module, entry.item)] = entry
+            self._by_code.setdefault(entry.code, []).append(entry)
+            for token in {entry.code, entry.kit, entry.module, entry.item}:
+                if token:
+                    self._by_token.setdefault(token, []).append(entry)
+            self._children.setdefault(
+                _parent_key(entry.kit, entry.module, entry.item), []
+            ).append(entry)
+        for siblings in self._children.values():
+            siblings.sort(key=lambda e: (e.treecode or "", e.id))
+
+    def __len__(self):
+        return len(self.entries)
+
+    # ---------------- Point lookups ----------------
+    def get(self, kit=None, module=None, item=None):
+        """Exact (kit, module, item) match or None."""
+        return self._triples.get((_norm(kit), _norm(module), _norm(item)))
+
+    def first_with(self, code):
+        """First row (by id) carrying `code` in code, kit, module or item."""
+        rows = self._by_token.get(_norm(code) or "")
+        return rows[0] if rows else None
+
+    def resolve(self, kit=None, module=None, item=None, display_code=None):
+        """Exact triple, else the first row carrying display_code (item index semantics)."""
+        return self.get(kit, module, item) or self.first_with(display_code)
+
+    def find(self, kit=None, module=None, item=None):
+        """
+        Row for the most specific code given, in context: an item matches rows
+        whose kit / module equal the ones given or are empty, a module rows
+        whose kit matches or is empty, a kit any row with that code. Rows with
+        a filled kit, then a filled module, are preferred.
+        """
+        kit, module, item = _norm(kit), _norm(module), _norm(item)
+        code = item or module or kit
+        if not code:
+            return None
+        candidates = self._by_code.get(code, ())
+        if item:
+            matches = [e for e in candidates
+                       if (e.kit is None or e.kit == kit) and (e.module is None or e.module == module)]
+            return min(matches, key=lambda e: (e.kit is None, e.module is None), default=None)
+        if module:
+            matches = [e for e in candidates if e.kit is None or e.kit == kit]
+            return min(matches, key=lambda e: e.kit is None, default=None)
+        return candidates[0] if candidates else None
+
+    def related(self, code):
+        """Every row carrying `code` in any column, ordered by treecode."""
+        rows = self._by_token.get(_norm(code) or "", [])
+        return sorted(rows, key=lambda e: (e.treecode or "", e.id))
+
+    # ---------------- Adjacency ----------------
+    def children(self, kit=None, module=None):
+        """Direct children of a kit / module (no arguments: top-level rows)."""
+        return list(self._children.get((_norm(kit), _norm(module), None), ()))
+
+    def parent(self, entry):
+        """Row of the node directly above `entry` (None for top-level rows)."""
+        key = _parent_key(entry.kit, entry.module, entry.item)
+        return None if key == ROOT else self._triples.get(key)
+
+
+class KitStructureIndex:
+    """Per-scenario KitStructure cache shared by every window."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._structures = {}
+        self._watch = TableWatch(("kit_items",))
+
+    # ---------------- Staleness ----------------
+    def invalidate(self, *_):
+        with self._lock:
+            self._structures = {}
+
+    def _on_composition_changed(self, event=None):
+        scenario_id = event.get("scenario_id") if event is not None else None
+        if scenario_id in (None, ""):
+            self.invalidate()
+            return
+        with self._lock:
+            self._structures.pop(str(scenario_id), None)
+
+    def _check_external_writes(self):
+        """Rebuild only when a foreign commit actually touched kit_items."""
+        if self._watch.changed():
+            self.invalidate()
+
+    # ---------------- Build ----------------
+    @staticmethod
+    def _load(scenario_id):
+        conn = connect_db()
+        if conn is None:
+            return KitStructure(scenario_id)
+        cur = conn.cursor()
+        try:
+            cur.execute(_STRUCTURE_SQL, (scenario_id,))
+            return KitStructure(scenario_id, cur.fetchall())
+        except sqlite3.Error as e:
+            logging.error(f"[KitStructureIndex] Load failed for scenario {scenario_id}: {e}")
+            return KitStructure(scenario_id)
+        finally:
+            cur.close()
+            conn.close()
+
+    def structure(self, scenario_id):
+        """KitStructure of one scenario (empty when unknown)."""
+        if scenario_id in (None, ""):
+            return KitStructure(scenario_id)
+        self._check_external_writes()
+        key = str(scenario_id)
+        with self._lock:
+            structure = self._structures.get(key)
+            if structure is None:
+                structure = self._structures[key] = self._load(scenario_id)
+            return structure
+
+    # ---------------- Convenience ----------------
+    def std_qty(self, scenario_id, kit=None, module=None, item=None):
+        """std_qty of the context match, 0 when there is none."""
+        entry = self.structure(scenario_id).find(kit, module, item)
+        return entry.std_qty if entry else 0
+
+    def treecode(self, scenario_id, kit=None, module=None, item=None):
+        """treecode of the context match, None when there is none."""
+        entry = self.structure(scenario_id).find(kit, module, item)
+        return entry.treecode if entry else None
+
+
+# Global singleton used across the app
+kit_structure = KitStructureIndex()
+bus.subscribe(COMPOSITION_CHANGED, kit_structure._on_composition_changed)
+bus.subscribe(SCENARIOS_CHANGED, kit_structure.invalidate)
@@ -2,6 +2,7 @@ import tkinter as tk
 from tkinter import ttk, Toplevel, StringVar, Listbox, Scrollbar, filedialog
 import sqlite3
 from db import connect_db
+from event_bus import bus, COMPOSITION_CHANGED, SCENARIOS_CHANGED
 from language_manager import lang
 import pandas as pd
 from popup_utils import custom_popup, custom_askyesno, custom_dialog, show_toast
@@ -46,9 +47,9 @@ class KitsComposition(tk.Frame):
 
         self.menu = None  # context menu reference
 
-        self.ensure_db_structure()
+        self.ensure_default_scenario()
         self._build_ui()
-        self.after(3000, self.auto_refresh_scenarios)
+        bus.subscribe(SCENARIOS_CHANGED, self.auto_refresh_scenarios, widget=self)
         self.load_scenarios()
 
     # ---------------- Permission helpers ----------------
@@ -217,45 +218,8 @@ class KitsComposition(tk.Frame):
             self.toggle_node(event)
 
     # ---------------- DB Structure ----------------
-    def ensure_db_structure(self):
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS scenarios (
-                scenario_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                activity_type TEXT,
-                target_population INTEGER,
-                responsible_person TEXT,
-                stock_location TEXT
-            )
-        """)
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS items_list (
-                code TEXT PRIMARY KEY,
-                type TEXT,
-                designation TEXT,
-                designation_en TEXT,
-                designation_fr TEXT,
-                designation_sp TEXT
-            )
-        """)
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS kit_items (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                scenario_id INTEGER,
-                scenario TEXT NOT NULL,
-                kit TEXT,
-                module TEXT,
-                item TEXT,
-                code TEXT NOT NULL,
-                std_qty INTEGER NOT NULL,
-                level TEXT,
-                treecode TEXT,
-                FOREIGN KEY (scenario_id) REFERENCES scenarios(scenario_id),
-                FOREIGN KEY (code) REFERENCES items_list(code),
-                CHECK (std_qty > 0)
-            )
-        """)
-        self.conn.commit()
+    def ensure_default_scenario(self):
+        """Seed one scenario so a fresh database has something to compose."""
         self.cursor.execute("SELECT COUNT(*) AS cnt FROM scenarios")
         if self.cursor.fetchone()["cnt"] == 0:
             self.cursor.execute("""
@@ -277,13 +241,9 @@ class KitsComposition(tk.Frame):
         for row in self.cursor.fetchall():
             self.scenario_listbox.insert(tk.END, f"{row['scenario_id']} - {row['name']}")
 
-    def auto_refresh_scenarios(self):
-        current_count = self.scenario_listbox.size()
-        self.cursor.execute("SELECT COUNT(*) AS cnt FROM scenarios")
-        new_count = self.cursor.fetchone()["cnt"]
-        if new_count != current_count:
-            self.load_scenarios()
-        self.after(3000, self.auto_refresh_scenarios)
+    def auto_refresh_scenarios(self, events=None):
+        """Reload the scenario list when the Scenarios screen publishes a change."""
+        self.load_scenarios()
 
     def load_selected_scenario(self, event):
         selection = self.scenario_listbox.curselection()
@@ -709,6 +669,7 @@ class KitsComposition(tk.Frame):
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
             """, (self.selected_scenario_id, self.selected_scenario, kit, module, item, code_norm, qty, db_level, treecode))
             self.conn.commit()
+            bus.publish(COMPOSITION_CHANGED, scenario_id=self.selected_scenario_id)
             self.status_var.set(f"{lang.t('kits.node_added','Node added')}: {code_norm}")
         except Exception as e:
             custom_popup(self, lang.t("kits.error","Error"), f"{lang.t('kits.db_error','Database error')}: {e}", "error")
@@ -872,6 +833,7 @@ class KitsComposition(tk.Frame):
                      WHERE scenario_id=? AND treecode=?
                 """, (new_qty, self.selected_scenario_id, tc))
                 self.conn.commit()
+                bus.publish(COMPOSITION_CHANGED, scenario_id=self.selected_scenario_id)
                 dlg.destroy()
                 self.refresh_current_tree(preserve_view=True)
             except ValueError:
@@ -955,6 +917,7 @@ class KitsComposition(tk.Frame):
                 """, (self.selected_scenario_id, tc))
 
             self.conn.commit()
+            bus.publish(COMPOSITION_CHANGED, scenario_id=self.selected_scenario_id)
             new_focus = None
             if parent and self.tree.exists(parent):
                 if node in siblings:
@@ -1215,6 +1178,7 @@ class KitsComposition(tk.Frame):
                 imported += 1
 
             self.conn.commit()
+            bus.publish(COMPOSITION_CHANGED, scenario_id=self.selected_scenario_id)
             self.refresh_current_tree(preserve_view=True)
             msg = f"{lang.t('kits.import_success','Import successful')}: {imported}"
             if skipped:
@@ -1430,6 +1394,7 @@ class KitsComposition(tk.Frame):
                 """, (self.selected_scenario_id, self.selected_scenario,
                       kit_code, None, di['item'], di['code'], di['std_qty'], sec_tc))
             self.conn.commit()
+            bus.publish(COMPOSITION_CHANGED, scenario_id=self.selected_scenario_id)
             custom_popup(self, "Success", f"Kit '{kit_code}' duplicated (PPP={new_ppp}).", "success")
             self.refresh_current_tree(preserve_view=True)
         except Exception as e:
@@ -1528,6 +1493,7 @@ class KitsComposition(tk.Frame):
                           kit_code, module_code, it['item'], it['code'], it['std_qty'], item_tc))
                 custom_popup(self, "Success", f"Module '{module_code}' duplicated (PPP={ppp}, MMM={new_mmm}).", "success")
             self.conn.commit()
+            bus.publish(COMPOSITION_CHANGED, scenario_id=self.selected_scenario_id)
             self.refresh_current_tree(preserve_view=True)
         except Exception as e:
             self.conn.rollback()
@@ -1,11 +1,61 @@
 import json
 import os
-from typing import Any, Dict, List, Optional
+import pickle
+from typing import Any, Dict, List, Optional, Sequence
+
+# Compiled catalogs are cached next to the JSON files, in __pycache__ so that
+# backups skip them like any other bytecode cache.
+CATALOG_CACHE_DIR = os.path.join("data", "translations", "__pycache__")
+CATALOG_CACHE_VERSION = 1
+
+
+class CompiledCatalog:
+    """
+    One language, compiled once:
+      translations : the nested JSON as loaded
+      flat         : every dotted path -> value (strings AND sub-sections),
+                     so t() / get_section() are a single dict lookup
+      enums        : section_key -> (canonical->display, normalized display->canonical)
+                     prebuilt for every section whose key ends with "_map"
+    """
+
+    __slots__ = ("translations", "flat", "enums", "source_mtime_ns")
+
+    def __init__(self, translations: Dict[str, Any], source_mtime_ns: Optional[int] = None):
+        self.translations = translations
+        self.source_mtime_ns = source_mtime_ns
+        self.flat: Dict[str, Any] = {}
+        self.enums: Dict[str, Any] = {}
+        self._flatten("", translations)
+
+    def _flatten(self, prefix: str, node: Dict[str, Any]) -> None:
+        for k, v in node.items():
+            path = f"{prefix}{k}"
+            # Nested path wins over a literal dotted key (same as walking the dicts)
+            self.flat.setdefault(path, v)
+            if isinstance(v, dict):
+                if k.endswith("_map"):
+                    self.enums[path] = build_enum_maps(v)
+                self._flatten(path + ".", v)
+
+
+def build_enum_maps(section: Dict[str, Any]):
+    """(canonical->display, normalized display->canonical) for str->str entries."""
+    enum_map: Dict[str, str] = {}
+    enum_rev: Dict[str, str] = {}
+    for k, v in section.items():
+        if isinstance(k, str) and isinstance(v, str):
+            enum_map[k] = v
+            # Normalize display for reverse lookup (trim + casefold for robustness)
+            enum_rev[v.strip().casefold()] = k
+    return enum_map, enum_rev
+
 
 class LanguageManager:
     """
     Centralized language manager with support for:
-      - Nested translation keys (dot notation)
+      - Nested translation keys (dot notation), served from a compiled flat catalog
+      - Bulk lookup t_many() for column headers
       - Enum mapping helpers:
           * enum_map(section_key): canonical -> display mapping
           * enum_reverse_map(section_key): display -> canonical mapping
@@ -13,44 +63,94 @@ class LanguageManager:
           * enum_to_display_list(section_key, canonical_list)
           * enum_to_canonical(section_key, display_value)
       - Graceful fallbacks if keys are missing or files invalid
+
+    Each language is compiled once per process (and cached on disk keyed by
+    the JSON mtime); switching language only rebinds the active catalog.
     """
 
     def __init__(self, default_lang: str = "en"):
         self.lang_code: str = default_lang
         self.lang_lang: str = default_lang  # compatibility alias
         self.translations: Dict[str, Any] = {}
+        self._flat: Dict[str, Any] = {}
+        self._catalogs: Dict[str, CompiledCatalog] = {}             # lang_code -> compiled catalog
         self._enum_cache: Dict[str, Dict[str, str]] = {}           # section_key -> canonical->display
         self._enum_rev_cache: Dict[str, Dict[str, str]] = {}        # section_key -> normalized display->canonical
         self.load_language(default_lang)
 
     # ---------------- Core loading ----------------
-    def load_language(self, lang_code: str) -> None:
+    @staticmethod
+    def _cache_path(lang_code: str) -> str:
+        return os.path.join(CATALOG_CACHE_DIR, f"{lang_code}.catalog.pickle")
+
+    def _read_cached_catalog(self, lang_code: str, mtime_ns: int) -> Optional[CompiledCatalog]:
+        try:
+            with open(self._cache_path(lang_code), "rb") as f:
+                version, cached_mtime, catalog = pickle.load(f)
+        except Exception:
+            return None
+        if version != CATALOG_CACHE_VERSION or cached_mtime != mtime_ns:
+            return None
+        return catalog
+
+    def _write_cached_catalog(self, lang_code: str, catalog: CompiledCatalog) -> None:
+        try:
+            os.makedirs(CATALOG_CACHE_DIR, exist_ok=True)
+            path = self._cache_path(lang_code)
+            with open(path + ".tmp", "wb") as f:
+                pickle.dump((CATALOG_CACHE_VERSION, catalog.source_mtime_ns, catalog), f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(path + ".tmp", path)
+        except Exception as e:
+            print(f"[Warning] Could not cache compiled translations: {e}")
+
+    def _compile(self, lang_code: str) -> CompiledCatalog:
         """
-        Load translation JSON for given language code from data/translations/{lang_code}.json.
-        Falls back to empty dict on error or missing file.
+        Compiled catalog for data/translations/{lang_code}.json: in-memory copy,
+        else the on-disk cache if the JSON mtime matches, else parse + compile.
+        Falls back to an empty catalog on error or missing file.
         """
         file_path = os.path.join("data", "translations", f"{lang_code}.json")
         try:
-            if os.path.exists(file_path):
+            mtime_ns = os.stat(file_path).st_mtime_ns
+        except OSError:
+            print(f"[Warning] Translation file not found: {file_path}")
+            return CompiledCatalog({})
+
+        catalog = self._catalogs.get(lang_code)
+        if catalog is not None and catalog.source_mtime_ns == mtime_ns:
+            return catalog
+        catalog = self._read_cached_catalog(lang_code, mtime_ns)
+        if catalog is None:
+            try:
                 with open(file_path, "r", encoding="utf-8") as f:
-                    self.translations = json.load(f)
-            else:
-                print(f"[Warning] Translation file not found: {file_path}")
-                self.translations = {}
-        except json.JSONDecodeError:
-            print(f"[Error] Failed to parse JSON: {file_path}")
-            self.translations = {}
-        except Exception as e:
-            print(f"[Error] Unexpected when loading translations: {e}")
-            self.translations = {}
+                    catalog = CompiledCatalog(json.load(f), mtime_ns)
+            except json.JSONDecodeError:
+                print(f"[Error] Failed to parse JSON: {file_path}")
+                return CompiledCatalog({})
+            except Exception as e:
+                print(f"[Error] Unexpected when loading translations: {e}")
+                return CompiledCatalog({})
+            self._write_cached_catalog(lang_code, catalog)
+        self._catalogs[lang_code] = catalog
+        return catalog
+
+    def load_language(self, lang_code: str) -> None:
+        """
+        Activate the compiled catalog for data/translations/{lang_code}.json.
+        Falls back to empty translations on error or missing file.
+        """
+        catalog = self._compile(lang_code)
+        self.translations = catalog.translations
+        self._flat = catalog.flat
 
         # Update language code + compatibility alias
         self.lang_code = lang_code
         self.lang_lang = lang_code
 
-        # Clear enum caches when language changes
-        self._enum_cache.clear()
-        self._enum_rev_cache.clear()
+        # Rebind the prebuilt enum maps of the new language
+        self._enum_cache = {k: maps[0] for k, maps in catalog.enums.items()}
+        self._enum_rev_cache = {k: maps[1] for k, maps in catalog.enums.items()}
 
     def set_language(self, lang_code: str) -> None:
         """
@@ -78,8 +178,7 @@ class LanguageManager:
         Fallbacks gracefully to provided fallback or the key itself.
         Supports basic str.format(**kwargs) for placeholders.
         """
-        parts = key.split(".")
-        text = self._get_nested(parts, self.translations)
+        text = self._flat.get(key)
 
         if text is None:
             text = fallback if fallback is not None else key
@@ -92,14 +191,29 @@ class LanguageManager:
                 pass
         return text
 
+    def t_many(self, keys: Sequence[str], prefix: str = "",
+               fallbacks: Optional[Sequence[str]] = None) -> List[str]:
+        """
+        Translate many keys at once (e.g. column headers), same order as keys.
+        Each key is looked up as prefix + key; a missing one falls back to the
+        matching entry of fallbacks, else to the key itself.
+        """
+        flat = self._flat
+        if fallbacks is None:
+            fallbacks = keys
+        out: List[str] = []
+        for key, fb in zip(keys, fallbacks):
+            text = flat.get(prefix + key)
+            out.append(fb if text is None else text)
+        return out
+
     # ---------------- Section helpers ----------------
     def get_section(self, section_key: str) -> Dict[str, Any]:
         """
         Return a nested section dict for a key like 'stock_in.in_types_map'.
         If not found or not a dict, returns {}.
         """
-        parts = section_key.split(".")
-        sect = self._get_nested(parts, self.translations)
+        sect = self._flat.get(section_key)
         return sect if isinstance(sect, dict) else {}
 
     # ---------------- Enum mapping (canonical EN <-> display) ----------------
@@ -121,18 +235,7 @@ class LanguageManager:
         if section_key in self._enum_cache:
             return
 
-        section = self.get_section(section_key)
-        enum_map: Dict[str, str] = {}
-        enum_rev: Dict[str, str] = {}
-
-        # Only include str->str entries
-        for k, v in section.items():
-            if isinstance(k, str) and isinstance(v, str):
-                enum_map[k] = v
-                # Normalize display for reverse lookup (trim + casefold for robustness)
-                norm_display = v.strip().casefold()
-                enum_rev[norm_display] = k
-
+        enum_map, enum_rev = build_enum_maps(self.get_section(section_key))
         self._enum_cache[section_key] = enum_map
         self._enum_rev_cache[section_key] = enum_rev
 
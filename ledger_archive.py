@@ -0,0 +1,325 @@
+"""
+ledger_archive.py
+Per-year archive files for the stock_transactions ledger.
+
+stock_transactions only ever grows, and every search, report and backup
+reads the whole of it. Closed years (before the current one) can be moved
+to data/archive/ledger_<year>.db instead:
+
+  * archive_year() copies the year's rows into its archive file, then
+    deletes them from iseprep.db and records the move in ledger_archives,
+    in one main-database transaction. Re-running after a crash first drops
+    the rows the archive received beyond the recorded max_rowid, so a year
+    is never duplicated.
+  * ledger_checkpoints keeps the archived months: they are rebuilt from the
+    archive file in the same transaction, so opening balances and
+    stock_as_of() stay exact without touching the archives
+  * attach_ledger(conn, from_date, to_date) ATTACHes the archives that
+    overlap a date range and creates the TEMP VIEW `ledger` (hot ledger
+    UNION ALL archives, plus a ledger_seq tie-breaker) for queries that
+    need history
+  * archive files live under data/, so backups carry them; once written they
+    never change, so incremental snapshots only re-copy the active database
+  * years holding loan / borrowing rows of a code with an open balance are
+    kept in iseprep.db (loan_held_years): the loans screen still converts
+    those rows to donations in place
+
+The ledger_archives registry is created by migrations.py
+(install_archive_registry).
+
+Usage:
+    from ledger_archive import archive_closed_years, attach_ledger
+    moved, held = archive_closed_years()                 # all years < this year
+    years = attach_ledger(conn, "2022-01-01", "2024-06-30")
+    conn.execute("SELECT ... FROM ledger WHERE code = ?", ...)
+"""
+
+import os
+import sqlite3
+import logging
+from datetime import date, datetime
+from tkinter import messagebox
+
+from db import connect_db
+from language_manager import lang
+from ledger_checkpoints import rebuild_ledger_checkpoints
+
+logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
+
+ARCHIVE_DIR = os.path.join("data", "archive")
+LEDGER_VIEW = "ledger"
+
+_REGISTRY_SQL = """
+    CREATE TABLE IF NOT EXISTS ledger_archives (
+        year        INTEGER PRIMARY KEY,
+        file_name   TEXT NOT NULL,
+        rows        INTEGER NOT NULL,
+        max_rowid   INTEGER NOT NULL,
+        first_date  TEXT,
+        last_date   TEXT,
+        archived_at TEXT
+    )
+"""
+
+
+def archive_path(year):
+    return os.path.join(ARCHIVE_DIR, f"ledger_{int(year)}.db")
+
+
+def _alias(year):
+    return f"ledger_{int(year)}"
+
+
+# Loan / borrowing movement types, as in loans.py
+_LOAN_OUT_TYPES = ("Loan", "Return of Borrowing")
+_LOAN_IN_TYPES = ("In Borrowing", "In Return of Loan")
+
+
+def _year_range(year):
+    return f"{int(year):04d}-01-01", f"{int(year) + 1:04d}-01-01"
+
+
+def _columns(cur, schema_name):
+    cur.execute(f"PRAGMA {schema_name}.table_info(stock_transactions)")
+    return [r[1] for r in cur.fetchall()]
+
+
+def _attached(cur):
+    cur.execute("PRAGMA database_list")
+    return {r[1] for r in cur.fetchall()}
+
+
+def install_archive_registry(cur):
+    """Create the ledger_archives registry (migration step)."""
+    cur.execute(_REGISTRY_SQL)
+
+
+def archived_years(conn=None):
+    """{year: registry row} of the archived years."""
+    own = conn is None
+    conn = conn or connect_db()
+    try:
+        cur = conn.execute("SELECT year, file_name, rows, max_rowid, first_date, last_date, archived_at "
+                           "FROM ledger_archives ORDER BY year")
+        cols = [d[0] for d in cur.description]
+        return {r[0]: dict(zip(cols, r)) for r in cur.fetchall()}
+    finally:
+        if own:
+            conn.close()
+
+
+def closed_years(conn, before_year=None):
+    """Years with ledger rows in iseprep.db that are older than before_year (default: this year)."""
+    before_year = before_year or date.today().year
+    cur = conn.execute(
+        "SELECT DISTINCT CAST(substr(Date,1,4) AS INTEGER) FROM stock_transactions "
+        "WHERE Date < ? ORDER BY 1",
+        (f"{int(before_year):04d}-01-01",),
+    )
+    return [r[0] for r in cur.fetchall() if r[0]]
+
+
+def loan_held_years(conn=None):
+    """
+    Years of the hot ledger holding loan / borrowing rows of a code whose
+    balance with some third party is still open (over the archives too).
+    """
+    own = conn is None
+    conn = conn or connect_db()
+    out_in = ",".join("?" for _ in _LOAN_OUT_TYPES)
+    in_in = ",".join("?" for _ in _LOAN_IN_TYPES)
+    loan_clause = f"(Out_Type IN ({out_in}) OR IN_Type IN ({in_in}))"
+    types = list(_LOAN_OUT_TYPES) + list(_LOAN_IN_TYPES)
+    try:
+        attach_ledger(conn)
+        cur = conn.execute(
+            f"""
+            WITH open_codes AS (
+                SELECT code
+                  FROM {LEDGER_VIEW}
+                 WHERE {loan_clause}
+                 GROUP BY code, IFNULL(Third_Party, '')
+                HAVING TOTAL(CASE WHEN Out_Type IN ({out_in}) THEN Qty_Out END)
+                     <> TOTAL(CASE WHEN IN_Type IN ({in_in}) THEN Qty_IN END)
+            )
+            SELECT DISTINCT CAST(substr(Date,1,4) AS INTEGER)
+              FROM main.stock_transactions
+             WHERE {loan_clause} AND code IN (SELECT code FROM open_codes)
+             ORDER BY 1
+            """,
+            types * 3,
+        )
+        return [r[0] for r in cur.fetchall() if r[0]]
+    finally:
+        if own:
+            conn.close()
+
+
+def archive_year(year, conn=None):
+    """
+    Move the year's ledger rows to its archive file. Returns the number of
+    rows moved (0 when the year has none left in iseprep.db).
+    """
+    own = conn is None
+    conn = conn or connect_db()
+    start, end = _year_range(year)
+    alias = _alias(year)
+    cur = conn.cursor()
+    attached = False
+    try:
+        cur.execute("SELECT COUNT(*) FROM stock_transactions WHERE Date >= ? AND Date < ?", (start, end))
+        if not cur.fetchone()[0]:
+            return 0
+
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        if alias not in _attached(cur):
+            cur.execute(f"ATTACH DATABASE ? AS {alias}", (archive_path(year),))
+            attached = True
+        cur.execute("SELECT max_rowid FROM ledger_archives WHERE year = ?", (int(year),))
+        row = cur.fetchone()
+        recorded_max = row[0] if row else 0
+
+        # 1. Copy into the archive (its own commit); rows past the recorded
+        #    max_rowid are leftovers of an interrupted run
+        cur.execute(f"CREATE TABLE IF NOT EXISTS {alias}.stock_transactions AS "
+                    f"SELECT * FROM main.stock_transactions WHERE 0")
+        cur.execute(f"DELETE FROM {alias}.stock_transactions WHERE rowid > ?", (recorded_max,))
+        main_cols = _columns(cur, "main")
+        arc_cols = set(_columns(cur, alias))
+        for col in main_cols:
+            if col not in arc_cols:
+                cur.execute(f'ALTER TABLE {alias}.stock_transactions ADD COLUMN "{col}"')
+        col_sql = ", ".join(f'"{c}"' for c in main_cols)
+        cur.execute(
+            f"INSERT INTO {alias}.stock_transactions ({col_sql}) "
+            f"SELECT {col_sql} FROM main.stock_transactions WHERE Date >= ? AND Date < ? "
+            f"ORDER BY Date, Time, rowid",
+            (start, end),
+        )
+        moved = cur.rowcount
+        conn.commit()
+
+        # 2. Drop from the hot ledger, keep the checkpoints, record the move
+        cur.execute(f"SELECT COUNT(*), IFNULL(MAX(rowid),0), MIN(Date), MAX(Date) "
+                    f"FROM {alias}.stock_transactions")
+        rows, max_rowid, first_date, last_date = cur.fetchone()
+        cur.execute("DELETE FROM main.stock_transactions WHERE Date >= ? AND Date < ?", (start, end))
+        rebuild_ledger_checkpoints(cur, f"{alias}.stock_transactions", start, end)
+        cur.execute(
+            """
+            INSERT INTO ledger_archives (year, file_name, rows, max_rowid, first_date, last_date, archived_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (year) DO UPDATE SET
+                file_name = excluded.file_name, rows = excluded.rows,
+                max_rowid = excluded.max_rowid, first_date = excluded.first_date,
+                last_date = excluded.last_date, archived_at = excluded.archived_at
+            """,
+            (int(year), os.path.basename(archive_path(year)), rows, max_rowid,
+             first_date, last_date, datetime.now().isoformat(timespec="seconds")),
+        )
+        conn.commit()
+        logging.info(f"[ledger_archive] Archived {moved} rows of {year} to {archive_path(year)}")
+        return moved
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    finally:
+        if attached:
+            try:
+                cur.execute(f"DETACH DATABASE {alias}")
+            except sqlite3.Error as e:
+                logging.error(f"[ledger_archive] Detach of {alias} failed: {e}")
+        cur.close()
+        if own:
+            conn.close()
+
+
+def archive_closed_years(before_year=None):
+    """
+    Archive every year older than before_year, except the loan-held ones.
+    Returns ({year: rows moved}, [held years]).
+    """
+    held = loan_held_years()
+    conn = connect_db()
+    try:
+        years = [y for y in closed_years(conn, before_year) if y not in held]
+        held = [y for y in held if y < (before_year or date.today().year)]
+        return {year: archive_year(year, conn) for year in years}, held
+    finally:
+        conn.close()
+
+
+def attach_ledger(conn, from_date=None, to_date=None):
+    """
+    ATTACH the archives overlapping [from_date, to_date] (None = open ended)
+    and (re)create TEMP VIEW ledger over them and the hot ledger. Returns the
+    attached years; with none, `ledger` is the hot ledger alone.
+    """
+    lo = str(from_date)[:10] if from_date else "0000-01-01"
+    hi = str(to_date)[:10] if to_date else "9999-12-31"
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            "SELECT year, file_name FROM ledger_archives "
+            "WHERE IFNULL(last_date,'') >= ? AND IFNULL(first_date,'') <= ? ORDER BY year",
+            (lo, hi),
+        )
+        wanted = cur.fetchall()
+        attached = _attached(cur)
+        main_cols = _columns(cur, "main")
+        col_sql = ", ".join(f'"{c}"' for c in main_cols)
+        selects = [f"SELECT {col_sql}, rowid AS ledger_seq FROM main.stock_transactions"]
+        years = []
+        for year, file_name in wanted:
+            path = os.path.join(ARCHIVE_DIR, file_name)
+            if not os.path.exists(path):
+                logging.error(f"[ledger_archive] Archive {path} of {year} is missing")
+                continue
+            alias = _alias(year)
+            if alias not in attached:
+                cur.execute(f"ATTACH DATABASE ? AS {alias}", (path,))
+            arc_cols = set(_columns(cur, alias))
+            cols = ", ".join(f'"{c}"' if c in arc_cols else f'NULL AS "{c}"' for c in main_cols)
+            selects.append(f"SELECT {cols}, rowid FROM {alias}.stock_transactions")
+            years.append(year)
+        cur.execute(f"DROP VIEW IF EXISTS temp.{LEDGER_VIEW}")
+        cur.execute(f"CREATE TEMP VIEW {LEDGER_VIEW} AS " + "\nUNION ALL\n".join(selects))
+        return years
+    finally:
+        cur.close()
+
+
+def archive_closed_years_interactive():
+    """Menu entry: confirm, archive every closed year and report the result."""
+    title = lang.t("backup_restore.archive_title", fallback="Archive Ledger")
+    if not messagebox.askyesno(
+        title,
+        lang.t(
+            "backup_restore.archive_confirm",
+            fallback="Move stock transactions of years before {year} to archive files?",
+        ).format(year=date.today().year),
+    ):
+        return None
+    try:
+        moved, held = archive_closed_years()
+    except (sqlite3.Error, OSError) as e:
+        logging.error(f"[ledger_archive] Archiving failed: {e}")
+        messagebox.showerror(
+            title,
+            lang.t("backup_restore.archive_failed", fallback="Archiving failed: {error}").format(error=str(e)),
+        )
+        return None
+    moved = {year: n for year, n in moved.items() if n}
+    if not moved:
+        message = lang.t("backup_restore.archive_nothing", fallback="No closed year left to archive.")
+    else:
+        message = lang.t(
+            "backup_restore.archive_success", fallback="Archived {rows} transactions ({years})."
+        ).format(rows=sum(moved.values()), years=", ".join(str(y) for y in sorted(moved)))
+    if held:
+        message += "\n" + lang.t(
+            "backup_restore.archive_loans_held",
+            fallback="Kept for open loans: {years}.",
+        ).format(years=", ".join(str(y) for y in held))
+    messagebox.showinfo(title, message)
+    return moved
@@ -0,0 +1,239 @@
+"""
+ledger_checkpoints.py
+Monthly checkpoints of the stock_transactions ledger.
+
+The stock card replayed every matching transaction in Python to build its
+running balance, started at 0 when a date range was applied (the opening
+balance before from_date was lost), and "stock as of date X" meant replaying
+the whole ledger. ledger_checkpoints keeps, per (code, scenario, kit,
+module, month), the totals moved in that month:
+
+  * kept exact by triggers on stock_transactions (insert, delete and
+    updates of quantities / keys), whichever screen writes the ledger
+  * the closing balance of a month is the SUM() OVER of the months up to it
+    (vw_ledger_closing)
+  * the balance before a date is the checkpoints of the earlier months plus
+    the rows of that one month: O(months), not O(history)
+
+kit / module are the ledger's Kit / Module columns ('' when empty); the
+ledger does not record kit / module numbers.
+
+The table, view and triggers are installed by migrations.py
+(install_ledger_checkpoints), next to the (code, Date, Time) ledger index.
+
+Usage:
+    from ledger_checkpoints import stock_as_of, balance_before
+    stock_as_of("ABCD", "2025-06-30", scenario="Cholera")
+    balance_before(cur, "ABCD", "2025-06-01", scenario="Cholera", kit="KMED...")
+"""
+
+import sqlite3
+import logging
+
+from db import connect_db
+
+logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Signed movement of one ledger row (Discrepancy is stored as text).
+MOVEMENT_SQL = ("(IFNULL({t}Qty_IN,0) - IFNULL({t}Qty_Out,0)"
+                " + CAST(IFNULL({t}Discrepancy,0) AS INTEGER))")
+
+_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS ledger_checkpoints (
+        code        TEXT NOT NULL,
+        scenario    TEXT NOT NULL DEFAULT '',
+        kit         TEXT NOT NULL DEFAULT '',
+        module      TEXT NOT NULL DEFAULT '',
+        month       TEXT NOT NULL,
+        qty_in      INTEGER NOT NULL DEFAULT 0,
+        qty_out     INTEGER NOT NULL DEFAULT 0,
+        discrepancy INTEGER NOT NULL DEFAULT 0,
+        net_qty     INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (code, scenario, kit, module, month)
+    ) WITHOUT ROWID
+"""
+
+_VIEW_SQL = """
+    CREATE VIEW IF NOT EXISTS vw_ledger_closing AS
+    SELECT code, scenario, kit, module, month, qty_in, qty_out, discrepancy, net_qty,
+           SUM(net_qty) OVER (PARTITION BY code, scenario, kit, module ORDER BY month
+                              ROWS UNBOUNDED PRECEDING) AS closing_qty
+      FROM ledger_checkpoints
+"""
+
+
+def _apply_sql(row, sign):
+    """Upsert adding (sign=+1) or removing (sign=-1) one ledger row."""
+    move = MOVEMENT_SQL.format(t=f"{row}.")
+    return f"""
+    INSERT INTO ledger_checkpoints (code, scenario, kit, module, month,
+                                    qty_in, qty_out, discrepancy, net_qty)
+    VALUES ({row}.code, IFNULL({row}.Scenario,''), IFNULL({row}.Kit,''),
+            IFNULL({row}.Module,''), substr({row}.Date,1,7),
+            {sign} * IFNULL({row}.Qty_IN,0), {sign} * IFNULL({row}.Qty_Out,0),
+            {sign} * CAST(IFNULL({row}.Discrepancy,0) AS INTEGER), {sign} * {move})
+    ON CONFLICT (code, scenario, kit, module, month) DO UPDATE SET
+        qty_in = qty_in + excluded.qty_in,
+        qty_out = qty_out + excluded.qty_out,
+        discrepancy = discrepancy + excluded.discrepancy,
+        net_qty = net_qty + excluded.net_qty;
+    """
+
+
+_TRIGGER_SQL = (
+    f"""
+    CREATE TRIGGER IF NOT EXISTS stock_transactions_checkpoint_ins
+    AFTER INSERT ON stock_transactions
+    FOR EACH ROW
+    BEGIN
+    {_apply_sql("NEW", 1)}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS stock_transactions_checkpoint_del
+    AFTER DELETE ON stock_transactions
+    FOR EACH ROW
+    BEGIN
+    {_apply_sql("OLD", -1)}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS stock_transactions_checkpoint_upd
+    AFTER UPDATE OF Date, code, Scenario, Kit, Module, Qty_IN, Qty_Out, Discrepancy
+    ON stock_transactions
+    FOR EACH ROW
+    BEGIN
+    {_apply_sql("OLD", -1)}
+    {_apply_sql("NEW", 1)}
+    END
+    """,
+)
+
+_REBUILD_SQL = f"""
+    INSERT INTO ledger_checkpoints (code, scenario, kit, module, month,
+                                    qty_in, qty_out, discrepancy, net_qty)
+    SELECT code, IFNULL(Scenario,''), IFNULL(Kit,''), IFNULL(Module,''), substr(Date,1,7),
+           TOTAL(IFNULL(Qty_IN,0)), TOTAL(IFNULL(Qty_Out,0)),
+           TOTAL(CAST(IFNULL(Discrepancy,0) AS INTEGER)), TOTAL({MOVEMENT_SQL.format(t="")})
+      FROM {{source}}
+     WHERE Date >= ? AND Date < ?
+     GROUP BY 1, 2, 3, 4, 5
+"""
+
+
+def rebuild_ledger_checkpoints(cur, source="stock_transactions", date_from="", date_to="9999-12-31"):
+    """
+    Recompute the checkpoints of the months in [date_from, date_to) from
+    `source` (the ledger, or an archived copy of it) in one GROUP BY pass.
+    Archived years are no longer in stock_transactions: rebuild them from
+    their archive (ledger_archive does) rather than from the hot ledger.
+    Bounds are full dates: Date has NUMERIC affinity, so a bare '9999'
+    would be compared as a number and match no row.
+    """
+    cur.execute(
+        "DELETE FROM ledger_checkpoints WHERE month >= substr(?,1,7) AND month < substr(?,1,7)",
+        (date_from, date_to),
+    )
+    cur.execute(_REBUILD_SQL.format(source=source), (date_from, date_to))
+
+
+def install_ledger_checkpoints(cur):
+    """
+    Create the checkpoint table, view and triggers (migration step, caller
+    commits); a new table is backfilled from the ledger.
+    """
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='ledger_checkpoints'")
+    existed = cur.fetchone() is not None
+    cur.execute(_TABLE_SQL)
+    for sql in (_VIEW_SQL,) + _TRIGGER_SQL:
+        cur.execute(sql)
+    if not existed:
+        rebuild_ledger_checkpoints(cur)
+
+
+def _filters(alias, scenario, kit, module, key_cols):
+    """WHERE fragments / params for the optional scenario / kit / module filters."""
+    clauses, params = [], []
+    for value, col in zip((scenario, kit, module), key_cols):
+        if value is not None:
+            clauses.append(f"{alias}{col} = ?")
+            params.append(value)
+    return "".join(f" AND {c}" for c in clauses), params
+
+
+def balance_before(cur, code, date, scenario=None, kit=None, module=None, inclusive=False,
+                   source="stock_transactions"):
+    """
+    Stock of `code` from every ledger row dated before `date` (YYYY-MM-DD),
+    or up to and including it with inclusive=True. None filters mean "all".
+    Earlier months come from the checkpoints, `date`'s own month from the
+    ledger rows of that month only, read from `source` (pass the attached
+    ledger view when that month may be archived).
+    """
+    month = str(date)[:7]
+    cp_where, cp_params = _filters("", scenario, kit, module, ("scenario", "kit", "module"))
+    cur.execute(
+        f"SELECT TOTAL(net_qty) FROM ledger_checkpoints WHERE code = ? AND month < ?{cp_where}",
+        [code, month] + cp_params,
+    )
+    opening = int(cur.fetchone()[0])
+
+    st_where, st_params = _filters("", scenario, kit, module, ("Scenario", "Kit", "Module"))
+    cur.execute(
+        f"""
+        SELECT TOTAL({MOVEMENT_SQL.format(t="")})
+          FROM {source}
+         WHERE code = ? AND Date >= ? AND Date {'<=' if inclusive else '<'} ?{st_where}
+        """,
+        [code, f"{month}-01", str(date)] + st_params,
+    )
+    return opening + int(cur.fetchone()[0])
+
+
+def stock_as_of(code, date, scenario=None, kit=None, module=None):
+    """Point-in-time stock of `code` at the end of `date` (0 on error)."""
+    conn = connect_db()
+    if conn is None:
+        return 0
+    # ledger_archive builds on this module; imported here to avoid the cycle
+    from ledger_archive import LEDGER_VIEW, attach_ledger
+
+    cur = conn.cursor()
+    try:
+        attach_ledger(conn, f"{str(date)[:7]}-01", date)
+        return balance_before(cur, code, date, scenario, kit, module, inclusive=True,
+                              source=LEDGER_VIEW)
+    except sqlite3.Error as e:
+        logging.error(f"[ledger_checkpoints] stock_as_of failed: {e}")
+        return 0
+    finally:
+        cur.close()
+        conn.close()
+
+
+def monthly_closing(code, scenario=None, kit=None, module=None):
+    """[(month, net_qty, closing_qty)] of `code`, summed over the unfiltered keys."""
+    conn = connect_db()
+    if conn is None:
+        return []
+    cur = conn.cursor()
+    where, params = _filters("", scenario, kit, module, ("scenario", "kit", "module"))
+    try:
+        cur.execute(
+            f"""
+            SELECT month, TOTAL(net_qty) AS net_qty,
+                   SUM(TOTAL(net_qty)) OVER (ORDER BY month ROWS UNBOUNDED PRECEDING) AS closing_qty
+              FROM ledger_checkpoints
+             WHERE code = ?{where}
+             GROUP BY month
+             ORDER BY month
+            """,
+            [code] + params,
+        )
+        return [(m, int(n), int(c)) for m, n, c in cur.fetchall()]
+    except sqlite3.Error as e:
+        logging.error(f"[ledger_checkpoints] monthly_closing failed: {e}")
+        return []
+    finally:
+        cur.close()
+        conn.close()
@@ -40,7 +40,9 @@ try:
 except Exception:
     TKCAL_AVAILABLE = False
 
-from db import connect_db
+from db import connect_db, cached_query
+from filter_options import filter_options
+from ledger_archive import LEDGER_VIEW, attach_ledger
 from manage_items import get_item_description, detect_type
 from language_manager import lang
 from popup_utils import custom_popup, custom_askyesno
@@ -116,81 +118,41 @@ def parse_user_date(text: str, bound: str):
 
 # ---------------- DB Helpers ----------------
 def fetch_scenarios():
-    conn = connect_db()
-    if conn is None: return []
-    cur = conn.cursor()
     try:
-        cur.execute("SELECT name FROM scenarios ORDER BY name")
-        return [r[0] for r in cur.fetchall()]
+        return [r[0] for r in cached_query("SELECT name FROM scenarios ORDER BY name")]
     except:
         return []
-    finally:
-        cur.close(); conn.close()
 
 def fetch_kit_numbers():
-    conn = connect_db()
-    if conn is None: return []
-    cur = conn.cursor()
-    try:
-        cur.execute("""
-            SELECT DISTINCT Kit FROM stock_transactions
-            WHERE Kit IS NOT NULL AND Kit!='None' AND Kit!=''
-            ORDER BY Kit
-        """)
-        return [r[0] for r in cur.fetchall()]
-    except:
-        return []
-    finally:
-        cur.close(); conn.close()
+    return filter_options.ledger_kit_numbers()
 
 def fetch_module_numbers():
-    conn = connect_db()
-    if conn is None: return []
-    cur = conn.cursor()
-    try:
-        cur.execute("""
-            SELECT DISTINCT Module FROM stock_transactions
-            WHERE Module IS NOT NULL AND Module!='None' AND Module!=''
-            ORDER BY Module
-        """)
-        return [r[0] for r in cur.fetchall()]
-    except:
-        return []
-    finally:
-        cur.close(); conn.close()
+    return filter_options.ledger_module_numbers()
 
 def fetch_third_parties():
-    conn = connect_db()
-    if conn is None: return []
-    cur = conn.cursor()
     try:
-        cur.execute("SELECT name FROM third_parties ORDER BY name")
-        return [r[0] for r in cur.fetchall()]
+        return [r[0] for r in cached_query("SELECT name FROM third_parties ORDER BY name")]
     except:
         return []
-    finally:
-        cur.close(); conn.close()
 
-# ---------------- Aggregation (per code + third_party) ----------------
-def aggregate_loans(filters):
+# ---------------- Queries ----------------
+LOAN_CLAUSE = """
+   (Out_Type IN ('Loan','Return of Borrowing')
+    OR IN_Type IN ('In Borrowing','In Return of Loan'))
+"""
+
+def build_loans_query(filters):
+    """(sql, params) of the loan movements matching the report filters."""
+    where = []
+    params = []
     scenario = filters.get("scenario")
     kit_number = filters.get("kit")
     module_number = filters.get("module")
-    type_filter = filters.get("type")
-    item_search = filters.get("item_search")
-    doc_search = filters.get("doc_number")
     third_party_filter = filters.get("third_party")
+    doc_search = filters.get("doc_number")
     date_from = filters.get("date_from")
     date_to = filters.get("date_to")
 
-    conn = connect_db()
-    if conn is None:
-        return []
-
-    cur = conn.cursor()
-    where = []
-    params = []
-
     if scenario and scenario.lower() != "all":
         where.append("Scenario = ?"); params.append(scenario)
     if kit_number and kit_number.lower() != "all":
@@ -206,20 +168,49 @@ def aggregate_loans(filters):
     if date_to:
         where.append("Date <= ?"); params.append(date_to.strftime("%Y-%m-%d"))
 
-    loan_clause = """
-       (Out_Type IN ('Loan','Return of Borrowing')
-        OR IN_Type IN ('In Borrowing','In Return of Loan'))
-    """
     base_where = " AND ".join(where) if where else "1=1"
-
     sql = f"""
       SELECT code, Scenario, Kit, Module,
              Qty_IN, IN_Type, Qty_Out, Out_Type,
              document_number, Third_Party
-      FROM stock_transactions
-      WHERE {base_where} AND {loan_clause}
+      FROM {LEDGER_VIEW}
+      WHERE {base_where} AND {LOAN_CLAUSE}
     """
+    return sql, params
+
+def build_loan_history_queries(code, third_party):
+    """(count_sql, rows_sql, params) of the loan movements of one code / third party.
+
+    count_sql counts them over the ledger view (archived years included),
+    rows_sql reads the hot rows the donation conversion rewrites.
+    """
+    where = "code=?{tp} AND {clause}".format(
+        tp=" AND Third_Party=?" if third_party else "", clause=LOAN_CLAUSE)
+    params = (code, third_party) if third_party else (code,)
+    count_sql = f"SELECT COUNT(*) FROM {LEDGER_VIEW} WHERE {where}"
+    rows_sql = f"""
+          SELECT rowid, IN_Type, Out_Type, document_number
+          FROM stock_transactions
+          WHERE {where}
+        """
+    return count_sql, rows_sql, params
+
+# ---------------- Aggregation (per code + third_party) ----------------
+def aggregate_loans(filters):
+    type_filter = filters.get("type")
+    item_search = filters.get("item_search")
+    date_from = filters.get("date_from")
+    date_to = filters.get("date_to")
+
+    conn = connect_db()
+    if conn is None:
+        return []
+
+    cur = conn.cursor()
+    sql, params = build_loans_query(filters)
     try:
+        # Balances run over the archived years as well
+        attach_ledger(conn, date_from, date_to)
         cur.execute(sql, params)
         rows = cur.fetchall()
     except:
@@ -691,7 +682,14 @@ class Loans(tk.Frame):
         if confirm != "yes":
             return
         changed = self._convert_code_third_party_to_donation(code, tp)
-        if changed:
+        if changed is None:
+            custom_popup(self,
+                         lang.t("generic.info","Info"),
+                         lang.t("loans.turn_archived",
+                                "Some loan/borrowing rows of {code}{tp_part} are in archived years and cannot be changed.")
+                         .format(code=code, tp_part=(f' / {tp}' if tp else '')),
+                         "warning")
+        elif changed:
             custom_popup(self,
                          lang.t("generic.success","Success"),
                          lang.t("loans.turn_success_tp","Updated {n} rows to Donation for {code}{tp_part}")
@@ -709,24 +707,16 @@ class Loans(tk.Frame):
         if conn is None: return 0
         cur = conn.cursor()
         count = 0
+        count_sql, rows_sql, params = build_loan_history_queries(code, third_party)
         try:
-            if third_party:
-                cur.execute("""
-                  SELECT rowid, IN_Type, Out_Type, document_number
-                  FROM stock_transactions
-                  WHERE code=? AND Third_Party=?
-                    AND (Out_Type IN ('Loan','Return of Borrowing')
-                         OR IN_Type IN ('In Borrowing','In Return of Loan'))
-                """,(code, third_party))
-            else:
-                cur.execute("""
-                  SELECT rowid, IN_Type, Out_Type, document_number
-                  FROM stock_transactions
-                  WHERE code=?
-                    AND (Out_Type IN ('Loan','Return of Borrowing')
-                         OR IN_Type IN ('In Borrowing','In Return of Loan'))
-                """,(code,))
+            attach_ledger(conn)
+            cur.execute(count_sql, params)
+            total = cur.fetchone()[0]
+            cur.execute(rows_sql, params)
             rows = cur.fetchall()
+            if total > len(rows):
+                # Part of the history is in archived years, which never change
+                return None
             for rowid, in_type, out_type, doc in rows:
                 new_in = in_type
                 new_out = out_type
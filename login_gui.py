@@ -6,32 +6,37 @@ import logging
 import json
 
 from db import connect_db
-from manage_users import ManageUsers
-from manage_items import ManageItems
-from manage_parties import ManageParties
-from stock_transactions import StockTransactions
-from reports import Reports
-from scenarios import Scenarios
-from kits_Composition import KitsComposition
+from migrations import apply_migrations
 from menu_bar import create_menu
 from language_manager import lang
-from standard_list import StandardList
-from stock_inv import StockInventory
-from item_families import ManageItemFamilies
-from in_ import StockIn
-from out import StockOut
-from in_kit import StockInKit
-from out_kit import StockOutKit
-from dispatch_kit import StockDispatchKit
-from receive_kit import StockReceiveKit
-from stock_card import StockCard
-from end_users import ManageEndUsers
 from project_details import ProjectDetailsWindow
-from dashboard import Dashboard
-from stock_availability import StockAvailability
-from order import OrderNeeds
-from stock_summary import open_stock_summary
-from auth_utils import authenticate
+from auth_utils import auth_service
+from screen_registry import screens
+
+# Screens are imported on first open (see screen_registry) so the login
+# window does not wait for pandas / openpyxl and every screen module.
+ManageUsers = screens["ManageUsers"]
+ManageItems = screens["ManageItems"]
+ManageParties = screens["ManageParties"]
+StockTransactions = screens["StockTransactions"]
+Reports = screens["Reports"]
+Scenarios = screens["Scenarios"]
+KitsComposition = screens["KitsComposition"]
+StandardList = screens["StandardList"]
+StockInventory = screens["StockInventory"]
+ManageItemFamilies = screens["ManageItemFamilies"]
+StockIn = screens["StockIn"]
+StockOut = screens["StockOut"]
+StockInKit = screens["StockInKit"]
+StockOutKit = screens["StockOutKit"]
+StockDispatchKit = screens["StockDispatchKit"]
+StockReceiveKit = screens["StockReceiveKit"]
+StockCard = screens["StockCard"]
+ManageEndUsers = screens["ManageEndUsers"]
+Dashboard = screens["Dashboard"]
+StockAvailability = screens["StockAvailability"]
+OrderNeeds = screens["OrderNeeds"]
+open_stock_summary = screens["open_stock_summary"]
 
 # ============================================================
 # IMPORT CENTRALIZED THEME (NEW)
@@ -127,6 +132,9 @@ class LoginGUI(tk.Frame):
         # APPLY GLOBAL STYLE ONCE AT STARTUP (NEW)
         # ============================================================
         apply_global_style(self.master)
+
+        # Bring the schema up to date before any screen queries it
+        apply_migrations()
         
         try:
             self.master.state('zoomed')
@@ -383,20 +391,39 @@ class LoginGUI(tk.Frame):
                 parent=self.get_active_window()
             )
             return
+        # Password hashing runs in a worker thread; the window stays responsive
+        if auth_service.authenticate_async(
+            username, password,
+            lambda result, error: self._on_authenticated(username, result, error),
+            self,
+        ):
+            self.master.config(cursor="watch")
+
+    def _on_authenticated(self, username, result, error):
         try:
-            ok, user_obj, migrated, msg = authenticate(username, password)
-        except Exception as e:
-            logging.error(f"authenticate() raised: {e}")
+            self.master.config(cursor="")
+        except tk.TclError:
+            return
+        if error is not None:
+            logging.error(f"authenticate() raised: {error}")
             messagebox.showerror(
                 lang.t("dialog_titles.error", "Error"),
-                f"Authentication error: {e}",
+                f"Authentication error: {error}",
                 parent=self.get_active_window()
             )
             return
+        ok, user_obj, migrated, msg = result
         if not ok or not user_obj:
+            wait = auth_service.retry_after(username)
+            if wait:
+                message = lang.t("login.error_locked",
+                                 "Too many failed attempts. Try again in {seconds} s.",
+                                 seconds=wait)
+            else:
+                message = lang.t("login.error_invalid", "Invalid username or password")
             messagebox.showerror(
                 lang.t("dialog_titles.error", "Error"),
-                lang.t("login.error_invalid", "Invalid username or password"),
+                message,
                 parent=self.get_active_window()
             )
             return
@@ -423,6 +450,8 @@ class LoginGUI(tk.Frame):
         if self.login_frame and self.login_frame.winfo_exists():
             self.login_frame.destroy()
         self.dashboard()
+        # Import the remaining screens in the background once the dashboard is drawn
+        self.after_idle(screens.prewarm)
 
     # ---------------- Dashboard ----------------
     def dashboard(self):
@@ -86,7 +86,9 @@ try:
 except Exception:
     TKCAL_AVAILABLE = False
 
-from db import connect_db
+from db import connect_db, cached_query
+from filter_options import filter_options
+from ledger_archive import LEDGER_VIEW, attach_ledger
 from manage_items import get_item_description, detect_type
 from language_manager import lang
 from popup_utils import custom_popup
@@ -168,58 +170,24 @@ def parse_user_date(text: str, role: str):
 
 # ---------------- Filter Value Providers ----------------
 def fetch_scenarios():
-    conn = connect_db()
-    if conn is None: return []
-    cur = conn.cursor()
     try:
-        cur.execute("SELECT name FROM scenarios ORDER BY name")
-        return [r[0] for r in cur.fetchall()]
+        return [r[0] for r in cached_query("SELECT name FROM scenarios ORDER BY name")]
     except sqlite3.Error:
         return []
-    finally:
-        cur.close(); conn.close()
 
 def fetch_kit_numbers():
     """Kit numbers from stock_data.kit_number"""
-    conn = connect_db()
-    if conn is None: return []
-    cur = conn.cursor()
-    try:
-        cur.execute("""
-            SELECT DISTINCT kit_number FROM stock_data
-            WHERE kit_number IS NOT NULL AND kit_number!='None' AND kit_number!=''
-            ORDER BY kit_number
-        """)
-        return [r[0] for r in cur.fetchall()]
-    except sqlite3.Error:
-        return []
-    finally:
-        cur.close(); conn.close()
+    return filter_options.kit_numbers()
 
 def fetch_module_numbers():
     """Module numbers from stock_data.module_number"""
-    conn = connect_db()
-    if conn is None: return []
-    cur = conn.cursor()
-    try:
-        cur.execute("""
-            SELECT DISTINCT module_number FROM stock_data
-            WHERE module_number IS NOT NULL AND module_number!='None' AND module_number!=''
-            ORDER BY module_number
-        """)
-        return [r[0] for r in cur.fetchall()]
-    except sqlite3.Error:
-        return []
-    finally:
-        cur.close(); conn.close()
+    return filter_options.module_numbers()
 
-# ---------------- Aggregation ----------------
-def aggregate_losses(filters):
+def build_losses_query(filters):
+    """(sql, params) of the loss movements matching the report filters."""
     scenario = filters.get("scenario")
     kit_number = filters.get("kit")
     module_number = filters.get("module")
-    type_filter = filters.get("type")
-    item_search = filters.get("item_search")
     doc_search = filters.get("doc_number")
     loss_filter = filters.get("loss_type")
     date_from = filters.get("date_from")
@@ -258,10 +226,19 @@ def aggregate_losses(filters):
             t.document_number, t.Remarks, t.unique_id,
             COALESCE(sd.exp_date, t.Expiry_date) as expiry_date,
             sd.kit_number, sd.module_number
-        FROM stock_transactions t
+        FROM {LEDGER_VIEW} t
         LEFT JOIN stock_data sd ON t.unique_id = sd.unique_id
         WHERE {where_sql}
     """
+    return sql, params
+
+def aggregate_losses(filters):
+    type_filter = filters.get("type")
+    item_search = filters.get("item_search")
+    date_from = filters.get("date_from")
+    date_to = filters.get("date_to")
+
+    sql, params = build_losses_query(filters)
 
     conn = connect_db()
     if conn is None:
@@ -269,6 +246,7 @@ def aggregate_losses(filters):
 
     cur = conn.cursor()
     try:
+        attach_ledger(conn, date_from, date_to)
         cur.execute(sql, params)
         fetched = cur.fetchall()
     except sqlite3.Error:
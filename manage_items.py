@@ -3,7 +3,8 @@ from tkinter import ttk, filedialog
 import pandas as pd
 import sqlite3
 import openpyxl
-from db import connect_db
+from db import connect_db, cached_query
+from event_bus import bus, ITEMS_CHANGED
 from language_manager import lang
 from item_families import ItemFamilyManager
 from popup_utils import custom_popup, custom_askyesno, custom_dialog
@@ -41,40 +42,6 @@ from theme_config import AppTheme, configure_tree_tags
 # ============================================================
 RESTRICTED_MODIFY = {"manager", "supervisor", "~", "$"}
 
-# ============================================================
-# DB bootstrap
-# ============================================================
-def ensure_table():
-    conn = connect_db()
-    if conn is None:
-        return
-    cursor = conn.cursor()
-    try:
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS items_list (
-                item_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                code TEXT UNIQUE NOT NULL,
-                pack TEXT,
-                price_per_pack_euros REAL,
-                unit_price_euros REAL,
-                weight_per_pack_kg REAL,
-                volume_per_pack_dm3 REAL,
-                shelf_life_months INTEGER,
-                remarks TEXT,
-                account_code TEXT,
-                type TEXT,
-                designation TEXT,
-                designation_en TEXT,
-                designation_fr TEXT,
-                designation_sp TEXT,
-                unique_id_1 TEXT
-            )
-        """)
-        conn.commit()
-    finally:
-        cursor.close()
-        conn.close()
-
 # ============================================================
 # TYPE / DESCRIPTION HELPERS
 # ============================================================
@@ -120,38 +87,30 @@ def generate_unique_id(code):
     return code
 
 def get_item_description(code):
-    conn = connect_db()
-    if conn is None: 
+    rows = cached_query(
+        "SELECT designation, designation_en, designation_fr, designation_sp FROM items_list WHERE code=?",
+        (code,))
+    row = rows[0] if rows else None
+    if not row:
         return "No Description"
-    cursor = conn.cursor()
-    try:
-        cursor.execute(
-            "SELECT designation, designation_en, designation_fr, designation_sp FROM items_list WHERE code=?",
-            (code,))
-        row = cursor.fetchone()
-        if not row:
-            return "No Description"
-        row_dict = {
-            "designation": row[0],
-            "designation_en":  row[1],
-            "designation_fr": row[2],
-            "designation_sp": row[3]
-        }
-        lang_code = lang.lang_code.lower()
-        mapping = {"en": "designation_en", "fr": "designation_fr", "es": "designation_sp", "sp": "designation_sp"}
-        active_col = mapping.get(lang_code, "designation_en")
-        if row_dict.get(active_col):
-            return row_dict[active_col]
-        if row_dict.get("designation_en"):
-            return row_dict["designation_en"]
-        if row_dict.get("designation_fr"):
-            return row_dict["designation_fr"]
-        if row_dict.get("designation_sp"):
-            return row_dict["designation_sp"]
-        return row_dict.get("designation") or "No Description"
-    finally:
-        cursor.close()
-        conn.close()
+    row_dict = {
+        "designation": row[0],
+        "designation_en":  row[1],
+        "designation_fr": row[2],
+        "designation_sp": row[3]
+    }
+    lang_code = lang.lang_code.lower()
+    mapping = {"en": "designation_en", "fr": "designation_fr", "es": "designation_sp", "sp": "designation_sp"}
+    active_col = mapping.get(lang_code, "designation_en")
+    if row_dict.get(active_col):
+        return row_dict[active_col]
+    if row_dict.get("designation_en"):
+        return row_dict["designation_en"]
+    if row_dict.get("designation_fr"):
+        return row_dict["designation_fr"]
+    if row_dict.get("designation_sp"):
+        return row_dict["designation_sp"]
+    return row_dict.get("designation") or "No Description"
 
 def get_family_remarks(code):
     if not code or len(code) < 4:
@@ -179,7 +138,6 @@ class ManageItems(tk.Frame):
         self.tree = None
         self.search_var = tk.StringVar()
         self.total_label = None
-        ensure_table()
         self._configure_styles()
         self._build_ui()
         self.load_data()
@@ -663,6 +621,7 @@ class ManageItems(tk.Frame):
                 return
             cursor.execute("DELETE FROM items_list")
             conn.commit()
+            bus.publish(ITEMS_CHANGED)
             self.load_data()
             custom_popup(self, lang.t("dialog_titles.success", fallback="Success"),
                          self.t("cleared_items", fallback="All items cleared.", count=0),
@@ -815,6 +774,7 @@ class ManageItems(tk.Frame):
                     ))
                 success += 1
             conn.commit()
+            bus.publish(ITEMS_CHANGED)
             custom_popup(self,
                          lang.t("dialog_titles.success", fallback="Success"),
                          self.t("import_complete",
@@ -902,6 +862,7 @@ class ManageItems(tk.Frame):
         try:
             cursor.execute("DELETE FROM items_list WHERE code=?", (code,))
             conn.commit()
+            bus.publish(ITEMS_CHANGED)
             self.load_data()
             custom_popup(self, lang.t("dialog_titles.success", fallback="Success"),
                          self.t("delete_success", fallback="Item deleted"),
@@ -1117,6 +1078,7 @@ class ManageItems(tk.Frame):
                         unique_id_1
                     ))
                 conn.commit()
+                bus.publish(ITEMS_CHANGED)
                 form.destroy()
                 self.load_data()
                 custom_popup(
@@ -110,8 +110,6 @@ class ManageUsers(tk.Frame):
         self.role = self._decode_role(getattr(app, "role", "supervisor"))
         self.tree = None
         self.pack(fill="both", expand=True)
-        self._ensure_preferred_language_column()
-        self._ensure_symbol_column()
         self._configure_styles()
         self._build_ui()
         self.load_users()
@@ -133,62 +131,6 @@ class ManageUsers(tk.Frame):
             return SYMBOL_TO_ROLE[value]
         return value
 
-    # --------------------------------------------------------
-    # DB Migration helpers
-    # --------------------------------------------------------
-    def _ensure_preferred_language_column(self):
-        conn = connect_db()
-        if conn is None:
-            return
-        cur = conn.cursor()
-        try:
-            cur.execute("PRAGMA table_info(users)")
-            cols = [r[1].lower() for r in cur.fetchall()]
-            if "preferred_language" not in cols:
-                cur.execute("ALTER TABLE users ADD COLUMN preferred_language TEXT")
-                conn.commit()
-            # Normalize existing null/empty -> EN
-            cur.execute("""
-                UPDATE users
-                   SET preferred_language='EN'
-                 WHERE preferred_language IS NULL
-                    OR TRIM(preferred_language)=''
-            """)
-            conn.commit()
-        except sqlite3.Error:
-            conn.rollback()
-        finally:
-            cur.close()
-            conn.close()
-
-    def _ensure_symbol_column(self):
-        """
-        Adds symbol column if missing, then backfills using role mapping.
-        """
-        conn = connect_db()
-        if conn is None:
-            return
-        cur = conn.cursor()
-        try:
-            cur.execute("PRAGMA table_info(users)")
-            cols = [r[1].lower() for r in cur.fetchall()]
-            if "symbol" not in cols:
-                cur.execute("ALTER TABLE users ADD COLUMN symbol TEXT")
-                conn.commit()
-            # Backfill any NULL symbol values
-            cur.execute('SELECT user_id, role, symbol FROM "users"')
-            rows = cur.fetchall()
-            for user_id, role, sym in rows:
-                if not sym or sym.strip() == "":
-                    new_sym = self._encode_role(role)
-                    cur.execute('UPDATE "users" SET symbol=? WHERE user_id=?', (new_sym, user_id))
-            conn.commit()
-        except sqlite3.Error:
-            conn.rollback()
-        finally:
-            cur.close()
-            conn.close()
-
     # --------------------------------------------------------
     # Styles (UPDATED: Removed theme_use call, using AppTheme colors)
     # --------------------------------------------------------
@@ -2,39 +2,45 @@ import tkinter as tk
 from tkinter import filedialog
 import sqlite3
 from db import connect_db
+from schema_registry import schema
 
 from language_manager import lang
 from project_details import ProjectDetailsWindow
-from backup_restore import create_backup_zip, restore_backup
-
-# Module windows / frames
-from in_kit import StockInKit
-from out_kit import StockOutKit
-from inv_kit import InventoryKit
-from in_ import StockIn
-from out import StockOut
-from stock_inv import StockInventory
-from item_families import ManageItemFamilies
-from manage_items import ManageItems
-from end_users import ManageEndUsers
-from reports import Reports
-from stock_transactions import StockTransactions
-from standard_list import StandardList
-from scenarios import Scenarios
-from stock_card import StockCard
-from dispatch_kit import StockDispatchKit
-from receive_kit import StockReceiveKit
+from backup_restore import (
+    create_backup_zip, create_snapshot_interactive, restore_backup, select_and_restore_snapshot,
+)
+from ledger_archive import archive_closed_years_interactive
+
+# Module windows / frames (imported on first open, see screen_registry)
+from screen_registry import screens
+
+StockInKit = screens["StockInKit"]
+StockOutKit = screens["StockOutKit"]
+InventoryKit = screens["InventoryKit"]
+StockIn = screens["StockIn"]
+StockOut = screens["StockOut"]
+StockInventory = screens["StockInventory"]
+ManageItemFamilies = screens["ManageItemFamilies"]
+ManageItems = screens["ManageItems"]
+ManageEndUsers = screens["ManageEndUsers"]
+Reports = screens["Reports"]
+StockTransactions = screens["StockTransactions"]
+StandardList = screens["StandardList"]
+Scenarios = screens["Scenarios"]
+StockCard = screens["StockCard"]
+StockDispatchKit = screens["StockDispatchKit"]
+StockReceiveKit = screens["StockReceiveKit"]
 
 # Additional report / info modules
-from expiry_data import StockExpiry
-from stock_availability import StockAvailability
-from consumption import Consumption
-from loans import Loans
-from donations import Donations
-from losses import Losses
-from order import OrderNeeds
-from stock_summary import open_stock_summary
-from info import AppInfo
+StockExpiry = screens["StockExpiry"]
+StockAvailability = screens["StockAvailability"]
+Consumption = screens["Consumption"]
+Loans = screens["Loans"]
+Donations = screens["Donations"]
+Losses = screens["Losses"]
+OrderNeeds = screens["OrderNeeds"]
+open_stock_summary = screens["open_stock_summary"]
+AppInfo = screens["AppInfo"]
 
 from popup_utils import custom_popup, custom_askyesno, custom_dialog  # retained if needed
 
@@ -56,8 +62,7 @@ def fetch_eprep_type(default=None):
         return default
     cur = conn.cursor()
     try:
-        cur.execute("PRAGMA table_info(project_details)")
-        cols = {c[1].lower(): c[1] for c in cur.fetchall()}
+        cols = schema.columns("project_details")
         if "eprep_type" not in cols:
             return default
         cur.execute("SELECT eprep_type FROM project_details LIMIT 1")
@@ -131,7 +136,15 @@ def create_menu(parent, user_mgmt_cmd, parties_cmd, kits_cmd, change_language, h
     file_menu = tk.Menu(menubar, tearoff=0)
     file_menu.add_command(
         label=lang.t("menu.file.backup", fallback="Create Backup"),
-        command=create_backup_zip
+        command=lambda: create_backup_zip(window)
+    )
+    file_menu.add_command(
+        label=lang.t("menu.file.snapshot", fallback="Create Incremental Snapshot"),
+        command=lambda: create_snapshot_interactive(window)
+    )
+    file_menu.add_command(
+        label=lang.t("menu.file.archive_ledger", fallback="Archive Closed Years"),
+        command=archive_closed_years_interactive
     )
     file_menu.add_command(
         label=lang.t("menu.file.restore", fallback="Restore Backup"),
@@ -139,6 +152,10 @@ def create_menu(parent, user_mgmt_cmd, parties_cmd, kits_cmd, change_language, h
             filedialog.askopenfilename(filetypes=[("Zip Files", "*.zip")])
         )
     )
+    file_menu.add_command(
+        label=lang.t("menu.file.restore_snapshot", fallback="Restore Incremental Snapshot"),
+        command=select_and_restore_snapshot
+    )
     if allow_project_details:
         file_menu.add_command(
             label=lang.t("menu.file.project_details", fallback="Project Details"),
@@ -0,0 +1,263 @@
+"""
+migrations.py
+Versioned schema migrations keyed on PRAGMA user_version.
+
+Tables, columns, indexes and triggers used to be created by whichever screen
+opened first (ManageItems, KitsComposition, ManageUsers, Project Details,
+the FEFO allocator, the ledger modules ...), each probing sqlite_master or
+PRAGMA table_info again in every process. MIGRATIONS lists those steps once,
+in order:
+
+  * apply_migrations() runs, at startup, every step above the database's
+    user_version, each in its own transaction that also bumps user_version,
+    so a step is applied exactly once and a failed one is retried next start
+  * every step is idempotent (IF NOT EXISTS, column probes), so a database
+    restored from an older backup or created by an older build is safe
+  * each run is timed and recorded in schema_migrations
+  * the indexes the hot queries need are created here, so screens never
+    issue DDL at runtime
+
+Add new steps at the end with the next version number; never edit or
+renumber an applied one.
+
+Usage:
+    from migrations import apply_migrations, LATEST_VERSION
+    for version, name, seconds in apply_migrations():
+        print(version, name, f"{seconds * 1000:.1f} ms")
+"""
+
+import sqlite3
+import logging
+import time
+from datetime import datetime
+
+from db import connect_db, install_write_counters
+from kit_closure import install_kit_closure
+from ledger_archive import install_archive_registry
+from ledger_checkpoints import install_ledger_checkpoints
+from role_map import encode_role
+from schema_registry import schema
+from statement_engine import install_snapshot_version
+
+logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
+
+_HISTORY_SQL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version     INTEGER PRIMARY KEY,
+        name        TEXT NOT NULL,
+        applied_at  TEXT NOT NULL,
+        duration_ms REAL NOT NULL
+    )
+"""
+
+_BASE_TABLE_SQL = (
+    """
+    CREATE TABLE IF NOT EXISTS scenarios (
+        scenario_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        activity_type TEXT,
+        target_population INTEGER,
+        responsible_person TEXT,
+        stock_location TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS items_list (
+        item_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        code TEXT UNIQUE NOT NULL,
+        pack TEXT,
+        price_per_pack_euros REAL,
+        unit_price_euros REAL,
+        weight_per_pack_kg REAL,
+        volume_per_pack_dm3 REAL,
+        shelf_life_months INTEGER,
+        remarks TEXT,
+        account_code TEXT,
+        type TEXT,
+        designation TEXT,
+        designation_en TEXT,
+        designation_fr TEXT,
+        designation_sp TEXT,
+        unique_id_1 TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS kit_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        scenario_id INTEGER,
+        scenario TEXT NOT NULL,
+        kit TEXT,
+        module TEXT,
+        item TEXT,
+        code TEXT NOT NULL,
+        std_qty INTEGER NOT NULL,
+        level TEXT,
+        treecode TEXT,
+        FOREIGN KEY (scenario_id) REFERENCES scenarios(scenario_id),
+        FOREIGN KEY (code) REFERENCES items_list(code),
+        CHECK (std_qty > 0)
+    )
+    """,
+)
+
+# (table, name, columns) of the indexes behind the hot lookups
+HOT_QUERY_INDEXES = (
+    # FEFO lot selection (fefo_allocator.fetch_lots)
+    ("stock_data", "idx_stock_fefo", "item, scenario, exp_date"),
+    # kit / module number lookups of the kit screens, per scenario
+    ("stock_data", "idx_stock_scenario_numbers", "scenario, kit_number, module_number"),
+    ("stock_data", "idx_stock_kit_number", "kit_number"),
+    ("stock_data", "idx_stock_module_number", "module_number"),
+    # stock card / ledger per code, transaction search by document
+    ("stock_transactions", "idx_st_code_date", "code, Date, Time"),
+    ("stock_transactions", "idx_st_document_number", "document_number"),
+    # kit structure and closure maintenance
+    ("kit_items", "idx_kit_items_scenario_treecode", "scenario_id, treecode"),
+    ("kit_items", "idx_kit_items_scenario_code", "scenario_id, code"),
+)
+
+# Report access paths (checked by benchmarks/query_plans.py)
+COVERING_INDEXES = (
+    # date-range reads: consumption, AMC / monthly "Out MSF" totals (covering),
+    # the transactions list in Date, Time order
+    ("stock_transactions", "idx_st_date_time_out", "Date, Time, Out_Type, code, Qty_Out"),
+    # movement-type reports: losses (Out_Type IN ...), loans / donations (OR of both)
+    ("stock_transactions", "idx_st_out_type_date", "Out_Type, Date"),
+    ("stock_transactions", "idx_st_in_type_date", "IN_Type, Date"),
+    ("stock_transactions", "idx_st_third_party_date", "Third_Party, Date"),
+    # scenario filters and the Scenario / Kit / Module filter options (covering)
+    ("stock_transactions", "idx_st_scenario_kit_module", "Scenario, Kit, Module"),
+    # next document number: document_number LIKE 'PREFIX/%' (LIKE is case-insensitive)
+    ("stock_transactions", "idx_st_document_number_nocase", "document_number COLLATE NOCASE"),
+    # in-box lots by treecode (lot popups, stock inventory)
+    ("stock_data", "idx_stock_treecode", "treecode, scenario, exp_date"),
+    # expiring quantities of the stock summary (exp_date <= cutoff, covering)
+    ("stock_data", "idx_stock_expiry", "exp_date, management_mode, scenario, item, treecode, final_qty"),
+)
+
+
+def _has_table(cur, table):
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,))
+    return cur.fetchone() is not None
+
+
+def _columns(cur, table):
+    cur.execute(f"PRAGMA table_info({table})")
+    return {r[1].lower() for r in cur.fetchall()}
+
+
+def _add_column(cur, table, column, decl):
+    """ALTER TABLE ... ADD COLUMN unless the table is missing or has it."""
+    if not _has_table(cur, table) or column.lower() in _columns(cur, table):
+        return False
+    cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+    return True
+
+
+# ---------------- Steps ----------------
+def _base_schema(cur):
+    """Tables the screens created on open, and their late-added columns."""
+    for sql in _BASE_TABLE_SQL:
+        cur.execute(sql)
+    _add_column(cur, "project_details", "buffer_months", "INTEGER DEFAULT 0")
+    if _has_table(cur, "users"):
+        _add_column(cur, "users", "preferred_language", "TEXT")
+        _add_column(cur, "users", "symbol", "TEXT")
+        cur.execute("""
+            UPDATE users
+               SET preferred_language = 'EN'
+             WHERE preferred_language IS NULL
+                OR TRIM(preferred_language) = ''
+        """)
+        cur.execute("SELECT user_id, role FROM users WHERE symbol IS NULL OR TRIM(symbol) = ''")
+        cur.executemany(
+            "UPDATE users SET symbol = ? WHERE user_id = ?",
+            [(encode_role(role), user_id) for user_id, role in cur.fetchall()],
+        )
+
+
+def _create_indexes(cur, indexes):
+    for table, name, columns in indexes:
+        if _has_table(cur, table):
+            cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table}({columns})")
+
+
+def _hot_query_indexes(cur):
+    _create_indexes(cur, HOT_QUERY_INDEXES)
+
+
+def _covering_indexes(cur):
+    _create_indexes(cur, COVERING_INDEXES)
+
+
+def _ledger_support(cur):
+    install_ledger_checkpoints(cur)
+    install_archive_registry(cur)
+
+
+# (version, name, step(cur)); versions are consecutive and never reused
+MIGRATIONS = (
+    (1, "base tables and columns", _base_schema),
+    (2, "hot query indexes", _hot_query_indexes),
+    (3, "kit_items closure", install_kit_closure),
+    (4, "ledger checkpoints and archive registry", _ledger_support),
+    (5, "report snapshot version", install_snapshot_version),
+    (6, "report covering indexes", _covering_indexes),
+    (7, "lookup table write counters", install_write_counters),
+)
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn):
+    """PRAGMA user_version of a connection's main database."""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def apply_migrations(conn=None):
+    """
+    Bring the database up to LATEST_VERSION. Returns [(version, name,
+    seconds)] of the steps applied by this call; a failing step is rolled
+    back, logged and stops the run (later steps may depend on it).
+    """
+    own = conn is None
+    conn = conn or connect_db()
+    if conn is None:
+        return []
+    applied = []
+    cur = conn.cursor()
+    try:
+        current = schema_version(conn)
+        if current >= LATEST_VERSION:
+            return applied
+        cur.execute(_HISTORY_SQL)
+        conn.commit()
+        for version, name, step in MIGRATIONS:
+            if version <= current:
+                continue
+            started = time.perf_counter()
+            try:
+                cur.execute("BEGIN IMMEDIATE")
+                step(cur)
+                elapsed = time.perf_counter() - started
+                cur.execute(
+                    "INSERT OR REPLACE INTO schema_migrations (version, name, applied_at, duration_ms) "
+                    "VALUES (?, ?, ?, ?)",
+                    (version, name, datetime.now().isoformat(timespec="seconds"), round(elapsed * 1000, 3)),
+                )
+                cur.execute(f"PRAGMA user_version = {int(version)}")
+                conn.commit()
+            except sqlite3.Error as e:
+                conn.rollback()
+                logging.error(f"[migrations] {version} ({name}) failed: {e}")
+                break
+            applied.append((version, name, elapsed))
+            logging.info(f"[migrations] {version} ({name}) applied in {elapsed * 1000:.1f} ms")
+        if applied:
+            # read the database just migrated, not whatever db.DB_FILE names
+            schema.refresh(conn)
+    finally:
+        cur.close()
+        if own:
+            conn.close()
+    return applied
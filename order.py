@@ -19,12 +19,10 @@ from __future__ import annotations
 import tkinter as tk
 from tkinter import ttk, filedialog
 import sqlite3
-import math
 import time
 from datetime import date, datetime
 from calendar import monthrange
 import re
-from collections import defaultdict
 import openpyxl
 from openpyxl.styles import PatternFill, Font
 from openpyxl.utils import get_column_letter
@@ -37,7 +35,11 @@ except Exception:
     TKCAL_AVAILABLE = False
 
 from db import connect_db
-from manage_items import get_item_description, detect_type
+from filter_options import filter_options
+from schema_registry import schema
+from item_catalog import item_catalog
+from manage_items import detect_type
+from order_engine import order_engine, recompute_row, recompute_rows
 from language_manager import lang
 from popup_utils import custom_popup
 from theme_config import AppTheme, configure_tree_tags, enable_column_auto_resize
@@ -45,9 +47,6 @@ from theme_config import AppTheme, configure_tree_tags, enable_column_auto_resiz
 KIT_FILL_COLOR = "228B22"
 MODULE_FILL_COLOR = "ADD8E6"
 
-LOAN_OUT_TYPES = {"Loan", "Return of Borrowing"}
-LOAN_IN_TYPES = {"In Borrowing", "In Return of Loan"}
-
 INT_ENTRY_MIN = 0
 INT_ENTRY_MAX = 24
 
@@ -71,8 +70,7 @@ def fetch_project_settings():
     cur = conn.cursor()
     lead = cover = buf = 0
     try:
-        cur.execute("PRAGMA table_info(project_details)")
-        cols = {r[1].lower(): r[1] for r in cur.fetchall()}
+        cols = schema.columns("project_details")
         needed = []
         if "lead_time_months" in cols:
             needed.append("lead_time_months")
@@ -118,40 +116,39 @@ class OrderData:
         self.horizon_end = add_months(date.today(), self.horizon_months)
 
     def fetch(self):
-        std_map = self._fetch_standard_qty()
-        stock_map = self._fetch_current_stock()
-        exp_map = self._fetch_expiring_qty()
-        loan_map = self._fetch_loan_balance()
-        commercial = self._fetch_commercial_data(
-            set().union(std_map, stock_map, exp_map, loan_map)
+        matrix = order_engine.matrix(self.kit_filter, self.module_filter)
+        horizon_end = (
+            self.horizon_end.strftime("%Y-%m-%d") if self.horizon_months > 0 else None
+        )
+        search = self.item_search.lower()
+        type_filter = (
+            self.type_filter.lower()
+            if self.type_filter and self.type_filter.lower() != "all"
+            else None
         )
 
-        codes = set(std_map) | set(stock_map) | set(exp_map) | set(loan_map)
         rows = []
-        for code in sorted(codes):
-            desc = get_item_description(code)
+        for m in matrix:
+            code = m.code
+            desc = item_catalog.description(code)
             dtype = detect_type(code, desc)
-            if self.type_filter and self.type_filter.lower() != "all":
-                if dtype.lower() != self.type_filter.lower():
-                    continue
-            if self.item_search:
+            if type_filter and dtype.lower() != type_filter:
+                continue
+            if search:
                 if dtype.lower() != "item":
                     continue
-                if (
-                    self.item_search.lower() not in code.lower()
-                    and self.item_search.lower() not in desc.lower()
-                ):
+                if search not in code.lower() and search not in desc.lower():
                     continue
-            cdat = commercial.get(code, {})
+            cdat = item_catalog.commercial(code)
             row = {
                 "code": code,
                 "description": desc,
                 "type": dtype,
-                "standard_qty": std_map.get(code, 0),
-                "current_stock": stock_map.get(code, 0),
-                "qty_expiring": exp_map.get(code, 0),
+                "standard_qty": m.standard_qty,
+                "current_stock": m.current_stock,
+                "qty_expiring": m.expiring(horizon_end),
                 "back_orders": 0,
-                "loan_balance": loan_map.get(code, 0),
+                "loan_balance": m.loan_balance,
                 "planned_dons_give": 0,
                 "dons_receive": 0,
                 "pack_size": cdat.get("pack_size", 0),
@@ -170,257 +167,6 @@ class OrderData:
             rows.append(row)
         return rows
 
-    def _fetch_standard_qty(self):
-        res = defaultdict(int)
-        conn = connect_db()
-        if not conn:
-            return res
-        cur = conn.cursor()
-        try:
-            cur.execute("PRAGMA table_info(std_qty_helper)")
-            cols = {r[1].lower(): r[1] for r in cur.fetchall()}
-            if "code" not in cols or "std_qty" not in cols:
-                return res
-            filters = []
-            params = []
-            if self.kit_filter and self.kit_filter.lower() != "all" and "kit" in cols:
-                filters.append("kit=?")
-                params.append(self.kit_filter)
-            if (
-                self.module_filter
-                and self.module_filter.lower() != "all"
-                and "module" in cols
-            ):
-                filters.append("module=?")
-                params.append(self.module_filter)
-            where = "WHERE " + " AND ".join(filters) if filters else ""
-            cur.execute(f"SELECT code,std_qty FROM std_qty_helper {where}", params)
-            for c, q in cur.fetchall():
-                if c:
-                    try:
-                        res[c] += int(q or 0)
-                    except:
-                        pass
-        finally:
-            cur.close()
-            conn.close()
-        return res
-
-    def _fetch_current_stock(self):
-        res = defaultdict(int)
-        conn = connect_db()
-        if not conn:
-            return res
-        cur = conn.cursor()
-        try:
-            cur.execute("PRAGMA table_info(stock_data)")
-            cols = {r[1].lower(): r[1] for r in cur.fetchall()}
-            if "final_qty" not in cols:
-                return res
-            has_code = "code" in cols
-            code_col = "code" if has_code else "unique_id"
-            filters = ["final_qty IS NOT NULL"]
-            params = []
-            if (
-                self.kit_filter
-                and self.kit_filter.lower() != "all"
-                and "kit_number" in cols
-            ):
-                filters.append("kit_number=?")
-                params.append(self.kit_filter)
-            if (
-                self.module_filter
-                and self.module_filter.lower() != "all"
-                and "module_number" in cols
-            ):
-                filters.append("module_number=?")
-                params.append(self.module_filter)
-            where = "WHERE " + " AND ".join(filters)
-            cur.execute(f"SELECT {code_col}, final_qty FROM stock_data {where}", params)
-            for c, q in cur.fetchall():
-                code = c if has_code else self._extract_code_from_unique_id(c)
-                if code:
-                    try:
-                        res[code] += int(q or 0)
-                    except:
-                        pass
-        finally:
-            cur.close()
-            conn.close()
-        return res
-
-    def _fetch_expiring_qty(self):
-        res = defaultdict(int)
-        if self.horizon_months <= 0:
-            return res
-        conn = connect_db()
-        if not conn:
-            return res
-        cur = conn.cursor()
-        try:
-            cur.execute("PRAGMA table_info(stock_data)")
-            cols = {r[1].lower(): r[1] for r in cur.fetchall()}
-            if not {"final_qty", "exp_date"} <= set(cols):
-                return res
-            has_code = "code" in cols
-            code_col = "code" if has_code else "unique_id"
-            horizon_end = self.horizon_end.strftime("%Y-%m-%d")
-            filters = [
-                "final_qty IS NOT NULL",
-                "exp_date IS NOT NULL",
-                "exp_date!=''",
-                "exp_date <= ?",
-            ]
-            params = [horizon_end]
-            if (
-                self.kit_filter
-                and self.kit_filter.lower() != "all"
-                and "kit_number" in cols
-            ):
-                filters.append("kit_number=?")
-                params.append(self.kit_filter)
-            if (
-                self.module_filter
-                and self.module_filter.lower() != "all"
-                and "module_number" in cols
-            ):
-                filters.append("module_number=?")
-                params.append(self.module_filter)
-            where = "WHERE " + " AND ".join(filters)
-            cur.execute(f"SELECT {code_col}, final_qty FROM stock_data {where}", params)
-            for c, q in cur.fetchall():
-                code = c if has_code else self._extract_code_from_unique_id(c)
-                if code:
-                    try:
-                        res[code] += int(q or 0)
-                    except:
-                        pass
-        finally:
-            cur.close()
-            conn.close()
-        return res
-
-    def _fetch_loan_balance(self):
-        res = defaultdict(int)
-        conn = connect_db()
-        if not conn:
-            return res
-        cur = conn.cursor()
-        try:
-            cur.execute("PRAGMA table_info(stock_transactions)")
-            cols = {r[1].lower(): r[1] for r in cur.fetchall()}
-            if not {"qty_in", "qty_out", "in_type", "out_type", "code"} <= set(cols):
-                return res
-            filters = []
-            params = []
-            if self.kit_filter and self.kit_filter.lower() != "all" and "kit" in cols:
-                filters.append("Kit=?")
-                params.append(self.kit_filter)
-            if (
-                self.module_filter
-                and self.module_filter.lower() != "all"
-                and "module" in cols
-            ):
-                filters.append("Module=?")
-                params.append(self.module_filter)
-
-            loan_condition = f"(Out_Type IN ({','.join('?'*len(LOAN_OUT_TYPES))}) OR IN_Type IN ({','.join('?'*len(LOAN_IN_TYPES))}))"
-            params_all = params + list(LOAN_OUT_TYPES) + list(LOAN_IN_TYPES)
-            if filters:
-                where = "WHERE " + " AND ".join(filters) + f" AND {loan_condition}"
-            else:
-                where = "WHERE " + loan_condition
-
-            cur.execute(
-                f"""
-                SELECT code, Qty_IN, IN_Type, Qty_Out, Out_Type
-                FROM stock_transactions
-                {where}
-            """,
-                params_all,
-            )
-            for code, q_in, in_type, q_out, out_type in cur.fetchall():
-                if not code:
-                    continue
-                if out_type in LOAN_OUT_TYPES and q_out:
-                    try:
-                        res[code] += int(q_out)
-                    except:
-                        pass
-                if in_type in LOAN_IN_TYPES and q_in:
-                    try:
-                        res[code] -= int(q_in)
-                    except:
-                        pass
-        except Exception:
-            pass
-        finally:
-            cur.close()
-            conn.close()
-        return res
-
-    def _fetch_commercial_data(self, codes):
-        res = {}
-        if not codes:
-            return res
-        conn = connect_db()
-        if not conn:
-            return res
-        cur = conn.cursor()
-        try:
-            cur.execute("PRAGMA table_info(items_list)")
-            cols = {r[1].lower(): r[1] for r in cur.fetchall()}
-            if "code" not in cols:
-                return res
-            field_map = {
-                "pack": "pack_size",
-                "price_per_pack_euros": "price",
-                "weight_per_pack_kg": "weight",
-                "volume_per_pack_dm3": "volume",
-                "account_code": "account",
-            }
-            sel = ["code"] + [c for c in field_map if c in cols]
-            placeholders = ",".join("?" for _ in codes)
-            cur.execute(
-                f"SELECT {', '.join(sel)} FROM items_list WHERE code IN ({placeholders})",
-                list(codes),
-            )
-            idx = {name: i for i, name in enumerate(sel)}
-            for row in cur.fetchall():
-                code = row[idx["code"]]
-                data = {}
-                for src, dst in field_map.items():
-                    if src in idx:
-                        val = row[idx[src]]
-                        try:
-                            if dst in ("pack_size",):
-                                data[dst] = int(val or 0)
-                            elif dst in ("price", "weight", "volume"):
-                                data[dst] = float(val or 0)
-                            else:
-                                data[dst] = val or ""
-                        except:
-                            data[dst] = 0 if dst != "account" else ""
-                res[code] = data
-        finally:
-            cur.close()
-            conn.close()
-        return res
-
-    @staticmethod
-    def _extract_code_from_unique_id(u):
-        try:
-            p = u.split("/")
-            if len(p) >= 4 and p[3] != "None":
-                return p[3]
-            if len(p) >= 3 and p[2] != "None":
-                return p[2]
-            if len(p) >= 2 and p[1] != "None":
-                return p[1]
-            return u
-        except:
-            return u
-
 
 # ---------- UI ----------
 class OrderNeeds(tk.Frame):
@@ -553,6 +299,16 @@ class OrderNeeds(tk.Frame):
             pady=6,
             command=self.export_excel,
         ).pack(side="right", padx=(6, 0))
+        tk.Button(
+            header,
+            text=lang.t("order_needs.what_if", "What-if"),
+            bg=AppTheme.BTN_EXPORT,
+            fg=AppTheme.TEXT_WHITE,
+            relief="flat",
+            padx=14,
+            pady=6,
+            command=self.open_what_if,
+        ).pack(side="right", padx=(6, 0))
         tk.Button(
             header,
             text=lang.t("generic.clear", "Clear"),
@@ -1187,8 +943,7 @@ All calculations update automatically after editing! ⚡
             buffer=self._safe_int(self.buffer_var.get()),
         )
         self.rows = od.fetch()
-        for r in self.rows:
-            self._recompute_row(r)
+        recompute_rows(self.rows)
 
         # Configure columns first (only if changed)
         self._configure_columns()
@@ -1277,49 +1032,7 @@ All calculations update automatically after editing! ⚡
 
     def _recompute_row(self, r):
         """Calculate order quantities"""
-        std = r.get("standard_qty", 0)
-        cur = r.get("current_stock", 0)
-        exp = r.get("qty_expiring", 0)
-        back = r.get("back_orders", 0)
-        loan = r.get("loan_balance", 0)
-        give = r.get("planned_dons_give", 0)
-        rec = r.get("dons_receive", 0)
-
-        qty_needed = std - cur + exp - back - loan + give - rec
-        if qty_needed < 0:
-            qty_needed = 0
-        r["qty_needed"] = qty_needed
-
-        q_to = r.get("qty_to_order", "")
-        if q_to == "":
-            q_to = qty_needed
-        r["qty_to_order"] = q_to
-
-        pack = r.get("pack_size", 0)
-        if pack and pack > 0:
-            rrounded = math.ceil(q_to / pack) * pack
-        else:
-            rrounded = q_to
-        r["qty_to_order_rounded"] = rrounded
-
-        pack_div = pack if pack and pack > 0 else None
-        price = float(r.get("price_per_pack") or 0)
-        wt = float(r.get("weight_per_pack") or 0)
-        vol_dm3 = float(r.get("volume_per_pack_dm3") or 0)
-
-        if pack_div:
-            packs = rrounded / pack_div
-            amount = packs * price
-            weight = packs * wt
-            volume_m3 = (packs * vol_dm3) / 1000
-        else:
-            amount = 0.0
-            weight = 0.0
-            volume_m3 = 0.0
-
-        r["amount"] = amount
-        r["weight_kg"] = weight
-        r["volume_m3"] = volume_m3
+        recompute_row(r)
 
     def _recompute_totals(self):
         total_amount = sum(r.get("amount", 0) for r in self.rows)
@@ -1352,34 +1065,8 @@ All calculations update automatically after editing! ⚡
         self.buffer_var.set(str(buffer))
 
     def populate_dropdowns(self):
-        self.kit_cb["values"] = ["All"] + self._distinct("stock_data", "kit_number")
-        self.module_cb["values"] = ["All"] + self._distinct(
-            "stock_data", "module_number"
-        )
-
-    def _distinct(self, table, column):
-        conn = connect_db()
-        if not conn:
-            return []
-        cur = conn.cursor()
-        try:
-            cur.execute(f"PRAGMA table_info({table})")
-            cols = {r[1].lower(): r[1] for r in cur.fetchall()}
-            if column.lower() not in cols:
-                return []
-            cur.execute(
-                f"""
-                SELECT DISTINCT {column} FROM {table}
-                WHERE {column} IS NOT NULL AND {column}!='' AND {column}!='None'
-                ORDER BY {column}
-            """
-            )
-            return [r[0] for r in cur.fetchall()]
-        except:
-            return []
-        finally:
-            cur.close()
-            conn.close()
+        self.kit_cb["values"] = ["All"] + filter_options.kit_numbers()
+        self.module_cb["values"] = ["All"] + filter_options.module_numbers()
 
     def clear_all(self):
         self.kit_var.set("All")
@@ -1567,6 +1254,171 @@ All calculations update automatically after editing! ⚡
                 "error",
             )
 
+    # ---------- What-if simulation ----------
+    @staticmethod
+    def _parse_int_list(text, lo, hi):
+        values = []
+        for part in re.split(r"[,; ]+", text.strip()):
+            if not part:
+                continue
+            if not part.isdigit() or not (lo <= int(part) <= hi):
+                return None
+            if int(part) not in values:
+                values.append(int(part))
+        return values or None
+
+    def open_what_if(self):
+        """Ask for horizon / AMC window grids, simulate, export the comparison."""
+        top = tk.Toplevel(self)
+        top.title(lang.t("order_needs.what_if", "What-if"))
+        top.configure(bg=AppTheme.BG_MAIN)
+        top.transient(self)
+        top.grab_set()
+        top.resizable(False, False)
+
+        current = (
+            self._safe_int(self.lead_var.get())
+            + self._safe_int(self.cover_var.get())
+            + self._safe_int(self.buffer_var.get())
+        )
+        default_h = sorted({current, 3, 6, 9, 12} - {0}) or [6]
+        horizons_var = tk.StringVar(value=", ".join(str(h) for h in default_h))
+        amc_var = tk.StringVar(value="0, 3, 6, 12")
+
+        tk.Label(
+            top,
+            text=lang.t(
+                "order_needs.what_if_horizons", "Horizons (lead + cover + buffer, months)"
+            ),
+            bg=AppTheme.BG_MAIN,
+        ).grid(row=0, column=0, sticky="w", padx=12, pady=(12, 4))
+        tk.Entry(top, textvariable=horizons_var, width=24).grid(
+            row=0, column=1, padx=12, pady=(12, 4)
+        )
+        tk.Label(
+            top,
+            text=lang.t("order_needs.what_if_amc", "AMC windows (months, 0 = standard only)"),
+            bg=AppTheme.BG_MAIN,
+        ).grid(row=1, column=0, sticky="w", padx=12, pady=4)
+        tk.Entry(top, textvariable=amc_var, width=24).grid(row=1, column=1, padx=12, pady=4)
+
+        def run():
+            horizons = self._parse_int_list(horizons_var.get(), 0, 3 * INT_ENTRY_MAX)
+            windows = self._parse_int_list(amc_var.get(), 0, 99)
+            if not horizons or not windows:
+                custom_popup(
+                    top,
+                    lang.t("generic.error", "Error"),
+                    lang.t("order_needs.invalid_int", "Enter whole integer."),
+                    "error",
+                )
+                return
+            top.grab_release()
+            top.destroy()
+            self._run_what_if(horizons, windows)
+
+        tk.Button(
+            top,
+            text=lang.t("generic.export", "Export"),
+            bg=AppTheme.BTN_EXPORT,
+            fg=AppTheme.TEXT_WHITE,
+            relief="flat",
+            padx=14,
+            pady=6,
+            command=run,
+        ).grid(row=2, column=0, columnspan=2, pady=(8, 12))
+
+    def _run_what_if(self, horizons, windows):
+        started = time.perf_counter()
+        result = order_engine.simulate(
+            self.rows, horizons, windows, self.kit_var.get(), self.module_var.get()
+        )
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.status_var.set(
+            lang.t(
+                "order_needs.what_if_done",
+                "Simulated {n} combinations x {rows} rows in {ms:.0f} ms",
+            ).format(n=len(result.combos), rows=len(self.rows), ms=elapsed_ms)
+        )
+        self._export_what_if(result)
+
+    def _export_what_if(self, result):
+        path = filedialog.asksaveasfilename(
+            defaultextension=".xlsx",
+            filetypes=[("Excel Files", "*.xlsx")],
+            title=lang.t("order_needs.export_title", "Save Order/Needs Report"),
+            initialfile=f"OrderWhatIf_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
+        )
+        if not path:
+            return
+        try:
+            wb = openpyxl.Workbook()
+            ws = wb.active
+            ws.title = "Summary"
+            ws.append(
+                [
+                    lang.t("generic.generated", "Generated"),
+                    datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    "Kit",
+                    self.kit_var.get(),
+                    "Module",
+                    self.module_var.get(),
+                ]
+            )
+            ws.append([])
+            ws.append(
+                [
+                    "Horizon (months)",
+                    "AMC Window (months)",
+                    "Lines To Order",
+                    "Total Amount (€)",
+                    "Total Weight (kg)",
+                    "Total Volume (m3)",
+                ]
+            )
+            for h, a, lines, amount, weight, volume in result.totals():
+                ws.append([h, a, lines, round(amount, 2), round(weight, 3), round(volume, 4)])
+
+            detail = wb.create_sheet("By Code")
+            labels = [f"H{h}/AMC{a}" for h, a in result.combos]
+            detail.append(
+                ["Code", "Description", "Type", "Pack Size"]
+                + [f"{lbl} Qty" for lbl in labels]
+                + [f"{lbl} Amount (€)" for lbl in labels]
+            )
+            for i, r in enumerate(result.rows):
+                detail.append(
+                    [r.get("code"), r.get("description"), r.get("type"), r.get("pack_size", 0)]
+                    + [result.qty_rounded[k][i] for k in range(len(result.combos))]
+                    + [round(result.amount[k][i], 2) for k in range(len(result.combos))]
+                )
+
+            for sheet in (ws, detail):
+                for col in sheet.columns:
+                    length = max(len("" if c.value is None else str(c.value)) for c in col)
+                    sheet.column_dimensions[get_column_letter(col[0].column)].width = min(
+                        length + 2, 60
+                    )
+            detail.freeze_panes = "E2"
+            wb.save(path)
+            custom_popup(
+                self,
+                lang.t("generic.success", "Success"),
+                lang.t("order_needs.export_success", "Export completed: {f}").format(
+                    f=path
+                ),
+                "info",
+            )
+        except Exception as e:
+            custom_popup(
+                self,
+                lang.t("generic.error", "Error"),
+                lang.t("order_needs.export_fail", "Export failed: {err}").format(
+                    err=str(e)
+                ),
+                "error",
+            )
+
 
 __all__ = ["OrderNeeds"]
 
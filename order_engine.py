@@ -0,0 +1,538 @@
+"""
+order_engine.py
+Order-needs matrix for the Order Needs screen (order.py).
+
+OrderData.fetch used to run five separate reads (std_qty_helper, stock_data
+twice, stock_transactions, items_list), each with its own connection and
+PRAGMA, then look up description / type per code. OrderEngine builds the
+whole std / stock / expiring / loan matrix with ONE CTE query:
+
+    std    : SUM(std_qty) per code from std_qty_helper
+    stock  : SUM(final_qty) per code from stock_data, plus the per-expiry
+             quantities packed as "exp_date|qty;..." so the expiring quantity
+             can be derived for any horizon without going back to the DB
+    loans  : loan out - loan in per code from the ledger (stock_transactions
+             plus the archived years, see ledger_archive)
+
+Descriptions and commercial data come from the cached item catalog.
+
+The matrix is cached per (kit, module) filter and validated by the event bus
+and a db.TableWatch, so changing lead / cover / buffer only recomputes
+the expiring column in memory.
+
+recompute_rows() applies the qty_needed / pack rounding / amount / weight /
+volume formulas to all rows at once (NumPy when available, plain Python
+otherwise).
+
+simulate() evaluates the same formulas for a grid of horizons x AMC windows
+in one pass over the cached matrix (what-if comparison).
+"""
+
+import math
+import sqlite3
+import logging
+import threading
+from bisect import bisect_right
+from calendar import monthrange
+from datetime import date
+
+try:
+    import numpy as np
+
+    NUMPY_AVAILABLE = True
+except Exception:
+    NUMPY_AVAILABLE = False
+
+from db import connect_db, TableWatch
+from event_bus import bus, STOCK_CHANGED, COMPOSITION_CHANGED
+from ledger_archive import LEDGER_VIEW, attach_ledger
+from schema_registry import schema
+
+logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
+
+LOAN_OUT_TYPES = ("Loan", "Return of Borrowing")
+LOAN_IN_TYPES = ("In Borrowing", "In Return of Loan")
+
+# Code of a stock_data line: item, else module, else kit (same parts the
+# unique_id carries), else the unique_id itself.
+_STOCK_CODE_EXPR = """COALESCE(NULLIF(NULLIF(item, 'None'), ''),
+                               NULLIF(NULLIF(module, 'None'), ''),
+                               NULLIF(NULLIF(kit, 'None'), ''),
+                               unique_id)"""
+
+_EMPTY_CTE = "SELECT NULL AS code, 0 AS qty WHERE 0"
+
+# 'Out MSF' issues per code between two dates (params: from, to), the AMC base
+AMC_OUT_SQL = f"""
+    SELECT code, SUM(COALESCE(Qty_Out, 0))
+      FROM {LEDGER_VIEW}
+     WHERE Out_Type IS NOT NULL
+       AND LOWER(Out_Type) = LOWER('Out MSF')
+       AND Date >= ? AND Date <= ?
+     GROUP BY code
+"""
+
+# Same issues per code and month (params: from, to)
+MONTHLY_OUT_SQL = f"""
+    SELECT code, substr(Date, 1, 7), SUM(COALESCE(Qty_Out, 0))
+      FROM {LEDGER_VIEW}
+     WHERE Out_Type IS NOT NULL
+       AND LOWER(Out_Type) = LOWER('Out MSF')
+       AND Date >= ? AND Date <= ?
+     GROUP BY code, substr(Date, 1, 7)
+"""
+
+
+def _is_set(value):
+    return bool(value) and value.lower() != "all"
+
+
+def _add_months(base, months):
+    y = base.year + (base.month - 1 + months) // 12
+    m = (base.month - 1 + months) % 12 + 1
+    return date(y, m, min(base.day, monthrange(y, m)[1]))
+
+
+def horizon_end(months, today=None):
+    """'YYYY-MM-DD' end of a horizon of `months` from today (None when <= 0)."""
+    if not months or months <= 0:
+        return None
+    return _add_months(today or date.today(), months).strftime("%Y-%m-%d")
+
+
+class OrderMatrixRow:
+    """Per-code aggregates; expiry holds sorted (exp_date, cumulative qty)."""
+
+    __slots__ = ("code", "standard_qty", "current_stock", "loan_balance", "_exp_dates", "_exp_cumul")
+
+    def __init__(self, code, standard_qty, current_stock, loan_balance, expiry_profile):
+        self.code = code
+        self.standard_qty = int(standard_qty or 0)
+        self.current_stock = int(current_stock or 0)
+        self.loan_balance = int(loan_balance or 0)
+        dates, cumul, total = [], [], 0
+        for part in sorted((expiry_profile or "").split(";")):
+            if not part:
+                continue
+            exp, _, qty = part.rpartition("|")
+            try:
+                total += int(qty or 0)
+            except ValueError:
+                continue
+            dates.append(exp)
+            cumul.append(total)
+        self._exp_dates = dates
+        self._exp_cumul = cumul
+
+    def expiring(self, horizon_end):
+        """Quantity with exp_date <= horizon_end ('YYYY-MM-DD'), None -> 0."""
+        if not horizon_end:
+            return 0
+        idx = bisect_right(self._exp_dates, horizon_end)
+        return self._exp_cumul[idx - 1] if idx else 0
+
+
+class OrderEngine:
+    """Cached order matrix per (kit, module) filter."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._matrices = {}
+        self._watch = TableWatch(("std_qty_helper", "stock_data", "stock_transactions"))
+
+    # ---------------- Staleness ----------------
+    def invalidate(self, *_):
+        with self._lock:
+            self._matrices = {}
+
+    def _check_external_writes(self):
+        if self._watch.changed():
+            self.invalidate()
+
+    # ---------------- Query ----------------
+    @staticmethod
+    def _build_sql(kit_filter, module_filter):
+        params = []
+
+        std_cols = schema.columns("std_qty_helper")
+        if {"code", "std_qty"} <= set(std_cols):
+            where = ["code IS NOT NULL", "code <> ''"]
+            if _is_set(kit_filter) and "kit" in std_cols:
+                where.append("kit = ?")
+                params.append(kit_filter)
+            if _is_set(module_filter) and "module" in std_cols:
+                where.append("module = ?")
+                params.append(module_filter)
+            std_cte = f"""SELECT code, SUM(std_qty) AS qty
+                            FROM std_qty_helper
+                           WHERE {' AND '.join(where)}
+                           GROUP BY code"""
+        else:
+            std_cte = _EMPTY_CTE
+
+        sd_cols = schema.columns("stock_data")
+        if "final_qty" in sd_cols:
+            where = ["final_qty IS NOT NULL"]
+            if _is_set(kit_filter) and "kit_number" in sd_cols:
+                where.append("kit_number = ?")
+                params.append(kit_filter)
+            if _is_set(module_filter) and "module_number" in sd_cols:
+                where.append("module_number = ?")
+                params.append(module_filter)
+            code_expr = "code" if "code" in sd_cols else _STOCK_CODE_EXPR
+            exp_expr = "exp_date" if "exp_date" in sd_cols else "NULL"
+            lines_cte = f"""SELECT {code_expr} AS code, {exp_expr} AS exp_date,
+                                   SUM(final_qty) AS qty
+                              FROM stock_data
+                             WHERE {' AND '.join(where)}
+                             GROUP BY 1, 2"""
+        else:
+            lines_cte = "SELECT NULL AS code, NULL AS exp_date, 0 AS qty WHERE 0"
+
+        tx_cols = schema.columns("stock_transactions")
+        if {"qty_in", "qty_out", "in_type", "out_type", "code"} <= set(tx_cols):
+            out_ph = ",".join("?" * len(LOAN_OUT_TYPES))
+            in_ph = ",".join("?" * len(LOAN_IN_TYPES))
+            # out / in type lists are bound twice: balance, then movement count
+            params.extend(2 * (LOAN_OUT_TYPES + LOAN_IN_TYPES))
+            # ... and once more to read only loan rows (Out_Type / IN_Type indexes)
+            params.extend(LOAN_OUT_TYPES + LOAN_IN_TYPES)
+            where = ["code IS NOT NULL", "code <> ''",
+                     f"(Out_Type IN ({out_ph}) OR IN_Type IN ({in_ph}))"]
+            if _is_set(kit_filter) and "kit" in tx_cols:
+                where.append("Kit = ?")
+                params.append(kit_filter)
+            if _is_set(module_filter) and "module" in tx_cols:
+                where.append("Module = ?")
+                params.append(module_filter)
+            loan_cte = f"""SELECT code,
+                                  SUM(CASE WHEN Out_Type IN ({out_ph}) THEN COALESCE(Qty_Out, 0) ELSE 0 END)
+                                - SUM(CASE WHEN IN_Type IN ({in_ph}) THEN COALESCE(Qty_IN, 0) ELSE 0 END) AS qty,
+                                  SUM(CASE WHEN (Out_Type IN ({out_ph}) AND Qty_Out)
+                                              OR (IN_Type IN ({in_ph}) AND Qty_IN)
+                                           THEN 1 ELSE 0 END) AS moves
+                             FROM {LEDGER_VIEW}
+                            WHERE {' AND '.join(where)}
+                            GROUP BY code"""
+        else:
+            loan_cte = "SELECT NULL AS code, 0 AS qty, 0 AS moves WHERE 0"
+
+        sql = f"""
+            WITH
+              std AS ({std_cte}),
+              lines AS ({lines_cte}),
+              stock AS (
+                SELECT code,
+                       SUM(qty) AS qty,
+                       GROUP_CONCAT(CASE WHEN exp_date IS NOT NULL AND exp_date <> ''
+                                         THEN exp_date || '|' || qty END, ';') AS expiry
+                  FROM lines
+                 WHERE code IS NOT NULL AND code <> ''
+                 GROUP BY code
+              ),
+              loans AS ({loan_cte}),
+              codes AS (
+                SELECT code FROM std
+                UNION SELECT code FROM stock
+                UNION SELECT code FROM loans WHERE moves > 0
+              )
+            SELECT codes.code,
+                   COALESCE(std.qty, 0),
+                   COALESCE(stock.qty, 0),
+                   COALESCE(loans.qty, 0),
+                   stock.expiry
+              FROM codes
+              LEFT JOIN std   ON std.code   = codes.code
+              LEFT JOIN stock ON stock.code = codes.code
+              LEFT JOIN loans ON loans.code = codes.code
+             ORDER BY codes.code
+        """
+        return sql, params
+
+    def _load(self, kit_filter, module_filter):
+        conn = connect_db()
+        if conn is None:
+            return []
+        cur = conn.cursor()
+        try:
+            attach_ledger(conn)
+            sql, params = self._build_sql(kit_filter, module_filter)
+            cur.execute(sql, params)
+            return [OrderMatrixRow(*r) for r in cur.fetchall()]
+        except sqlite3.Error as e:
+            logging.error(f"[OrderEngine] Matrix query failed: {e}")
+            return []
+        finally:
+            cur.close()
+            conn.close()
+
+    def matrix(self, kit_filter=None, module_filter=None):
+        """List of OrderMatrixRow sorted by code (cached)."""
+        key = (
+            kit_filter if _is_set(kit_filter) else None,
+            module_filter if _is_set(module_filter) else None,
+        )
+        self._check_external_writes()
+        with self._lock:
+            rows = self._matrices.get(key)
+            if rows is None:
+                rows = self._load(*key)
+                self._matrices[key] = rows
+            return rows
+
+    # ---------------- Consumption (AMC) ----------------
+    def _load_monthly_out(self, months):
+        """{code: {'YYYY-MM': qty}} of 'Out MSF' issues over the last `months` months."""
+        res = {}
+        tx_cols = schema.columns("stock_transactions")
+        if not {"date", "qty_out", "out_type", "code"} <= set(tx_cols):
+            return res
+        today = date.today()
+        start = _add_months(today.replace(day=1), -(months - 1))
+        end = today.replace(day=monthrange(today.year, today.month)[1])
+        conn = connect_db()
+        if conn is None:
+            return res
+        cur = conn.cursor()
+        try:
+            # The window reaches back into closed (possibly archived) years
+            attach_ledger(conn, start, end)
+            cur.execute(MONTHLY_OUT_SQL, (start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d")))
+            for code, month, qty in cur.fetchall():
+                if code:
+                    res.setdefault(code, {})[month] = qty or 0
+        except sqlite3.Error as e:
+            logging.error(f"[OrderEngine] Consumption query failed: {e}")
+        finally:
+            cur.close()
+            conn.close()
+        return res
+
+    def amc(self, windows):
+        """
+        {window: {code: average monthly consumption}} for each AMC window
+        (months, current month included). Window 0 -> no consumption.
+        One grouped query covers the widest window.
+        """
+        windows = sorted({int(w) for w in windows if int(w) >= 0})
+        widest = max(windows, default=0)
+        result = {w: {} for w in windows}
+        if widest <= 0:
+            return result
+        self._check_external_writes()
+        key = ("amc", widest)
+        with self._lock:
+            monthly = self._matrices.get(key)
+            if monthly is None:
+                monthly = self._load_monthly_out(widest)
+                self._matrices[key] = monthly
+        first_day = date.today().replace(day=1)
+        for w in windows:
+            if w <= 0:
+                continue
+            start = _add_months(first_day, -(w - 1)).strftime("%Y-%m")
+            result[w] = {
+                code: sum(q for m, q in by_month.items() if m >= start) / w
+                for code, by_month in monthly.items()
+            }
+        return result
+
+    # ---------------- What-if ----------------
+    def simulate(self, rows, horizons, amc_windows, kit_filter=None, module_filter=None):
+        """
+        Evaluate the order formulas for every (horizon, AMC window) pair.
+
+        rows are the Order Needs rows (their back orders / loans / donations
+        edits are kept; a manual qty_to_order is ignored). For each pair:
+            demand     = standard_qty, or max(standard_qty, ceil(AMC * horizon))
+                         when the AMC window is > 0
+            qty_needed = max(demand - current_stock + expiring(horizon)
+                             - back_orders - loan_balance
+                             + planned_dons_give - dons_receive, 0)
+        then pack rounding, amount, weight and volume as in recompute_row().
+
+        Returns a WhatIfResult.
+        """
+        combos = [(int(h), int(a)) for h in horizons for a in amc_windows]
+        matrix = {m.code: m for m in self.matrix(kit_filter, module_filter)}
+        amc_maps = self.amc(a for _, a in combos)
+        ends = {h: horizon_end(h) for h, _ in combos}
+
+        codes = [r["code"] for r in rows]
+        expiring = {
+            h: [matrix[c].expiring(end) if c in matrix else 0 for c in codes]
+            for h, end in ends.items()
+        }
+        amc = {a: [amc_maps.get(a, {}).get(c, 0.0) for c in codes] for _, a in combos}
+
+        if NUMPY_AVAILABLE:
+            out = _simulate_numpy(rows, combos, expiring, amc)
+        else:
+            out = _simulate_python(rows, combos, expiring, amc)
+        return WhatIfResult(rows, combos, *out)
+
+
+class WhatIfResult:
+    """
+    Per-combo results of OrderEngine.simulate().
+      combos      : [(horizon_months, amc_window)]
+      qty_needed, qty_rounded, amount, weight_kg, volume_m3 :
+                    [combo index][row index]
+    """
+
+    def __init__(self, rows, combos, qty_needed, qty_rounded, amount, weight_kg, volume_m3):
+        self.rows = rows
+        self.combos = combos
+        self.qty_needed = qty_needed
+        self.qty_rounded = qty_rounded
+        self.amount = amount
+        self.weight_kg = weight_kg
+        self.volume_m3 = volume_m3
+
+    def totals(self):
+        """[(horizon, amc_window, lines_to_order, amount, weight_kg, volume_m3)] per combo."""
+        return [
+            (
+                h,
+                a,
+                sum(1 for q in self.qty_rounded[k] if q > 0),
+                float(sum(self.amount[k])),
+                float(sum(self.weight_kg[k])),
+                float(sum(self.volume_m3[k])),
+            )
+            for k, (h, a) in enumerate(self.combos)
+        ]
+
+
+def _simulate_python(rows, combos, expiring, amc):
+    needed_all, rounded_all, amount_all, weight_all, volume_all = [], [], [], [], []
+    for h, a in combos:
+        needed_k, rounded_k, amount_k, weight_k, volume_k = [], [], [], [], []
+        for i, r in enumerate(rows):
+            std = r.get("standard_qty", 0)
+            if a > 0:
+                std = max(std, math.ceil(amc[a][i] * h))
+            sim = dict(r)
+            sim.update(standard_qty=std, qty_expiring=expiring[h][i], qty_to_order="")
+            recompute_row(sim)
+            needed_k.append(sim["qty_needed"])
+            rounded_k.append(sim["qty_to_order_rounded"])
+            amount_k.append(sim["amount"])
+            weight_k.append(sim["weight_kg"])
+            volume_k.append(sim["volume_m3"])
+        needed_all.append(needed_k)
+        rounded_all.append(rounded_k)
+        amount_all.append(amount_k)
+        weight_all.append(weight_k)
+        volume_all.append(volume_k)
+    return needed_all, rounded_all, amount_all, weight_all, volume_all
+
+
+def _simulate_numpy(rows, combos, expiring, amc):
+    n = len(rows)
+
+    def col(key, dtype=np.int64):
+        return np.fromiter((r.get(key) or 0 for r in rows), dtype=dtype, count=n)
+
+    horizons = np.array([h for h, _ in combos], dtype=np.float64)[:, None]
+    amc_mat = np.array([amc[a] for _, a in combos], dtype=np.float64).reshape(len(combos), n)
+    exp_mat = np.array([expiring[h] for h, _ in combos], dtype=np.int64).reshape(len(combos), n)
+
+    demand = np.maximum(col("standard_qty")[None, :], np.ceil(amc_mat * horizons).astype(np.int64))
+    base = (
+        -col("current_stock") - col("back_orders") - col("loan_balance")
+        + col("planned_dons_give") - col("dons_receive")
+    )
+    needed = np.maximum(demand + exp_mat + base[None, :], 0)
+
+    pack = col("pack_size")[None, :]
+    has_pack = pack > 0
+    safe_pack = np.where(has_pack, pack, 1)
+    rounded = np.where(has_pack, -(-needed // safe_pack) * safe_pack, needed)
+    packs = np.where(has_pack, rounded / safe_pack, 0.0)
+    amount = packs * col("price_per_pack", np.float64)[None, :]
+    weight = packs * col("weight_per_pack", np.float64)[None, :]
+    volume = packs * col("volume_per_pack_dm3", np.float64)[None, :] / 1000
+    return needed.tolist(), rounded.tolist(), amount.tolist(), weight.tolist(), volume.tolist()
+
+
+# ---------------- Row formulas ----------------
+def recompute_row(r):
+    """qty_needed, qty_to_order, pack rounding, amount / weight / volume for one row."""
+    qty_needed = (
+        r.get("standard_qty", 0) - r.get("current_stock", 0) + r.get("qty_expiring", 0)
+        - r.get("back_orders", 0) - r.get("loan_balance", 0)
+        + r.get("planned_dons_give", 0) - r.get("dons_receive", 0)
+    )
+    if qty_needed < 0:
+        qty_needed = 0
+    r["qty_needed"] = qty_needed
+
+    q_to = r.get("qty_to_order", "")
+    if q_to == "":
+        q_to = qty_needed
+    r["qty_to_order"] = q_to
+
+    pack = r.get("pack_size", 0)
+    if pack and pack > 0:
+        rounded = math.ceil(q_to / pack) * pack
+        packs = rounded / pack
+        r["qty_to_order_rounded"] = rounded
+        r["amount"] = packs * float(r.get("price_per_pack") or 0)
+        r["weight_kg"] = packs * float(r.get("weight_per_pack") or 0)
+        r["volume_m3"] = (packs * float(r.get("volume_per_pack_dm3") or 0)) / 1000
+    else:
+        r["qty_to_order_rounded"] = q_to
+        r["amount"] = 0.0
+        r["weight_kg"] = 0.0
+        r["volume_m3"] = 0.0
+
+
+def recompute_rows(rows):
+    """recompute_row() for every row, vectorized with NumPy when available."""
+    if not rows:
+        return
+    if not NUMPY_AVAILABLE:
+        for r in rows:
+            recompute_row(r)
+        return
+
+    def col(key, dtype=np.int64):
+        return np.fromiter((r.get(key) or 0 for r in rows), dtype=dtype, count=len(rows))
+
+    needed = (
+        col("standard_qty") - col("current_stock") + col("qty_expiring")
+        - col("back_orders") - col("loan_balance")
+        + col("planned_dons_give") - col("dons_receive")
+    )
+    np.maximum(needed, 0, out=needed)
+
+    manual = np.fromiter((r.get("qty_to_order", "") != "" for r in rows), dtype=bool, count=len(rows))
+    q_to = np.where(
+        manual,
+        np.fromiter((r.get("qty_to_order") if r.get("qty_to_order", "") != "" else 0 for r in rows),
+                    dtype=np.int64, count=len(rows)),
+        needed,
+    )
+
+    pack = col("pack_size")
+    has_pack = pack > 0
+    safe_pack = np.where(has_pack, pack, 1)
+    rounded = np.where(has_pack, -(-q_to // safe_pack) * safe_pack, q_to)
+    packs = np.where(has_pack, rounded / safe_pack, 0.0)
+    amount = packs * col("price_per_pack", np.float64)
+    weight = packs * col("weight_per_pack", np.float64)
+    volume = packs * col("volume_per_pack_dm3", np.float64) / 1000
+
+    for i, r in enumerate(rows):
+        r["qty_needed"] = int(needed[i])
+        r["qty_to_order"] = int(q_to[i])
+        r["qty_to_order_rounded"] = int(rounded[i])
+        r["amount"] = float(amount[i])
+        r["weight_kg"] = float(weight[i])
+        r["volume_m3"] = float(volume[i])
+
+
+# Shared instance reused by every screen
+order_engine = OrderEngine()
+bus.subscribe((STOCK_CHANGED, COMPOSITION_CHANGED), order_engine.invalidate)
@@ -5,10 +5,13 @@ import sqlite3
 import os
 import re
 import logging
-from db import connect_db
+from db import connect_db, cached_query
+from event_bus import bus, STOCK_CHANGED
+from schema_registry import schema
 from language_manager import lang
 from stock_data import parse_expiry   # only need parse_expiry now
-from transaction_utils import log_transaction
+from transaction_utils import LAST_DOCUMENT_SQL, insert_transaction
+from write_queue import writer
 from popup_utils import custom_popup, custom_askyesno, custom_dialog
 import openpyxl
 from openpyxl.styles import PatternFill, Alignment, Font
@@ -88,22 +91,12 @@ def check_expiry_required(code):
 
 
 def fetch_project_details():
-    conn = connect_db()
-    if conn is None:
+    row = next(iter(cached_query("SELECT project_name, project_code FROM project_details LIMIT 1")), None)
+    if not row:
         return (lang.t("stock_out.unknown_project", "Unknown Project"),
                 lang.t("stock_out.unknown_code", "Unknown Code"))
-    cur = conn.cursor()
-    try:
-        cur.execute("SELECT project_name, project_code FROM project_details LIMIT 1")
-        row = cur.fetchone()
-        if not row:
-            return (lang.t("stock_out.unknown_project", "Unknown Project"),
-                    lang.t("stock_out.unknown_code", "Unknown Code"))
-        return (row[0] or lang.t("stock_out.unknown_project", "Unknown Project"),
-                row[1] or lang.t("stock_out.unknown_code", "Unknown Code"))
-    finally:
-        cur.close()
-        conn.close()
+    return (row[0] or lang.t("stock_out.unknown_project", "Unknown Project"),
+            row[1] or lang.t("stock_out.unknown_code", "Unknown Code"))
 
 
 # ---------------- OUT type helpers ---------------- #
@@ -246,11 +239,7 @@ class StockOut(tk.Frame):
         if conn:
             cur = conn.cursor()
             try:
-                cur.execute("""
-                    SELECT document_number FROM stock_transactions
-                    WHERE document_number LIKE ?
-                    ORDER BY document_number DESC LIMIT 1
-                """, (prefix + "/%",))
+                cur.execute(LAST_DOCUMENT_SQL, (prefix + "/%",))
                 r = cur.fetchone()
                 if r and r[0]:
                     tail = r[0].rsplit('/', 1)[-1]
@@ -272,8 +261,7 @@ class StockOut(tk.Frame):
         conn.row_factory = sqlite3.Row
         cur = conn.cursor()
         try:
-            cur.execute("PRAGMA table_info(stock_data)")
-            cols = [c[1] for c in cur.fetchall()]
+            cols = list(schema.columns("stock_data").values())
             if "final_qty" not in cols or "management_mode" not in cols:
                 logging.warning("Required columns (final_qty / management_mode) missing.")
                 return []
@@ -589,12 +577,11 @@ class StockOut(tk.Frame):
         return bool(parsed and parsed > today)
 
     # ---- Direct delta application (NO final_qty touch) ----
-    def _apply_stock_out_delta(self, unique_id, delta_qty_out, expiry_date=None, scenario_name=None):
+    @staticmethod
+    def _apply_stock_out_delta(conn, unique_id, delta_qty_out, expiry_date=None, scenario_name=None):
+        """Writer job: add delta_qty_out to the lot (the caller's writer transaction commits)."""
         if delta_qty_out <= 0:
             return
-        conn = connect_db()
-        if conn is None:
-            raise RuntimeError("DB connection failed")
         cur = conn.cursor()
         try:
             cur.execute("SELECT qty_in, qty_out, final_qty FROM stock_data WHERE unique_id=?", (unique_id,))
@@ -613,18 +600,20 @@ class StockOut(tk.Frame):
                     INSERT INTO stock_data (unique_id, scenario, qty_in, qty_out, exp_date)
                     VALUES (?, ?, 0, ?, ?)
                 """, (unique_id, scenario_name, delta_qty_out, expiry_date))
-            conn.commit()
 
             cur.execute("SELECT qty_in, qty_out, final_qty FROM stock_data WHERE unique_id=?", (unique_id,))
             after = cur.fetchone()
             logging.info(f"[STOCK_OUT][AFTER] {unique_id} -> {after}")
-
-        except Exception:
-            conn.rollback()
-            raise
         finally:
             cur.close()
-            conn.close()
+
+    @staticmethod
+    def _save_row(conn, transaction, scenario_name):
+        """Writer job of one row: the stock_data delta and its ledger line, in one savepoint."""
+        StockOut._apply_stock_out_delta(conn, transaction["unique_id"], transaction["Qty_Out"],
+                                        expiry_date=transaction["Expiry_date"],
+                                        scenario_name=scenario_name)
+        insert_transaction(conn, **transaction)
 
     # ---- Current final (read only) ----
     def _current_final(self, unique_id):
@@ -678,6 +667,7 @@ class StockOut(tk.Frame):
         doc_number = self.generate_document_number(out_display)
         invalid = []
         export_rows = []
+        pending = []   # (writer future, export row)
 
         for iid in rows:
             vals = self.tree.item(iid, "values")
@@ -722,49 +712,46 @@ class StockOut(tk.Frame):
             kit_number = parts[6] if len(parts) > 6 and parts[6] != "None" else ""
             module_number = parts[7] if len(parts) > 7 and parts[7] != "None" else ""
 
-            try:
-                self._apply_stock_out_delta(unique_id, delta_qty_out,
-                                            expiry_date=expiry_date,
-                                            scenario_name=scenario_name)
-            except Exception as e:
-                self._err("stock_out.save_failed", "Failed updating stock_data: {error}", error=str(e))
-                continue
-
-            try:
-                log_transaction(
-                    unique_id=unique_id,
-                    code=code,
-                    Description=description,
-                    Expiry_date=expiry_date,
-                    Batch_Number=None,
-                    Scenario=scenario_name,
-                    Kit=kit_number or None,
-                    Module=module_number or None,
-                    Qty_IN=None,
-                    IN_Type=None,
-                    Qty_Out=delta_qty_out,
-                    Out_Type=out_type,  # canonical English
-                    Third_Party=third_party if third_party else None,
-                    End_User=end_user if end_user else None,
-                    Remarks=remarks,
-                    Movement_Type="stock_out",
-                    document_number=doc_number
-                )
-                export_rows.append({
-                    "code": code,
-                    "description": description,
-                    "type": item_type,
-                    "kit_number": kit_number,
-                    "module_number": module_number,
-                    "current_stock": int(current_stock) if str(current_stock).isdigit() else 0,
-                    "expiry_date": exp_date or "",
-                    "batch_number": "",
-                    "qty_issued": delta_qty_out
-                })
-            except Exception as e:
-                self._err("stock_out.save_failed", "Failed to log transaction: {error}", error=str(e))
-                continue
+            # queued for the writer thread: all rows of the save share one commit
+            transaction = dict(
+                unique_id=unique_id,
+                code=code,
+                Description=description,
+                Expiry_date=expiry_date,
+                Batch_Number=None,
+                Scenario=scenario_name,
+                Kit=kit_number or None,
+                Module=module_number or None,
+                Qty_IN=None,
+                IN_Type=None,
+                Qty_Out=delta_qty_out,
+                Out_Type=out_type,  # canonical English
+                Third_Party=third_party if third_party else None,
+                End_User=end_user if end_user else None,
+                Remarks=remarks,
+                Movement_Type="stock_out",
+                document_number=doc_number
+            )
+            pending.append((writer.submit(self._save_row, transaction, scenario_name), {
+                "code": code,
+                "description": description,
+                "type": item_type,
+                "kit_number": kit_number,
+                "module_number": module_number,
+                "current_stock": int(current_stock) if str(current_stock).isdigit() else 0,
+                "expiry_date": exp_date or "",
+                "batch_number": "",
+                "qty_issued": delta_qty_out
+            }))
+
+        for future, row in pending:
+            error = future.exception()
+            if error is None:
+                export_rows.append(row)
+            else:
+                self._err("stock_out.save_failed", "Failed updating stock_data: {error}", error=str(error))
 
+        bus.publish(STOCK_CHANGED)
         self._info("stock_out.save_success", "Stock OUT saved successfully.")
         self.status_var.set(lang.t("stock_out.document_number_saved",
                                    "Saved. Document Number: {doc}").format(doc=doc_number))
@@ -23,7 +23,12 @@ from popup_utils import custom_popup, custom_askyesno, custom_dialog
 import os
 
 
-from db import connect_db
+from db import connect_db, cached_query
+from transaction_utils import LAST_DOCUMENT_SQL
+from event_bus import bus, STOCK_CHANGED
+from write_queue import writer
+from fefo_allocator import IssueConflict, allocate, apply_issue
+from kit_structure_index import kit_structure
 from manage_items import get_item_description, detect_type
 from language_manager import lang
 from theme_config import (
@@ -44,14 +49,8 @@ OUT_TYPE_CANONICAL = "Internal move from in-box items"
 
 
 def fetch_project_details():
-    conn = connect_db()
-    if conn is None:
-        logging.error("[BREAK] DB connection failed (fetch_project_details)")
-        return "Unknown Project", "Unknown Code"
-    cur = conn.cursor()
     try:
-        cur.execute("SELECT project_name, project_code FROM project_details LIMIT 1")
-        row = cur.fetchone()
+        row = next(iter(cached_query("SELECT project_name, project_code FROM project_details LIMIT 1")), None)
         return (
             row[0] if row and row[0] else "Unknown Project",
             row[1] if row and row[1] else "Unknown Code",
@@ -59,9 +58,6 @@ def fetch_project_details():
     except sqlite3.Error as e:
         logging.error(f"[BREAK] fetch_project_details error: {e}")
         return "Unknown Project", "Unknown Code"
-    finally:
-        cur.close()
-        conn.close()
 
 
 def configure_db_pragmas():
@@ -131,7 +127,7 @@ class StockOutKit(tk.Frame):
         self.row_data = {}  # iid -> metadata
         self.search_min_chars = 2
         self.editing_cell = None
-        self._item_index_cache = {}
+        self._item_index = None
 
         if self.parent and self.parent.winfo_exists():
             self.pack(fill="both", expand=True)
@@ -241,21 +237,12 @@ class StockOutKit(tk.Frame):
 
     # -------------------- Scenario / Modes --------------------
     def fetch_scenario_map(self):
-        conn = connect_db()
-        if conn is None:
-            return {}
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
         try:
-            cur.execute("SELECT scenario_id, name FROM scenarios ORDER BY name")
-            rows = cur.fetchall()
+            rows = cached_query("SELECT scenario_id, name FROM scenarios ORDER BY name")
             return {str(r["scenario_id"]): r["name"] for r in rows}
         except sqlite3.Error as e:
             logging.error(f"[BREAK] fetch_scenario_map error: {e}")
             return {}
-        finally:
-            cur.close()
-            conn.close()
 
     def build_mode_definitions(self):
         """
@@ -799,54 +786,13 @@ class StockOutKit(tk.Frame):
     # ============================= out_kit.py (Part 2/6) =============================
     # -------------------- Index / Treecode --------------------
     def ensure_item_index(self, scenario_id):
-        if self._item_index_cache.get(
-            "scenario_id"
-        ) == scenario_id and self._item_index_cache.get("flat_map"):
-            return
-        self._item_index_cache = {
-            "scenario_id": scenario_id,
-            "flat_map": {},
-            "triple_map": {},
-        }
-        conn = connect_db()
-        if conn is None:
-            return
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-        try:
-            cur.execute(
-                """
-                SELECT code, kit, module, item, treecode, level
-                  FROM kit_items
-                 WHERE scenario_id=?
-            """,
-                (scenario_id,),
-            )
-            for r in cur.fetchall():
-                code = (r["code"] or "").strip()
-                kit = (r["kit"] or "").strip()
-                module = (r["module"] or "").strip()
-                item = (r["item"] or "").strip()
-                treecode = r["treecode"]
-                entry = {
-                    "code": code,
-                    "kit": kit,
-                    "module": module,
-                    "item": item,
-                    "treecode": treecode,
-                    "level": (r["level"] or "").lower(),
-                }
-                for tok in (code, kit, module, item):
-                    if tok and tok.upper() != "NONE":
-                        self._item_index_cache["flat_map"].setdefault(tok, entry)
-                self._item_index_cache["triple_map"][
-                    (kit or None, module or None, item or None)
-                ] = entry
-        except sqlite3.Error as e:
-            logging.error(f"[BREAK] ensure_item_index error: {e}")
-        finally:
-            cur.close()
-            conn.close()
+        """
+        Point at the shared kit structure of the scenario (built once, kept
+        current) and return it. Loads resolve it once and pass it to
+        enrich_stock_row() for every row.
+        """
+        self._item_index = kit_structure.structure(scenario_id)
+        return self._item_index
 
     @staticmethod
     def parse_unique_id(unique_id: str):
@@ -877,8 +823,10 @@ class StockOutKit(tk.Frame):
         Kit_number,
         module_number,
         line_id,
+        structure=None,
     ):
-        self.ensure_item_index(scenario_id)
+        if structure is None:
+            structure = self.ensure_item_index(scenario_id)
         parsed = self.parse_unique_id(unique_id)
         kit_code = parsed["kit"]
         module_code = parsed["module"]
@@ -898,11 +846,8 @@ class StockOutKit(tk.Frame):
             forced = "Kit"
             triple_key = (kit_code, None, None)
 
-        idx = self._item_index_cache
-        entry = idx.get("triple_map", {}).get(triple_key) or idx.get(
-            "flat_map", {}
-        ).get(display_code or "")
-        treecode = entry.get("treecode") if entry else None
+        entry = structure.resolve(*triple_key, display_code=display_code)
+        treecode = entry.treecode if entry else None
 
         description = get_item_description(display_code or "")
         detected = detect_type(display_code or "", description) or forced
@@ -937,7 +882,7 @@ class StockOutKit(tk.Frame):
         Fetch stock data for a kit number.
         ✅ FILTERS: Only in-box items (> 6 slashes in unique_id).
         """
-        self.ensure_item_index(scenario_id)
+        structure = self.ensure_item_index(scenario_id)
         conn = connect_db()
         if conn is None:
             logging.error(
@@ -974,6 +919,7 @@ class StockOutKit(tk.Frame):
                     r["kit_number"],
                     r["module_number"],
                     r["line_id"],
+                    structure=structure,
                 )
                 for r in rows
             ]
@@ -997,7 +943,7 @@ class StockOutKit(tk.Frame):
         Fetch stock data for a module number.
         ✅ FILTERS: Only in-box items (> 6 slashes in unique_id).
         """
-        self.ensure_item_index(scenario_id)
+        structure = self.ensure_item_index(scenario_id)
         conn = connect_db()
         if conn is None:
             logging.error(
@@ -1034,6 +980,7 @@ class StockOutKit(tk.Frame):
                     r["kit_number"],
                     r["module_number"],
                     r["line_id"],
+                    structure=structure,
                 )
                 for r in rows
             ]
@@ -1055,7 +1002,7 @@ class StockOutKit(tk.Frame):
         Fetch standalone stock items (no kit_number or module_number).
         ✅ FILTERS: Only in-box items (> 6 slashes in unique_id).
         """
-        self.ensure_item_index(scenario_id)
+        structure = self.ensure_item_index(scenario_id)
         conn = connect_db()
         if conn is None:
             logging.error(
@@ -1093,6 +1040,7 @@ class StockOutKit(tk.Frame):
                     r["kit_number"],
                     r["module_number"],
                     r["line_id"],
+                    structure=structure,
                 )
                 for r in rows
             ]
@@ -2117,25 +2065,35 @@ class StockOutKit(tk.Frame):
                 if raw.startswith("★"):
                     raw = raw[2:].strip()
                 module_map[meta.get("module_number")] = int(raw) if raw.isdigit() else 0
+        # Lots of the same item inside one module share the module requirement (FEFO)
+        groups = {}
         for iid in self.tree.get_children():
             meta = self.row_data.get(iid, {})
             if meta.get("is_header"):
                 continue
             if meta.get("row_type") != "Item":
                 continue
-            vals = list(self.tree.item(iid, "values"))
-            std_qty = meta.get("std_qty") or 1
-            mod_qty = module_map.get(meta.get("module_number"), 0)
-            desired = std_qty * mod_qty
+            vals = self.tree.item(iid, "values")
             try:
                 stock = int(vals[5]) if vals[5] else 0
             except:
                 stock = 0
-            if desired > stock:
-                desired = stock
-            vals[8] = str(desired)
-            vals[11] = str(desired)
-            self.tree.item(iid, values=vals)
+            key = (meta.get("module_number"), vals[0])
+            groups.setdefault(key, []).append(
+                {
+                    "iid": iid,
+                    "expiry_date": vals[6],
+                    "current_stock": stock,
+                    "std_qty": meta.get("std_qty") or 1,
+                }
+            )
+        for (module_number, _code), lots in groups.items():
+            desired = lots[0]["std_qty"] * module_map.get(module_number, 0)
+            for lot, qty, _ in allocate(lots, desired):
+                vals = list(self.tree.item(lot["iid"], "values"))
+                vals[8] = str(qty)
+                vals[11] = str(qty)
+                self.tree.item(lot["iid"], values=vals)
 
     def _reapply_editable_icons(self, rules):
         editable_lower = {t.lower() for t in rules["editable_types"]}
@@ -3416,11 +3374,7 @@ class StockOutKit(tk.Frame):
             cur = conn.cursor()
             try:
                 cur.execute(
-                    """
-                    SELECT document_number FROM stock_transactions
-                     WHERE document_number LIKE ?
-                     ORDER BY document_number DESC LIMIT 1
-                """,
+                    LAST_DOCUMENT_SQL,
                     (prefix + "/%",),
                 )
                 r = cur.fetchone()
@@ -4055,78 +4009,32 @@ class StockOutKit(tk.Frame):
             )
         )
 
-        # Process with retry logic
-        import time
-
-        max_attempts = 4
-
-        for attempt in range(1, max_attempts + 1):
-            conn = connect_db()
-            if conn is None:
-                custom_popup(
-                    self.parent,
-                    lang.t("dialog_titles.error", "Error"),
-                    lang.t(
-                        "out_kit.db_connection_failed", "Database connection failed."
-                    ),
-                    "error",
-                )
-                return
+        now_date = datetime.today().strftime("%Y-%m-%d")
+        now_time = datetime.now().strftime("%H:%M:%S")
 
+        def book(conn):
+            # Runs on the writer thread, which commits the whole break at once
+            # and retries while another process holds the database
+            cur = conn.cursor()
             try:
-                conn.execute("PRAGMA busy_timeout=5000;")
-                cur = conn.cursor()
-                now_date = datetime.today().strftime("%Y-%m-%d")
-                now_time = datetime.now().strftime("%H:%M:%S")
-
-                # Process each row
-                for r in rows:
-                    # ===== 1️⃣ OUT TRANSACTION (in-box) =====
-
-                    # Verify in-box stock availability
-                    cur.execute(
-                        """
-                        SELECT final_qty FROM stock_data WHERE unique_id = ?
-                    """,
-                        (r["unique_id_inbox"],),
+                # ===== 1️⃣ OUT (in-box): verify + book every lot in one batch =====
+                try:
+                    apply_issue(
+                        cur,
+                        [(r["unique_id_inbox"], r["qty_out"], r["code"]) for r in rows],
+                        f"{now_date} {now_time}",
                     )
-
-                    db_row = cur.fetchone()
-                    if not db_row or db_row[0] is None or db_row[0] < r["qty_out"]:
-                        raise ValueError(
-                            lang.t(
-                                "out_kit.insufficient_stock",
-                                "Insufficient stock or concurrency issue for {code}",
-                                code=r["code"],
-                            )
+                except IssueConflict as e:
+                    raise ValueError(
+                        lang.t(
+                            "out_kit.concurrent_change",
+                            "Concurrent change or insufficient stock for {code}",
+                            code=", ".join(e.codes),
                         )
-
-                    # Update in-box stock_data: Increase qty_out
-                    cur.execute(
-                        """
-                        UPDATE stock_data
-                        SET qty_out = qty_out + ?,
-                            updated_at = ?
-                        WHERE unique_id = ?
-                          AND (qty_in - qty_out) >= ?
-                    """,
-                        (
-                            r["qty_out"],
-                            f"{now_date} {now_time}",
-                            r["unique_id_inbox"],
-                            r["qty_out"],
-                        ),
                     )
 
-                    if cur.rowcount == 0:
-                        raise ValueError(
-                            lang.t(
-                                "out_kit.concurrent_change",
-                                "Concurrent change or insufficient stock for {code}",
-                                code=r["code"],
-                            )
-                        )
-
+                # Process each row
+                for r in rows:
                     # ✅ Build comment for OUT transaction
                     out_comment = (
                         f"OUT from in-box {r['kit_number']}/{r['module_number']}"
@@ -4279,113 +4187,68 @@ class StockOutKit(tk.Frame):
                         logging.info(
                             f"[OUT_KIT] IN processed: {r['code']} qty={r['qty_in']} to on-shelf"
                         )
+            finally:
+                cur.close()
 
-                # Commit transaction
-                conn.commit()
-
-                # Success message
-                total_transactions = len(rows) * 2
-                custom_popup(
-                    self.parent,
-                    lang.t("dialog_titles.success", "Success"),
-                    lang.t(
-                        "out_kit.break_complete",
-                        "Break complete. Logged {count} transactions (OUT from in-box + IN to on-shelf).",
-                        count=total_transactions,
-                    ),
-                    "info",
-                )
-
-                self.status_var.set(
-                    lang.t(
-                        "out_kit.break_complete_doc",
-                        "Break complete. Document Number: {doc}",
-                        doc=doc_number,
-                    )
+        try:
+            writer.run(book)
+        except Exception as e:
+            logging.error(f"[OUT_KIT] Break failed: {e}")
+            if isinstance(e, sqlite3.OperationalError) and "locked" in str(e).lower():
+                message = lang.t(
+                    "out_kit.break_failed_locked", "Break failed: database remained locked."
                 )
-
-                # Ask for export
-                if (
-                    custom_askyesno(
-                        self.parent,
-                        lang.t("dialog_titles.confirm", "Confirm"),
-                        lang.t(
-                            "out_kit.ask_export", "Export the break operation to Excel?"
-                        ),
-                    )
-                    == "yes"
-                ):
-                    self.export_data(rows)
-
-                # Clear form
-                self.clear_form()
-                return
-
-            except sqlite3.OperationalError as e:
-                if "locked" in str(e).lower() and attempt < max_attempts:
-                    logging.warning(
-                        f"[OUT_KIT] Database locked attempt {attempt}/{max_attempts}, retrying..."
-                    )
-                    try:
-                        conn.rollback()
-                    except:
-                        pass
-                    time.sleep(0.8 * attempt)
-                    continue
-                else:
-                    try:
-                        conn.rollback()
-                    except:
-                        pass
-                    logging.error(f"[OUT_KIT] Break failed: {e}")
-                    custom_popup(
-                        self.parent,
-                        lang.t("dialog_titles.error", "Error"),
-                        lang.t(
-                            "out_kit.break_failed",
-                            "Break failed: {error}",
-                            error=str(e),
-                        ),
-                        "error",
-                    )
-                    return
-
-            except Exception as e:
-                try:
-                    conn.rollback()
-                except:
-                    pass
-                logging.error(f"[OUT_KIT] Break failed: {e}")
-                custom_popup(
-                    self.parent,
-                    lang.t("dialog_titles.error", "Error"),
-                    lang.t(
-                        "out_kit.break_failed", "Break failed: {error}", error=str(e)
-                    ),
-                    "error",
+            else:
+                message = lang.t(
+                    "out_kit.break_failed", "Break failed: {error}", error=str(e)
                 )
-                return
+            custom_popup(
+                self.parent,
+                lang.t("dialog_titles.error", "Error"),
+                message,
+                "error",
+            )
+            return
 
-            finally:
-                try:
-                    cur.close()
-                except:
-                    pass
-                try:
-                    conn.close()
-                except:
-                    pass
+        bus.publish(STOCK_CHANGED)
 
-        # Max attempts reached
+        # Success message
+        total_transactions = len(rows) * 2
         custom_popup(
             self.parent,
-            lang.t("dialog_titles.error", "Error"),
+            lang.t("dialog_titles.success", "Success"),
             lang.t(
-                "out_kit.break_failed_locked", "Break failed: database remained locked."
+                "out_kit.break_complete",
+                "Break complete. Logged {count} transactions (OUT from in-box + IN to on-shelf).",
+                count=total_transactions,
             ),
-            "error",
+            "info",
+        )
+
+        self.status_var.set(
+            lang.t(
+                "out_kit.break_complete_doc",
+                "Break complete. Document Number: {doc}",
+                doc=doc_number,
+            )
         )
 
+        # Ask for export
+        if (
+            custom_askyesno(
+                self.parent,
+                lang.t("dialog_titles.confirm", "Confirm"),
+                lang.t(
+                    "out_kit.ask_export", "Export the break operation to Excel?"
+                ),
+            )
+            == "yes"
+        ):
+            self.export_data(rows)
+
+        # Clear form
+        self.clear_form()
+
     # -------------------- Utility / Clear / Export --------------------
     def clear_search(self):
         self.search_var.set("")
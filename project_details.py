@@ -2,6 +2,7 @@ import tkinter as tk
 from tkinter import ttk
 import sqlite3
 from db import connect_db
+from event_bus import bus, PROJECT_CHANGED
 from language_manager import lang
 from popup_utils import custom_popup, custom_askyesno, custom_dialog
 import logging
@@ -19,7 +20,6 @@ class ProjectDetailsWindow(tk.Toplevel):
           * update button enabled only for roles: admin, hq
       - Save button only shown when no project exists yet (initial setup).
       - Automatic prompt if any required field missing.
-      - Graceful schema adaptation: adds buffer_months column if missing.
       - Personalised popups via custom_popup.
     """
     NAME_CODE_TYPE_EDIT_ROLES = {"admin", "hq", "coordinator"}
@@ -37,9 +37,6 @@ class ProjectDetailsWindow(tk.Toplevel):
         self.geometry("560x430")
         self.resizable(False, False)
 
-        # Make sure schema has buffer_months
-        self.ensure_schema()
-
         # Data
         self.project_data = self.load_project()
 
@@ -57,27 +54,6 @@ class ProjectDetailsWindow(tk.Toplevel):
     def t(self, key, fallback=None, **kwargs):
         return lang.t(f"project_details.{key}", fallback=fallback, **kwargs)
 
-    # ------------- Schema adaptation -------------
-    def ensure_schema(self):
-        """
-        Add buffer_months column if missing.
-        """
-        conn = connect_db()
-        if not conn:
-            return
-        cur = conn.cursor()
-        try:
-            cur.execute("PRAGMA table_info(project_details)")
-            cols = {r[1].lower() for r in cur.fetchall()}
-            if "buffer_months" not in cols:
-                cur.execute("ALTER TABLE project_details ADD COLUMN buffer_months INTEGER DEFAULT 0")
-                conn.commit()
-        except sqlite3.Error as e:
-            logger.error(f"[ensure_schema] {e}")
-        finally:
-            cur.close()
-            conn.close()
-
     # ------------- UI Construction -------------
     def create_widgets(self):
         pad_lbl = {'padx': 10, 'pady': 4, 'sticky': 'w'}
@@ -339,6 +315,7 @@ class ProjectDetailsWindow(tk.Toplevel):
                 self.current_user.get("username")
             ))
             conn.commit()
+            bus.publish(PROJECT_CHANGED)
             custom_popup(self, lang.t("dialog_titles.success","Success"),
                          self.t("save_success", fallback="Project saved successfully."),
                          "success")
@@ -401,6 +378,7 @@ class ProjectDetailsWindow(tk.Toplevel):
                 self.project_data["id"]
             ))
             conn.commit()
+            bus.publish(PROJECT_CHANGED)
             custom_popup(self, lang.t("dialog_titles.success","Success"),
                          self.t("update_success", fallback="Project updated successfully."),
                          "success")
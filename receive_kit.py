@@ -37,7 +37,14 @@ from openpyxl.styles import PatternFill, Alignment, Font
 from openpyxl.utils import get_column_letter
 
 # External project modules
-from db import connect_db
+from db import connect_db, cached_query
+from transaction_utils import LAST_DOCUMENT_SQL
+from event_bus import bus, STOCK_CHANGED
+from schema_registry import schema
+from write_queue import writer
+from stock_ratio_index import stock_ratio_index
+from kit_structure_index import kit_structure
+from kit_closure import subtree as kit_subtree
 from manage_items import get_item_description, detect_type
 from kits_Composition import (
     KitsComposition,
@@ -249,52 +256,28 @@ def check_expiry_required(code: str) -> bool:
 
 
 def fetch_project_details():
-    conn = connect_db()
-    if conn is None:
-        return ("Unknown Project", "Unknown Code")
-    cur = conn.cursor()
     try:
-        cur.execute("SELECT project_name, project_code FROM project_details LIMIT 1")
-        row = cur.fetchone()
+        row = next(iter(cached_query("SELECT project_name, project_code FROM project_details LIMIT 1")), None)
         return (
             row[0] if row and row[0] else "Unknown Project",
             row[1] if row and row[1] else "Unknown Code",
         )
     except sqlite3.Error:
         return ("Unknown Project", "Unknown Code")
-    finally:
-        cur.close()
-        conn.close()
 
 
 def fetch_third_parties():
-    conn = connect_db()
-    if conn is None:
-        return []
-    cur = conn.cursor()
     try:
-        cur.execute("SELECT name FROM third_parties ORDER BY name")
-        return [r[0] for r in cur.fetchall()]
+        return [r[0] for r in cached_query("SELECT name FROM third_parties ORDER BY name")]
     except sqlite3.Error:
         return []
-    finally:
-        cur.close()
-        conn.close()
 
 
 def fetch_end_users():
-    conn = connect_db()
-    if conn is None:
-        return []
-    cur = conn.cursor()
     try:
-        cur.execute("SELECT name FROM end_users ORDER BY name")
-        return [r[0] for r in cur.fetchall()]
+        return [r[0] for r in cached_query("SELECT name FROM end_users ORDER BY name")]
     except sqlite3.Error:
         return []
-    finally:
-        cur.close()
-        conn.close()
 
 
 def validate_expiry_not_past(iso_date: str) -> tuple[bool, str]:
@@ -347,172 +330,164 @@ class StockData:
         kit/module numbers and comments.Supports optional 'scenario' column
         (auto‑detected) and new 'comments' column (must exist in schema).
         """
-        conn = connect_db()
-        if conn is None:
-            raise ValueError("Database connection failed")
-
-        cur = conn.cursor()
-        try:
-            # Inspect table columns (case-insensitive)
-            cur.execute("PRAGMA table_info(stock_data)")
-            cols = {row[1].lower(): row[1] for row in cur.fetchall()}
-
-            has_scenario = "scenario" in cols
-            has_comments = "comments" in cols
+        def job(conn):
+            cur = conn.cursor()
+            try:
+                has_scenario = schema.has_stock_scenario
+                has_comments = schema.has_comments
 
-            cur.execute(
-                "SELECT qty_in, qty_out FROM stock_data WHERE unique_id = ?",
-                (unique_id,),
-            )
-            existing = cur.fetchone()
-            now_ts = _dt.now().strftime("%Y-%m-%d %H:%M:%S")
+                cur.execute(
+                    "SELECT qty_in, qty_out FROM stock_data WHERE unique_id = ?",
+                    (unique_id,),
+                )
+                existing = cur.fetchone()
+                now_ts = _dt.now().strftime("%Y-%m-%d %H:%M:%S")
 
-            if existing:
-                new_in = existing[0] + qty_in
-                new_out = existing[1] + qty_out
+                if existing:
+                    new_in = existing[0] + qty_in
+                    new_out = existing[1] + qty_out
 
-                if has_scenario and has_comments:
-                    cur.execute(
-                        f"""
-                        UPDATE stock_data
-                           SET qty_in=?,
-                               qty_out=?,
-                               exp_date=?,
-                               kit_number=?,
-                               module_number=?,
-                               scenario=?,
-                               comments=?,
-                               updated_at=?
-                         WHERE unique_id=?
-                    """,
-                        (
-                            new_in,
-                            new_out,
-                            exp_date,
-                            kit_number,
-                            module_number,
-                            scenario,
-                            comments,
-                            now_ts,
-                            unique_id,
-                        ),
-                    )
-                elif has_scenario:
-                    cur.execute(
-                        f"""
-                        UPDATE stock_data
-                           SET qty_in=?,
-                               qty_out=?,
-                               exp_date=?,
-                               kit_number=?,
-                               module_number=?,
-                               scenario=?,
-                               updated_at=?
-                         WHERE unique_id=?
-                    """,
-                        (
-                            new_in,
-                            new_out,
-                            exp_date,
-                            kit_number,
-                            module_number,
-                            scenario,
-                            now_ts,
-                            unique_id,
-                        ),
-                    )
-                elif has_comments:
-                    cur.execute(
-                        f"""
-                        UPDATE stock_data
-                           SET qty_in=?,
-                               qty_out=?,
-                               exp_date=?,
-                               kit_number=?,
-                               module_number=?,
-                               comments=?,
-                               updated_at=?
-                         WHERE unique_id=?
-                    """,
-                        (
-                            new_in,
-                            new_out,
-                            exp_date,
-                            kit_number,
-                            module_number,
-                            comments,
-                            now_ts,
-                            unique_id,
-                        ),
-                    )
+                    if has_scenario and has_comments:
+                        cur.execute(
+                            f"""
+                            UPDATE stock_data
+                               SET qty_in=?,
+                                   qty_out=?,
+                                   exp_date=?,
+                                   kit_number=?,
+                                   module_number=?,
+                                   scenario=?,
+                                   comments=?,
+                                   updated_at=?
+                             WHERE unique_id=?
+                        """,
+                            (
+                                new_in,
+                                new_out,
+                                exp_date,
+                                kit_number,
+                                module_number,
+                                scenario,
+                                comments,
+                                now_ts,
+                                unique_id,
+                            ),
+                        )
+                    elif has_scenario:
+                        cur.execute(
+                            f"""
+                            UPDATE stock_data
+                               SET qty_in=?,
+                                   qty_out=?,
+                                   exp_date=?,
+                                   kit_number=?,
+                                   module_number=?,
+                                   scenario=?,
+                                   updated_at=?
+                             WHERE unique_id=?
+                        """,
+                            (
+                                new_in,
+                                new_out,
+                                exp_date,
+                                kit_number,
+                                module_number,
+                                scenario,
+                                now_ts,
+                                unique_id,
+                            ),
+                        )
+                    elif has_comments:
+                        cur.execute(
+                            f"""
+                            UPDATE stock_data
+                               SET qty_in=?,
+                                   qty_out=?,
+                                   exp_date=?,
+                                   kit_number=?,
+                                   module_number=?,
+                                   comments=?,
+                                   updated_at=?
+                             WHERE unique_id=?
+                        """,
+                            (
+                                new_in,
+                                new_out,
+                                exp_date,
+                                kit_number,
+                                module_number,
+                                comments,
+                                now_ts,
+                                unique_id,
+                            ),
+                        )
+                    else:
+                        cur.execute(
+                            f"""
+                            UPDATE stock_data
+                               SET qty_in=?,
+                                   qty_out=?,
+                                   exp_date=?,
+                                   kit_number=?,
+                                   module_number=?,
+                                   updated_at=?
+                             WHERE unique_id=?
+                        """,
+                            (
+                                new_in,
+                                new_out,
+                                exp_date,
+                                kit_number,
+                                module_number,
+                                now_ts,
+                                unique_id,
+                            ),
+                        )
                 else:
+                    # Build dynamic insert
+                    base_cols = [
+                        "unique_id",
+                        "qty_in",
+                        "qty_out",
+                        "exp_date",
+                        "kit_number",
+                        "module_number",
+                    ]
+                    base_vals = [
+                        unique_id,
+                        qty_in,
+                        qty_out,
+                        exp_date,
+                        kit_number,
+                        module_number,
+                    ]
+                    if has_scenario:
+                        base_cols.append("scenario")
+                        base_vals.append(scenario)
+                    if has_comments:
+                        base_cols.append("comments")
+                        base_vals.append(comments)
+                    base_cols.append("updated_at")
+                    base_vals.append(now_ts)
+
+                    placeholders = ",".join("?" for _ in base_vals)
+                    col_list = ",".join(base_cols)
                     cur.execute(
                         f"""
-                        UPDATE stock_data
-                           SET qty_in=?,
-                               qty_out=?,
-                               exp_date=?,
-                               kit_number=?,
-                               module_number=?,
-                               updated_at=?
-                         WHERE unique_id=?
+                        INSERT INTO stock_data ({col_list})
+                        VALUES ({placeholders})
                     """,
-                        (
-                            new_in,
-                            new_out,
-                            exp_date,
-                            kit_number,
-                            module_number,
-                            now_ts,
-                            unique_id,
-                        ),
+                        base_vals,
                     )
-            else:
-                # Build dynamic insert
-                base_cols = [
-                    "unique_id",
-                    "qty_in",
-                    "qty_out",
-                    "exp_date",
-                    "kit_number",
-                    "module_number",
-                ]
-                base_vals = [
-                    unique_id,
-                    qty_in,
-                    qty_out,
-                    exp_date,
-                    kit_number,
-                    module_number,
-                ]
-                if has_scenario:
-                    base_cols.append("scenario")
-                    base_vals.append(scenario)
-                if has_comments:
-                    base_cols.append("comments")
-                    base_vals.append(comments)
-                base_cols.append("updated_at")
-                base_vals.append(now_ts)
 
-                placeholders = ",".join("?" for _ in base_vals)
-                col_list = ",".join(base_cols)
-                cur.execute(
-                    f"""
-                    INSERT INTO stock_data ({col_list})
-                    VALUES ({placeholders})
-                """,
-                    base_vals,
-                )
-
-            conn.commit()
+            finally:
+                cur.close()
 
+        try:
+            writer.run(job)
         except sqlite3.Error as e:
-            conn.rollback()
             logging.error(f"StockData.add_or_update error: {e}")
             raise
-        finally:
-            cur.close()
-            conn.close()
 
 
 # ---------------------------------------------------------------------
@@ -562,19 +537,10 @@ class StockReceiveKit(tk.Frame):
 
     # ----------------- Scenario / init -----------------
     def fetch_scenario_map(self):
-        conn = connect_db()
-        if conn is None:
-            return {}
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
         try:
-            cur.execute("SELECT scenario_id, name FROM scenarios ORDER BY name")
-            return {str(r["scenario_id"]): r["name"] for r in cur.fetchall()}
+            return {str(r["scenario_id"]): r["name"] for r in cached_query("SELECT scenario_id, name FROM scenarios ORDER BY name")}
         except sqlite3.Error:
             return {}
-        finally:
-            cur.close()
-            conn.close()
 
     def fetch_scenarios(self):
         conn = connect_db()
@@ -1350,6 +1316,9 @@ class StockReceiveKit(tk.Frame):
         if not self.tree:
             return
 
+        # Pass 1: row contexts; pass 2 resolves std_qty / treecodes for all of
+        # them from one kit structure and one stock ratio lookup
+        rows = []
         for iid in self._gather_full_tree_nodes():
             if not self.tree.exists(iid):
                 continue
@@ -1388,20 +1357,29 @@ class StockReceiveKit(tk.Frame):
                 if expiry_iso:
                     rd["expiry_iso"] = expiry_iso
 
+            rows.append((iid, vals, rd, expiry_iso, (kit_code, module_code, item_code or code), item_code))
+
+        structure = kit_structure.structure(scenario_id)
+        treecodes = self.lookup_treecodes_from_kit_items(
+            scenario_id,
+            [context for _iid, _vals, rd, _exp, context, _item in rows if not rd.get("treecode")],
+            structure=structure,
+        )
+
+        for iid, vals, rd, expiry_iso, context, item_code in rows:
+            kit_code, module_code, _lookup_code = context
             kit_number = rd.get("kit_number") or "None"
             module_number = rd.get("module_number") or "None"
 
             # ✅ Lookup std_qty from kit_items table with correct context
             std_qty_from_db = self.lookup_std_qty_from_kit_items(
-                scenario_id, kit_code, module_code, item_code or code
+                scenario_id, *context, structure=structure
             )
 
             # ✅ NEW: Lookup treecode from kit_items table or use existing
             treecode = rd.get("treecode")
             if not treecode:
-                treecode = self.lookup_treecode_from_kit_items(
-                    scenario_id, kit_code, module_code, item_code or code
-                )
+                treecode = treecodes.get(context)
                 if treecode:
                     rd["treecode"] = treecode
 
@@ -1584,73 +1562,23 @@ class StockReceiveKit(tk.Frame):
         Returns:
             treecode with lowest stock ratio, or None if not found
         """
-        conn = connect_db()
-        if not conn:
-            return None
-
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-
-        try:
-            # Get scenario name for matching
-            scenario_name = self.scenario_map.get(str(scenario_id), str(scenario_id))
-
-            # Build WHERE clause
-            where_clauses = [
-                "(scenario=? OR scenario=?)",
-                "final_qty > 0",
-                "std_qty > 0",
-                "treecode IS NOT NULL",
-            ]
-            params = [str(scenario_id), scenario_name]
-
-            # Match by code in kit/module/item columns
-            code_match = "(kit=? OR module=? OR item=?)"
-            where_clauses.append(code_match)
-            params.extend([code, code, code])
-
-            # Add context filters if provided
-            if kit_code:
-                where_clauses.append("kit=?")
-                params.append(kit_code)
-
-            if module_code:
-                where_clauses.append("module=?")
-                params.append(module_code)
-
-            sql = f"""
-                SELECT treecode,
-                       unique_id,
-                    final_qty,
-                    std_qty,
-                    CAST(final_qty AS REAL) / NULLIF(std_qty, 0) AS stock_ratio
-                FROM stock_data
-                WHERE {' AND '.join(where_clauses)}
-                ORDER BY stock_ratio ASC, treecode ASC
-                LIMIT 1
-            """
-
-            cur.execute(sql, params)
-            row = cur.fetchone()
-
-            if row:
-                logging.info(
-                    f"[STOCK_RATIO] Selected treecode={row['treecode']} for code={code} "
-                    f"(ratio={row['stock_ratio']:.2f}, qty={row['final_qty']}/{row['std_qty']})"
-                )
-                return row["treecode"]
-            else:
-                logging.debug(
-                    f"[STOCK_RATIO] No treecode found for code={code} with stock"
-                )
-                return None
-
-        except sqlite3.Error as e:
-            logging.error(f"[STOCK_RATIO] Error selecting treecode: {e}")
-            return None
-        finally:
-            cur.close()
-            conn.close()
+        scenario_name = self.scenario_map.get(str(scenario_id), str(scenario_id))
+        lines = [
+            e
+            for e in stock_ratio_index.instances(
+                (scenario_id, scenario_name), code, kit_code, module_code
+            )
+            if e.treecode is not None
+        ]
+        if lines:
+            best = lines[0]
+            logging.info(
+                f"[STOCK_RATIO] Selected treecode={best.treecode} for code={code} "
+                f"(ratio={best.stock_ratio:.2f}, qty={best.final_qty}/{best.std_qty})"
+            )
+            return best.treecode
+        logging.debug(f"[STOCK_RATIO] No treecode found for code={code} with stock")
+        return None
 
     def check_module_stock_in_kit(self, scenario_id, kit_code, module_code):
         """
@@ -1662,108 +1590,77 @@ class StockReceiveKit(tk.Frame):
                 - min_ratio: Lowest stock ratio found (or None)
                 - message: User-friendly message explaining the situation
         """
-        conn = connect_db()
-        if not conn:
-            return True, None, ""  # Allow if DB error
-
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-
-        try:
-            # Get scenario name
-            scenario_name = self.scenario_map.get(str(scenario_id), str(scenario_id))
+        scenario_name = self.scenario_map.get(str(scenario_id), str(scenario_id))
 
-            # Find all instances of this module in this kit
-            cur.execute(
-                """
-                SELECT 
-                    kit_number,
-                    module_number,
-                    treecode,
-                    final_qty,
-                    std_qty,
-                    CAST(final_qty AS REAL) / NULLIF(std_qty, 0) AS stock_ratio
-                FROM stock_data
-                WHERE (scenario=? OR scenario=?)
-                  AND kit=?
-                  AND module=?
-                  AND final_qty > 0
-                  AND std_qty > 0
-                ORDER BY stock_ratio ASC
-            """,
-                (str(scenario_id), scenario_name, kit_code, module_code),
+        # Find all stocked instances of this module in this kit (lowest ratio first)
+        rows = [
+            e._asdict()
+            for e in stock_ratio_index.instances(
+                (scenario_id, scenario_name), module_code, kit_code, module_code
             )
+        ]
 
-            rows = cur.fetchall()
-
-            if not rows:
-                # No existing instances - OK to add
-                return True, None, ""
-
-            # Get minimum ratio
-            min_ratio = rows[0]["stock_ratio"]
+        if not rows:
+            # No existing instances - OK to add
+            return True, None, ""
 
-            # Check if ALL instances have ratio >= 1.0
-            all_fully_stocked = all(row["stock_ratio"] >= 1.0 for row in rows)
+        # Get minimum ratio
+        min_ratio = rows[0]["stock_ratio"]
 
-            if all_fully_stocked:
-                # REFUSE: All instances are fully stocked
-                instance_details = "\n".join(
-                    [
-                        lang.t(
-                            "receive_kit.module_instance_detail",
-                            "  • Kit {kit_number}, Module {module_number}: {final_qty}/{std_qty}",
-                            kit_number=row["kit_number"],
-                            module_number=row["module_number"],
-                            final_qty=row["final_qty"],
-                            std_qty=row["std_qty"],
-                        )
-                        for row in rows[:3]  # Show first 3 instances
-                    ]
-                )
+        # Check if ALL instances have ratio >= 1.0
+        all_fully_stocked = all(row["stock_ratio"] >= 1.0 for row in rows)
 
-                more_text = ""
-                if len(rows) > 3:
-                    more_text = "\n" + lang.t(
-                        "receive_kit.and_more_instances",
-                        "  ... and {count} more",
-                        count=len(rows) - 3,
+        if all_fully_stocked:
+            # REFUSE: All instances are fully stocked
+            instance_details = "\n".join(
+                [
+                    lang.t(
+                        "receive_kit.module_instance_detail",
+                        "  • Kit {kit_number}, Module {module_number}: {final_qty}/{std_qty}",
+                        kit_number=row["kit_number"],
+                        module_number=row["module_number"],
+                        final_qty=row["final_qty"],
+                        std_qty=row["std_qty"],
                     )
+                    for row in rows[:3]  # Show first 3 instances
+                ]
+            )
 
-                message = lang.t(
-                    "receive_kit.cannot_add_module_full",
-                    "Cannot add module '{module_code}' to kit '{kit_code}'.\n\n"
-                    "This module already exists in the kit with full stock:\n\n"
-                    "{instance_details}\n\n"
-                    "Options:\n"
-                    "  1. Add this module as a separate module to '{scenario_name}'\n"
-                    "  2. Add to a different kit",
-                    module_code=module_code,
-                    kit_code=kit_code,
-                    instance_details=instance_details + more_text,
-                    scenario_name=self.selected_scenario_name,
+            more_text = ""
+            if len(rows) > 3:
+                more_text = "\n" + lang.t(
+                    "receive_kit.and_more_instances",
+                    "  ... and {count} more",
+                    count=len(rows) - 3,
                 )
 
-                return False, min_ratio, message
-            else:
-                # OK to add: At least one instance needs replenishment
-                lowest_instance = rows[0]
-                message = (
-                    f"Adding to existing module instance:\n"
-                    f"Kit {lowest_instance['kit_number']}, "
-                    f"Module {lowest_instance['module_number']}\n"
-                    f"Current stock: {lowest_instance['final_qty']}/{lowest_instance['std_qty']} "
-                    f"(ratio: {min_ratio:.2f})"
-                )
+            message = lang.t(
+                "receive_kit.cannot_add_module_full",
+                "Cannot add module '{module_code}' to kit '{kit_code}'.\n\n"
+                "This module already exists in the kit with full stock:\n\n"
+                "{instance_details}\n\n"
+                "Options:\n"
+                "  1. Add this module as a separate module to '{scenario_name}'\n"
+                "  2. Add to a different kit",
+                module_code=module_code,
+                kit_code=kit_code,
+                instance_details=instance_details + more_text,
+                scenario_name=self.selected_scenario_name,
+            )
 
-                return True, min_ratio, message
+            return False, min_ratio, message
+        else:
+            # OK to add: At least one instance needs replenishment
+            lowest_instance = rows[0]
+            message = (
+                f"Adding to existing module instance:\n"
+                f"Kit {lowest_instance['kit_number']}, "
+                f"Module {lowest_instance['module_number']}\n"
+                f"Current stock: {lowest_instance['final_qty']}/{lowest_instance['std_qty']} "
+                f"(ratio: {min_ratio:.2f})"
+            )
 
-        except sqlite3.Error as e:
-            logging.error(f"[VALIDATE] Error checking module stock: {e}")
-            return True, None, ""  # Allow on error (fail open)
-        finally:
-            cur.close()
-            conn.close()
+            return True, min_ratio, message
 
     def fetch_search_results(self, query, scenario_id, mode_key):
         """
@@ -2017,47 +1914,25 @@ class StockReceiveKit(tk.Frame):
             conn.close()
 
     def fetch_kit_items(self, scenario_id, code):
-        conn = connect_db()
-        if conn is None:
-            return []
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-        try:
-            cur.execute(
-                """
-                SELECT ki.code, ki.level, ki.kit, ki.module, ki.item,
-                       COALESCE(ki.std_qty,0) AS std_qty, ki.treecode
-                FROM kit_items ki
-                WHERE ki.scenario_id=? AND (
-                      ki.code=? OR ki.kit=? OR ki.module=? OR ki.item=?)
-                ORDER BY ki.treecode
-            """,
-                (scenario_id, code, code, code, code),
+        out = []
+        for e in kit_structure.structure(scenario_id).related(code):
+            desc = get_item_description(e.code)
+            out.append(
+                {
+                    "code": e.code,
+                    "description": desc,
+                    "type": detect_type(e.code, desc),
+                    "kit": e.kit or "-----",
+                    "module": e.module or "-----",
+                    "item": e.item or "-----",
+                    "std_qty": e.std_qty,
+                    "qty_to_receive": e.std_qty,
+                    "expiry_date": "",
+                    "batch_no": "",
+                    "treecode": e.treecode,
+                }
             )
-            out = []
-            for r in cur.fetchall():
-                desc = get_item_description(r["code"])
-                out.append(
-                    {
-                        "code": r["code"],
-                        "description": desc,
-                        "type": detect_type(r["code"], desc),
-                        "kit": r["kit"] or "-----",
-                        "module": r["module"] or "-----",
-                        "item": r["item"] or "-----",
-                        "std_qty": r["std_qty"],
-                        "qty_to_receive": r["std_qty"],
-                        "expiry_date": "",
-                        "batch_no": "",
-                        "treecode": r["treecode"],
-                    }
-                )
-            return out
-        except sqlite3.Error:
-            return []
-        finally:
-            cur.close()
-            conn.close()
+        return out
 
     def fetch_kits(self, scenario_id):
         """
@@ -2345,104 +2220,31 @@ class StockReceiveKit(tk.Frame):
     # -----------------------------------------------------------------
     def fetch_full_module_subtree(self, scenario_id: str, module_code: str):
         """
-        Fetch a module and all its descendants using treecode hierarchy.
+        Fetch a module and all its descendants from the kit_items closure.
         Works for modules at both primary and secondary levels.
         """
-        conn = connect_db()
-        if conn is None:
-            return []
-
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-
-        try:
-            # ✅ Check BOTH primary and secondary levels
-            cur.execute(
-                """
-                SELECT code, level, kit, module, item, COALESCE(std_qty, 0) AS std_qty, treecode
-                FROM kit_items
-                WHERE scenario_id=?   
-                AND code=?  
-                AND (LOWER(level)='primary' OR LOWER(level)='secondary')
-                LIMIT 1
-            """,
-                (scenario_id, module_code),
-            )
-
-            base = cur.fetchone()
-
-            if not base:
-                logging.debug(
-                    f"fetch_full_module_subtree:   Module {module_code} not found"
-                )
-                return []
-
-            tc = base["treecode"]
-            level = (base["level"] or "").lower()
-
-            if not tc:
-                logging.debug(
-                    f"fetch_full_module_subtree:  Module {module_code} has no treecode"
-                )
-                return []
-
-            # ✅ FIX:   Match on relevant digits based on level
-            if level == "primary":
-                # Primary module (SS PPP 000 000) → children are secondary (SS PPP MMM 000)
-                # Match first 5 digits: SS + PPP
-                prefix = tc[:5]  # '01004'
-                pattern = f"{prefix}%"
-            else:
-                # Secondary module (SS PPP MMM 000) → children are tertiary (SS PPP MMM III)
-                # Match first 8 digits: SS + PPP + MMM
-                prefix = tc[:8]  # '01004001'
-                pattern = f"{prefix}%"
-
-            logging.debug(
-                f"fetch_full_module_subtree: Module {module_code} (level={level}, tc={tc}) → pattern={pattern}"
-            )
-
-            # Fetch all items matching the pattern
-            cur.execute(
-                """
-                SELECT code, level, kit, module, item, COALESCE(std_qty, 0) AS std_qty, treecode
-                FROM kit_items
-                WHERE scenario_id=?  AND treecode LIKE ?
-                ORDER BY treecode
-            """,
-                (scenario_id, pattern),
-            )
-
-            lst = []
-            for r in cur.fetchall():
-                desc = get_item_description(r["code"])
-                lst.append(
-                    {
-                        "code": r["code"],
-                        "description": desc,
-                        "type": detect_type(r["code"], desc),
-                        "kit": r["kit"] or "-----",
-                        "module": r["module"] or "-----",
-                        "item": r["item"] or "-----",
-                        "std_qty": r["std_qty"],
-                        "qty_to_receive": r["std_qty"],
-                        "expiry_date": "",
-                        "batch_no": "",
-                        "treecode": r["treecode"],
-                    }
-                )
-
-            logging.debug(
-                f"fetch_full_module_subtree:   Returned {len(lst)} items for module {module_code}"
+        lst = []
+        for r in kit_subtree(scenario_id, module_code, levels=("primary", "secondary")):
+            desc = get_item_description(r["code"])
+            lst.append(
+                {
+                    "code": r["code"],
+                    "description": desc,
+                    "type": detect_type(r["code"], desc),
+                    "kit": r["kit"] or "-----",
+                    "module": r["module"] or "-----",
+                    "item": r["item"] or "-----",
+                    "std_qty": r["std_qty"],
+                    "qty_to_receive": r["std_qty"],
+                    "expiry_date": "",
+                    "batch_no": "",
+                    "treecode": r["treecode"],
+                }
             )
-            return lst
-
-        except sqlite3.Error as e:
-            logging.error(f"fetch_full_module_subtree error: {e}")
-            return []
-        finally:
-            cur.close()
-            conn.close()
+        logging.debug(
+            f"fetch_full_module_subtree: Returned {len(lst)} items for module {module_code}"
+        )
+        return lst
 
     def fetch_items_by_module_column(self, scenario_id: str, module_code: str):
         conn = connect_db()
@@ -3664,23 +3466,20 @@ class StockReceiveKit(tk.Frame):
                 )
                 return
 
-            # ✅ Try multiple retrieval strategies
-            comps1 = self.fetch_full_module_subtree(self.selected_scenario_id, code)
-            comps2 = self.fetch_items_by_module_column(self.selected_scenario_id, code)
-            comps3 = self.fetch_items_by_code_prefix(self.selected_scenario_id, code)
-
-            # Choose strategy with most results
-            candidates = [
-                ("treecode_subtree", comps1),
-                ("module_column", comps2),
-                ("code_prefix", comps3),
-            ]
-
-            chosen_label, components = None, []
-            for lbl, lst in sorted(candidates, key=lambda x: len(x[1]), reverse=True):
-                if lst:
-                    chosen_label, components = lbl, lst
-                    break
+            # ✅ Subtree from the closure table; the column / prefix scans are
+            # only a fallback for rows without a well-formed treecode
+            chosen_label = "treecode_subtree"
+            components = self.fetch_full_module_subtree(self.selected_scenario_id, code)
+            if not components:
+                candidates = [
+                    ("module_column", self.fetch_items_by_module_column(self.selected_scenario_id, code)),
+                    ("code_prefix", self.fetch_items_by_code_prefix(self.selected_scenario_id, code)),
+                ]
+                chosen_label, components = None, []
+                for lbl, lst in sorted(candidates, key=lambda x: len(x[1]), reverse=True):
+                    if lst:
+                        chosen_label, components = lbl, lst
+                        break
 
             if not components:
                 # No descendants found - insert only the module row
@@ -4051,7 +3850,7 @@ class StockReceiveKit(tk.Frame):
         logging.debug(f"[EXTRACT] No separator in '{display_string}', returning as-is")
         return display_string.strip()
 
-    def lookup_std_qty_from_kit_items(self, scenario_id, kit, module, item):
+    def lookup_std_qty_from_kit_items(self, scenario_id, kit, module, item, structure=None):
         """
         Lookup std_qty from kit_items table based on exact context.
 
@@ -4060,90 +3859,23 @@ class StockReceiveKit(tk.Frame):
             kit:  Kit code (can be None)
             module: Module code (can be None)
             item: Item code (can be None)
+            structure: the scenario's KitStructure when the caller already has it
 
         Returns:
             std_qty from kit_items, or 0 if not found
         """
-        conn = connect_db()
-        if not conn:
-            logging.error("[RECEIVE] Cannot connect to DB for std_qty lookup")
-            return 0
-
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-
-        try:
-            # Normalize None values
-            kit_val = kit if kit and kit.upper() != "NONE" else None
-            module_val = module if module and module.upper() != "NONE" else None
-            item_val = item if item and item.upper() != "NONE" else None
-
-            # Determine which code to lookup
-            code_to_lookup = item_val or module_val or kit_val
-
-            if not code_to_lookup:
-                return 0
-
-            # Build query based on context
-            if item_val:
-                # Item level - most specific
-                cur.execute(
-                    """
-                    SELECT std_qty FROM kit_items
-                    WHERE scenario_id=? 
-                      AND (kit=? OR kit IS NULL)
-                      AND (module=?  OR module IS NULL)
-                      AND code=?
-                    ORDER BY 
-                      CASE WHEN kit IS NOT NULL THEN 1 ELSE 2 END,
-                      CASE WHEN module IS NOT NULL THEN 1 ELSE 2 END
-                    LIMIT 1
-                """,
-                    (scenario_id, kit_val, module_val, code_to_lookup),
-                )
-            elif module_val:
-                # Module level
-                cur.execute(
-                    """
-                    SELECT std_qty FROM kit_items
-                    WHERE scenario_id=?  
-                      AND (kit=? OR kit IS NULL)
-                      AND code=?
-                    ORDER BY CASE WHEN kit IS NOT NULL THEN 1 ELSE 2 END
-                    LIMIT 1
-                """,
-                    (scenario_id, kit_val, code_to_lookup),
-                )
-            else:
-                # Kit level
-                cur.execute(
-                    """
-                    SELECT std_qty FROM kit_items
-                    WHERE scenario_id=? AND code=?
-                    LIMIT 1
-                """,
-                    (scenario_id, code_to_lookup),
-                )
-
-            row = cur.fetchone()
-            if row and row["std_qty"]:
-                std_qty = row["std_qty"]
-                logging.debug(
-                    f"[RECEIVE] Found std_qty={std_qty} for code={code_to_lookup} in context kit={kit_val}, module={module_val}"
-                )
-                return std_qty
-            else:
-                logging.warning(
-                    f"[RECEIVE] No std_qty found for code={code_to_lookup} in kit_items"
-                )
-                return 0
-
-        except sqlite3.Error as e:
-            logging.error(f"[RECEIVE] Error looking up std_qty: {e}")
-            return 0
-        finally:
-            cur.close()
-            conn.close()
+        if structure is None:
+            structure = kit_structure.structure(scenario_id)
+        entry = structure.find(kit, module, item)
+        if entry and entry.std_qty:
+            logging.debug(
+                f"[RECEIVE] Found std_qty={entry.std_qty} for code={entry.code} in context kit={kit}, module={module}"
+            )
+            return entry.std_qty
+        logging.warning(
+            f"[RECEIVE] No std_qty found for kit={kit}, module={module}, item={item} in kit_items"
+        )
+        return 0
 
     def lookup_treecode_from_kit_items(self, scenario_id, kit, module, item):
         """
@@ -4159,91 +3891,55 @@ class StockReceiveKit(tk.Frame):
         Returns:
             treecode from kit_items, or None if not found
         """
-        # ✅ NEW: First try to get treecode from stock_data based on lowest stock ratio
-        kit_val = kit if kit and kit.upper() != "NONE" else None
-        module_val = module if module and module.upper() != "NONE" else None
-        item_val = item if item and item.upper() != "NONE" else None
-
-        code_to_lookup = item_val or module_val or kit_val
-
-        if code_to_lookup:
-            # Try to find in stock_data with lowest stock ratio
-            best_treecode = self.select_best_treecode_by_stock_ratio(
-                scenario_id, code_to_lookup, kit_val, module_val
-            )
-            if best_treecode:
-                return best_treecode
-
-        # ✅ Fallback: Look up from kit_items (original logic)
-        conn = connect_db()
-        if not conn:
-            logging.error("[RECEIVE] Cannot connect to DB for treecode lookup")
-            return None
+        return self.lookup_treecodes_from_kit_items(scenario_id, [(kit, module, item)])[
+            (kit, module, item)
+        ]
 
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
+    def lookup_treecodes_from_kit_items(self, scenario_id, contexts, structure=None):
+        """
+        Batch form of lookup_treecode_from_kit_items() for a whole tree:
+        {(kit, module, item): treecode or None}. The lowest-stock-ratio
+        treecodes come from ONE stock_ratio_index.best_treecodes() call, the
+        kit_items fallback from one kit structure.
+        """
+        normalized = {}
+        for context in contexts:
+            kit, module, item = context
+            kit_val = kit if kit and kit.upper() != "NONE" else None
+            module_val = module if module and module.upper() != "NONE" else None
+            item_val = item if item and item.upper() != "NONE" else None
+            normalized[context] = (kit_val, module_val, item_val)
+        if not normalized:
+            return {}
 
-        try:
+        # ✅ First: treecode from stock_data with the lowest stock ratio
+        lookups = {
+            (item_val or module_val or kit_val, kit_val, module_val)
+            for kit_val, module_val, item_val in normalized.values()
+            if item_val or module_val or kit_val
+        }
+        scenario_name = self.scenario_map.get(str(scenario_id), str(scenario_id))
+        best = stock_ratio_index.best_treecodes((scenario_id, scenario_name), lookups)
+
+        # ✅ Fallback: context match in the shared kit structure
+        if structure is None:
+            structure = kit_structure.structure(scenario_id)
+        result = {}
+        for context, (kit_val, module_val, item_val) in normalized.items():
+            code_to_lookup = item_val or module_val or kit_val
             if not code_to_lookup:
-                return None
-
-            # Build query based on context (original logic preserved)
-            if item_val:
-                cur.execute(
-                    """
-                    SELECT treecode FROM kit_items
-                    WHERE scenario_id=? 
-                      AND (kit=? OR kit IS NULL)
-                      AND (module=? OR module IS NULL)
-                      AND code=?
-                    ORDER BY 
-                      CASE WHEN kit IS NOT NULL THEN 1 ELSE 2 END,
-                      CASE WHEN module IS NOT NULL THEN 1 ELSE 2 END
-                    LIMIT 1
-                """,
-                    (scenario_id, kit_val, module_val, code_to_lookup),
-                )
-            elif module_val:
-                cur.execute(
-                    """
-                    SELECT treecode FROM kit_items
-                    WHERE scenario_id=? 
-                      AND (kit=? OR kit IS NULL)
-                      AND code=?
-                    ORDER BY CASE WHEN kit IS NOT NULL THEN 1 ELSE 2 END
-                    LIMIT 1
-                """,
-                    (scenario_id, kit_val, code_to_lookup),
-                )
-            else:
-                cur.execute(
-                    """
-                    SELECT treecode FROM kit_items
-                    WHERE scenario_id=? AND code=?
-                    LIMIT 1
-                """,
-                    (scenario_id, code_to_lookup),
-                )
-
-            row = cur.fetchone()
-            if row and row["treecode"]:
-                treecode = row["treecode"]
-                logging.debug(
-                    f"[RECEIVE] Found treecode={treecode} from kit_items for code={code_to_lookup}"
-                )
-                return treecode
-            else:
+                result[context] = None
+                continue
+            treecode = best.get((code_to_lookup, kit_val, module_val))
+            if not treecode:
+                entry = structure.find(kit_val, module_val, item_val)
+                treecode = entry.treecode if entry else None
+            if not treecode:
                 logging.debug(
                     f"[RECEIVE] No treecode found for code={code_to_lookup} in kit_items"
                 )
-                return None
-
-        except sqlite3.Error as e:
-            logging.error(f"[RECEIVE] Error looking up treecode: {e}")
-            return None
-        finally:
-            cur.close()
-            conn.close()
+            result[context] = treecode
+        return result
 
     def fetch_module_numbers_for_module_instance(
         self, scenario_id, module_code, kit_number=None
@@ -4727,12 +4423,7 @@ class StockReceiveKit(tk.Frame):
             cur = conn.cursor()
             try:
                 cur.execute(
-                    """
-                    SELECT document_number FROM stock_transactions
-                    WHERE document_number LIKE ?
-                    ORDER BY document_number DESC
-                    LIMIT 1
-                """,
+                    LAST_DOCUMENT_SQL,
                     (prefix + "/%",),
                 )
                 row = cur.fetchone()
@@ -4775,99 +4466,91 @@ class StockReceiveKit(tk.Frame):
 
         IMPORTANT:  Canonicalize UI values to English before storing.
         """
-        conn = connect_db()
-        if conn is None:
-            raise ValueError("Database connection failed")
+        # Canonicalize values (store English keys in DB)
+        in_type_canon = self._canon_in_type(in_type)
+        out_type_canon = self._canon_out_type(out_type)
+        movement_type_canon = self._canon_movement_type(movement_type)
+        comments_canon = self._canon_comment(comments)
 
-        cur = conn.cursor()
-        try:
-            # Canonicalize values (store English keys in DB)
-            in_type_canon = self._canon_in_type(in_type)
-            out_type_canon = self._canon_out_type(out_type)
-            movement_type_canon = self._canon_movement_type(movement_type)
-            comments_canon = self._canon_comment(comments)
-
-            # Detect if Comments column exists (case-insensitive)
-            cur.execute("PRAGMA table_info(stock_transactions)")
-            cols = {row[1].lower(): row[1] for row in cur.fetchall()}
-            has_comments = "comments" in cols
-
-            if has_comments:
-                cur.execute(
-                    """
-                    INSERT INTO stock_transactions
-                    (Date, Time, unique_id, code, Description, Expiry_date, Batch_Number,
-                     Scenario, Kit, Module, Qty_IN, IN_Type, Qty_Out, Out_Type, Third_Party,
-                    End_User, Remarks, Movement_Type, document_number, Comments)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                    (
-                        _dt.today().strftime("%Y-%m-%d"),
-                        _dt.now().time().strftime("%H:%M:%S"),
-                        unique_id,
-                        code,
-                        description,
-                        expiry_date,
-                        batch_number,
-                        scenario,
-                        kit,
-                        module,
-                        qty_in,
-                        in_type_canon,
-                        qty_out,
-                        out_type_canon,
-                        third_party,
-                        end_user,
-                        remarks,
-                        movement_type_canon,
-                        document_number,
-                        comments_canon,
-                    ),
-                )
-            else:
-                # Backward compatibility if Comments column missing
-                cur.execute(
-                    """
-                    INSERT INTO stock_transactions
-                    (Date, Time, unique_id, code, Description, Expiry_date, Batch_Number,
-                     Scenario, Kit, Module, Qty_IN, IN_Type, Qty_Out, Out_Type, Third_Party,
-                     End_User, Remarks, Movement_Type, document_number)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                    (
-                        _dt.today().strftime("%Y-%m-%d"),
-                        _dt.now().time().strftime("%H:%M:%S"),
-                        unique_id,
-                        code,
-                        description,
-                        expiry_date,
-                        batch_number,
-                        scenario,
-                        kit,
-                        module,
-                        qty_in,
-                        in_type_canon,
-                        qty_out,
-                        out_type_canon,
-                        third_party,
-                        end_user,
-                        remarks,
-                        movement_type_canon,
-                        document_number,
-                    ),
-                )
+        def job(conn):
+            cur = conn.cursor()
+            try:
+                has_comments = schema.has_transaction_comments
 
-            conn.commit()
+                if has_comments:
+                    cur.execute(
+                        """
+                        INSERT INTO stock_transactions
+                        (Date, Time, unique_id, code, Description, Expiry_date, Batch_Number,
+                         Scenario, Kit, Module, Qty_IN, IN_Type, Qty_Out, Out_Type, Third_Party,
+                        End_User, Remarks, Movement_Type, document_number, Comments)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                        (
+                            _dt.today().strftime("%Y-%m-%d"),
+                            _dt.now().time().strftime("%H:%M:%S"),
+                            unique_id,
+                            code,
+                            description,
+                            expiry_date,
+                            batch_number,
+                            scenario,
+                            kit,
+                            module,
+                            qty_in,
+                            in_type_canon,
+                            qty_out,
+                            out_type_canon,
+                            third_party,
+                            end_user,
+                            remarks,
+                            movement_type_canon,
+                            document_number,
+                            comments_canon,
+                        ),
+                    )
+                else:
+                    # Backward compatibility if Comments column missing
+                    cur.execute(
+                        """
+                        INSERT INTO stock_transactions
+                        (Date, Time, unique_id, code, Description, Expiry_date, Batch_Number,
+                         Scenario, Kit, Module, Qty_IN, IN_Type, Qty_Out, Out_Type, Third_Party,
+                         End_User, Remarks, Movement_Type, document_number)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                        (
+                            _dt.today().strftime("%Y-%m-%d"),
+                            _dt.now().time().strftime("%H:%M:%S"),
+                            unique_id,
+                            code,
+                            description,
+                            expiry_date,
+                            batch_number,
+                            scenario,
+                            kit,
+                            module,
+                            qty_in,
+                            in_type_canon,
+                            qty_out,
+                            out_type_canon,
+                            third_party,
+                            end_user,
+                            remarks,
+                            movement_type_canon,
+                            document_number,
+                        ),
+                    )
+
+            finally:
+                cur.close()
 
+        try:
+            writer.run(job)
         except sqlite3.Error as e:
-            conn.rollback()
             logging.error(f"Error logging transaction: {e}")
             raise
 
-        finally:
-            cur.close()
-            conn.close()
-
     # -----------------------------------------------------------------
     # Tree iteration helpers
     # -----------------------------------------------------------------
@@ -6576,6 +6259,7 @@ class StockReceiveKit(tk.Frame):
                 )
                 return
         self.rewrite_module_number_rows()
+        bus.publish(STOCK_CHANGED)
         custom_popup(
             self.parent,
             lang.t("receive_kit.save_success_title", "Success"),
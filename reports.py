@@ -17,12 +17,14 @@ Adjustments in this version:
   - All functions from previous version retained (no removals).
 
 Features:
-  - Refreshes snapshot tables (std_list_combined, std_qty_helper) each Load.
+  - Snapshot tables (std_list_combined, std_qty_helper) are rebuilt only when
+    their sources or the language changed (statement_engine snapshot version).
+  - Std / stock / expiring / item metadata come from one joined query, cached
+    per filter set (statement_engine).
   - Manual Expiry Period override (months); blank = recommended (lead+cover+buffer).
   - Real-time search (filters the populated table only, no extra DB hits).
   - Translation aware (language_manager.lang.t).
   - Aggregations handle kit/module/item codes from stock_data (no direct 'code' column).
-  - Compatible with very old SQLite (no CTE/window functions).
 
 Missing Dependencies:
   - db.connect_db()
@@ -42,7 +44,10 @@ from openpyxl.styles import PatternFill, Font
 from openpyxl.utils import get_column_letter
 
 from db import connect_db
+from event_bus import bus, STOCK_CHANGED, COMPOSITION_CHANGED, SCENARIOS_CHANGED
 from language_manager import lang
+from schema_registry import schema
+from statement_engine import designation_sql, statement_engine
 
 try:
     from popup_utils import custom_popup
@@ -74,14 +79,7 @@ def _get_designation_field():
 
 def _build_designation_sql():
     """Build SQL COALESCE expression for language-aware designation with fallback"""
-    lang_code = getattr(lang, "lang_code", "en").lower()
-
-    if lang_code == "fr":
-        return "COALESCE(il.designation_fr, il.designation_en, il.designation)"
-    elif lang_code in ("es", "sp"):
-        return "COALESCE(il.designation_sp, il.designation_en, il.designation)"
-    else:
-        return "COALESCE(il.designation_en, il.designation)"
+    return designation_sql()
 
 
 # ------------------------------------------------------------------
@@ -112,85 +110,15 @@ def _fetchone(sql, params=()):
 # Snapshot Refresh (Option B real-time) - LANGUAGE AWARE
 # ------------------------------------------------------------------
 def _refresh_snapshots_internal():
-    """Refresh snapshot tables with language-aware descriptions"""
-    conn = connect_db()
-    if conn is None:
-        raise RuntimeError("DB connection failed for snapshot refresh")
-    cur = conn.cursor()
-
-    # Build language-aware designation expression
-    designation_expr = _build_designation_sql()
-
-    try:
-        # Refresh std_list_combined
-        cur.execute("DELETE FROM std_list_combined")
-        sql_std_list = f"""
-        INSERT INTO std_list_combined (code, description, type, std_qty_collective)
-        SELECT
-            all_codes.code,
-            {designation_expr},
-            il.type,
-            SUM(all_codes.qty_component) AS std_qty_collective
-        FROM (
-            SELECT code, quantity AS qty_component FROM compositions
-            UNION ALL
-            SELECT code, std_qty AS qty_component FROM kit_items
-        ) AS all_codes
-        LEFT JOIN items_list il ON il.code = all_codes.code
-        GROUP BY all_codes.code
-        """
-        cur.execute(sql_std_list)
-
-        # Refresh std_qty_helper
-        cur.execute("DELETE FROM std_qty_helper")
-        sql_helper = f"""
-        INSERT INTO std_qty_helper (id, code, description, type, scenario_id, scenario, kit, module, std_qty)
-        SELECT
-          c.std_id,
-          c.code,
-          {designation_expr.replace('il.', 'il.')},
-          il.type,
-          c.scenario_id,
-          s.name,
-          NULL,
-          NULL,
-          c.quantity
-        FROM compositions c
-        LEFT JOIN items_list il ON il.code = c.code
-        LEFT JOIN scenarios s ON s.scenario_id = c.scenario_id
-        UNION ALL
-        SELECT
-          CAST(k.id AS TEXT),
-          k.code,
-          {designation_expr.replace('il.', 'il.')},
-          il.type,
-          k.scenario_id,
-          s.name,
-          k.kit,
-          k.module,
-          k.std_qty
-        FROM kit_items k
-        LEFT JOIN items_list il ON il.code = k.code
-        LEFT JOIN scenarios s ON s.scenario_id = k.scenario_id
-        """
-        cur.execute(sql_helper)
-
-        conn.commit()
-    except Exception:
-        conn.rollback()
-        raise
-    finally:
-        cur.close()
-        conn.close()
+    """Refresh snapshot tables with language-aware descriptions (unconditional rebuild)"""
+    statement_engine.ensure_snapshots(force=True)
 
 
 # ------------------------------------------------------------------
 # Period Logic
 # ------------------------------------------------------------------
 def compute_horizon_months():
-    cols = {
-        r["name"].lower(): True for r in _fetchall("PRAGMA table_info(project_details)")
-    }
+    cols = schema.columns("project_details")
     needed = ["lead_time_months", "cover_period_months", "buffer_months"]
     if not all(n in cols for n in needed):
         return 0
@@ -396,6 +324,13 @@ class ReportsFrame(tk.Frame):
         # ========== NEW: Perform initial load automatically ==========
         self.after(100, self._initial_load)
 
+        # Reload when another window saves stock or edits compositions
+        bus.subscribe(
+            (STOCK_CHANGED, COMPOSITION_CHANGED, SCENARIOS_CHANGED),
+            lambda events: self._schedule_auto_refresh(),
+            widget=self,
+        )
+
         self.status_var.set(
             lang.t("reports.ready", "Ready (role={role})", role=self.role)
         )
@@ -1057,13 +992,12 @@ class ReportsFrame(tk.Frame):
         self.tree.delete(*self.tree.get_children())
         self._all_rows.clear()
 
-        # Refresh snapshots
+        # Rebuild snapshots only if compositions / kit_items / items_list / language changed
         try:
             self.status_var.set(
                 lang.t("reports.refreshing_snapshots", "Refreshing snapshots...")
             )
-            self.update_idletasks()
-            _refresh_snapshots_internal()
+            statement_engine.ensure_snapshots()
         except Exception as e:
             self.status_var.set(
                 lang.t(
@@ -1101,57 +1035,48 @@ class ReportsFrame(tk.Frame):
 
         self.status_var.set(lang.t("reports.computing", "Computing aggregates..."))
         self.update_idletasks()
-        std_map = aggregate_std_qty(filters)
-        stock_map = aggregate_stock(filters, cutoff_iso)
-        all_codes = set(std_map.keys()) | set(stock_map.keys())
-        meta = load_item_metadata(all_codes)
-
-        for code in sorted(all_codes):
-            std_qty = std_map.get(code, 0) or 0
-            stock_entry = stock_map.get(code, {"current_stock": 0, "expiring": 0})
-            current_stock = stock_entry["current_stock"] or 0
-            qty_expiring = stock_entry["expiring"] or 0
+        for m in statement_engine.statement(filters, cutoff_iso):
+            std_qty = m["standard_qty"] or 0
+            current_stock = m["current_stock"] or 0
+            qty_expiring = m["qty_expiring"] or 0
             over_stock = max(0, current_stock - std_qty)
             missing_qty = max(0, (std_qty - current_stock) + min(qty_expiring, std_qty))
 
-            m = meta.get(code)
             row = {
-                "code": code,
-                "description": m["designation"] if m else "",
-                "type": (m["type"] if m else ""),
+                "code": m["code"],
+                "description": m["designation"] or "",
+                "type": m["type"] or "",
                 "standard_qty": std_qty,
                 "current_stock": current_stock,
                 "qty_expiring": qty_expiring,
                 "over_stock": over_stock,
                 "missing_qty": missing_qty,
-                "pack": m["pack"] if m else "",
+                "pack": m["pack"] if m["pack"] is not None else "",
                 "price_per_pack": (
                     m["price_per_pack_euros"]
-                    if m and m["price_per_pack_euros"] is not None
+                    if m["price_per_pack_euros"] is not None
                     else ""
                 ),
                 "unit_price": (
-                    m["unit_price_euros"]
-                    if m and m["unit_price_euros"] is not None
-                    else ""
+                    m["unit_price_euros"] if m["unit_price_euros"] is not None else ""
                 ),
                 "weight_per_pack": (
                     m["weight_per_pack_kg"]
-                    if m and m["weight_per_pack_kg"] is not None
+                    if m["weight_per_pack_kg"] is not None
                     else ""
                 ),
                 "volume_per_pack": (
                     m["volume_per_pack_dm3"]
-                    if m and m["volume_per_pack_dm3"] is not None
+                    if m["volume_per_pack_dm3"] is not None
                     else ""
                 ),
                 "shelf_life": (
                     m["shelf_life_months"]
-                    if m and m["shelf_life_months"] is not None
+                    if m["shelf_life_months"] is not None
                     else ""
                 ),
-                "remarks": (m["remarks"] if m else ""),
-                "account_code": (m["account_code"] if m else ""),
+                "remarks": m["remarks"] or "",
+                "account_code": m["account_code"] or "",
             }
             self._all_rows.append(row)
 
@@ -15,6 +15,8 @@ Call initialize_reporting() once at application startup (or before opening Repor
 """
 
 from db import connect_db
+from ledger_archive import LEDGER_VIEW, attach_ledger
+from schema_registry import schema
 import sqlite3
 
 # ---------------------------------------------------------------------------
@@ -31,6 +33,94 @@ def _execute_ddl(cursor, stmts):
         except sqlite3.Error as e:
             print(f"[reports_backend] DDL warning: {e} | {s[:70]}...")
 
+# ---------------------------------------------------------------------------
+# Ledger views
+# ---------------------------------------------------------------------------
+
+# Views over the transaction ledger, {source} = the table they read. The
+# stored views read the hot stock_transactions; fetch_view() shadows them
+# with TEMP views over ledger_archive's `ledger` so archived years count too.
+LEDGER_VIEWS = {
+    "vw_report_detailed": """
+    SELECT
+        ROW_NUMBER() OVER (ORDER BY Date, Time, code) AS row_id,
+        Date || ' ' || COALESCE(Time,'00:00:00') AS timestamp,
+        Date AS transaction_date,
+        Time AS transaction_time,
+        code,
+        Description AS description,
+        Scenario AS scenario,
+        Kit AS kit,
+        Module AS module,
+        COALESCE(Third_Party,'') AS third_party,
+        COALESCE(End_User,'') AS end_user,
+        IN_Type,
+        Out_Type,
+        Movement_Type AS movement_type,
+        Qty_IN,
+        Qty_Out,
+        Expiry_date,
+        unique_id,
+        Remarks AS remarks,
+        CASE
+            WHEN IFNULL(Qty_IN,0) > 0 THEN 'IN'
+            WHEN IFNULL(Qty_Out,0) > 0 THEN 'OUT'
+            ELSE 'NA'
+        END AS direction,
+        CASE
+            WHEN IFNULL(Qty_IN,0) > 0 THEN Qty_IN
+            WHEN IFNULL(Qty_Out,0) > 0 THEN Qty_Out
+            ELSE 0
+        END AS quantity
+    FROM {source}
+    """,
+    "vw_report_summary": """
+    SELECT
+        Date AS transaction_date,
+        code,
+        MAX(Description) AS description,
+        Scenario AS scenario,
+        SUM(COALESCE(Qty_IN,0)) AS total_in,
+        SUM(COALESCE(Qty_Out,0)) AS total_out,
+        (SUM(COALESCE(Qty_IN,0)) - SUM(COALESCE(Qty_Out,0))) AS net_movement,
+        CASE
+            WHEN (SUM(COALESCE(Qty_IN,0)) - SUM(COALESCE(Qty_Out,0))) > 0 THEN 'IN_DOMINANT'
+            WHEN (SUM(COALESCE(Qty_IN,0)) - SUM(COALESCE(Qty_Out,0))) < 0 THEN 'OUT_DOMINANT'
+            ELSE 'BALANCED'
+        END AS movement_balance_flag
+    FROM {source}
+    GROUP BY Date, code, Scenario
+    """,
+    "vw_report_expiry": """
+    SELECT
+        st.code,
+        st.Description AS description,
+        st.Scenario AS scenario,
+        st.Kit AS kit,
+        st.Module AS module,
+        st.Expiry_date,
+        COALESCE(st.Qty_IN,0) AS qty_in,
+        CAST((julianday(st.Expiry_date) - julianday('now')) AS INTEGER) AS days_left,
+        CASE
+            WHEN st.Expiry_date IS NULL THEN 'NO_DATE'
+            WHEN (julianday(st.Expiry_date) - julianday('now')) < 0 THEN 'EXPIRED'
+            WHEN (julianday(st.Expiry_date) - julianday('now')) <= 30 THEN 'ALERT_30'
+            WHEN (julianday(st.Expiry_date) - julianday('now')) <= 60 THEN 'ALERT_60'
+            WHEN (julianday(st.Expiry_date) - julianday('now')) <= 90 THEN 'ALERT_90'
+            ELSE 'OK'
+        END AS expiry_bucket
+    FROM {source} st
+    JOIN items_list il ON il.code = st.code
+    WHERE st.Qty_IN > 0
+      AND st.Expiry_date IS NOT NULL
+      AND il.remarks LIKE '%exp%'
+    """,
+}
+
+
+def _ledger_view_ddl(name, source="stock_transactions", temp=False):
+    return f"CREATE {'TEMP ' if temp else ''}VIEW {name} AS\n" + LEDGER_VIEWS[name].format(source=source)
+
 # ---------------------------------------------------------------------------
 # View creation
 # ---------------------------------------------------------------------------
@@ -51,86 +141,6 @@ def ensure_report_views():
         ]
         _execute_ddl(cur, drops)
 
-        vw_report_detailed = """
-        CREATE VIEW vw_report_detailed AS
-        SELECT
-            ROW_NUMBER() OVER (ORDER BY Date, Time, code) AS row_id,
-            Date || ' ' || COALESCE(Time,'00:00:00') AS timestamp,
-            Date AS transaction_date,
-            Time AS transaction_time,
-            code,
-            Description AS description,
-            Scenario AS scenario,
-            Kit AS kit,
-            Module AS module,
-            COALESCE(Third_Party,'') AS third_party,
-            COALESCE(End_User,'') AS end_user,
-            IN_Type,
-            Out_Type,
-            Movement_Type AS movement_type,
-            Qty_IN,
-            Qty_Out,
-            Expiry_date,
-            unique_id,
-            Remarks AS remarks,
-            CASE
-                WHEN IFNULL(Qty_IN,0) > 0 THEN 'IN'
-                WHEN IFNULL(Qty_Out,0) > 0 THEN 'OUT'
-                ELSE 'NA'
-            END AS direction,
-            CASE
-                WHEN IFNULL(Qty_IN,0) > 0 THEN Qty_IN
-                WHEN IFNULL(Qty_Out,0) > 0 THEN Qty_Out
-                ELSE 0
-            END AS quantity
-        FROM stock_transactions
-        """
-
-        vw_report_summary = """
-        CREATE VIEW vw_report_summary AS
-        SELECT
-            Date AS transaction_date,
-            code,
-            MAX(Description) AS description,
-            Scenario AS scenario,
-            SUM(COALESCE(Qty_IN,0)) AS total_in,
-            SUM(COALESCE(Qty_Out,0)) AS total_out,
-            (SUM(COALESCE(Qty_IN,0)) - SUM(COALESCE(Qty_Out,0))) AS net_movement,
-            CASE
-                WHEN (SUM(COALESCE(Qty_IN,0)) - SUM(COALESCE(Qty_Out,0))) > 0 THEN 'IN_DOMINANT'
-                WHEN (SUM(COALESCE(Qty_IN,0)) - SUM(COALESCE(Qty_Out,0))) < 0 THEN 'OUT_DOMINANT'
-                ELSE 'BALANCED'
-            END AS movement_balance_flag
-        FROM stock_transactions
-        GROUP BY Date, code, Scenario
-        """
-
-        vw_report_expiry = """
-        CREATE VIEW vw_report_expiry AS
-        SELECT
-            st.code,
-            st.Description AS description,
-            st.Scenario AS scenario,
-            st.Kit AS kit,
-            st.Module AS module,
-            st.Expiry_date,
-            COALESCE(st.Qty_IN,0) AS qty_in,
-            CAST((julianday(st.Expiry_date) - julianday('now')) AS INTEGER) AS days_left,
-            CASE
-                WHEN st.Expiry_date IS NULL THEN 'NO_DATE'
-                WHEN (julianday(st.Expiry_date) - julianday('now')) < 0 THEN 'EXPIRED'
-                WHEN (julianday(st.Expiry_date) - julianday('now')) <= 30 THEN 'ALERT_30'
-                WHEN (julianday(st.Expiry_date) - julianday('now')) <= 60 THEN 'ALERT_60'
-                WHEN (julianday(st.Expiry_date) - julianday('now')) <= 90 THEN 'ALERT_90'
-                ELSE 'OK'
-            END AS expiry_bucket
-        FROM stock_transactions st
-        JOIN items_list il ON il.code = st.code
-        WHERE st.Qty_IN > 0
-          AND st.Expiry_date IS NOT NULL
-          AND il.remarks LIKE '%exp%'
-        """
-
         vw_report_required_qty = """
         CREATE VIEW vw_report_required_qty AS
         WITH required AS (
@@ -171,14 +181,12 @@ def ensure_report_views():
         ORDER BY r.scenario, r.kit, r.module, r.code
         """
 
-        creates = [
-            vw_report_detailed,
-            vw_report_summary,
-            vw_report_expiry,
+        creates = [_ledger_view_ddl(name) for name in LEDGER_VIEWS] + [
             vw_report_required_qty
         ]
         _execute_ddl(cur, creates)
         conn.commit()
+        schema.refresh()
     finally:
         cur.close()
         conn.close()
@@ -196,6 +204,9 @@ def fetch_view(view_name, where="", params=None, order=""):
     conn = connect_db()
     cur = conn.cursor()
     try:
+        if view_name in LEDGER_VIEWS:
+            attach_ledger(conn)
+            cur.execute(_ledger_view_ddl(view_name, source=LEDGER_VIEW, temp=True))
         sql = f"SELECT * FROM {view_name}"
         if where:
             sql += f" WHERE {where}"
@@ -3,6 +3,7 @@ from tkinter import ttk
 import sqlite3
 from datetime import datetime
 from db import connect_db
+from event_bus import bus, SCENARIOS_CHANGED
 from language_manager import lang as lang_lang   # (kept original alias style)
 from popup_utils import custom_popup, custom_askyesno
 import time
@@ -439,6 +440,7 @@ class Scenarios(tk.Frame):
         try:
             cur.execute("DELETE FROM scenarios WHERE scenario_id = ?", (scenario_id,))
             conn.commit()
+            bus.publish(SCENARIOS_CHANGED)
         except sqlite3.Error as e:
             conn.rollback()
             custom_popup(self, lang_lang.t("dialog_titles.error", "Error"), str(e), "error")
@@ -631,6 +633,7 @@ class Scenarios(tk.Frame):
                         VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
                     """, (name, activity, population_val, location, responsible))
                 conn.commit()
+                bus.publish(SCENARIOS_CHANGED)
             except sqlite3.Error as e:
                 conn.rollback()
                 custom_popup(form,
@@ -0,0 +1,122 @@
+"""
+schema_registry.py
+Cached schema introspection.
+
+Many screens adapt to optional columns (comments, document_number,
+buffer_months, ...) and used to run `PRAGMA table_info(...)` before almost
+every query. SchemaRegistry reads the column list of every table and view
+ONCE (single query over sqlite_master + pragma_table_info) and serves
+lookups from memory.
+
+The snapshot is tagged with PRAGMA schema_version. It is only re-read when
+refresh() is called, which the migration / DDL helpers do after they change
+the schema.
+
+Usage:
+    from schema_registry import schema
+    cols = schema.columns("stock_data")      # {lower_name: actual_name}
+    if schema.has_comments: ...
+"""
+
+import sqlite3
+import logging
+import threading
+from typing import Dict
+
+from db import connect_db
+
+logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
+
+_COLUMNS_SQL = """
+    SELECT m.name, p.name
+      FROM sqlite_master m
+      JOIN pragma_table_info(m.name) p
+     WHERE m.type IN ('table', 'view')
+"""
+
+
+class SchemaRegistry:
+    """
+    In-memory map of table -> {lower column name: actual column name}.
+    Table names are matched case-insensitively.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tables: Dict[str, Dict[str, str]] = None
+        self.schema_version = None
+
+    def refresh(self, conn=None) -> None:
+        """
+        Re-read the schema (call after migrations / DDL). `conn` reads a
+        connection the caller already has open on the database instead of
+        opening db.DB_FILE.
+        """
+        own = conn is None
+        conn = conn or connect_db()
+        if conn is None:
+            return
+        cur = conn.cursor()
+        tables: Dict[str, Dict[str, str]] = {}
+        try:
+            cur.execute("PRAGMA schema_version")
+            version = cur.fetchone()[0]
+            cur.execute(_COLUMNS_SQL)
+            for table, column in cur.fetchall():
+                tables.setdefault(table.lower(), {})[column.lower()] = column
+        except sqlite3.Error as e:
+            logging.error(f"[SchemaRegistry] Introspection failed: {e}")
+            return
+        finally:
+            cur.close()
+            if own:
+                conn.close()
+        with self._lock:
+            self._tables = tables
+            self.schema_version = version
+
+    def _snapshot(self) -> Dict[str, Dict[str, str]]:
+        if self._tables is None:
+            self.refresh()
+        return self._tables or {}
+
+    # ---------------- Generic lookups ----------------
+    def has_table(self, table: str) -> bool:
+        return table.lower() in self._snapshot()
+
+    def columns(self, table: str) -> Dict[str, str]:
+        """{lower_name: actual_name} for the table ({} if missing)."""
+        return dict(self._snapshot().get(table.lower(), {}))
+
+    def has_column(self, table: str, column: str) -> bool:
+        return column.lower() in self._snapshot().get(table.lower(), {})
+
+    # ---------------- Typed capabilities ----------------
+    @property
+    def has_comments(self) -> bool:
+        """stock_data.comments exists."""
+        return self.has_column("stock_data", "comments")
+
+    @property
+    def has_stock_scenario(self) -> bool:
+        """stock_data.scenario exists."""
+        return self.has_column("stock_data", "scenario")
+
+    @property
+    def has_document_number(self) -> bool:
+        """stock_transactions.document_number exists."""
+        return self.has_column("stock_transactions", "document_number")
+
+    @property
+    def has_transaction_comments(self) -> bool:
+        """stock_transactions.comments exists."""
+        return self.has_column("stock_transactions", "comments")
+
+    @property
+    def has_buffer_months(self) -> bool:
+        """project_details.buffer_months exists."""
+        return self.has_column("project_details", "buffer_months")
+
+
+# Global singleton used across the app
+schema = SchemaRegistry()
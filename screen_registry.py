@@ -0,0 +1,135 @@
+"""
+screen_registry.py
+Lazy registry of the application screens.
+
+login_gui / menu_bar used to import every screen module at top level, which
+pulled pandas, openpyxl, dateutil and ~30 modules in before the login window
+could appear. The registry hands out LazyScreen placeholders instead: they
+are callable exactly like the screen class / function they stand for and
+import its module on first call (first open_new_window).
+
+After login, prewarm() imports the remaining modules in a background thread
+so the first open of a screen is still instant.
+
+Usage:
+    from screen_registry import screens
+    StockIn = screens["StockIn"]
+    frame = StockIn(parent, app, role=role)     # imports in_ on first call
+    screens.prewarm()
+"""
+
+import logging
+import threading
+import importlib
+import time
+
+logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# name -> (module, attribute). Ordered by how early a user usually needs them
+# (dashboard first): prewarm() follows this order.
+SCREENS = {
+    "Dashboard": ("dashboard", "Dashboard"),
+    "StockIn": ("in_", "StockIn"),
+    "StockOut": ("out", "StockOut"),
+    "StockCard": ("stock_card", "StockCard"),
+    "StockAvailability": ("stock_availability", "StockAvailability"),
+    "OrderNeeds": ("order", "OrderNeeds"),
+    "open_stock_summary": ("stock_summary", "open_stock_summary"),
+    "ManageItems": ("manage_items", "ManageItems"),
+    "StandardList": ("standard_list", "StandardList"),
+    "KitsComposition": ("kits_Composition", "KitsComposition"),
+    "StockReceiveKit": ("receive_kit", "StockReceiveKit"),
+    "StockDispatchKit": ("dispatch_kit", "StockDispatchKit"),
+    "StockInKit": ("in_kit", "StockInKit"),
+    "StockOutKit": ("out_kit", "StockOutKit"),
+    "InventoryKit": ("inv_kit", "InventoryKit"),
+    "StockInventory": ("stock_inv", "StockInventory"),
+    "StockTransactions": ("stock_transactions", "StockTransactions"),
+    "Reports": ("reports", "Reports"),
+    "StockExpiry": ("expiry_data", "StockExpiry"),
+    "Consumption": ("consumption", "Consumption"),
+    "Loans": ("loans", "Loans"),
+    "Donations": ("donations", "Donations"),
+    "Losses": ("losses", "Losses"),
+    "Scenarios": ("scenarios", "Scenarios"),
+    "ManageUsers": ("manage_users", "ManageUsers"),
+    "ManageParties": ("manage_parties", "ManageParties"),
+    "ManageEndUsers": ("end_users", "ManageEndUsers"),
+    "ManageItemFamilies": ("item_families", "ManageItemFamilies"),
+    "AppInfo": ("info", "AppInfo"),
+}
+
+
+class LazyScreen:
+    """Callable stand-in for a screen class / opener; imports it on first use."""
+
+    def __init__(self, name, module, attr):
+        self.__name__ = name
+        self.module = module
+        self.attr = attr
+        self._target = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._target is not None
+
+    def resolve(self):
+        """Import the module (once) and return the real class / function."""
+        if self._target is None:
+            with self._lock:
+                if self._target is None:
+                    self._target = getattr(importlib.import_module(self.module), self.attr)
+        return self._target
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+    def __repr__(self):
+        state = "loaded" if self.loaded else "lazy"
+        return f"<LazyScreen {self.module}.{self.attr} ({state})>"
+
+
+class ScreenRegistry:
+    """One LazyScreen per name, shared by every importer (identity is stable)."""
+
+    def __init__(self, screens):
+        self._screens = {name: LazyScreen(name, mod, attr) for name, (mod, attr) in screens.items()}
+        self._prewarm_thread = None
+        self.prewarm_seconds = None
+
+    def __getitem__(self, name):
+        return self._screens[name]
+
+    def __iter__(self):
+        return iter(self._screens.values())
+
+    def loaded(self):
+        """Names of the screens already imported."""
+        return [s.__name__ for s in self if s.loaded]
+
+    def prewarm(self, names=None):
+        """
+        Import the given (default: all) screen modules in a daemon thread.
+        Safe to call repeatedly; only one pre-warm thread runs at a time.
+        """
+        if self._prewarm_thread and self._prewarm_thread.is_alive():
+            return
+        targets = [self._screens[n] for n in names] if names else list(self)
+
+        def _run():
+            started = time.perf_counter()
+            for screen in targets:
+                try:
+                    screen.resolve()
+                except Exception as e:
+                    logging.error(f"[ScreenRegistry] Pre-warm of {screen.module} failed: {e}")
+            self.prewarm_seconds = time.perf_counter() - started
+            logging.info(f"[ScreenRegistry] Pre-warmed {len(targets)} screens in {self.prewarm_seconds:.2f}s")
+
+        self._prewarm_thread = threading.Thread(target=_run, name="screen-prewarm", daemon=True)
+        self._prewarm_thread.start()
+
+
+# Global singleton used across the app
+screens = ScreenRegistry(SCREENS)
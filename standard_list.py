@@ -4,6 +4,7 @@ import openpyxl
 import sqlite3
 import re
 from db import connect_db
+from event_bus import bus, COMPOSITION_CHANGED
 from language_manager import lang
 from datetime import datetime
 from popup_utils import custom_popup, custom_askyesno, custom_dialog
@@ -473,6 +474,7 @@ class StandardList(tk.Frame):
                                    (cleaned_code, scenario_id))
 
             conn.commit()
+            bus.publish(COMPOSITION_CHANGED)
             self.status_var.set(lang.t("standard_list.changes_saved", fallback="Changes saved"))
             self.load_data()
         except Exception as e: 
@@ -616,6 +618,7 @@ class StandardList(tk.Frame):
                                        (cleaned_code, scenario_id))
 
             conn.commit()
+            bus.publish(COMPOSITION_CHANGED)
             cursor.close()
             conn.close()
 
@@ -678,6 +681,7 @@ class StandardList(tk.Frame):
             cursor = conn.cursor()
             cursor.execute("DELETE FROM compositions")
             conn.commit()
+            bus.publish(COMPOSITION_CHANGED)
             cursor.close()
             conn.close()
             self.load_data()
@@ -0,0 +1,335 @@
+"""
+statement_engine.py
+Stock Statement computation for reports.py.
+
+Reports.load_report used to, on EVERY load:
+  * DELETE + re-INSERT std_list_combined and std_qty_helper (language-aware
+    designations), even when nothing had changed
+  * run aggregate_std_qty, aggregate_stock (all stock_data rows walked in
+    Python) and load_item_metadata as separate reads
+
+StatementEngine instead:
+  * tracks a snapshot version = write counters of compositions / kit_items /
+    items_list / scenarios + language, stored in report_snapshot_version;
+    the snapshot tables are rebuilt only when that version changes, or on
+    COMPOSITION_CHANGED / ITEMS_CHANGED / SCENARIOS_CHANGED
+  * computes std, stock, expiring and item metadata in ONE joined query
+  * caches the resulting rows per (filters, cutoff, language); the cache is
+    dropped on STOCK_CHANGED / COMPOSITION_CHANGED / ITEMS_CHANGED /
+    SCENARIOS_CHANGED and when a db.TableWatch shows an external commit
+
+Usage:
+    from statement_engine import statement_engine
+    rebuilt = statement_engine.ensure_snapshots()
+    rows = statement_engine.statement(filters, cutoff_iso)
+"""
+
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+
+from db import connect_db, write_counters, TableWatch
+from event_bus import bus, STOCK_CHANGED, COMPOSITION_CHANGED, ITEMS_CHANGED, SCENARIOS_CHANGED
+from language_manager import lang
+from schema_registry import schema
+
+logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
+
+_VERSION_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS report_snapshot_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        fingerprint TEXT,
+        lang TEXT,
+        built_at TEXT
+    )
+"""
+
+# Tables the snapshot tables are built from
+_SOURCE_TABLES = ("compositions", "kit_items", "items_list", "scenarios")
+
+
+def _fingerprint(conn):
+    """
+    Write counters of the source tables ('compositions:12|kit_items:3|...').
+    Every insert / update / delete moves them; None when the counters are
+    missing (not migrated), which always rebuilds.
+    """
+    counters = write_counters(conn)
+    if not all(t in counters for t in _SOURCE_TABLES):
+        return None
+    return "|".join(f"{t}:{counters[t]}" for t in _SOURCE_TABLES)
+
+_ISO_DATE_GLOB = "[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]"
+
+STATEMENT_COLUMNS = (
+    "code", "standard_qty", "current_stock", "qty_expiring", "designation", "type",
+    "pack", "price_per_pack_euros", "unit_price_euros", "weight_per_pack_kg",
+    "volume_per_pack_dm3", "shelf_life_months", "remarks", "account_code",
+)
+
+
+def designation_sql(lang_code=None):
+    """COALESCE expression (alias il = items_list) for the language-aware designation."""
+    lang_code = (lang_code or getattr(lang, "lang_code", "en")).lower()
+    if lang_code == "fr":
+        return "COALESCE(il.designation_fr, il.designation_en, il.designation)"
+    elif lang_code in ("es", "sp"):
+        return "COALESCE(il.designation_sp, il.designation_en, il.designation)"
+    else:
+        return "COALESCE(il.designation_en, il.designation)"
+
+
+def install_snapshot_version(cur):
+    """Create the report_snapshot_version table (migration step)."""
+    cur.execute(_VERSION_TABLE_SQL)
+
+
+def rebuild_snapshots(cur, designation_expr):
+    """Re-fill std_list_combined and std_qty_helper (caller commits)."""
+    cur.execute("DELETE FROM std_list_combined")
+    cur.execute(
+        f"""
+        INSERT INTO std_list_combined (code, description, type, std_qty_collective)
+        SELECT
+            all_codes.code,
+            {designation_expr},
+            il.type,
+            SUM(all_codes.qty_component) AS std_qty_collective
+        FROM (
+            SELECT code, quantity AS qty_component FROM compositions
+            UNION ALL
+            SELECT code, std_qty AS qty_component FROM kit_items
+        ) AS all_codes
+        LEFT JOIN items_list il ON il.code = all_codes.code
+        GROUP BY all_codes.code
+        """
+    )
+    cur.execute("DELETE FROM std_qty_helper")
+    cur.execute(
+        f"""
+        INSERT INTO std_qty_helper (id, code, description, type, scenario_id, scenario, kit, module, std_qty)
+        SELECT
+          c.std_id, c.code, {designation_expr}, il.type,
+          c.scenario_id, s.name, NULL, NULL, c.quantity
+        FROM compositions c
+        LEFT JOIN items_list il ON il.code = c.code
+        LEFT JOIN scenarios s ON s.scenario_id = c.scenario_id
+        UNION ALL
+        SELECT
+          CAST(k.id AS TEXT), k.code, {designation_expr}, il.type,
+          k.scenario_id, s.name, k.kit, k.module, k.std_qty
+        FROM kit_items k
+        LEFT JOIN items_list il ON il.code = k.code
+        LEFT JOIN scenarios s ON s.scenario_id = k.scenario_id
+        """
+    )
+
+
+def _statement_sql(filters, cutoff_iso):
+    """The joined std + stock + metadata query for one filter set, with params."""
+    std_where, std_params = [], []
+    stock_where, stock_params = [], []
+    if filters.get("scenario"):
+        std_where.append("scenario = ?")
+        std_params.append(filters["scenario"])
+        stock_where.append("scenario = ?")
+        stock_params.append(filters["scenario"])
+    kit_code = filters.get("kit_code")
+    module_code = filters.get("module_code")
+    item_code = filters.get("item_code")
+    if kit_code:
+        std_where.append("(kit = ? OR (type='KIT' AND code=?))")
+        std_params.extend([kit_code, kit_code])
+    if module_code:
+        std_where.append("(module = ? OR (type='MODULE' AND code=?))")
+        std_params.extend([module_code, module_code])
+    if item_code:
+        std_where.append("code = ?")
+        std_params.append(item_code)
+    type_filter = (filters.get("type_filter") or "All").upper()
+    if type_filter not in ("KIT", "MODULE", "ITEM"):
+        type_filter = None
+    if type_filter:
+        std_where.append("UPPER(type)=?")
+        std_params.append(type_filter)
+
+    base = " AND ".join(stock_where) or "1=1"
+    lines, line_params = [], []
+    for column, only in (("kit", kit_code), ("module", module_code), ("item", item_code)):
+        sql = (
+            f"SELECT {column} AS code, COALESCE(final_qty, 0) AS qty, exp_date FROM stock_data "
+            f"WHERE {base} AND {column} <> '' AND LOWER(TRIM({column})) <> 'none'"
+        )
+        line_params.extend(stock_params)
+        if only:
+            sql += f" AND {column} = ?"
+            line_params.append(only)
+        lines.append(sql)
+
+    stock_type = ""
+    if type_filter:
+        stock_type = "WHERE code IN (SELECT code FROM items_list WHERE UPPER(type) = ?)"
+
+    sql = f"""
+        WITH std AS (
+            SELECT code, SUM(std_qty) AS total_std
+              FROM std_qty_helper
+             WHERE {' AND '.join(std_where) or '1=1'}
+             GROUP BY code
+        ),
+        lines AS (
+            {' UNION ALL '.join(lines)}
+        ),
+        stock AS (
+            SELECT code,
+                   SUM(qty) AS current_stock,
+                   SUM(CASE WHEN ? IS NOT NULL AND exp_date GLOB '{_ISO_DATE_GLOB}'
+                             AND exp_date <= ? THEN qty ELSE 0 END) AS expiring
+              FROM lines
+              {stock_type}
+             GROUP BY code
+        ),
+        codes AS (
+            SELECT code FROM std
+            UNION
+            SELECT code FROM stock
+        )
+        SELECT c.code,
+               COALESCE(std.total_std, 0) AS standard_qty,
+               COALESCE(stock.current_stock, 0) AS current_stock,
+               COALESCE(stock.expiring, 0) AS qty_expiring,
+               {designation_sql()} AS designation, il.type,
+               il.pack, il.price_per_pack_euros, il.unit_price_euros,
+               il.weight_per_pack_kg, il.volume_per_pack_dm3,
+               il.shelf_life_months, il.remarks, il.account_code
+          FROM codes c
+          LEFT JOIN std ON std.code = c.code
+          LEFT JOIN stock ON stock.code = c.code
+          LEFT JOIN items_list il ON il.code = c.code
+         ORDER BY c.code
+    """
+    params = std_params + line_params + [cutoff_iso, cutoff_iso]
+    if type_filter:
+        params.append(type_filter)
+    return sql, params
+
+
+class StatementEngine:
+    """Snapshot-version tracking + cached stock statement rows."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._results = {}
+        self._snapshot_version = None  # (fingerprint, lang) known to be built
+        self._rebuild_due = False      # an edit event asked for a rebuild
+        self._watch = TableWatch()
+
+    # ---------------- Staleness ----------------
+    def invalidate(self, *_):
+        with self._lock:
+            self._results = {}
+
+    def invalidate_snapshots(self, *_):
+        """Edit events: the next ensure_snapshots() rebuilds whatever version is stored."""
+        with self._lock:
+            self._results = {}
+            self._snapshot_version = None
+            self._rebuild_due = True
+
+    def _check_external_writes(self):
+        written = self._watch.poll()
+        if written is None:
+            return
+        with self._lock:
+            self._results = {}
+            if written.touches(_SOURCE_TABLES):
+                # re-checked against the stored version on next ensure_snapshots()
+                self._snapshot_version = None
+
+    # ---------------- Snapshots ----------------
+    def ensure_snapshots(self, force=False):
+        """
+        Rebuild std_list_combined / std_qty_helper only if the source tables or
+        the language changed since the last build. Returns True if rebuilt.
+        """
+        self._check_external_writes()
+        lang_code = getattr(lang, "lang_code", "en").lower()
+        force = force or self._rebuild_due
+        if not force and self._snapshot_version and self._snapshot_version[1] == lang_code:
+            return False
+
+        conn = connect_db()
+        if conn is None:
+            raise RuntimeError("DB connection failed for snapshot refresh")
+        cur = conn.cursor()
+        try:
+            fingerprint = _fingerprint(conn)
+            version = (fingerprint, lang_code)
+            if not force and fingerprint is not None and schema.has_table("report_snapshot_version"):
+                stored = cur.execute(
+                    "SELECT fingerprint, lang FROM report_snapshot_version WHERE id = 1"
+                ).fetchone()
+                if stored and tuple(stored) == version:
+                    self._snapshot_version = version
+                    return False
+
+            rebuild_snapshots(cur, designation_sql(lang_code))
+            cur.execute(
+                "INSERT OR REPLACE INTO report_snapshot_version (id, fingerprint, lang, built_at) "
+                "VALUES (1, ?, ?, ?)",
+                (fingerprint, lang_code, datetime.now().isoformat(timespec="seconds")),
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            conn.close()
+        # Our own commit moved data_version: re-sync so it is not taken as external
+        self._check_external_writes()
+        self._snapshot_version = version
+        self._rebuild_due = False
+        return True
+
+    # ---------------- Statement ----------------
+    def statement(self, filters, cutoff_iso):
+        """
+        Rows (dicts keyed by STATEMENT_COLUMNS) for the filters and expiry
+        cutoff, sorted by code. Cached per (filters, cutoff, language).
+        """
+        self._check_external_writes()
+        key = (
+            filters.get("scenario"), filters.get("kit_code"), filters.get("module_code"),
+            filters.get("item_code"), (filters.get("type_filter") or "All").upper(),
+            cutoff_iso, getattr(lang, "lang_code", "en"),
+        )
+        with self._lock:
+            rows = self._results.get(key)
+        if rows is not None:
+            return rows
+
+        sql, params = _statement_sql(filters, cutoff_iso)
+        conn = connect_db()
+        if conn is None:
+            return []
+        cur = conn.cursor()
+        try:
+            cur.execute(sql, params)
+            rows = [dict(zip(STATEMENT_COLUMNS, r)) for r in cur.fetchall()]
+        except sqlite3.Error as e:
+            logging.error(f"[StatementEngine] Statement query failed: {e}")
+            return []
+        finally:
+            cur.close()
+            conn.close()
+        with self._lock:
+            self._results[key] = rows
+        return rows
+
+
+# Global singleton used across the app
+statement_engine = StatementEngine()
+bus.subscribe(STOCK_CHANGED, statement_engine.invalidate)
+bus.subscribe((COMPOSITION_CHANGED, ITEMS_CHANGED, SCENARIOS_CHANGED), statement_engine.invalidate_snapshots)
@@ -0,0 +1,162 @@
+"""
+std_qty_index.py
+Shared, cached index of standard quantities for every scenario.
+
+The Inventory (stock_inv.py) and Stock Summary (stock_summary.py) screens both
+need the std quantities of every scenario keyed by:
+    (scenario_name, code)      for ON-SHELF lines (compositions)
+    (scenario_name, treecode)  for IN-BOX lines (kit_items)
+
+Instead of issuing two queries per scenario, StdQuantityIndex loads
+compositions and kit_items for ALL scenarios with two set-based queries and
+keeps the result in memory. The cache is validated by a db.TableWatch on
+compositions, kit_items and scenarios (their write counters), so any
+composition / kit / scenario edit, from any connection, rebuilds it on next
+access.
+"""
+
+import sqlite3
+import logging
+import threading
+
+from db import connect_db, TableWatch
+from event_bus import bus, COMPOSITION_CHANGED, SCENARIOS_CHANGED
+
+logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
+
+_ONSHELF_SQL = """
+    SELECT s.scenario_id, s.name, c.code, c.quantity
+      FROM compositions c
+      JOIN scenarios s ON s.scenario_id = c.scenario_id
+     ORDER BY s.scenario_id, c.code
+"""
+
+_INBOX_SQL = """
+    SELECT s.scenario_id, s.name, k.code, k.kit, k.module, k.std_qty, k.treecode
+      FROM kit_items k
+      JOIN scenarios s ON s.scenario_id = k.scenario_id
+     ORDER BY s.scenario_id, k.treecode, k.kit, k.module
+"""
+
+
+class StdQuantityIndex:
+    """
+    In-memory std quantity index for all scenarios.
+
+    entries(scenario_name) returns {key: info} where key is the code for
+    on-shelf lines and the treecode for in-box lines. info carries
+    code, std_qty, mgmt_type, kit_code, module_code, treecode, scenario_id.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._watch = TableWatch(("compositions", "kit_items", "scenarios"))
+        self._loaded = False
+        self._by_scenario = {}      # scenario_name -> {key: info}
+        self._scenario_ids = {}     # scenario_name -> scenario_id
+
+    # ------------------------------------------------------------------ #
+    # Cache management
+    # ------------------------------------------------------------------ #
+    def invalidate(self):
+        """Drop the cached index; it is rebuilt on next access."""
+        with self._lock:
+            self._loaded = False
+            self._by_scenario = {}
+            self._scenario_ids = {}
+
+    def _ensure_loaded(self):
+        if self._watch.changed():
+            self.invalidate()
+        if self._loaded:
+            return
+        conn = connect_db()
+        if conn is None:
+            return
+        conn.row_factory = sqlite3.Row
+        cur = conn.cursor()
+        try:
+            with self._lock:
+                if self._loaded:
+                    return
+
+                by_scenario = {}
+                scenario_ids = {}
+
+                cur.execute("SELECT scenario_id, name FROM scenarios")
+                for r in cur.fetchall():
+                    if r["name"] is None:
+                        continue
+                    by_scenario.setdefault(r["name"], {})
+                    scenario_ids[r["name"]] = r["scenario_id"]
+
+                # 1. ON-SHELF (key = code)
+                cur.execute(_ONSHELF_SQL)
+                for r in cur.fetchall():
+                    code = r["code"]
+                    by_scenario.setdefault(r["name"], {})[code] = {
+                        "code": code,
+                        "std_qty": r["quantity"] or 0,
+                        "mgmt_type": "on-shelf",
+                        "kit_code": None,
+                        "module_code": None,
+                        "treecode": None,
+                        "scenario_id": r["scenario_id"],
+                    }
+
+                # 2. IN-BOX (key = treecode)
+                cur.execute(_INBOX_SQL)
+                for r in cur.fetchall():
+                    code = r["code"]
+                    treecode = r["treecode"] or code
+                    by_scenario.setdefault(r["name"], {})[treecode] = {
+                        "code": code,
+                        "std_qty": r["std_qty"] or 0,
+                        "mgmt_type": "in-box",
+                        "kit_code": r["kit"] or "",
+                        "module_code": r["module"] or "",
+                        "treecode": treecode,
+                        "scenario_id": r["scenario_id"],
+                    }
+
+                self._by_scenario = by_scenario
+                self._scenario_ids = scenario_ids
+                self._loaded = True
+        except sqlite3.Error as e:
+            logging.error(f"[StdQuantityIndex] Load failed: {e}")
+        finally:
+            cur.close()
+            conn.close()
+
+    # ------------------------------------------------------------------ #
+    # Lookups
+    # ------------------------------------------------------------------ #
+    def scenario_names(self):
+        self._ensure_loaded()
+        return list(self._by_scenario.keys())
+
+    def entries(self, scenario_name):
+        """Return {key: info} for one scenario (empty dict if unknown)."""
+        self._ensure_loaded()
+        return self._by_scenario.get(scenario_name, {})
+
+    def by_scenario(self, scenario_name=None):
+        """
+        Return {scenario_name: {key: info}} for one scenario, or for every
+        scenario when scenario_name is falsy. Unknown scenario -> {}.
+        """
+        self._ensure_loaded()
+        if scenario_name:
+            if scenario_name not in self._by_scenario:
+                return {}
+            return {scenario_name: self._by_scenario[scenario_name]}
+        return dict(self._by_scenario)
+
+    def get(self, scenario_name, key):
+        """Lookup by (scenario, code) for on-shelf or (scenario, treecode) for in-box."""
+        return self.entries(scenario_name).get(key)
+
+
+# Shared instance reused by every screen
+std_qty_index = StdQuantityIndex()
+bus.subscribe((COMPOSITION_CHANGED, SCENARIOS_CHANGED), lambda event: std_qty_index.invalidate())
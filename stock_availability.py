@@ -40,6 +40,10 @@ from openpyxl.styles import PatternFill
 from openpyxl.utils import get_column_letter
 
 from db import connect_db
+from filter_options import filter_options
+from ledger_archive import attach_ledger
+from order_engine import AMC_OUT_SQL
+from schema_registry import schema
 from language_manager import lang
 from popup_utils import custom_popup
 from manage_items import get_item_description, detect_type
@@ -118,11 +122,7 @@ class StockAvailabilityCalculator:
 
     # ---- Internals ----
     def _table_cols(self, cur, table):
-        try:
-            cur.execute(f"PRAGMA table_info({table})")
-            return [r[1].lower() for r in cur.fetchall()]
-        except sqlite3.Error:
-            return []
+        return list(schema.columns(table))
 
     def _load_stock(self, conn):
         cur = conn.cursor()
@@ -166,14 +166,9 @@ class StockAvailabilityCalculator:
             start_date = date(start_year, start_month, 1)
             end_day = monthrange(self.current_year, self.current_month)[1]
             end_date = date(self.current_year, self.current_month, end_day)
-            cur.execute("""
-                SELECT code, SUM(COALESCE(Qty_Out,0))
-                FROM stock_transactions
-                WHERE Out_Type IS NOT NULL
-                  AND LOWER(Out_Type)=LOWER('Out MSF')
-                  AND Date >= ? AND Date <= ?
-                GROUP BY code
-            """,(start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")))
+            # The AMC window reaches back into closed (possibly archived) years
+            attach_ledger(conn, start_date, end_date)
+            cur.execute(AMC_OUT_SQL, (start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")))
             for code, total_out in cur.fetchall():
                 if code:
                     mapping[code] = (total_out or 0)/self.amc_months
@@ -520,29 +515,8 @@ class StockAvailability(tk.Frame):
             self.scenario_var.set("All")
 
     def populate_kit_module_lists(self):
-        conn = connect_db()
-        kits, modules = set(), set()
-        if conn:
-            cur = conn.cursor()
-            try:
-                cur.execute("PRAGMA table_info(stock_data)")
-                cols = [r[1].lower() for r in cur.fetchall()]
-                if "kit_number" in cols:
-                    cur.execute("""SELECT DISTINCT kit_number FROM stock_data
-                                   WHERE kit_number IS NOT NULL AND kit_number!='None'
-                                   ORDER BY kit_number""")
-                    for (k,) in cur.fetchall():
-                        if k: kits.add(str(k))
-                if "module_number" in cols:
-                    cur.execute("""SELECT DISTINCT module_number FROM stock_data
-                                   WHERE module_number IS NOT NULL AND module_number!='None'
-                                   ORDER BY module_number""")
-                    for (m,) in cur.fetchall():
-                        if m: modules.add(str(m))
-            except sqlite3.Error:
-                pass
-            finally:
-                cur.close(); conn.close()
+        kits = {str(k) for k in filter_options.kit_numbers()}
+        modules = {str(m) for m in filter_options.module_numbers()}
         kit_vals = ["All"] + sorted(kits, key=lambda x: (len(x), x))
         mod_vals = ["All"] + sorted(modules, key=lambda x: (len(x), x))
         self.kit_cb['values'] = kit_vals
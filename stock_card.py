@@ -3,6 +3,10 @@ from tkinter import ttk, filedialog
 from datetime import datetime
 import sqlite3
 from db import connect_db
+from filter_options import filter_options
+from ledger_checkpoints import MOVEMENT_SQL, balance_before
+from ledger_archive import LEDGER_VIEW, attach_ledger
+from schema_registry import schema
 from language_manager import lang
 import openpyxl
 from openpyxl.styles import PatternFill, Alignment, Font
@@ -73,6 +77,74 @@ def parse_user_date(text: str, bound: str) -> date | None:
     return None
 
 
+# ---------------- Queries ----------------
+# Every line of a document, in entry order (param: document_number)
+DOCUMENT_LINES_SQL = (
+    f"SELECT * FROM {LEDGER_VIEW} WHERE document_number = ? ORDER BY Date, Time, ledger_seq"
+)
+
+_CARD_SOURCE_SQL = f"""
+      FROM {LEDGER_VIEW} st
+      LEFT JOIN stock_data sd ON sd.unique_id = st.unique_id
+     WHERE st.code = ?
+"""
+
+
+def _card_where(code, scenario=None, kit=None, module=None, management_mode=None):
+    """(where, params) of the card filters, appended to _CARD_SOURCE_SQL."""
+    where = ""
+    params = [code]
+    if scenario is not None:
+        where += " AND st.Scenario = ?"
+        params.append(scenario)
+    if kit is not None:
+        where += " AND st.Kit = ?"
+        params.append(kit)
+    if module is not None:
+        where += " AND st.Module = ?"
+        params.append(module)
+    # Management mode filter (from stock_data)
+    if management_mode:
+        where += " AND sd.management_mode = ?"
+        params.append(management_mode)
+    return where, params
+
+
+def build_opening_query(code, from_str, scenario=None, kit=None, module=None, management_mode=None):
+    """(sql, params) of the balance carried in before from_str, as one aggregate.
+
+    Used when filtering on stock_data.management_mode, which the monthly
+    checkpoints do not carry.
+    """
+    where, params = _card_where(code, scenario, kit, module, management_mode)
+    sql = f"SELECT TOTAL({MOVEMENT_SQL.format(t='st.')}) {_CARD_SOURCE_SQL}{where} AND st.Date < ?"
+    return sql, params + [from_str]
+
+
+def build_card_query(code, from_str=None, to_str=None, scenario=None, kit=None,
+                     module=None, management_mode=None, opening_balance=0):
+    """(sql, params) of the card lines of code with their running balance."""
+    where, params = _card_where(code, scenario, kit, module, management_mode)
+    if from_str:
+        where += " AND st.Date >= ?"
+        params.append(from_str)
+    if to_str:
+        where += " AND st.Date <= ?"
+        params.append(to_str)
+    sql = f"""
+        SELECT st.Date, st.Time, st.IN_Type, st.Out_Type, st.End_User, st.Third_Party,
+               st.Qty_IN, st.Qty_Out, st.Discrepancy,
+               st.Expiry_date, st.Remarks, st.comments, st.document_number,
+               sd.management_mode,
+               ? + SUM({MOVEMENT_SQL.format(t="st.")}) OVER (
+                   ORDER BY st.Date, st.Time, st.ledger_seq ROWS UNBOUNDED PRECEDING
+               ) AS running_balance
+        {_CARD_SOURCE_SQL}{where}
+         ORDER BY st.Date, st.Time, st.ledger_seq
+    """
+    return sql, [opening_balance] + params
+
+
 def get_active_designation(code: str) -> str:
     """
     Fetch the active designation for a given code based on lang.lang_code.
@@ -136,30 +208,9 @@ def fetch_kit_numbers(scenario_name: str | None = None) -> list:
     Fetch distinct kit_number values from stock_data.
     Optionally filter by scenario (scenario_name, not ID) if provided and not 'All Scenarios'.
     """
-    conn = connect_db()
-    if conn is None:
-        return []
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    try:
-        base = """
-            SELECT DISTINCT kit_number
-              FROM stock_data
-             WHERE kit_number IS NOT NULL
-               AND kit_number != 'None'
-        """
-        params = []
-        if scenario_name and scenario_name != lang.t(
-            "stock_card.all_scenarios", "All Scenarios"
-        ):
-            base += " AND scenario = ?"
-            params.append(scenario_name)
-        base += " ORDER BY kit_number"
-        cur.execute(base, params)
-        return [r["kit_number"] for r in cur.fetchall()]
-    finally:
-        cur.close()
-        conn.close()
+    if scenario_name == lang.t("stock_card.all_scenarios", "All Scenarios"):
+        scenario_name = None
+    return filter_options.kit_numbers(scenario_name)
 
 
 def fetch_module_numbers(
@@ -169,33 +220,11 @@ def fetch_module_numbers(
     Fetch distinct module_number values from stock_data.
     Optionally filter by scenario and kit_number (in that order).
     """
-    conn = connect_db()
-    if conn is None:
-        return []
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    try:
-        base = """
-            SELECT DISTINCT module_number
-              FROM stock_data
-             WHERE module_number IS NOT NULL
-               AND module_number != 'None'
-        """
-        params = []
-        if scenario_name and scenario_name != lang.t(
-            "stock_card.all_scenarios", "All Scenarios"
-        ):
-            base += " AND scenario = ?"
-            params.append(scenario_name)
-        if kit_number and kit_number != lang.t("stock_card.all_kits", "All Kits"):
-            base += " AND kit_number = ?"
-            params.append(kit_number)
-        base += " ORDER BY module_number"
-        cur.execute(base, params)
-        return [r["module_number"] for r in cur.fetchall()]
-    finally:
-        cur.close()
-        conn.close()
+    if scenario_name == lang.t("stock_card.all_scenarios", "All Scenarios"):
+        scenario_name = None
+    if kit_number == lang.t("stock_card.all_kits", "All Kits"):
+        kit_number = None
+    return filter_options.module_numbers(scenario_name, kit_number)
 
 
 class StockCard(tk.Frame):
@@ -396,7 +425,7 @@ class StockCard(tk.Frame):
 
         query_sql = f"""
             SELECT DISTINCT s.code
-              FROM stock_transactions s
+              FROM {LEDGER_VIEW} s
               LEFT JOIN items_list i ON s.code = i.code
               LEFT JOIN stock_data sd ON sd.unique_id = s.unique_id
              WHERE (
@@ -443,6 +472,8 @@ class StockCard(tk.Frame):
 
         query_sql += " ORDER BY s.code"
         try:
+            # Codes whose movements are all in archived years are found too
+            attach_ledger(conn, from_date, to_date)
             cursor.execute(query_sql, params)
             results = cursor.fetchall()
             return [
@@ -520,16 +551,7 @@ class StockCard(tk.Frame):
 
     # ---------------- Document window helpers ----------------
     def _get_stock_transactions_columns(self) -> list[str]:
-        conn = connect_db()
-        if conn is None:
-            return []
-        cur = conn.cursor()
-        try:
-            cur.execute("PRAGMA table_info(stock_transactions)")
-            return [r[1] for r in cur.fetchall()]
-        finally:
-            cur.close()
-            conn.close()
+        return list(schema.columns("stock_transactions").values())
 
     def _auto_fit_tree_columns(
         self, tree: ttk.Treeview, max_width: int = 420, padding: int = 24
@@ -546,7 +568,8 @@ class StockCard(tk.Frame):
             width = min(max_width, max(80, (max_len * 7) + padding))
             tree.column(col, width=width, stretch=True)
 
-    def open_document_window(self, document_number: str) -> None:
+    def open_document_window(self, document_number: str, row_date: str = None) -> None:
+        """Rows of one document; row_date (ISO) limits the archives read to that date."""
         doc = (document_number or "").strip()
         if not doc:
             custom_popup(
@@ -642,9 +665,11 @@ class StockCard(tk.Frame):
 
         tree.tag_configure("active_code", background="#FFF3CD")
 
-        for col in visible_columns:
-            key = f"stock_transactions.{col.lower()}"
-            tree.heading(col, text=lang.t(key, col))
+        labels = lang.t_many(
+            [c.lower() for c in visible_columns], "stock_transactions.", visible_columns
+        )
+        for col, label in zip(visible_columns, labels):
+            tree.heading(col, text=label)
             tree.column(col, width=120, stretch=True)
 
         conn = connect_db()
@@ -664,10 +689,8 @@ class StockCard(tk.Frame):
         conn.row_factory = sqlite3.Row
         cur = conn.cursor()
         try:
-            cur.execute(
-                "SELECT * FROM stock_transactions WHERE document_number = ? ORDER BY Date, Time",
-                (doc,),
-            )
+            attach_ledger(conn, None, row_date or None)
+            cur.execute(DOCUMENT_LINES_SQL, (doc,))
             rows = cur.fetchall()
 
             if rows:
@@ -744,60 +767,51 @@ class StockCard(tk.Frame):
         from_date, to_date = self._get_date_range()
 
         try:
-            query = """
-                SELECT st.Date, st.Time, st.IN_Type, st.Out_Type, st.End_User, st.Third_Party,
-                       st.Qty_IN, st.Qty_Out, st.Discrepancy,
-                       st.Expiry_date, st.Remarks, st.comments, st.document_number,
-                       sd.management_mode
-                  FROM stock_transactions st
-                  LEFT JOIN stock_data sd ON sd.unique_id = st.unique_id
-                 WHERE st.code = ?
-            """
-            params = [code]
+            # Hot ledger plus the archived years the range reaches into
+            # (all of them for the management-mode opening aggregate)
+            mmode = self._selected_management_mode_db()
+            attach_ledger(conn, None if mmode else from_date, to_date)
+            scenario = kit = module = None
 
             # Scenario / Kit / Module filters
             if self.scenario_var.get() != lang.t(
                 "stock_card.all_scenarios", "All Scenarios"
             ):
-                query += " AND st.Scenario = ?"
-                params.append(self.scenario_var.get())
+                scenario = self.scenario_var.get()
 
             if self.kit_var.get() != lang.t("stock_card.all_kits", "All Kits"):
-                query += " AND st.Kit = ?"
-                params.append(self.kit_var.get())
+                kit = self.kit_var.get()
 
             if self.module_var.get() != lang.t("stock_card.all_modules", "All Modules"):
-                query += " AND st.Module = ?"
-                params.append(self.module_var.get())
-
-            # Management mode filter (from stock_data)
-            mmode = self._selected_management_mode_db()
-            if mmode:
-                query += " AND sd.management_mode = ?"
-                params.append(mmode)
+                module = self.module_var.get()
 
             # Date range filter (convert to YYYY-MM-DD strings for DB)
-            if from_date:
-                query += " AND st.Date >= ?"
-                params.append(from_date.strftime("%Y-%m-%d"))
-
-            if to_date:
-                query += " AND st.Date <= ?"
-                params.append(to_date.strftime("%Y-%m-%d"))
+            from_str = from_date.strftime("%Y-%m-%d") if from_date else None
+            to_str = to_date.strftime("%Y-%m-%d") if to_date else None
+
+            # Opening balance carried in before from_date: monthly checkpoints,
+            # or one aggregate when filtering on stock_data.management_mode
+            opening_balance = 0
+            if from_str:
+                if mmode:
+                    cursor.execute(*build_opening_query(code, from_str, scenario, kit, module, mmode))
+                    opening_balance = int(cursor.fetchone()[0])
+                else:
+                    opening_balance = balance_before(
+                        cursor, code, from_str, scenario, kit, module, source=LEDGER_VIEW
+                    )
 
-            query += " ORDER BY st.Date, st.Time"
-            cursor.execute(query, params)
+            cursor.execute(*build_card_query(code, from_str, to_str, scenario, kit, module,
+                                             mmode, opening_balance))
             rows = cursor.fetchall()
 
             processed_rows = []
-            running_balance = 0
 
             for row in rows:
                 qty_in = row["Qty_IN"] or 0
                 qty_out = row["Qty_Out"] or 0
                 disc = self._safe_int(row["Discrepancy"])
-
-                running_balance += qty_in - qty_out + disc
+                running_balance = row["running_balance"]
 
                 origin_destination = ""
                 if row["IN_Type"]:
@@ -1196,7 +1210,8 @@ class StockCard(tk.Frame):
                 return
             doc = values[idx]
             if doc:
-                self.open_document_window(str(doc))
+                row_date = str(values[self.cols.index("date")] or "")[:10]
+                self.open_document_window(str(doc), row_date)
         except Exception:
             return
 
@@ -1,7 +1,8 @@
 import sqlite3
 from datetime import datetime, timedelta
 from language_manager import lang
-from db import connect_db
+from event_bus import bus, STOCK_CHANGED
+from write_queue import writer
 from dateutil import parser
 from calendar import monthrange
 from popup_utils import custom_popup, custom_askyesno, custom_dialog
@@ -56,11 +57,26 @@ class StockData:
         Insert or update stock_data table.
         If unique_id exists, update qty_in, qty_out, exp_date, and updated_at.
         If exp_date is provided, use it; otherwise, parse from unique_id.
+        Applied by the writer thread together with the item recalculation.
+        """
+        parsed = StockData.parse_unique_id(unique_id)
+        try:
+            writer.run(StockData.apply, unique_id, qty_in, qty_out, exp_date)
+        except Exception as e:
+            logging.error(f"Error in add_or_update for unique_id {unique_id}: {str(e)}")
+            raise
+        bus.publish(STOCK_CHANGED, code=parsed['item'], scenario=parsed['scenario'], unique_id=unique_id)
+
+    @staticmethod
+    def apply(conn, unique_id, qty_in=0, qty_out=0, exp_date=None):
+        """
+        Writer job of add_or_update(): upsert the lot and recalculate its item
+        on the writer's connection (no commit, no STOCK_CHANGED). Screens that
+        save many rows submit() these and wait once, so the rows share a commit.
         """
         parsed = StockData.parse_unique_id(unique_id)
         effective_exp_date = exp_date if exp_date else parsed['exp_date']
         current_timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        conn = connect_db()
         cursor = conn.cursor()
 
         try:
@@ -85,17 +101,9 @@ class StockData:
                     parsed['scenario'], parsed['kit'], parsed['module'], parsed['item'],
                     parsed['std_qty'], qty_in, qty_out, effective_exp_date, current_timestamp
                 ))
-
-            conn.commit()
-        except Exception as e:
-            conn.rollback()
-            logging.error(f"Error in add_or_update for unique_id {unique_id}: {str(e)}")
-            raise
+            StockData._recalculate(cursor, parsed['item'])
         finally:
             cursor.close()
-            conn.close()
-
-        StockData.recalculate_for_item(parsed['item'])
 
     @staticmethod
     def recalculate_for_item(item_code):
@@ -103,9 +111,17 @@ class StockData:
         Recalculate qty_to_order, qty_overstock, qty_to_order_per_scenario, qt_expiring
         for all rows with this item_code.
         """
-        conn = connect_db()
-        cursor = conn.cursor()
+        def job(conn):
+            cursor = conn.cursor()
+            try:
+                StockData._recalculate(cursor, item_code)
+            finally:
+                cursor.close()
+        writer.run(job)
 
+    @staticmethod
+    def _recalculate(cursor, item_code):
+        """recalculate_for_item() on the cursor of a writer job."""
         cursor.execute("""
             SELECT COALESCE(SUM(final_qty), 0) AS total_final_qty, COALESCE(SUM(std_qty), 0) AS total_std_qty
             FROM stock_data WHERE item=?
@@ -151,20 +167,9 @@ class StockData:
                 WHERE unique_id=?
             """, (qty_to_order, qty_overstock, qty_to_order_per_scenario, qt_expiring, unique_id))
 
-        conn.commit()
-        cursor.close()
-        conn.close()
-
     @staticmethod
     def cleanup_zero_final_qty():
         """
         Delete rows where final_qty = 0 (no stock remaining).
         """
-        conn = connect_db()
-        cursor = conn.cursor()
-
-        cursor.execute("DELETE FROM stock_data WHERE final_qty = 0")
-        conn.commit()
-
-        cursor.close()
-        conn.close()
\ No newline at end of file
+        writer.run(lambda conn: conn.execute("DELETE FROM stock_data WHERE final_qty = 0"))
\ No newline at end of file
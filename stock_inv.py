@@ -7,9 +7,14 @@ import os
 import openpyxl
 from openpyxl.styles import Font, Alignment, PatternFill
 
-from db import connect_db
+from db import connect_db, cached_query
+from transaction_utils import LAST_DOCUMENT_SQL
+from event_bus import bus, STOCK_CHANGED
 from language_manager import lang
 from stock_data import parse_expiry
+from std_qty_index import std_qty_index
+from inventory_model import InventoryModel
+from filter_options import filter_options
 from manage_items import get_item_description, detect_type
 from popup_utils import custom_popup, custom_askyesno, custom_dialog
 
@@ -67,26 +72,16 @@ def normalize_type_text(text: str) -> str:
 
 def load_scenario_maps():
     """Load scenario ID to name mappings"""
-    conn = connect_db()
-    if conn is None:
-        return {}, set()
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    try:
-        cur.execute("SELECT scenario_id, name FROM scenarios")
-        rows = cur.fetchall()
-        id_to_name = {}
-        name_set = set()
-        for r in rows:
-            sid = r["scenario_id"]
-            nm = r["name"]
-            if nm:
-                name_set.add(nm)
-            id_to_name[str(sid)] = nm
-        return id_to_name, name_set
-    finally:
-        cur.close()
-        conn.close()
+    rows = cached_query("SELECT scenario_id, name FROM scenarios")
+    id_to_name = {}
+    name_set = set()
+    for r in rows:
+        sid = r["scenario_id"]
+        nm = r["name"]
+        if nm:
+            name_set.add(nm)
+        id_to_name[str(sid)] = nm
+    return id_to_name, name_set
 
 
 def normalize_scenario(raw_val, id_to_name, name_set):
@@ -106,81 +101,12 @@ def load_std_quantities_by_scenario(scenario_name=None):
     Load standard quantities with treecodes and management type info
     Returns: dict with structure {scenario_name: {key: {"code": code, "std_qty": qty, "mgmt_type": type, ...}}}
     Key is: code for on-shelf, treecode for in-box
+    Served from the shared StdQuantityIndex (all scenarios, two queries, cached).
     """
-    result = {}
-
-    # Determine scenarios to load
-    if not scenario_name:
-        scenario_rows = _fetchall("SELECT scenario_id, name FROM scenarios")
-        scenarios = [(r["scenario_id"], r["name"]) for r in scenario_rows]
-    else:
-        scenario_row = _fetchone(
-            "SELECT scenario_id, name FROM scenarios WHERE name = ?", (scenario_name,)
-        )
-        if not scenario_row:
-            return {}
-        scenarios = [(scenario_row["scenario_id"], scenario_row["name"])]
-
-    for scenario_id, scenario_name in scenarios:
-        if scenario_name not in result:
-            result[scenario_name] = {}
-
-        # 1. Load ON-SHELF items from compositions
-        onshelf_rows = _fetchall(
-            """
-            SELECT code, quantity
-            FROM compositions 
-            WHERE scenario_id = ?
-            ORDER BY code
-            """,
-            (scenario_id,),
-        )
-
-        for r in onshelf_rows:
-            code = r["code"]
-            qty = r["quantity"] or 0
-
-            # Key is code for on-shelf items
-            result[scenario_name][code] = {
-                "code": code,
-                "std_qty": qty,
-                "mgmt_type": "on-shelf",
-                "kit_code": None,
-                "module_code": None,
-                "treecode": None,
-                "scenario_id": scenario_id,
-            }
-
-        # 2. Load IN-BOX items from kit_items
-        inbox_rows = _fetchall(
-            """
-            SELECT code, kit, module, std_qty, treecode
-            FROM kit_items
-            WHERE scenario_id = ?
-            ORDER BY treecode, kit, module
-            """,
-            (scenario_id,),
-        )
-
-        for r in inbox_rows:
-            code = r["code"]
-            treecode = r["treecode"] or code
-            kit = r["kit"] or ""
-            module = r["module"] or ""
-            qty = r["std_qty"] or 0
-
-            # Key is treecode for in-box items
-            result[scenario_name][treecode] = {
-                "code": code,
-                "std_qty": qty,
-                "mgmt_type": "in-box",
-                "kit_code": kit,
-                "module_code": module,
-                "treecode": treecode,
-                "scenario_id": scenario_id,
-            }
-
-    return result
+    return {
+        scen: {key: dict(info) for key, info in entries.items()}
+        for scen, entries in std_qty_index.by_scenario(scenario_name).items()
+    }
 
 
 def aggregate_stock_by_key(scenario_name, mgmt_mode):
@@ -580,7 +506,7 @@ class StockInventory(tk.Frame):
         self.scenario_map = self.fetch_scenario_map()
         self.ctx_menu = None
         self.ctx_row = None
-        self.base_physical_inputs = {}
+        self.inv_model = InventoryModel()
         self.user_row_states = {}
         self.temp_row_counter = 0
         self.pack(fill="both", expand=True)
@@ -588,71 +514,22 @@ class StockInventory(tk.Frame):
 
     # ---------- DB fetchers ----------
     def fetch_scenario_map(self):
-        conn = connect_db()
-        if conn is None:
-            return {}
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-        try:
-            cur.execute("SELECT scenario_id, name FROM scenarios")
-            return {str(r["scenario_id"]): r["name"] for r in cur.fetchall()}
-        finally:
-            cur.close()
-            conn.close()
+        return {str(r["scenario_id"]): r["name"] for r in cached_query("SELECT scenario_id, name FROM scenarios")}
 
     def fetch_kit_numbers(self, scenario_name=None):
-        conn = connect_db()
-        if conn is None:
-            return []
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-        try:
-            sql = """SELECT DISTINCT kit_number
-                       FROM stock_data
-                      WHERE kit_number IS NOT NULL
-                        AND kit_number != 'None'"""
-            params = []
-            if scenario_name and scenario_name != lang.t(
-                "stock_inv.all_scenarios", "All Scenarios"
-            ):
-                sql += " AND scenario = ?"
-                params.append(scenario_name)
-            sql += " ORDER BY kit_number"
-            cur.execute(sql, params)
-            return [r["kit_number"] for r in cur.fetchall()]
-        finally:
-            cur.close()
-            conn.close()
+        if scenario_name == lang.t("stock_inv.all_scenarios", "All Scenarios"):
+            scenario_name = None
+        return filter_options.kit_numbers(scenario_name)
 
     def fetch_module_numbers(self, scenario_name=None, kit_number=None):
-        conn = connect_db()
-        if conn is None:
-            return []
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-        try:
-            sql = """SELECT DISTINCT module_number
-                       FROM stock_data
-                      WHERE module_number IS NOT NULL
-                        AND module_number != 'None'"""
-            params = []
-            if scenario_name and scenario_name != lang.t(
-                "stock_inv.all_scenarios", "All Scenarios"
-            ):
-                sql += " AND scenario = ?"
-                params.append(scenario_name)
-            if kit_number and kit_number not in (
-                lang.t("stock_inv.all_kits", "All Kits"),
-                lang.t("stock_inv.stand_alone_items", "Stand alone items"),
-            ):
-                sql += " AND kit_number = ?"
-                params.append(kit_number)
-            sql += " ORDER BY module_number"
-            cur.execute(sql, params)
-            return [r["module_number"] for r in cur.fetchall()]
-        finally:
-            cur.close()
-            conn.close()
+        if scenario_name == lang.t("stock_inv.all_scenarios", "All Scenarios"):
+            scenario_name = None
+        if kit_number in (
+            lang.t("stock_inv.all_kits", "All Kits"),
+            lang.t("stock_inv.stand_alone_items", "Stand alone items"),
+        ):
+            kit_number = None
+        return filter_options.module_numbers(scenario_name, kit_number)
 
     def fetch_project_details(self):
         try:
@@ -1128,18 +1005,9 @@ class StockInventory(tk.Frame):
 
     # ---------- State preservation helpers ----------
     def capture_current_rows(self):
-        for iid in self.tree.get_children():
-            vals = self.tree.item(iid, "values")
-            if not vals:
-                continue
+        for row in self.inv_model.rows():
+            vals = row.values
             uid = vals[0]
-            # ✅ FIXED: Index shifted by 1 (management_type at index 4)
-            base_ph = self.base_physical_inputs.get(
-                iid,
-                (
-                    int(vals[10]) if str(vals[10]).isdigit() else 0
-                ),  # ✅ physical_qty is now at index 10
-            )
             self.user_row_states[uid] = {
                 "unique_id": uid,
                 "code": vals[1],
@@ -1156,15 +1024,14 @@ class StockInventory(tk.Frame):
                 "discrepancy": vals[12],
                 "remarks": vals[13],
                 "std_qty": vals[14],
-                "base_physical": base_ph,
-                "is_custom": uid.startswith("temp::")
-                or (int(vals[8]) if str(vals[8]).isdigit() else 0)
-                == 0,  # ✅ current_stock is now at index 8
+                "base_physical": row.base_physical,
+                "is_custom": uid.startswith("temp::") or row.current_stock == 0,
             }
 
     def rebuild_tree_preserving_state(self):
         self.capture_current_rows()
         self.tree.delete(*self.tree.get_children())
+        self.inv_model.clear()
 
         # ✅ NEW: Load ALL items from standard quantities
         items = self.fetch_inventory_items()
@@ -1252,174 +1119,78 @@ class StockInventory(tk.Frame):
             else lang.t("stock_inv.in_box", "In-Box")
         )
 
-        iid = self.tree.insert(
-            "",
-            "end",
-            values=(
-                item_dict["unique_id"],  # 0
-                item_dict["code"],  # 1
-                item_dict["description"],  # 2
-                item_dict["type"],  # 3
-                mgmt_label,  # 4 ✅ TRANSLATED for display
-                item_dict["scenario"],  # 5
-                item_dict.get("kit_number", "-----"),  # 6
-                item_dict.get("module_number", "-----"),  # 7
-                item_dict["current_stock"],  # 8
-                current_exp,  # 9
-                phys_str,  # 10
-                auto_updated_exp,  # 11
-                disc_str,  # 12
-                remarks,  # 13
-                item_dict["std_qty"],  # 14
-            ),
+        values = (
+            item_dict["unique_id"],  # 0
+            item_dict["code"],  # 1
+            item_dict["description"],  # 2
+            item_dict["type"],  # 3
+            mgmt_label,  # 4 ✅ TRANSLATED for display
+            item_dict["scenario"],  # 5
+            item_dict.get("kit_number", "-----"),  # 6
+            item_dict.get("module_number", "-----"),  # 7
+            item_dict["current_stock"],  # 8
+            current_exp,  # 9
+            phys_str,  # 10
+            auto_updated_exp,  # 11
+            disc_str,  # 12
+            remarks,  # 13
+            item_dict["std_qty"],  # 14
         )
+        iid = self.tree.insert("", "end", values=values)
+        row = self.inv_model.add(iid, values, base_physical)
 
         # Type normalization for highlighting (handles Module/Módulo/Kit)
-        t = normalize_type_text(item_dict["type"] or "")
-
-        if t == "KIT":
+        if row.row_type == "KIT":
             self.tree.item(iid, tags=("kit_row",))
-        elif t == "MODULE":
+        elif row.row_type == "MODULE":
             self.tree.item(iid, tags=("module_row",))
         else:
             self.tree.item(iid, tags=())
 
-        self.base_physical_inputs[iid] = base_physical
         return iid
 
     # ---------- In-box multiplier logic ----------
 
-    def recompute_all_physical_quantities(self):
+    def recompute_all_physical_quantities(self, changed_iid=None):
         """
         Universal quantity calculation engine.
+        Propagation runs on the in-memory InventoryModel; only rows whose
+        physical_qty / discrepancy changed are pushed to the tree.
+        changed_iid limits the pass to the subtree affected by that row.
         """
-        # --- Phase 1: Calculate all final quantities ---
-        kit_factors = {}
-        module_factors = {}
-
-        all_iids = self.tree.get_children()
-
-        # First pass: Identify all KIT/MODULE rows and calculate their factors (0 or 1)
-        for iid in all_iids:
-            vals = self.tree.item(iid, "values")
-            if not vals:
-                continue
+        changed, notices = self.inv_model.recompute(changed_iid)
 
-            unique_id = vals[0]
-            is_physical = unique_id and unique_id.count("/") == 7
-            if not is_physical:
-                continue
-
-            # ✅ FIXED: Normalize type text (handles Module/Módulo)
-            row_type = normalize_type_text(vals[3] or "")
-            base_input = self.base_physical_inputs.get(iid, 0)
-
-            if row_type == "KIT":
-                kit_number = vals[6]  # ✅ Updated index
-                if kit_number and kit_number != "-----":
-                    final_qty = 1 if base_input > 0 else 0
-                    kit_factors[kit_number] = final_qty
-                    self.tree.set(iid, "physical_qty", str(final_qty))
-
-            elif row_type == "MODULE":
-                module_number = vals[7]  # ✅ Updated index
-                kit_number = vals[6]  # ✅ Updated index
-                if module_number and module_number != "-----":
-                    parent_kit_factor = kit_factors.get(kit_number, 1)
-                    base_factor = 1 if base_input > 0 else 0
-                    final_qty = base_factor * parent_kit_factor
-                    module_factors[module_number] = final_qty
-                    self.tree.set(iid, "physical_qty", str(final_qty))
-
-                    # Enhanced popup for MODULEs zeroed out by a KIT
-                    if base_input > 0 and final_qty == 0 and parent_kit_factor == 0:
-                        custom_popup(
-                            self,
-                            lang.t("dialog_titles.info", "Info"),
-                            lang.t(
-                                "stock_inv.kit_zero_module_zero",
-                                "Quantity for {code} {desc} will remain 0 as the kit number {kit} has 0 quantity.",
-                            ).format(code=vals[1], desc=vals[2], kit=kit_number),
-                            "info",
-                        )
-                        # State Synchronization: Reset base input to prevent repeated popups
-                        self.base_physical_inputs[iid] = 0
-
-        # Second pass: Calculate quantities for all other rows (ITEMS and non-physical)
-        for iid in all_iids:
-            vals = self.tree.item(iid, "values")
-            if not vals:
-                continue
-
-            unique_id = vals[0]
-            is_physical = unique_id and unique_id.count("/") == 7
-            base_input = self.base_physical_inputs.get(iid, 0)
-
-            # ✅ FIXED: Normalize type text (handles Module/Módulo)
-            row_type = normalize_type_text(vals[3] or "")
-
-            final_qty = base_input  # Default for non-physical rows
-
-            if is_physical and row_type == "ITEM":
-                kit_number = vals[6]  # ✅ Updated index
-                module_number = vals[7]  # ✅ Updated index
-
-                parent_kit_factor = kit_factors.get(kit_number, 1)
-                parent_module_factor = module_factors.get(module_number, 1)
-
-                final_qty = base_input * parent_kit_factor * parent_module_factor
-                self.tree.set(iid, "physical_qty", str(final_qty))
-
-                if base_input > 0 and final_qty == 0:
-                    reason = ""
-                    if parent_module_factor == 0:
-                        reason = (
-                            lang.t("stock_inv.module_number", "module number")
-                            + f" {module_number}"
-                        )
-                    elif parent_kit_factor == 0:
-                        reason = (
-                            lang.t("stock_inv.kit_number", "kit number")
-                            + f" {kit_number}"
-                        )
-
-                    if reason:
-                        custom_popup(
-                            self,
-                            lang.t("dialog_titles.info", "Info"),
-                            lang.t(
-                                "stock_inv.item_zero_reason",
-                                "Quantity for {code} {desc} will remain 0 as the {reason} has 0 quantity.",
-                            ).format(code=vals[1], desc=vals[2], reason=reason),
-                            "info",
-                        )
-                        # State Synchronization: Reset base input
-                        self.base_physical_inputs[iid] = 0
-
-            elif not is_physical:
-                self.tree.set(iid, "physical_qty", str(final_qty))
-
-        # --- Phase 2: Update discrepancies for all rows ---
-        for iid in all_iids:
-            vals = self.tree.item(iid, "values")
-            if not vals:
-                continue
-
-            current_stock = (
-                int(vals[8]) if str(vals[8]).isdigit() else 0
-            )  # ✅ Updated index
-            physical_qty = (
-                int(vals[10]) if str(vals[10]).isdigit() else 0
-            )  # ✅ Updated index
-            discrepancy = physical_qty - current_stock
-
-            self.tree.set(
-                iid, "discrepancy", "" if discrepancy == 0 else str(discrepancy)
-            )
+        for iid in changed:
+            row = self.inv_model.get(iid)
+            self.tree.set(iid, "physical_qty", row.values[10])
+            self.tree.set(iid, "discrepancy", row.values[12])
             self._update_state_from_row(iid)
 
-        # --- Phase 3: Re-apply all visual highlights ---
-        self._highlight_missing_required_expiry()
+        for reason, row, number in notices:
+            if reason == "kit_zero_module_zero":
+                message = lang.t(
+                    "stock_inv.kit_zero_module_zero",
+                    "Quantity for {code} {desc} will remain 0 as the kit number {kit} has 0 quantity.",
+                ).format(code=row.code, desc=row.description, kit=number)
+            else:
+                label = (
+                    lang.t("stock_inv.module_number", "module number")
+                    if reason == "module"
+                    else lang.t("stock_inv.kit_number", "kit number")
+                )
+                message = lang.t(
+                    "stock_inv.item_zero_reason",
+                    "Quantity for {code} {desc} will remain 0 as the {reason} has 0 quantity.",
+                ).format(code=row.code, desc=row.description, reason=f"{label} {number}")
+            custom_popup(self, lang.t("dialog_titles.info", "Info"), message, "info")
+            # State Synchronization: base input already reset by the model
+            self._update_state_from_row(row.iid)
+
+        # Re-apply visual highlights on the rows that changed
+        if changed_iid is None:
+            self._highlight_missing_required_expiry()
+        else:
+            self._highlight_missing_required_expiry(changed | {changed_iid})
 
     def _force_reapply_tags(self):
         """
@@ -1432,18 +1203,11 @@ class StockInventory(tk.Frame):
             "module_row", background="#F3E5F5", foreground="#4A148C"
         )
 
-        for iid in self.tree.get_children():
-            vals = self.tree.item(iid, "values")
-            if not vals or len(vals) < 4:
-                continue
-
-            type_text = vals[3]  # Type is at index 3
-            normalized = normalize_type_text(type_text or "")
-
-            if normalized == "KIT":
-                self.tree.item(iid, tags=("kit_row",))
-            elif normalized == "MODULE":
-                self.tree.item(iid, tags=("module_row",))
+        for row in self.inv_model.rows():
+            if row.row_type == "KIT":
+                self.tree.item(row.iid, tags=("kit_row",))
+            elif row.row_type == "MODULE":
+                self.tree.item(row.iid, tags=("module_row",))
 
     # ---------- Document number generation ----------
     def generate_document_number(self):
@@ -1464,11 +1228,7 @@ class StockInventory(tk.Frame):
             cur = conn.cursor()
             try:
                 cur.execute(
-                    """
-                    SELECT document_number FROM stock_transactions
-                    WHERE document_number LIKE ?
-                    ORDER BY document_number DESC LIMIT 1
-                """,
+                    LAST_DOCUMENT_SQL,
                     (prefix + "/%",),
                 )
                 row = cur.fetchone()
@@ -2226,44 +1986,39 @@ class StockInventory(tk.Frame):
         d = parsed.date() if hasattr(parsed, "date") else parsed
         return d > datetime.now().date()
 
-    def _highlight_missing_required_expiry(self):
+    def _highlight_missing_required_expiry(self, iids=None):
         """
         Highlight rows (light_red) ONLY when:
         - Item requires expiry (remarks contains 'exp')
         - Physical quantity > 0
         - AND (updated_exp_date is missing OR invalid / not future)
+        iids limits the pass to those rows (default: every row).
         """
-        for iid in self.tree.get_children():
-            vals = self.tree.item(iid, "values")
-            if not vals:
-                continue
-            code = vals[1]
-            phys = vals[10]  # ✅ Updated index
-            updated = vals[11]  # ✅ Updated index
-            t = (vals[3] or "").upper()
+        if iids is None:
+            rows = self.inv_model.rows()
+        else:
+            rows = [r for r in map(self.inv_model.get, iids) if r is not None]
+
+        for row in rows:
+            t = str(row.values[3] or "").upper()
+            phys = row.physical_qty
             phys_int = int(phys) if phys.isdigit() else 0
-            requires = check_expiry_required(code)
-
-            if requires and phys_int > 0:
-                if self._is_valid_future_updated_exp(updated):
-                    # Valid updated future expiry -> normal coloring
-                    if t == "KIT":
-                        self.tree.item(iid, tags=("kit_row",))
-                    elif t == "MODULE":
-                        self.tree.item(iid, tags=("module_row",))
-                    else:
-                        self.tree.item(iid, tags=())
-                else:
-                    # Missing or invalid updated future expiry -> highlight
-                    self.tree.item(iid, tags=("light_red",))
+            if row.requires_expiry is None:
+                row.requires_expiry = check_expiry_required(row.code)
+
+            if (
+                row.requires_expiry
+                and phys_int > 0
+                and not self._is_valid_future_updated_exp(row.updated_exp_date)
+            ):
+                # Missing or invalid updated future expiry -> highlight
+                self.tree.item(row.iid, tags=("light_red",))
+            elif t == "KIT":
+                self.tree.item(row.iid, tags=("kit_row",))
+            elif t == "MODULE":
+                self.tree.item(row.iid, tags=("module_row",))
             else:
-                # Not requiring OR phys not positive -> normal coloring
-                if t == "KIT":
-                    self.tree.item(iid, tags=("kit_row",))
-                elif t == "MODULE":
-                    self.tree.item(iid, tags=("module_row",))
-                else:
-                    self.tree.item(iid, tags=())
+                self.tree.item(row.iid, tags=())
 
     def _show_expiry_change_instructions(self, code, description):
         """
@@ -2476,7 +2231,7 @@ class StockInventory(tk.Frame):
         # Remove row
         self.ctx_menu.add_command(
             label=lang.t("stock_inv.remove_row", "Remove Row"),
-            command=lambda: (self.tree.delete(row_id), self._remove_state(row_id)),
+            command=lambda: (self._remove_state(row_id), self.tree.delete(row_id)),
         )
 
         self.ctx_menu.tk_popup(event.x_root, event.y_root)
@@ -2541,27 +2296,25 @@ class StockInventory(tk.Frame):
 
     # ---------- State utility ----------
     def _remove_state(self, row_id):
-        vals = self.tree.item(row_id, "values")
-        if vals:
-            uid = vals[0]
-            self.user_row_states.pop(uid, None)
-        self.base_physical_inputs.pop(row_id, None)
+        row = self.inv_model.remove(row_id)
+        if row:
+            self.user_row_states.pop(row.unique_id, None)
+            if row.is_physical and row.row_type in ("KIT", "MODULE"):
+                # Rows under it lose its factor
+                self.recompute_all_physical_quantities()
 
     def _update_state_from_row(self, row_id):
-        vals = self.tree.item(row_id, "values")
-        if not vals:
+        row = self.inv_model.get(row_id)
+        if not row:
             return
-        uid = vals[0]
-        st = self.user_row_states.get(uid)
+        st = self.user_row_states.get(row.unique_id)
         if not st:
             return
-        st["physical_qty"] = vals[9]
-        st["updated_exp_date"] = vals[10]
-        st["discrepancy"] = vals[11]
-        st["remarks"] = vals[12]
-        st["base_physical"] = self.base_physical_inputs.get(
-            row_id, st.get("base_physical", 0)
-        )
+        st["physical_qty"] = row.values[10]
+        st["updated_exp_date"] = row.values[11]
+        st["discrepancy"] = row.values[12]
+        st["remarks"] = row.values[13]
+        st["base_physical"] = row.base_physical
 
     # ---------- Insert row ----------
     def insert_tree_row(self, item, physical_qty=""):
@@ -2578,26 +2331,24 @@ class StockInventory(tk.Frame):
         else:
             auto_updated_exp = ""  # New row - blank for user to fill
 
-        iid = self.tree.insert(
-            "",
-            "end",
-            values=(
-                item["unique_id"],
-                item["code"],
-                item["description"],
-                item["type"],
-                item["scenario"],
-                item.get("kit_number", "-----"),
-                item.get("module_number", "-----"),
-                current_stock,
-                current_exp,
-                "",  # physical qty blank
-                auto_updated_exp,  # ✅ Auto-filled for existing, blank for new
-                "",  # discrepancy blank
-                "",  # remarks blank
-                item["std_qty"],
-            ),
+        values = (
+            item["unique_id"],
+            item["code"],
+            item["description"],
+            item["type"],
+            item["scenario"],
+            item.get("kit_number", "-----"),
+            item.get("module_number", "-----"),
+            current_stock,
+            current_exp,
+            "",  # physical qty blank
+            auto_updated_exp,  # ✅ Auto-filled for existing, blank for new
+            "",  # discrepancy blank
+            "",  # remarks blank
+            item["std_qty"],
         )
+        iid = self.tree.insert("", "end", values=values)
+        self.inv_model.add(iid, values)
         t = item["type"].upper()
         if t == "KIT":
             self.tree.item(iid, tags=("kit_row",))
@@ -2605,7 +2356,6 @@ class StockInventory(tk.Frame):
             self.tree.item(iid, tags=("module_row",))
         else:
             self.tree.item(iid, tags=())
-        self.base_physical_inputs[iid] = 0
         self.user_row_states[item["unique_id"]] = {
             "unique_id": item["unique_id"],
             "code": item["code"],
@@ -2664,26 +2414,23 @@ class StockInventory(tk.Frame):
 
         # Insert below the selected row
         idx = self.tree.index(row_id)
-        new_iid = self.tree.insert(
-            "",
-            idx + 1,
-            values=(
-                new_item["unique_id"],
-                new_item["code"],
-                new_item["description"],
-                new_item["type"],
-                new_item["scenario"],
-                new_item["kit_number"],
-                new_item["module_number"],
-                new_item["current_stock"],  # 0
-                new_item["exp_date"],  # blank
-                "",  # physical_qty - user will enter
-                "",  # ✅ updated_exp_date - BLANK for new row (user will fill)
-                "",  # discrepancy - will be calculated
-                "",  # remarks
-                new_item["std_qty"],
-            ),
+        values = (
+            new_item["unique_id"],
+            new_item["code"],
+            new_item["description"],
+            new_item["type"],
+            new_item["scenario"],
+            new_item["kit_number"],
+            new_item["module_number"],
+            new_item["current_stock"],  # 0
+            new_item["exp_date"],  # blank
+            "",  # physical_qty - user will enter
+            "",  # ✅ updated_exp_date - BLANK for new row (user will fill)
+            "",  # discrepancy - will be calculated
+            "",  # remarks
+            new_item["std_qty"],
         )
+        new_iid = self.tree.insert("", idx + 1, values=values)
 
         # Apply row styling
         t = (vals[3] or "").upper()
@@ -2692,8 +2439,8 @@ class StockInventory(tk.Frame):
         elif t == "MODULE":
             self.tree.item(new_iid, tags=("module_row",))
 
-        # Initialize base physical input to 0
-        self.base_physical_inputs[new_iid] = 0
+        # Register in the model (base physical input starts at 0)
+        self.inv_model.add(new_iid, values)
 
         # ✅ Save state WITH parent row metadata (kit_code, module_code, treecode, is_in_box)
         self.user_row_states[temp_uid] = {
@@ -2739,14 +2486,16 @@ class StockInventory(tk.Frame):
             )
 
         # Highlight if expiry is required
-        self._highlight_missing_required_expiry()
+        self._highlight_missing_required_expiry([new_iid])
 
     def _clear_physical(self, row_id):
         vals = self.tree.item(row_id, "values")
         if not vals:
             return
         uid = vals[0]
-        self.base_physical_inputs[row_id] = 0
+        self.inv_model.set_base(row_id, 0)
+        self.inv_model.set_value(row_id, "physical_qty", "")
+        self.inv_model.set_value(row_id, "discrepancy", "")
         self.tree.set(row_id, "physical_qty", "")
         self.tree.set(row_id, "discrepancy", "")
         st = self.user_row_states.get(uid)
@@ -2760,8 +2509,8 @@ class StockInventory(tk.Frame):
         elif t == "MODULE":
             self.tree.item(row_id, tags=("module_row",))
         if self.mgmt_mode_var.get() == lang.t("stock_inv.management_in_box", "In-Box"):
-            self.recompute_all_physical_quantities()
-        self._highlight_missing_required_expiry()
+            self.recompute_all_physical_quantities(row_id)
+        self._highlight_missing_required_expiry([row_id])
 
         # ---------- Inline edit ----------
 
@@ -2818,21 +2567,23 @@ class StockInventory(tk.Frame):
             new_value = entry.get().strip()
             entry.destroy()
 
-            # Update tree
+            # Update tree and model
             self.tree.set(row_id, col_key, new_value)
+            self.inv_model.set_value(row_id, col_key, new_value)
 
             # Update state
             if col_key == "physical_qty":
                 # Update base physical input
                 if new_value.isdigit():
-                    self.base_physical_inputs[row_id] = int(new_value)
+                    self.inv_model.set_base(row_id, int(new_value))
                 else:
-                    self.base_physical_inputs[row_id] = 0
-                # Recompute all quantities
-                self.recompute_all_physical_quantities()
+                    self.inv_model.set_base(row_id, 0)
+                # Recompute the subtree affected by this row
+                self.recompute_all_physical_quantities(row_id)
             else:
                 # For remarks or updated_exp_date, just update state
                 self._update_state_from_row(row_id)
+                self._highlight_missing_required_expiry([row_id])
 
         # Bind events
         entry.bind("<Return>", save_edit)
@@ -2911,7 +2662,7 @@ class StockInventory(tk.Frame):
 
         # ✅ ALWAYS clear data when inventory type changes (both directions)
         self.user_row_states.clear()
-        self.base_physical_inputs.clear()
+        self.inv_model.clear()
 
         if inv_type == lang.t("stock_inv.complete_inventory", "Complete Inventory"):
             # Complete Inventory mode: Load all items
@@ -2926,6 +2677,7 @@ class StockInventory(tk.Frame):
         else:
             # Partial Inventory mode: Clear tree and show search
             self.tree.delete(*self.tree.get_children())
+            self.inv_model.clear()
             self.search_frame.pack(pady=5, fill="x")
             self.status_var.set(
                 lang.t(
@@ -3444,6 +3196,8 @@ class StockInventory(tk.Frame):
                 rows_to_export=rows_to_export, document_number=doc_number
             )
 
+            bus.publish(STOCK_CHANGED)
+
             # Success message
             custom_popup(
                 self,
@@ -3488,6 +3242,7 @@ class StockInventory(tk.Frame):
     # ---------- Clear form ----------
     def clear_form(self):
         self.tree.delete(*self.tree.get_children())
+        self.inv_model.clear()
         self.code_entry.delete(0, tk.END)
         self.search_listbox.delete(0, tk.END)
         self.inv_type_var.set(
@@ -3503,7 +3258,6 @@ class StockInventory(tk.Frame):
         self.batch_info_var.set("")
         self.status_var.set("")
         self.user_row_states.clear()
-        self.base_physical_inputs.clear()
         self.on_inv_type_selected()
 
 
@@ -0,0 +1,151 @@
+"""
+stock_ratio_index.py
+In-memory stock ratio (final_qty / std_qty) index per scenario.
+
+Receive Kit picks the treecode / module instance with the LOWEST stock ratio
+("use-lowest-stock-first"). It used to query stock_data for every row with
+    (scenario=? OR scenario=?) AND (kit=? OR module=? OR item=?)
+which no index can serve, so each call scanned the table, many times while
+building one receive tree. StockRatioIndex instead:
+
+  * loads all stocked lines of a scenario (final_qty > 0, std_qty > 0) in ONE
+    query on the indexed scenario column
+  * files each line under every code it carries (kit, module, item), sorted
+    by (ratio, treecode), so a lookup is a dict read plus a short filter
+  * is dropped on STOCK_CHANGED and when a db.TableWatch shows a commit
+    from another connection; scenarios are reloaded lazily
+
+Usage:
+    from stock_ratio_index import stock_ratio_index
+    stock_ratio_index.best_treecode(("3", "Cholera"), "ABCD", kit_code, module_code)
+    stock_ratio_index.best_treecodes(("3", "Cholera"), [(code, kit, module), ...])
+    stock_ratio_index.instances(("3", "Cholera"), code, kit_code=..., module_code=...)
+"""
+
+import sqlite3
+import logging
+import threading
+from collections import namedtuple
+
+from db import connect_db, TableWatch
+from event_bus import bus, STOCK_CHANGED
+
+logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
+
+StockRatioEntry = namedtuple(
+    "StockRatioEntry",
+    "kit module item kit_number module_number treecode final_qty std_qty stock_ratio",
+)
+
+_SCENARIO_LINES_SQL = """
+    SELECT kit, module, item, kit_number, module_number, treecode,
+           final_qty, std_qty,
+           CAST(final_qty AS REAL) / std_qty AS stock_ratio
+      FROM stock_data
+     WHERE scenario IN ({placeholders})
+       AND final_qty > 0
+       AND std_qty > 0
+"""
+
+
+def _scenario_key(scenario_values):
+    return tuple(sorted({str(v) for v in scenario_values if v not in (None, "")}))
+
+
+class StockRatioIndex:
+    """
+    Per-scenario map: code -> [StockRatioEntry, ...] sorted by (ratio, treecode).
+    A scenario is identified by the tuple of values stock_data.scenario may
+    hold for it (scenario_id and / or name).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._scenarios = {}
+        self._watch = TableWatch(("stock_data",))
+
+    # ---------------- Staleness ----------------
+    def invalidate(self, *_):
+        with self._lock:
+            self._scenarios = {}
+
+    def _check_external_writes(self):
+        """Drop the cache when another connection wrote one of its tables."""
+        if self._watch.changed():
+            self.invalidate()
+
+    # ---------------- Build ----------------
+    @staticmethod
+    def _load(key):
+        by_code = {}
+        conn = connect_db()
+        if conn is None:
+            return by_code
+        cur = conn.cursor()
+        try:
+            cur.execute(_SCENARIO_LINES_SQL.format(placeholders=",".join("?" * len(key))), key)
+            for row in cur.fetchall():
+                entry = StockRatioEntry(*row)
+                for code in {entry.kit, entry.module, entry.item}:
+                    if code and code != "None":
+                        by_code.setdefault(code, []).append(entry)
+        except sqlite3.Error as e:
+            logging.error(f"[StockRatioIndex] Load failed: {e}")
+        finally:
+            cur.close()
+            conn.close()
+        for entries in by_code.values():
+            entries.sort(key=lambda e: (e.stock_ratio, e.treecode or ""))
+        return by_code
+
+    def _scenario(self, scenario_values):
+        key = _scenario_key(scenario_values)
+        if not key:
+            return {}
+        self._check_external_writes()
+        with self._lock:
+            by_code = self._scenarios.get(key)
+            if by_code is None:
+                by_code = self._scenarios[key] = self._load(key)
+            return by_code
+
+    # ---------------- Lookups ----------------
+    @staticmethod
+    def _filter(entries, kit_code, module_code):
+        return [
+            e for e in entries
+            if (not kit_code or e.kit == kit_code)
+            and (not module_code or e.module == module_code)
+        ]
+
+    def instances(self, scenario_values, code, kit_code=None, module_code=None):
+        """Stocked lines carrying `code`, lowest stock ratio first."""
+        return self._filter(self._scenario(scenario_values).get(code, ()), kit_code, module_code)
+
+    def best_treecodes(self, scenario_values, lookups):
+        """
+        {(code, kit_code, module_code): treecode or None} for every lookup,
+        answered from one scenario load.
+        """
+        by_code = self._scenario(scenario_values)
+        result = {}
+        for lookup in lookups:
+            code, kit_code, module_code = lookup
+            best = None
+            for e in self._filter(by_code.get(code, ()), kit_code, module_code):
+                if e.treecode is not None:
+                    best = e
+                    break
+            result[lookup] = best.treecode if best else None
+        return result
+
+    def best_treecode(self, scenario_values, code, kit_code=None, module_code=None):
+        """Treecode of the lowest-ratio stocked line for `code` (or None)."""
+        return self.best_treecodes(scenario_values, [(code, kit_code, module_code)])[
+            (code, kit_code, module_code)
+        ]
+
+
+# Global singleton used across the app
+stock_ratio_index = StockRatioIndex()
+bus.subscribe(STOCK_CHANGED, stock_ratio_index.invalidate)
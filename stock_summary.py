@@ -23,8 +23,11 @@ import openpyxl
 from openpyxl.styles import PatternFill, Font
 from openpyxl.utils import get_column_letter
 
-from db import connect_db
+from db import connect_db, cached_query
 from language_manager import lang
+from std_qty_index import std_qty_index
+from filter_options import filter_options
+from event_bus import bus, STOCK_CHANGED, COMPOSITION_CHANGED, SCENARIOS_CHANGED
 
 try:
     from popup_utils import custom_popup
@@ -43,6 +46,89 @@ except ImportError:
 from theme_config import AppTheme, enable_column_auto_resize
 
 
+# ----------------------------- Queries -----------------------------
+ON_SHELF_MODES = "LOWER(management_mode) IN ('on_shelf','on-shelf','onshelf')"
+IN_BOX_MODES = "LOWER(management_mode) IN ('in_box','in-box','inbox')"
+
+# Expiring quantities up to a cutoff (params: where params + cutoff_iso)
+EXPIRING_ON_SHELF_SQL = """
+    SELECT
+      CAST(scenario AS TEXT) AS raw_scenario,
+      item AS code,
+      SUM(final_qty) AS expiring_sum
+    FROM stock_data
+    WHERE {where}
+      AND item IS NOT NULL
+      AND item <> ''
+      AND exp_date IS NOT NULL
+      AND exp_date <= ?
+    GROUP BY raw_scenario, item
+"""
+
+EXPIRING_IN_BOX_SQL = """
+    SELECT
+      CAST(scenario AS TEXT) AS raw_scenario,
+      treecode,
+      SUM(final_qty) AS expiring_sum
+    FROM stock_data
+    WHERE {where}
+      AND treecode IS NOT NULL
+      AND treecode <> ''
+      AND exp_date IS NOT NULL
+      AND exp_date <= ?
+    GROUP BY raw_scenario, treecode
+"""
+
+# In-box lots of a treecode for the details popup (params: scenario, scenario, treecode)
+IN_BOX_LOTS_SQL = """
+    SELECT 
+        unique_id,
+        scenario,
+        item AS code,
+        final_qty,
+        exp_date,
+        management_mode,
+        kit_number,
+        module_number,
+        kit,
+        module,
+        comments
+    FROM stock_data
+    WHERE (scenario = ? OR scenario = (SELECT CAST(scenario_id AS TEXT) FROM scenarios WHERE name = ?))
+      AND treecode = ?
+      AND final_qty > 0
+    ORDER BY exp_date, kit_number, module_number
+"""
+
+
+def build_stock_where(filters):
+    """(where_clause, params) of the scenario / kit / module / item filters."""
+    where_parts = ["1=1"]
+    params = []
+
+    scen = filters["scenario"]
+    all_text = lang.t("stock_summary.all_scenarios", "All")
+    if scen and scen != all_text:
+        where_parts.append(
+            "(scenario = ? OR scenario = (SELECT CAST(scenario_id AS TEXT) FROM scenarios WHERE name=? LIMIT 1))"
+        )
+        params.extend([scen, scen])
+
+    if filters["kit_number"]:
+        where_parts.append("kit_number = ?")
+        params.append(filters["kit_number"])
+
+    if filters["module_number"]:
+        where_parts.append("module_number = ?")
+        params.append(filters["module_number"])
+
+    if filters["item_code"]:
+        where_parts.append("item = ?")
+        params.append(filters["item_code"])
+
+    return " AND ".join(where_parts), params
+
+
 # ----------------------------- DB Helpers -----------------------------
 def _fetchall(sql, params=()):
     conn = connect_db()
@@ -104,7 +190,7 @@ def cutoff_date_from_months(months: int | None):
 
 # --------------------------- Scenario Mapping -------------------------
 def load_scenario_maps():
-    rows = _fetchall("SELECT scenario_id, name FROM scenarios")
+    rows = cached_query("SELECT scenario_id, name FROM scenarios")
     id_to_name = {}
     name_set = set()
     for r in rows:
@@ -127,86 +213,28 @@ def normalize_scenario(raw_val, id_to_name, name_set):
     return txt
 
 
-# Replace load_std_quantities_by_scenario() function:
 def load_std_quantities_by_scenario(scenario_name):
     """
     Load standard quantities with treecodes
     Returns: dict with structure {scenario_name: {treecode: {"code": code, "std_qty": qty, "type": "on-shelf"/"in-box", ...}}}
+    Served from the shared StdQuantityIndex (all scenarios, two queries, cached).
     """
-    result = {}
-
     # Check if loading all scenarios
     all_text = lang.t("stock_summary.all_scenarios", "All")
     load_all = not scenario_name or scenario_name == all_text
 
-    # Get scenario_id(s) and names
-    if load_all:
-        scenario_rows = _fetchall("SELECT scenario_id, name FROM scenarios")
-        scenarios = [(r["scenario_id"], r["name"]) for r in scenario_rows]
-    else:
-        scenario_row = _fetchone(
-            "SELECT scenario_id, name FROM scenarios WHERE name = ?", (scenario_name,)
-        )
-        if not scenario_row:
-            return {}
-        scenarios = [(scenario_row["scenario_id"], scenario_row["name"])]
-
-    for scenario_id, scenario_name in scenarios:
-        if scenario_name not in result:
-            result[scenario_name] = {}
-
-        # 1. Load ON-SHELF items from compositions
-        # NOTE: compositions table doesn't have treecode column
-        on_shelf_rows = _fetchall(
-            """
-            SELECT unique_id_2, code, quantity
-            FROM compositions 
-            WHERE scenario_id = ?
-            ORDER BY code
-            """,
-            (scenario_id,),
-        )
-
-        for r in on_shelf_rows:
-            code = r["code"]
-            treecode = code  # Use code as treecode for on-shelf items
-            qty = r["quantity"] or 0
-
-            result[scenario_name][treecode] = {
-                "code": code,
-                "std_qty": qty,
-                "mgmt_type": "on-shelf",
-                "kit_code": "",
-                "module_code": "",
-            }
-
-        # 2. Load IN-BOX items from kit_items
-        in_box_rows = _fetchall(
-            """
-            SELECT code, kit, module, std_qty, treecode
-            FROM kit_items
-            WHERE scenario_id = ?
-            ORDER BY treecode, kit, module
-            """,
-            (scenario_id,),
-        )
-
-        for r in in_box_rows:
-            code = r["code"]
-            treecode = r["treecode"] or code
-            kit = r["kit"] or ""
-            module = r["module"] or ""
-            qty = r["std_qty"] or 0
-
-            # Use treecode as key
-            result[scenario_name][treecode] = {
-                "code": code,
-                "std_qty": qty,
-                "mgmt_type": "in-box",
-                "kit_code": kit,
-                "module_code": module,
+    result = {}
+    for scen, entries in std_qty_index.by_scenario(None if load_all else scenario_name).items():
+        result[scen] = {
+            key: {
+                "code": info["code"],
+                "std_qty": info["std_qty"],
+                "mgmt_type": info["mgmt_type"],
+                "kit_code": info["kit_code"] or "",
+                "module_code": info["module_code"] or "",
             }
-
+            for key, info in entries.items()
+        }
     return result
 
 
@@ -268,37 +296,14 @@ def aggregate_stock_by_treecode(filters, cutoff_iso, id_to_name, name_set):
     Aggregate stock by treecode (in-box) and by code (on-shelf)
     Returns: dict with key = (scenario, key) where key is code for on-shelf, treecode for in-box
     """
-    where_parts = ["1=1"]
-    params = []
-
-    scen = filters["scenario"]
-    all_text = lang.t("stock_summary.all_scenarios", "All")
-    if scen and scen != all_text:
-        where_parts.append(
-            "(scenario = ? OR scenario = (SELECT CAST(scenario_id AS TEXT) FROM scenarios WHERE name=? LIMIT 1))"
-        )
-        params.extend([scen, scen])
+    where_clause, params = build_stock_where(filters)
 
     mm = filters["management_mode"].lower()
     mm_filter = ""
     if mm == "on-shelf":
-        mm_filter = "LOWER(management_mode) IN ('on_shelf','on-shelf','onshelf')"
+        mm_filter = ON_SHELF_MODES
     elif mm == "in-box":
-        mm_filter = "LOWER(management_mode) IN ('in_box','in-box','inbox')"
-
-    if filters["kit_number"]:
-        where_parts.append("kit_number = ?")
-        params.append(filters["kit_number"])
-
-    if filters["module_number"]:
-        where_parts.append("module_number = ?")
-        params.append(filters["module_number"])
-
-    if filters["item_code"]:
-        where_parts.append("item = ?")
-        params.append(filters["item_code"])
-
-    where_clause = " AND ".join(where_parts)
+        mm_filter = IN_BOX_MODES
 
     result = {}
 
@@ -308,9 +313,7 @@ def aggregate_stock_by_treecode(filters, cutoff_iso, id_to_name, name_set):
         if mm_filter and mm == "on-shelf":
             onshelf_where += f" AND {mm_filter}"
         else:
-            onshelf_where += (
-                " AND LOWER(management_mode) IN ('on_shelf','on-shelf','onshelf')"
-            )
+            onshelf_where += f" AND {ON_SHELF_MODES}"
 
         onshelf_sql = f"""
             SELECT
@@ -357,7 +360,7 @@ def aggregate_stock_by_treecode(filters, cutoff_iso, id_to_name, name_set):
         if mm_filter and mm == "in-box":
             inbox_where += f" AND {mm_filter}"
         else:
-            inbox_where += " AND LOWER(management_mode) IN ('in_box','in-box','inbox')"
+            inbox_where += f" AND {IN_BOX_MODES}"
 
         inbox_sql = f"""
             SELECT
@@ -410,23 +413,9 @@ def aggregate_stock_by_treecode(filters, cutoff_iso, id_to_name, name_set):
             if mm_filter and mm == "on-shelf":
                 exp_onshelf_where += f" AND {mm_filter}"
             else:
-                exp_onshelf_where += (
-                    " AND LOWER(management_mode) IN ('on_shelf','on-shelf','onshelf')"
-                )
+                exp_onshelf_where += f" AND {ON_SHELF_MODES}"
 
-            exp_onshelf_sql = f"""
-                SELECT
-                  CAST(scenario AS TEXT) AS raw_scenario,
-                  item AS code,
-                  SUM(final_qty) AS expiring_sum
-                FROM stock_data
-                WHERE {exp_onshelf_where}
-                  AND item IS NOT NULL
-                  AND item <> ''
-                  AND exp_date IS NOT NULL
-                  AND exp_date <= ?
-                GROUP BY raw_scenario, item
-            """
+            exp_onshelf_sql = EXPIRING_ON_SHELF_SQL.format(where=exp_onshelf_where)
             exp_params = params + [cutoff_iso]
             exp_onshelf_rows = _fetchall(exp_onshelf_sql, tuple(exp_params))
 
@@ -442,23 +431,9 @@ def aggregate_stock_by_treecode(filters, cutoff_iso, id_to_name, name_set):
             if mm_filter and mm == "in-box":
                 exp_inbox_where += f" AND {mm_filter}"
             else:
-                exp_inbox_where += (
-                    " AND LOWER(management_mode) IN ('in_box','in-box','inbox')"
-                )
+                exp_inbox_where += f" AND {IN_BOX_MODES}"
 
-            exp_inbox_sql = f"""
-                SELECT
-                  CAST(scenario AS TEXT) AS raw_scenario,
-                  treecode,
-                  SUM(final_qty) AS expiring_sum
-                FROM stock_data
-                WHERE {exp_inbox_where}
-                  AND treecode IS NOT NULL
-                  AND treecode <> ''
-                  AND exp_date IS NOT NULL
-                  AND exp_date <= ?
-                GROUP BY raw_scenario, treecode
-            """
+            exp_inbox_sql = EXPIRING_IN_BOX_SQL.format(where=exp_inbox_where)
             exp_params = params + [cutoff_iso]
             exp_inbox_rows = _fetchall(exp_inbox_sql, tuple(exp_params))
 
@@ -473,44 +448,13 @@ def aggregate_stock_by_treecode(filters, cutoff_iso, id_to_name, name_set):
 
 # ------------------------- Distinct Values ---------------------------
 def distinct_kit_numbers(scenario=None):
-    if scenario:
-        rows = _fetchall(
-            """
-            SELECT DISTINCT kit_number FROM stock_data
-            WHERE kit_number IS NOT NULL
-              AND (scenario = ? OR scenario = (SELECT CAST(scenario_id AS TEXT) FROM scenarios WHERE name=? LIMIT 1))
-            ORDER BY kit_number
-        """,
-            (scenario, scenario),
-        )
-    else:
-        rows = _fetchall(
-            "SELECT DISTINCT kit_number FROM stock_data WHERE kit_number IS NOT NULL ORDER BY kit_number"
-        )
-    return [r["kit_number"] for r in rows if r["kit_number"]]
+    return filter_options.kit_numbers(scenario)
 
 
 def distinct_module_numbers(scenario=None, kit_number=None):
-    where = ["module_number IS NOT NULL"]
-    params = []
-    if scenario:
-        where.append(
-            "(scenario = ? OR scenario = (SELECT CAST(scenario_id AS TEXT) FROM scenarios WHERE name=? LIMIT 1))"
-        )
-        params.extend([scenario, scenario])
-    if kit_number:
-        where.append("kit_number = ?")
-        params.append(kit_number)
-    sql = (
-        "SELECT DISTINCT module_number FROM stock_data WHERE "
-        + " AND ".join(where)
-        + " ORDER BY module_number"
-    )
-    rows = _fetchall(sql, tuple(params))
-    return [r["module_number"] for r in rows if r["module_number"]]
+    return filter_options.module_numbers(scenario, kit_number)
 
 
-# ---------------------------- UI Window ------------------------------
 class StockSummaryWindow(tk.Toplevel):
     def __init__(self, parent=None, role="user"):
         super().__init__(parent)
@@ -526,6 +470,11 @@ class StockSummaryWindow(tk.Toplevel):
             lang.t("reports.ready", "Ready (role={role})", role=self.role)
         )
         self.after(100, self.load_data)
+        bus.subscribe(
+            (STOCK_CHANGED, COMPOSITION_CHANGED, SCENARIOS_CHANGED),
+            lambda events: self.load_data(),
+            widget=self,
+        )
 
     def _build_ui(self):
         # Header
@@ -1010,26 +959,7 @@ class StockSummaryWindow(tk.Toplevel):
         else:
             # In-box: match by treecode
             if treecode_val:
-                sql = """
-                    SELECT 
-                        unique_id,
-                        scenario,
-                        item AS code,
-                        final_qty,
-                        exp_date,
-                        management_mode,
-                        kit_number,
-                        module_number,
-                        kit,
-                        module,
-                        comments
-                    FROM stock_data
-                    WHERE (scenario = ? OR scenario = (SELECT CAST(scenario_id AS TEXT) FROM scenarios WHERE name = ?))
-                      AND treecode = ?
-                      AND final_qty > 0
-                    ORDER BY exp_date, kit_number, module_number
-                """
-                rows = _fetchall(sql, (scenario, scenario, treecode_val))
+                rows = _fetchall(IN_BOX_LOTS_SQL, (scenario, scenario, treecode_val))
             else:
                 rows = []
 
@@ -2,12 +2,24 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 from db import connect_db
 from language_manager import lang
+from ledger_archive import LEDGER_VIEW, attach_ledger
 import csv
 import logging
 from popup_utils import custom_popup, custom_askyesno, custom_dialog
 
 # Configure logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Every hot transaction, newest first
+TRANSACTIONS_SQL = """
+    SELECT 
+        Date, Time, unique_id, code, Description,
+        Expiry_date, Batch_Number, Scenario, Kit, Module,
+        Qty_IN, IN_Type, Qty_Out, Out_Type,
+        Third_Party, End_User, Discrepancy, Remarks, Movement_Type
+    FROM stock_transactions
+    ORDER BY Date DESC, Time DESC
+"""
 
 
 class StockTransactions(tk.Frame):
@@ -194,15 +206,7 @@ class StockTransactions(tk.Frame):
         cursor = conn.cursor()
 
         try:
-            cursor.execute("""
-                SELECT 
-                    Date, Time, unique_id, code, Description,
-                    Expiry_date, Batch_Number, Scenario, Kit, Module,
-                    Qty_IN, IN_Type, Qty_Out, Out_Type,
-                    Third_Party, End_User, Discrepancy, Remarks, Movement_Type
-                FROM stock_transactions
-                ORDER BY Date DESC, Time DESC
-            """)
+            cursor.execute(TRANSACTIONS_SQL)
 
             for i, row in enumerate(cursor.fetchall()):
                 # Localize selected columns (IN_Type, Remarks, Movement_Type)
@@ -262,13 +266,15 @@ class StockTransactions(tk.Frame):
             # Convert localized movement type to canonical English (case-insensitive) for searching
             canonical_mt = lang.enum_to_canonical("stock_transactions.movement_types_map", query, fallback=query)
 
-            cursor.execute("""
+            # Search covers the archived years as well
+            attach_ledger(conn)
+            cursor.execute(f"""
                 SELECT 
                     Date, Time, unique_id, code, Description,
                     Expiry_date, Batch_Number, Scenario, Kit, Module,
                     Qty_IN, IN_Type, Qty_Out, Out_Type,
                     Third_Party, End_User, Discrepancy, Remarks, Movement_Type
-                FROM stock_transactions
+                FROM {LEDGER_VIEW}
                 WHERE code LIKE ?
                    OR Movement_Type LIKE ?
                    OR Movement_Type = ?
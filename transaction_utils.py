@@ -1,4 +1,6 @@
-from db import connect_db
+from event_bus import bus, STOCK_CHANGED
+from schema_registry import schema
+from write_queue import writer
 from datetime import datetime
 import logging
 import sqlite3
@@ -6,26 +8,14 @@ import sqlite3
 # Configure logging (you can adjust level to INFO while testing)
 logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Cache for columns so we don't PRAGMA on every insert
-_STOCK_TX_COLUMNS_CACHE = None
-
-def _get_stock_transaction_columns(conn) -> set:
-    """
-    Return a lowercase set of column names for stock_transactions.
-    Uses a module-level cache to avoid repeated PRAGMA calls.
-    """
-    global _STOCK_TX_COLUMNS_CACHE
-    if _STOCK_TX_COLUMNS_CACHE is not None:
-        return _STOCK_TX_COLUMNS_CACHE
-    try:
-        cur = conn.cursor()
-        cur.execute("PRAGMA table_info(stock_transactions)")
-        _STOCK_TX_COLUMNS_CACHE = {row[1].lower() for row in cur.fetchall()}
-        cur.close()
-    except Exception as e:
-        logging.error(f"[log_transaction] Failed to inspect table schema: {e}")
-        _STOCK_TX_COLUMNS_CACHE = set()
-    return _STOCK_TX_COLUMNS_CACHE
+# Highest document number of a prefix (param: prefix + "/%"), for the next serial
+LAST_DOCUMENT_SQL = """
+    SELECT document_number
+      FROM stock_transactions
+     WHERE document_number LIKE ?
+     ORDER BY document_number DESC
+     LIMIT 1
+"""
 
 def log_transaction(
     *,
@@ -52,7 +42,8 @@ def log_transaction(
     """
     Insert a new transaction row into stock_transactions.
     - Auto-generates Date and Time.
-    - Reuses provided connection if supplied; otherwise creates & closes one.
+    - Reuses (and commits) the provided connection if supplied; otherwise the
+      row is written by the writer thread (see insert_transaction).
     - Automatically includes document_number if the column exists; otherwise logs a warning once.
     - Backward compatible: callers not passing document_number are unaffected.
 
@@ -61,70 +52,77 @@ def log_transaction(
       Scenario, Kit, Module, Qty_IN, IN_Type, Qty_Out, Out_Type,
       Third_Party, End_User, Discrepancy, Remarks, Movement_Type, document_number (optional)
     """
+    fields = dict(
+        unique_id=unique_id, code=code, Description=Description, Expiry_date=Expiry_date,
+        Batch_Number=Batch_Number, Scenario=Scenario, Kit=Kit, Module=Module,
+        Qty_IN=Qty_IN, IN_Type=IN_Type, Qty_Out=Qty_Out, Out_Type=Out_Type,
+        Third_Party=Third_Party, End_User=End_User, Discrepancy=Discrepancy,
+        Remarks=Remarks, Movement_Type=Movement_Type, document_number=document_number,
+    )
+    try:
+        if conn is None:
+            writer.run(insert_transaction, **fields)
+        else:
+            insert_transaction(conn, **fields)
+            conn.commit()
+        logging.info(f"Logged transaction unique_id={unique_id} doc={document_number}")
+        bus.publish(STOCK_CHANGED, code=code, scenario=Scenario, unique_id=unique_id)
+
+    except sqlite3.Error as e:
+        if conn is not None:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+        logging.error(f"Error logging transaction for unique_id {unique_id}: {e}")
+        raise
+
+def insert_transaction(conn, *, unique_id=None, code=None, Description=None, Expiry_date=None,
+                       Batch_Number=None, Scenario=None, Kit=None, Module=None, Qty_IN=None,
+                       IN_Type=None, Qty_Out=None, Out_Type=None, Third_Party=None, End_User=None,
+                       Discrepancy=None, Remarks=None, Movement_Type=None, document_number=None):
+    """
+    Writer job of log_transaction(): INSERT the row on `conn` without
+    committing or publishing STOCK_CHANGED. Screens saving many rows
+    writer.submit() it per row and wait once, so the rows share a commit.
+    """
     now = datetime.now()
     date_str = now.strftime("%Y-%m-%d")
     time_str = now.strftime("%H:%M:%S")
 
-    created_locally = False
-    if conn is None:
-        conn = connect_db()
-        if conn is None:
-            raise ValueError("Database connection failed in log_transaction")
-        created_locally = True
-
-    try:
-        cols = _get_stock_transaction_columns(conn)
-        has_doc_col = "document_number" in cols
-
-        base_fields = [
-            "Date", "Time", "unique_id", "code", "Description", "Expiry_date",
-            "Batch_Number", "Scenario", "Kit", "Module",
-            "Qty_IN", "IN_Type", "Qty_Out", "Out_Type",
-            "Third_Party", "End_User", "Discrepancy", "Remarks", "Movement_Type"
-        ]
-        base_values = [
-            date_str, time_str, unique_id, code, Description, Expiry_date,
-            Batch_Number, Scenario, Kit, Module,
-            Qty_IN, IN_Type, Qty_Out, Out_Type,
-            Third_Party, End_User, Discrepancy, Remarks, Movement_Type
-        ]
+    has_doc_col = schema.has_document_number
 
-        if has_doc_col:
-            field_list = base_fields + ["document_number"]
-            values = base_values + [document_number]
-        else:
-            field_list = base_fields
-            values = base_values
-            if document_number is not None:
-                logging.warning(
-                    "[log_transaction] document_number provided but column missing. "
-                    "Run: ALTER TABLE stock_transactions ADD COLUMN document_number TEXT;"
-                )
+    base_fields = [
+        "Date", "Time", "unique_id", "code", "Description", "Expiry_date",
+        "Batch_Number", "Scenario", "Kit", "Module",
+        "Qty_IN", "IN_Type", "Qty_Out", "Out_Type",
+        "Third_Party", "End_User", "Discrepancy", "Remarks", "Movement_Type"
+    ]
+    base_values = [
+        date_str, time_str, unique_id, code, Description, Expiry_date,
+        Batch_Number, Scenario, Kit, Module,
+        Qty_IN, IN_Type, Qty_Out, Out_Type,
+        Third_Party, End_User, Discrepancy, Remarks, Movement_Type
+    ]
 
-        placeholders = ", ".join(["?"] * len(field_list))
-        cols_sql = ", ".join(field_list)
+    if has_doc_col:
+        field_list = base_fields + ["document_number"]
+        values = base_values + [document_number]
+    else:
+        field_list = base_fields
+        values = base_values
+        if document_number is not None:
+            logging.warning(
+                "[log_transaction] document_number provided but column missing. "
+                "Run: ALTER TABLE stock_transactions ADD COLUMN document_number TEXT;"
+            )
 
-        sql = f"INSERT INTO stock_transactions ({cols_sql}) VALUES ({placeholders})"
+    placeholders = ", ".join(["?"] * len(field_list))
+    cols_sql = ", ".join(field_list)
 
-        cur = conn.cursor()
-        cur.execute(sql, values)
-        conn.commit()
-        logging.info(f"Logged transaction unique_id={unique_id} doc={document_number}")
-        cur.close()
+    sql = f"INSERT INTO stock_transactions ({cols_sql}) VALUES ({placeholders})"
 
-    except sqlite3.Error as e:
-        try:
-            conn.rollback()
-        except Exception:
-            pass
-        logging.error(f"Error logging transaction for unique_id {unique_id}: {e}")
-        raise
-    finally:
-        if created_locally:
-            try:
-                conn.close()
-            except:
-                pass
+    conn.execute(sql, values)
 
 def format_decimal(value):
     try:
@@ -0,0 +1,247 @@
+"""
+write_queue.py
+Single writer thread for the stock mutations.
+
+Every save path used to open its own connection and commit on its own,
+often once per row (a transaction line, then its stock_data line, then the
+item recalculation). Two windows saving at once raced for the write lock
+and the loser got "database is locked". WriteQueue owns the only write
+connection instead:
+
+  * writer.run(job, ...) / writer.submit(job, ...) queue job(conn, ...) for
+    the writer thread; run() waits for the commit and returns job's result
+    or raises its exception
+  * group commit: the jobs waiting in the queue are applied in one
+    BEGIN IMMEDIATE ... COMMIT, each inside its own SAVEPOINT, so a failing
+    job is rolled back alone and the others still commit. A save that
+    submit()s all its rows before waiting pays for one commit, not one per
+    row
+  * a busy database (another process writing) is retried with backoff on
+    top of the connection's busy timeout
+  * jobs must not commit or roll back themselves; readers keep their own
+    connect_db() connections and read WAL snapshots, so reports never wait
+    for a save
+  * stats() reports queue depth, batch sizes, retries and wait / commit
+    latencies (shown in Info > SQL Diagnostics)
+
+The thread starts on the first job and stops with close(), which
+db.close_persistent_connections() calls before a restore replaces the file.
+
+Usage:
+    from write_queue import writer
+    writer.run(lambda conn: conn.execute("UPDATE stock_data SET ..."))
+    futures = [writer.submit(save_row, row) for row in rows]
+    errors = writer.wait(futures)
+"""
+
+import time
+import queue
+import logging
+import sqlite3
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+import db
+
+logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
+
+MAX_BATCH = 64                  # jobs committed together at most
+BUSY_RETRIES = 5                # BEGIN IMMEDIATE attempts beyond the busy timeout
+RETRY_BACKOFF = 0.05            # seconds, times the attempt number
+LATENCY_SAMPLES = 1000          # recent jobs kept for the latency figures
+
+_STOP = object()
+
+
+def _is_busy(error):
+    text = str(error).lower()
+    return isinstance(error, sqlite3.OperationalError) and ("locked" in text or "busy" in text)
+
+
+def _summary(samples):
+    if not samples:
+        return {"avg_ms": 0.0, "p95_ms": 0.0, "max_ms": 0.0}
+    ordered = sorted(samples)
+    return {"avg_ms": round(sum(ordered) / len(ordered), 3),
+            "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+            "max_ms": round(ordered[-1], 3)}
+
+
+class _Job:
+    __slots__ = ("fn", "args", "kwargs", "future", "queued_at")
+
+    def __init__(self, fn, args, kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.queued_at = time.perf_counter()
+
+
+class WriteQueue:
+    def __init__(self, max_batch=MAX_BATCH):
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._conn = None
+        self._path = None
+        self.reset_stats()
+
+    # ---------------- Submitting ----------------
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn(conn, *args, **kwargs); returns a Future resolved after its commit."""
+        if threading.current_thread() is self._thread:
+            # a job submitting another job: run it inline, in the same transaction
+            future = Future()
+            try:
+                future.set_result(fn(self._conn, *args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        job = _Job(fn, args, kwargs)
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="iseprep-writer", daemon=True)
+                self._thread.start()
+            self._queue.put(job)
+            self._submitted += 1
+            self._max_depth = max(self._max_depth, self._queue.qsize())
+        return job.future
+
+    def run(self, fn, *args, **kwargs):
+        """submit() and wait: fn's result, or its exception raised here."""
+        return self.submit(fn, *args, **kwargs).result()
+
+    @staticmethod
+    def wait(futures):
+        """Wait for every future; returns their exceptions (None for the committed ones)."""
+        return [f.exception() for f in futures]
+
+    def close(self, timeout=30):
+        """Apply the queued jobs, then stop the thread and close the write connection."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is None or not thread.is_alive():
+                return
+            self._queue.put(_STOP)
+        thread.join(timeout)
+
+    # ---------------- Writer thread ----------------
+    def _connection(self):
+        # reopened when db.DB_FILE was pointed elsewhere (benchmarks, restore)
+        if self._conn is None or self._path != db.DB_FILE:
+            if self._conn is not None:
+                self._conn.close()
+            self._path = db.DB_FILE
+            self._conn = db.connect_db()
+            self._conn.isolation_level = None  # transactions are explicit
+        return self._conn
+
+    def _loop(self):
+        stop = False
+        try:
+            while not stop:
+                batch = [self._queue.get()]
+                while len(batch) < self.max_batch:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if _STOP in batch:
+                    batch = [job for job in batch if job is not _STOP]
+                    stop = True
+                if batch:
+                    self._apply(batch)
+        finally:
+            if self._conn is not None:
+                try:
+                    self._conn.close()
+                except sqlite3.Error:
+                    pass
+                self._conn = None
+
+    def _begin(self, conn):
+        for attempt in range(BUSY_RETRIES + 1):
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                return
+            except sqlite3.OperationalError as e:
+                if not _is_busy(e) or attempt == BUSY_RETRIES:
+                    raise
+                with self._lock:
+                    self._retries += 1
+                logging.warning(f"[WriteQueue] Database busy, retry {attempt + 1}/{BUSY_RETRIES}")
+                time.sleep(RETRY_BACKOFF * (attempt + 1))
+
+    def _apply(self, batch):
+        started = time.perf_counter()
+        outcomes = []
+        try:
+            conn = self._connection()
+            self._begin(conn)
+            for job in batch:
+                conn.execute("SAVEPOINT job")
+                try:
+                    outcomes.append((job.fn(conn, *job.args, **job.kwargs), None))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO job")
+                    outcomes.append((None, e))
+                conn.execute("RELEASE job")
+            conn.execute("COMMIT")
+        except Exception as e:
+            logging.error(f"[WriteQueue] Batch of {len(batch)} failed: {e}")
+            try:
+                if self._conn is not None and self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+            outcomes = [(None, e)] * len(batch)
+
+        done = time.perf_counter()
+        with self._lock:
+            self._batches += 1
+            self._max_batch_seen = max(self._max_batch_seen, len(batch))
+            self._jobs += len(batch)
+            self._commit_ms.append((done - started) * 1000.0)
+            for job, (_result, error) in zip(batch, outcomes):
+                self._failed += error is not None
+                self._wait_ms.append((started - job.queued_at) * 1000.0)
+                self._latency_ms.append((done - job.queued_at) * 1000.0)
+        for job, (result, error) in zip(batch, outcomes):
+            if error is None:
+                job.future.set_result(result)
+            else:
+                job.future.set_exception(error)
+
+    # ---------------- Metrics ----------------
+    def reset_stats(self):
+        with self._lock:
+            self._submitted = self._jobs = self._failed = self._batches = self._retries = 0
+            self._max_depth = self._max_batch_seen = 0
+            self._wait_ms = deque(maxlen=LATENCY_SAMPLES)
+            self._latency_ms = deque(maxlen=LATENCY_SAMPLES)
+            self._commit_ms = deque(maxlen=LATENCY_SAMPLES)
+
+    def stats(self):
+        """Counters since the last reset_stats(); latencies over the recent jobs."""
+        with self._lock:
+            return {
+                "submitted": self._submitted,
+                "jobs": self._jobs,
+                "failed": self._failed,
+                "batches": self._batches,
+                "avg_batch": round(self._jobs / self._batches, 2) if self._batches else 0.0,
+                "max_batch": self._max_batch_seen,
+                "retries": self._retries,
+                "queue_depth": self._queue.qsize(),
+                "max_queue_depth": self._max_depth,
+                "wait": _summary(self._wait_ms),
+                "latency": _summary(self._latency_ms),
+                "commit": _summary(self._commit_ms),
+            }
+
+
+writer = WriteQueue()
+db.on_close_persistent(writer.close)